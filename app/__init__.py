@@ -75,7 +75,7 @@ def create_app(config_class=None):
             response.headers["Access-Control-Allow-Origin"] = origin if origin else "*"
             response.headers["Access-Control-Allow-Headers"] = (
                 "Content-Type, Authorization, X-Request-ID, "
-                "Idempotency-Key, X-Nonce, X-Role"
+                "Idempotency-Key, X-Nonce, X-Role, X-Client-Id"
             )
             response.headers["Access-Control-Allow-Methods"] = (
                 "GET, PUT, POST, DELETE, OPTIONS"
@@ -117,8 +117,20 @@ def create_app(config_class=None):
     if broker_url:
         celery = Celery(app.import_name, broker=broker_url, backend=backend_url)
         celery.conf.update(task_always_eager=app.config.get('TESTING', False))
+        from app.tasks.queues import declare_queues
+        from app.tasks.drainer import schedule_drainer
+        from app.tasks.retry_scheduler import schedule_retry_poller
+        from app.tasks.reconciler import schedule_reconciler
+        from app.tasks.job_counters import schedule_job_counter_fold
+        declare_queues(celery, int(app.config.get('DISPATCH_SHARDS', 1) or 1))
+        with app.app_context():
+            schedule_drainer(celery)
+            schedule_retry_poller(celery)
+            schedule_reconciler(celery)
+            schedule_job_counter_fold(celery)
         app.celery = celery
     from app.tasks.sms_tasks import send_and_record  # noqa: F401
+    from app.tasks.bulk_ingest import ingest_job  # noqa: F401
 
     # Core health endpoint (global)
     @app.get('/health')
@@ -63,6 +63,145 @@ class Config:
 	OTP_ID = os.getenv('OTP_ID')
 	OTP_SENDERID = os.getenv('OTP_SENDERID')
 	OTP_FLAG = os.getenv('OTP_FLAG', 'True') == 'True'  # enable real sending by default if configured
+	OTP_TPS = float(os.getenv('OTP_TPS', 0))  # account TPS cap for the OTP_* gateway (0 = uncapped)
+	# Gateway pool (see app/utils/sms_gateway_pool.py). JSON list of accounts, e.g.
+	# [{"name": "acct1", "url": "...", "username": "...", "password": "...", "senderid": "...",
+	#   "templateid": "...", "tps": 50, "weight": 1}]; omitted fields fall back to OTP_*.
+	# Unset = a single 'default' member built from OTP_*.
+	SMS_GATEWAYS = os.getenv('SMS_GATEWAYS')
+	# Prefix routing (see app/utils/sms_routing.py), JSON list, e.g.
+	# [{"name": "india", "prefix": "91", "gateways": ["acct1"], "senderid": "AIIMS"}];
+	# sms_routes table rows override entries with the same prefix.
+	SMS_ROUTES = os.getenv('SMS_ROUTES')
+	SMS_ROUTES_RELOAD_SECONDS = float(os.getenv('SMS_ROUTES_RELOAD_SECONDS', 60))
+	# Number of sending processes that share each account's TPS budget
+	SMS_GATEWAY_PROCESSES = int(os.getenv('SMS_GATEWAY_PROCESSES', 1))
+	# Longest a send waits for TPS budget on some member before returning 503
+	SMS_GATEWAY_MAX_WAIT = float(os.getenv('SMS_GATEWAY_MAX_WAIT', 1.0))
+	# Pooled keep-alive client for the SOAP gateway (see app/utils/sms_gateway.py)
+	SMS_GATEWAY_POOL_CONNECTIONS = int(os.getenv('SMS_GATEWAY_POOL_CONNECTIONS', 4))
+	SMS_GATEWAY_POOL_MAXSIZE = int(os.getenv('SMS_GATEWAY_POOL_MAXSIZE', 16))
+	SMS_GATEWAY_RETRIES = int(os.getenv('SMS_GATEWAY_RETRIES', 2))
+	SMS_GATEWAY_CONNECT_TIMEOUT = float(os.getenv('SMS_GATEWAY_CONNECT_TIMEOUT', 5))
+	SMS_GATEWAY_TIMEOUT = float(os.getenv('SMS_GATEWAY_TIMEOUT', 30))
+	# Max concurrent gateway requests per process (1 restores the old one-at-a-time behaviour)
+	SMS_DISPATCH_CONCURRENCY = int(os.getenv('SMS_DISPATCH_CONCURRENCY', 8))
+	# AIMD controller: grow the in-flight limit while p95 latency and 5xx rate stay healthy,
+	# cut it when they degrade; read timeout = p99 x multiplier within [MIN_TIMEOUT, SMS_GATEWAY_TIMEOUT]
+	SMS_ADAPTIVE_CONCURRENCY = os.getenv('SMS_ADAPTIVE_CONCURRENCY', 'True') == 'True'
+	SMS_DISPATCH_MIN_CONCURRENCY = int(os.getenv('SMS_DISPATCH_MIN_CONCURRENCY', 1))
+	SMS_DISPATCH_MAX_CONCURRENCY = int(os.getenv('SMS_DISPATCH_MAX_CONCURRENCY', 64))
+	SMS_ADAPTIVE_TARGET_P95 = float(os.getenv('SMS_ADAPTIVE_TARGET_P95', 2.0))
+	SMS_ADAPTIVE_MAX_ERROR_RATE = float(os.getenv('SMS_ADAPTIVE_MAX_ERROR_RATE', 0.05))
+	SMS_ADAPTIVE_BACKOFF = float(os.getenv('SMS_ADAPTIVE_BACKOFF', 0.7))
+	SMS_ADAPTIVE_WINDOW = int(os.getenv('SMS_ADAPTIVE_WINDOW', 20))
+	SMS_ADAPTIVE_TIMEOUT_MULTIPLIER = float(os.getenv('SMS_ADAPTIVE_TIMEOUT_MULTIPLIER', 3))
+	SMS_GATEWAY_MIN_TIMEOUT = float(os.getenv('SMS_GATEWAY_MIN_TIMEOUT', 2))
+	SMS_DISPATCH_ACQUIRE_TIMEOUT = float(os.getenv('SMS_DISPATCH_ACQUIRE_TIMEOUT', 30))
+	# Bulk sends pack up to SMS_GATEWAY_BATCH_SIZE recipients into one SOAP envelope. The
+	# gateway answers an envelope with one HTTP status and no per-number result, so every
+	# recipient in it gets that outcome: a rejected envelope fails (and retries) all of them,
+	# including numbers the gateway might have accepted. 1 gives per-recipient outcomes
+	SMS_GATEWAY_BATCH_SIZE = int(os.getenv('SMS_GATEWAY_BATCH_SIZE', 50))
+	SMS_GATEWAY_BULK_OPERATION = os.getenv('SMS_GATEWAY_BULK_OPERATION', 'sendBulkSMS')
+	# Envelopes of one batch task sent in parallel (still bounded by the in-flight limit)
+	SMS_BATCH_CONCURRENCY = int(os.getenv('SMS_BATCH_CONCURRENCY', 4))
+	# Gateway circuit breaker (state shared through REDIS_URL, see app/utils/circuit_breaker.py)
+	REDIS_URL = os.getenv('REDIS_URL')
+	SMS_BREAKER_ENABLED = os.getenv('SMS_BREAKER_ENABLED', 'True') == 'True'
+	SMS_BREAKER_WINDOW = float(os.getenv('SMS_BREAKER_WINDOW', 30))
+	SMS_BREAKER_MIN_CALLS = int(os.getenv('SMS_BREAKER_MIN_CALLS', 10))
+	SMS_BREAKER_ERROR_RATE = float(os.getenv('SMS_BREAKER_ERROR_RATE', 0.5))
+	SMS_BREAKER_SLOW_CALL_SECONDS = float(os.getenv('SMS_BREAKER_SLOW_CALL_SECONDS', 5))
+	SMS_BREAKER_SLOW_RATE = float(os.getenv('SMS_BREAKER_SLOW_RATE', 0.8))
+	SMS_BREAKER_OPEN_SECONDS = float(os.getenv('SMS_BREAKER_OPEN_SECONDS', 30))
+	SMS_BREAKER_HALF_OPEN_MAX_CALLS = int(os.getenv('SMS_BREAKER_HALF_OPEN_MAX_CALLS', 3))
+	SMS_BREAKER_HALF_OPEN_SUCCESSES = int(os.getenv('SMS_BREAKER_HALF_OPEN_SUCCESSES', 3))
+	# Write-behind status updates from send tasks (see app/utils/status_writer.py):
+	# coalesced and flushed every FLUSH_INTERVAL seconds or BATCH_SIZE transitions
+	STATUS_WRITER_ENABLED = os.getenv('STATUS_WRITER_ENABLED', 'True') == 'True'
+	STATUS_WRITER_FLUSH_INTERVAL = float(os.getenv('STATUS_WRITER_FLUSH_INTERVAL', 0.05))
+	STATUS_WRITER_BATCH_SIZE = int(os.getenv('STATUS_WRITER_BATCH_SIZE', 500))
+	# Transactional outbox relay (python -m app.tasks.outbox_relay): rows published per
+	# round, idle poll and the longest back-off while the broker is unavailable
+	OUTBOX_RELAY_BATCH_SIZE = int(os.getenv('OUTBOX_RELAY_BATCH_SIZE', 500))
+	OUTBOX_RELAY_POLL_INTERVAL = float(os.getenv('OUTBOX_RELAY_POLL_INTERVAL', 0.2))
+	OUTBOX_RELAY_MAX_BACKOFF = float(os.getenv('OUTBOX_RELAY_MAX_BACKOFF', 30))
+	# Cluster-wide outbound rate governor (Redis token buckets, see app/utils/rate_governor.py).
+	# Messages/second per channel across all workers (0 = unlimited; SMS is still held to
+	# each gateway account's tps). Sends without a permit after RATE_GOVERNOR_MAX_WAIT
+	# seconds are parked and re-published by the beat-scheduled drainer.
+	SMS_RATE_PER_SECOND = float(os.getenv('SMS_RATE_PER_SECOND', 0))
+	SMS_RATE_BURST = os.getenv('SMS_RATE_BURST')
+	EMAIL_RATE_PER_SECOND = float(os.getenv('EMAIL_RATE_PER_SECOND', 0))
+	EMAIL_RATE_BURST = os.getenv('EMAIL_RATE_BURST')
+	RATE_GOVERNOR_MAX_WAIT = float(os.getenv('RATE_GOVERNOR_MAX_WAIT', 2.0))
+	RATE_GOVERNOR_DRAIN_INTERVAL = float(os.getenv('RATE_GOVERNOR_DRAIN_INTERVAL', 1.0))
+	# Retry scheduler (Redis sorted set, see app/tasks/retry_scheduler.py), polled by beat
+	# every RETRY_POLL_INTERVAL seconds. RETRY_POLICIES overrides the backoff per error
+	# class as JSON, e.g. {"timeout": {"base": 15, "cap": 300}, "rate_limited": {"base": 60, "cap": 900}}
+	RETRY_POLICIES = os.getenv('RETRY_POLICIES')
+	RETRY_POLL_INTERVAL = float(os.getenv('RETRY_POLL_INTERVAL', 1.0))
+	RETRY_POLL_BATCH_SIZE = int(os.getenv('RETRY_POLL_BATCH_SIZE', 500))
+	# Dead-letter replay (admin API, see app/utils/dead_letters.py): dead letters re-queued
+	# per transaction, and the most one replay request may re-queue
+	DEAD_LETTER_REPLAY_CHUNK = int(os.getenv('DEAD_LETTER_REPLAY_CHUNK', 500))
+	DEAD_LETTER_REPLAY_MAX = int(os.getenv('DEAD_LETTER_REPLAY_MAX', 50000))
+	# Stuck-message reconciler (beat, see app/tasks/reconciler.py): queued/retry rows untouched
+	# for STALE_SECONDS whose task is not live (outbox, workers, parked or retry:due) are
+	# re-enqueued. Keep STALE_SECONDS above the worst-case broker queue latency: tasks waiting
+	# in the broker can't be inspected, and would be re-enqueued and sent twice.
+	RECONCILER_INTERVAL = float(os.getenv('RECONCILER_INTERVAL', 60))
+	RECONCILER_STALE_SECONDS = float(os.getenv('RECONCILER_STALE_SECONDS', 1800))
+	RECONCILER_BATCH_SIZE = int(os.getenv('RECONCILER_BATCH_SIZE', 500))
+	RECONCILER_MAX_ROWS = int(os.getenv('RECONCILER_MAX_ROWS', 10000))
+	RECONCILER_INSPECT_TIMEOUT = float(os.getenv('RECONCILER_INSPECT_TIMEOUT', 1.0))
+	# Default time-to-live per priority lane when a request sets neither expires_at nor
+	# ttl_seconds (0 = never expires); late messages are marked 'expired', not sent
+	MESSAGE_TTL_OTP_SECONDS = int(os.getenv('MESSAGE_TTL_OTP_SECONDS', 0))
+	MESSAGE_TTL_TRANSACTIONAL_SECONDS = int(os.getenv('MESSAGE_TTL_TRANSACTIONAL_SECONDS', 0))
+	MESSAGE_TTL_BULK_SECONDS = int(os.getenv('MESSAGE_TTL_BULK_SECONDS', 0))
+	# Per-client fair queuing in the asyncio dispatcher (app/utils/fair_queue.py): callers send
+	# X-Client-Id; CLIENT_WEIGHTS is JSON {"client": weight} (unlisted clients weigh 1) and a
+	# weight-1 client may take FAIR_QUEUE_QUANTUM rows per round-robin turn
+	CLIENT_WEIGHTS = os.getenv('CLIENT_WEIGHTS')
+	# Per-client API keys, JSON {"client": "key"}: a request with one of these keys is that
+	# client whatever X-Client-Id says (the shared SMS_API_KEY trusts the header)
+	CLIENT_API_KEYS = os.getenv('CLIENT_API_KEYS')
+	FAIR_QUEUE_QUANTUM = int(os.getenv('FAIR_QUEUE_QUANTUM', 10))
+	# Shard queues per lane by recipient hash (app/tasks/queues.py); 1 = no sharding. Run one
+	# single-process worker per shard (make celery-shard SHARD=n) for per-recipient ordering
+	DISPATCH_SHARDS = int(os.getenv('DISPATCH_SHARDS', 1))
+	# Streamed bulk upload jobs (app/utils/bulk_jobs.py): rows inserted and staged per
+	# transaction, the largest upload accepted (instead of MAX_CONTENT_LENGTH), the longest
+	# line, and how many rejected rows are reported back on the job
+	BULK_JOB_CHUNK_SIZE = int(os.getenv('BULK_JOB_CHUNK_SIZE', 1000))
+	BULK_JOB_MAX_UPLOAD_BYTES = int(os.getenv('BULK_JOB_MAX_UPLOAD_BYTES', 256 * 1024 * 1024))
+	BULK_JOB_MAX_LINE_BYTES = int(os.getenv('BULK_JOB_MAX_LINE_BYTES', 4096))
+	BULK_JOB_ERROR_SAMPLE = int(os.getenv('BULK_JOB_ERROR_SAMPLE', 50))
+	# Uploads are spooled here and ingested by a worker, so it must be shared with the Celery
+	# workers (default: the system temp dir). Without Celery (asyncio dispatcher only) the
+	# request ingests the upload itself and gives up after BULK_JOB_INLINE_INGEST_SECONDS
+	BULK_JOB_SPOOL_DIR = os.getenv('BULK_JOB_SPOOL_DIR')
+	BULK_JOB_INLINE_INGEST_SECONDS = float(os.getenv('BULK_JOB_INLINE_INGEST_SECONDS', 30))
+	# Most items in one /sms/batch or /mail/batch request (app/utils/batch_workflow.py)
+	BATCH_REQUEST_MAX_ITEMS = int(os.getenv('BATCH_REQUEST_MAX_ITEMS', 500))
+	# Job progress (app/tasks/job_counters.py): workers count outcomes in Redis; beat folds up
+	# to JOB_COUNTER_FOLD_BATCH dirty jobs per round into bulk_jobs every FOLD_INTERVAL seconds
+	JOB_COUNTER_FOLD_INTERVAL = float(os.getenv('JOB_COUNTER_FOLD_INTERVAL', 10))
+	JOB_COUNTER_FOLD_BATCH = int(os.getenv('JOB_COUNTER_FOLD_BATCH', 1000))
+	# Processes sharing the channel rates when Redis is down (each then allows rate / processes)
+	RATE_GOVERNOR_PROCESSES = int(os.getenv('RATE_GOVERNOR_PROCESSES', 1))
+	# 'celery' (default) publishes send tasks; 'asyncio' leaves rows queued for
+	# the event-loop dispatcher (python -m app.tasks.sms_dispatcher)
+	SMS_DISPATCH_BACKEND = os.getenv('SMS_DISPATCH_BACKEND', 'celery').lower()
+	SMS_DISPATCHER_CONCURRENCY = int(os.getenv('SMS_DISPATCHER_CONCURRENCY', 200))
+	SMS_DISPATCHER_PER_GATEWAY_CONCURRENCY = int(os.getenv('SMS_DISPATCHER_PER_GATEWAY_CONCURRENCY', 100))
+	SMS_DISPATCHER_CLAIM_BATCH = int(os.getenv('SMS_DISPATCHER_CLAIM_BATCH', 500))
+	SMS_DISPATCHER_FLUSH_SIZE = int(os.getenv('SMS_DISPATCHER_FLUSH_SIZE', 200))
+	SMS_DISPATCHER_FLUSH_INTERVAL = float(os.getenv('SMS_DISPATCHER_FLUSH_INTERVAL', 0.5))
+	SMS_DISPATCHER_POLL_INTERVAL = float(os.getenv('SMS_DISPATCHER_POLL_INTERVAL', 1.0))
+	SMS_DISPATCHER_RETRY_DELAY = float(os.getenv('SMS_DISPATCHER_RETRY_DELAY', 10))
 	LOG_RETENTION_MONTHS = int(os.getenv('LOG_RETENTION_MONTHS', 8))
 	TRACE_ENABLED = os.getenv('TRACE_ENABLED', 'False') == 'True'
 	
@@ -104,6 +243,10 @@ class Config:
 	SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
 	SMTP_FROM_EMAIL = os.getenv('SMTP_FROM_EMAIL', 'noreply@example.com')
 	SMTP_USE_TLS = os.getenv('SMTP_USE_TLS', 'True') == 'True'
+	# Bulk email publishes EMAIL_BATCH_SIZE records per batch task, sent over
+	# EMAIL_BATCH_CONCURRENCY reused SMTP sessions
+	EMAIL_BATCH_SIZE = int(os.getenv('EMAIL_BATCH_SIZE', 50))
+	EMAIL_BATCH_CONCURRENCY = int(os.getenv('EMAIL_BATCH_CONCURRENCY', 4))
 
 	HEALTH_CHECK_TEST_NUMBER = os.getenv('HEALTH_CHECK_TEST_NUMBER', '9876543210')
 
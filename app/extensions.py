@@ -3,7 +3,7 @@ from logging.handlers import RotatingFileHandler
 from flask_sqlalchemy import SQLAlchemy
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from prometheus_client import Counter
+from prometheus_client import Counter, Gauge
 import os
 
 # Initialize extensions
@@ -26,11 +26,62 @@ def init_limiter(app):
 sms_sent_counter = Counter('sms_sent_total', 'Total SMS successfully sent')
 sms_failed_counter = Counter('sms_failed_total', 'Total SMS failed to send')
 sms_queued_counter = Counter('sms_queued_total', 'Total SMS queued for async send')
+sms_expired_counter = Counter('sms_expired_total', 'Total SMS dropped unsent because their expires_at had passed')
+
+# SMS gateway connection pool metrics (values are per process)
+sms_gateway_requests_counter = Counter('sms_gateway_requests_total', 'HTTP requests sent to the SOAP SMS gateway', ['outcome'])
+sms_gateway_pool_connections_gauge = Gauge('sms_gateway_pool_connections_opened', 'TCP/TLS connections opened to the SMS gateway')
+sms_gateway_pool_requests_gauge = Gauge('sms_gateway_pool_requests', 'Requests served by the SMS gateway connection pool')
+sms_gateway_pool_reuse_ratio_gauge = Gauge('sms_gateway_pool_reuse_ratio', 'Share of SMS gateway requests served on a reused connection')
+sms_gateway_pool_idle_gauge = Gauge('sms_gateway_pool_idle_connections', 'Idle keep-alive connections in the SMS gateway pool')
+sms_gateway_concurrency_limit_gauge = Gauge('sms_gateway_concurrency_limit', 'Current adaptive in-flight limit for SMS gateway requests')
+sms_gateway_in_flight_gauge = Gauge('sms_gateway_in_flight', 'SMS gateway requests currently in flight')
+sms_gateway_latency_p95_gauge = Gauge('sms_gateway_latency_p95_seconds', 'p95 latency of recent SMS gateway requests')
+sms_gateway_timeout_gauge = Gauge('sms_gateway_timeout_seconds', 'Current latency-derived SMS gateway read timeout')
+sms_gateway_breaker_state_gauge = Gauge('sms_gateway_breaker_state', 'SMS gateway circuit breaker state (0=closed, 1=half_open, 2=open)', ['gateway'])
+sms_gateway_breaker_rejections_counter = Counter('sms_gateway_breaker_rejections_total', 'SMS gateway calls rejected by an open circuit breaker', ['gateway'])
+
+# Messages published per priority lane (see app/tasks/queues.py)
+messages_enqueued_counter = Counter('messages_enqueued_total', 'Messages published to a priority lane', ['channel', 'priority'])
+
+# Outbound rate governor (see app/utils/rate_governor.py, app/tasks/drainer.py)
+governor_parked_counter = Counter('governor_parked_total', 'Sends parked for the drainer because no rate permit was available', ['channel', 'outcome'])
+governor_drained_counter = Counter('governor_drained_total', 'Parked sends re-published by the drainer with a permit', ['channel', 'priority'])
+
+# Write-behind status updates (see app/utils/status_writer.py)
+status_updates_flushed_counter = Counter('status_updates_flushed_total', 'Message status transitions written by the status writer', ['table'])
+
+# Transactional outbox (see app/tasks/outbox_relay.py)
+outbox_published_counter = Counter('outbox_published_total', 'Outbox tasks published to the broker by the relay', ['task'])
+outbox_publish_failures_counter = Counter('outbox_publish_failures_total', 'Outbox relay rounds stopped by a broker error')
+
+# Retry scheduler (see app/tasks/retry_scheduler.py)
+retry_scheduled_counter = Counter('retry_scheduled_total', 'Failed sends scheduled for retry', ['error_class'])
+retry_released_counter = Counter('retry_released_total', 'Due retries re-published by the retry poller')
+retry_backlog_gauge = Gauge('retry_backlog_size', 'Retries waiting in the scheduler')
+retry_backlog_age_gauge = Gauge('retry_backlog_oldest_age_seconds', 'Seconds since the oldest waiting retry was scheduled')
+
+# Dead letters (see app/utils/dead_letters.py)
+dead_letters_counter = Counter('dead_letters_total', 'Messages finalised as failed and dead-lettered', ['channel', 'error_class'])
+dead_letters_replayed_counter = Counter('dead_letters_replayed_total', 'Dead-lettered messages re-queued by an admin replay', ['channel'])
+
+# Stuck-message reconciler (see app/tasks/reconciler.py)
+reconciler_requeued_counter = Counter('reconciler_requeued_total', 'Orphaned queued/retry messages re-enqueued by the reconciler', ['channel'])
+
+# Per-client fair queuing (asyncio SMS dispatcher)
+sms_client_queue_depth_gauge = Gauge('sms_client_queue_depth', 'Claimable SMS per client at the last dispatcher claim', ['client'])
+sms_client_share_gauge = Gauge('sms_client_share', "Client's share of the SMS rows in the last dispatcher claim", ['client'])
+sms_client_dispatched_counter = Counter('sms_client_dispatched_total', 'SMS claimed for sending by the dispatcher, per client', ['client'])
+
+# Streamed bulk upload jobs (see app/utils/bulk_jobs.py)
+bulk_job_rows_counter = Counter('bulk_job_rows_total', 'Rows read from bulk job uploads', ['channel', 'outcome'])
+bulk_job_counts_folded_counter = Counter('bulk_job_counts_folded_total', 'Redis job counter hashes folded into bulk_jobs rows')
 
 # Email metrics
 email_sent_counter = Counter('email_sent_total', 'Total emails successfully sent')
 email_failed_counter = Counter('email_failed_total', 'Total emails failed to send')
 email_queued_counter = Counter('email_queued_total', 'Total emails queued for async send')
+email_expired_counter = Counter('email_expired_total', 'Total emails dropped unsent because their expires_at had passed')
 
 def init_logging(json_logs: bool = False):
     # Create logs directory if it doesn't exist
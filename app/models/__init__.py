@@ -1,2 +1,6 @@
 from .sms_message import SMSMessage  # noqa
+from .sms_route import SMSRoute  # noqa
+from .outbox_message import OutboxMessage  # noqa
+from .dead_letter import DeadLetter  # noqa
+from .bulk_job import BulkJob  # noqa
 """Model package."""
\ No newline at end of file
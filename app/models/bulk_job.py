@@ -0,0 +1,72 @@
+from datetime import datetime, timezone
+from app.extensions import db
+
+
+class BulkJob(db.Model):  # type: ignore
+    """
+    A bulk submission: a /bulk request or a streamed upload (CSV or NDJSON
+    recipient list, see app/utils/bulk_jobs.py). Its messages carry job_id.
+    total/accepted/rejected are updated as each chunk of rows is committed, so
+    a job interrupted mid-upload still shows how many recipients were queued;
+    sent/failed/expired are folded in from Redis by app/tasks/job_counters.py.
+    """
+    __tablename__ = 'bulk_jobs'
+    __table_args__ = {'extend_existing': True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    uuid = db.Column(db.String(36), index=True, nullable=False, unique=True)
+    channel = db.Column(db.String(16), index=True, nullable=False)  # 'sms' or 'email'
+    # receiving (upload spooled or being read) -> queued -> completed (every accepted
+    # message finalised), or failed if the upload could not be read to the end
+    status = db.Column(db.String(16), index=True, nullable=False, default='receiving')
+    format = db.Column(db.String(16), nullable=False)  # 'json' (/bulk), 'csv' or 'ndjson'
+    priority = db.Column(db.String(16), default='bulk')
+    client_id = db.Column(db.String(64), nullable=False, default='default', server_default='default')
+    correlation_id = db.Column(db.String(64), index=True)
+    # Data rows read, rows queued as messages, rows rejected (unparseable or invalid recipient)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    accepted = db.Column(db.Integer, nullable=False, default=0)
+    rejected = db.Column(db.Integer, nullable=False, default=0)
+    # Final outcomes of the accepted messages, as of the last counter fold
+    sent = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    failed = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    expired = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Token of the last Redis fold applied, so a retried fold is not counted twice
+    fold_token = db.Column(db.String(32))
+    # The first BULK_JOB_ERROR_SAMPLE rejections: [{'line', 'error'}]
+    errors = db.Column(db.JSON, nullable=False, default=list)
+    error = db.Column(db.String(255))
+    created_at = db.Column(
+        db.DateTime(timezone=True),
+        index=True,
+        default=lambda: datetime.now(timezone.utc)
+    )
+    updated_at = db.Column(
+        db.DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc)
+    )
+    finished_at = db.Column(db.DateTime(timezone=True))
+
+    def as_dict(self):
+        return {
+            'job_id': self.uuid,
+            'channel': self.channel,
+            'status': self.status,
+            'format': self.format,
+            'priority': self.priority,
+            'client_id': self.client_id,
+            'correlation_id': self.correlation_id,
+            'total': self.total,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'queued': max((self.accepted or 0) - (self.sent or 0) - (self.failed or 0) - (self.expired or 0), 0),
+            'sent': self.sent or 0,
+            'failed': self.failed or 0,
+            'expired': self.expired or 0,
+            'errors': self.errors or [],
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
@@ -0,0 +1,41 @@
+from datetime import datetime, timezone
+from app.extensions import db
+
+
+class DeadLetter(db.Model):  # type: ignore
+    """
+    A message that exhausted its attempts or was rejected (see
+    app/utils/dead_letters.py). Kept for inspection and bulk replay from the
+    admin API; one row per final failure, so a replayed message that fails
+    again gets a new row.
+    """
+    __tablename__ = 'dead_letters'
+    __table_args__ = {'extend_existing': True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(16), index=True, nullable=False)  # 'sms' or 'email'
+    message_id = db.Column(db.Integer, index=True, nullable=False)
+    correlation_id = db.Column(db.String(64), index=True)
+    # retry_scheduler.classify_error(): timeout, server_error, rate_limited, rejected, default
+    error_class = db.Column(db.String(32), index=True, nullable=False)
+    last_status_code = db.Column(db.Integer)
+    attempts = db.Column(db.Integer)
+    failed_at = db.Column(
+        db.DateTime(timezone=True),
+        index=True,
+        default=lambda: datetime.now(timezone.utc)
+    )
+    replayed_at = db.Column(db.DateTime(timezone=True), index=True)
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'channel': self.channel,
+            'message_id': self.message_id,
+            'correlation_id': self.correlation_id,
+            'error_class': self.error_class,
+            'last_status_code': self.last_status_code,
+            'attempts': self.attempts,
+            'failed_at': self.failed_at.isoformat() if self.failed_at else None,
+            'replayed_at': self.replayed_at.isoformat() if self.replayed_at else None,
+        }
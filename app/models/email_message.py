@@ -1,7 +1,9 @@
 from datetime import datetime, timezone
 from app.extensions import db
+from app.tasks.queues import recipient_shard_key
 import re
 import os
+import uuid
 import logging
 from cryptography.fernet import Fernet
 
@@ -31,7 +33,13 @@ def get_fernet() -> Fernet:
 
 class EmailMessage(db.Model):  # type: ignore
     __tablename__ = 'email_messages'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        # Reconciler scan: stale 'queued'/'retry' rows by age (app/tasks/reconciler.py)
+        db.Index('ix_email_messages_status_updated_at', 'status', 'updated_at'),
+        # Per-client backlog for fair queuing (app/utils/fair_queue.py)
+        db.Index('ix_email_messages_status_client_id', 'status', 'client_id'),
+        {'extend_existing': True},
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     uuid = db.Column(db.String(36), index=True, nullable=False, unique=True)
@@ -43,6 +51,16 @@ class EmailMessage(db.Model):  # type: ignore
     correlation_id = db.Column(db.String(64), index=True)
     attempts = db.Column(db.Integer, default=0)
     idempotency_key = db.Column(db.String(64), unique=True, index=True)
+    # Priority lane (app/tasks/queues.py): otp, transactional or bulk
+    priority = db.Column(db.String(16), index=True, default='transactional')
+    # Not sent after this; finalised as 'expired' instead (app/utils/message_ttl.py)
+    expires_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    # Calling integration (X-Client-Id)
+    client_id = db.Column(db.String(64), nullable=False, default='default', server_default='default')
+    # Recipient bucket for shard queues (app/tasks/queues.py); not reversible to the recipient
+    shard_key = db.Column(db.SmallInteger)
+    # Bulk upload job the message came from (app/utils/bulk_jobs.py), if any
+    job_id = db.Column(db.Integer, index=True)
     created_at = db.Column(
         db.DateTime(timezone=True),
         index=True,
@@ -56,18 +74,19 @@ class EmailMessage(db.Model):  # type: ignore
     deleted_at = db.Column(db.DateTime(timezone=True),
                            nullable=True, index=True)
 
-    def __init__(self, **kwargs):
-        # Input validation and sanitization
-        to = kwargs.get('to', '').strip()
-        subject = kwargs.get('subject', '').strip()
-        body = kwargs.get('body', '').strip()
-
-        # Email format validation
+    @staticmethod
+    def validate_to(to: str) -> str:
+        to = (to or '').strip()
         email_pattern = re.compile(r'^[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}$')
         if not email_pattern.fullmatch(to):
             raise ValueError('Invalid email address format')
         if len(to) > 255:
             raise ValueError('Email address too long')
+        return to
+
+    @staticmethod
+    def validate_content(subject: str, body: str):
+        subject, body = (subject or '').strip(), (body or '').strip()
         if not subject or len(subject) > 500:
             raise ValueError('Subject length must be 1–500 characters')
         if not body or len(body) > 10000:  # 10KB max
@@ -77,11 +96,76 @@ class EmailMessage(db.Model):  # type: ignore
         content_to_check = (subject + " " + body).upper()
         if any(f in content_to_check for f in forbidden):
             raise ValueError('Message contains forbidden content')
+        return subject, body
+
+    @classmethod
+    def batch_values(cls, items, **fields):
+        """
+        Validated, encrypted column values for (recipient, subject, body) items, for a
+        multi-row INSERT. Each distinct subject/body pair is validated and encrypted once.
+        Returns one (recipient, column values, reason) triple per item, in order:
+        the validated recipient and its values, or the input and why it was rejected.
+        """
+        fernet = get_fernet()
+        now = datetime.now(timezone.utc)
+        encrypted = {}  # (subject, body) -> ciphertexts, or the ValueError they raised
+        results = []
+        for recipient, subject, body in items:
+            if (subject, body) not in encrypted:
+                try:
+                    clean_subject, clean_body = cls.validate_content(subject, body)
+                    encrypted[subject, body] = (fernet.encrypt(clean_subject.encode()).decode(),
+                                                fernet.encrypt(clean_body.encode()).decode())
+                except ValueError as e:
+                    encrypted[subject, body] = e
+            try:
+                to = cls.validate_to(recipient)
+                if isinstance(encrypted[subject, body], ValueError):
+                    raise encrypted[subject, body]
+            except ValueError as e:
+                results.append((recipient, None, str(e)))
+                continue
+            encrypted_subject, encrypted_body = encrypted[subject, body]
+            results.append((to, {
+                **fields,
+                'to': fernet.encrypt(to.encode()).decode(),
+                'subject': encrypted_subject,
+                'body': encrypted_body,
+                'uuid': str(uuid.uuid4()),
+                'shard_key': recipient_shard_key(to),
+                'attempts': 0,
+                'created_at': now,
+                'updated_at': now,
+            }, None))
+        return results
+
+    @classmethod
+    def bulk_values(cls, recipients, subject: str, body: str, **fields):
+        """
+        Validated, encrypted column values for one email to many recipients, for a
+        multi-row INSERT. Subject and body are validated and encrypted once.
+        Returns (rows, rejected): (recipient, column values) and (recipient, reason) pairs.
+        Raises ValueError if the subject or body is invalid.
+        """
+        subject, body = cls.validate_content(subject, body)
+        rows, rejected = [], []
+        for recipient, values, reason in cls.batch_values([(r, subject, body) for r in recipients], **fields):
+            if reason:
+                rejected.append((recipient, reason))
+            else:
+                rows.append((recipient, values))
+        return rows, rejected
+
+    def __init__(self, **kwargs):
+        # Input validation and sanitization
+        to = self.validate_to(kwargs.get('to', ''))
+        subject, body = self.validate_content(kwargs.get('subject', ''), kwargs.get('body', ''))
 
         # Set non-encrypted fields
         for k, v in kwargs.items():
             if k not in ['to', 'subject', 'body']:
                 setattr(self, k, v)
+        self.shard_key = recipient_shard_key(to)
 
         # Encrypt sensitive fields
         fernet = get_fernet()
@@ -94,6 +178,16 @@ class EmailMessage(db.Model):  # type: ignore
         logging.getLogger('audit_logger').info(
             f"Created EmailMessage: uuid={self.uuid}")
 
+    def decrypt_fields(self):
+        """
+        Return the plaintext (to, subject, body) triple.
+        Raises RuntimeError / cryptography.fernet.InvalidToken if the row cannot be decrypted.
+        """
+        fernet = get_fernet()
+        return (fernet.decrypt(self.to.encode()).decode(),
+                fernet.decrypt(self.subject.encode()).decode(),
+                fernet.decrypt(self.body.encode()).decode())
+
     def as_dict(self):
         fernet = None
         try:
@@ -129,6 +223,10 @@ class EmailMessage(db.Model):  # type: ignore
             'correlation_id': self.correlation_id,
             'attempts': self.attempts,
             'idempotency_key': self.idempotency_key,
+            'priority': self.priority,
+            'client_id': self.client_id,
+            'job_id': self.job_id,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
             'deleted_at': self.deleted_at.isoformat() if self.deleted_at else None,
@@ -0,0 +1,39 @@
+from datetime import datetime, timezone
+from app.extensions import db
+
+
+class OutboxMessage(db.Model):  # type: ignore
+    """
+    A Celery task waiting to be published (transactional outbox, see
+    app/tasks/outbox_relay.py). Written in the same transaction as the message
+    row it sends, with the task id pre-generated, so the message and its
+    publication commit or roll back together.
+    """
+    __tablename__ = 'outbox_messages'
+    __table_args__ = {'extend_existing': True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(db.String(64), unique=True, nullable=False)
+    task_name = db.Column(db.String(128), nullable=False)
+    queue = db.Column(db.String(64))
+    args = db.Column(db.JSON, nullable=False, default=list)
+    kwargs = db.Column(db.JSON, nullable=False, default=dict)
+    # Failed publish attempts (broker unavailable); the relay keeps retrying
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_error = db.Column(db.String(255))
+    created_at = db.Column(
+        db.DateTime(timezone=True),
+        index=True,
+        default=lambda: datetime.now(timezone.utc)
+    )
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'task_id': self.task_id,
+            'task_name': self.task_name,
+            'queue': self.queue,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
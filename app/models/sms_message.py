@@ -1,7 +1,9 @@
 from datetime import datetime, timezone
 from app.extensions import db
+from app.tasks.queues import recipient_shard_key
 import re
 import os
+import uuid
 import logging
 from cryptography.fernet import Fernet
 
@@ -41,7 +43,13 @@ def get_fernet() -> Fernet:
 
 class SMSMessage(db.Model):  # type: ignore
     __tablename__ = 'sms_messages'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        # Reconciler scan: stale 'queued'/'retry' rows by age (app/tasks/reconciler.py)
+        db.Index('ix_sms_messages_status_updated_at', 'status', 'updated_at'),
+        # Per-client backlog for fair queuing (app/utils/fair_queue.py)
+        db.Index('ix_sms_messages_status_client_id', 'status', 'client_id'),
+        {'extend_existing': True},
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     uuid = db.Column(db.String(36), index=True, nullable=False, unique=True)
@@ -52,6 +60,18 @@ class SMSMessage(db.Model):  # type: ignore
     correlation_id = db.Column(db.String(64), index=True)
     attempts = db.Column(db.Integer, default=0)
     idempotency_key = db.Column(db.String(64), unique=True, index=True)
+    # Priority lane (app/tasks/queues.py): otp, transactional or bulk
+    priority = db.Column(db.String(16), index=True, default='transactional')
+    # Not sent after this; finalised as 'expired' instead (app/utils/message_ttl.py)
+    expires_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    # Calling integration (X-Client-Id); the dispatcher shares capacity fairly between clients
+    client_id = db.Column(db.String(64), nullable=False, default='default', server_default='default')
+    # Recipient bucket for shard queues (app/tasks/queues.py); not reversible to the recipient
+    shard_key = db.Column(db.SmallInteger)
+    # Bulk upload job the message came from (app/utils/bulk_jobs.py), if any
+    job_id = db.Column(db.Integer, index=True)
+    # Routing decision (sms_routing route name) recorded at enqueue; NULL = no prefix matched
+    route = db.Column(db.String(64), index=True)
     created_at = db.Column(
         db.DateTime(timezone=True),
         index=True,
@@ -65,24 +85,88 @@ class SMSMessage(db.Model):  # type: ignore
     deleted_at = db.Column(db.DateTime(timezone=True),
                            nullable=True, index=True)
 
-    def __init__(self, **kwargs):
-        # Input validation and sanitization
-        to = kwargs.get('to', '').strip()
-        message = kwargs.get('message', '').strip()
-
+    @staticmethod
+    def validate_to(to: str) -> str:
+        to = (to or '').strip()
         if not re.fullmatch(r'\+[1-9]\d{5,14}', to) and not re.fullmatch(r'[1-9]\d{5,14}', to):
             raise ValueError('Invalid phone number format')
         if len(to) < 6 or len(to) > 16:
             raise ValueError('Phone number length must be 6–16 digits')
+        return to
+
+    @staticmethod
+    def validate_message(message: str) -> str:
+        message = (message or '').strip()
         if not message or len(message) < 1 or len(message) > 500:
             raise ValueError('Message length must be 1–500 characters')
         if re.search(r'<script|SELECT|INSERT|UPDATE|DELETE|DROP|--', message, re.IGNORECASE):
             raise ValueError('Message contains forbidden content')
+        return message
+
+    @classmethod
+    def batch_values(cls, items, **fields):
+        """
+        Validated, encrypted column values for (recipient, message) pairs, for a
+        multi-row INSERT. Each distinct message is validated and encrypted once.
+        Returns one (recipient, column values, reason) triple per item, in order:
+        the validated recipient and its values, or the input and why it was rejected.
+        """
+        fernet = get_fernet()
+        now = datetime.now(timezone.utc)
+        encrypted = {}  # message -> ciphertext, or the ValueError it raised
+        results = []
+        for recipient, message in items:
+            if message not in encrypted:
+                try:
+                    encrypted[message] = fernet.encrypt(cls.validate_message(message).encode()).decode()
+                except ValueError as e:
+                    encrypted[message] = e
+            try:
+                to = cls.validate_to(recipient)
+                if isinstance(encrypted[message], ValueError):
+                    raise encrypted[message]
+            except ValueError as e:
+                results.append((recipient, None, str(e)))
+                continue
+            results.append((to, {
+                **fields,
+                'to': fernet.encrypt(to.encode()).decode(),
+                'message': encrypted[message],
+                'uuid': str(uuid.uuid4()),
+                'shard_key': recipient_shard_key(to),
+                'attempts': 0,
+                'created_at': now,
+                'updated_at': now,
+            }, None))
+        return results
+
+    @classmethod
+    def bulk_values(cls, recipients, message: str, **fields):
+        """
+        Validated, encrypted column values for one message to many recipients, for a
+        multi-row INSERT. The message is validated and encrypted once.
+        Returns (rows, rejected): (recipient, column values) and (recipient, reason) pairs.
+        Raises ValueError if the message itself is invalid.
+        """
+        message = cls.validate_message(message)
+        rows, rejected = [], []
+        for recipient, values, reason in cls.batch_values([(r, message) for r in recipients], **fields):
+            if reason:
+                rejected.append((recipient, reason))
+            else:
+                rows.append((recipient, values))
+        return rows, rejected
+
+    def __init__(self, **kwargs):
+        # Input validation and sanitization
+        to = self.validate_to(kwargs.get('to', ''))
+        message = self.validate_message(kwargs.get('message', ''))
 
         # Set non-encrypted fields
         for k, v in kwargs.items():
             if k not in ['to', 'message']:
                 setattr(self, k, v)
+        self.shard_key = recipient_shard_key(to)
 
         # Encrypt sensitive fields only now
         fernet = get_fernet()
@@ -94,6 +178,15 @@ class SMSMessage(db.Model):  # type: ignore
         logging.getLogger('audit_logger').info(
             f"Created SMSMessage: uuid={self.uuid}")
 
+    def decrypt_fields(self):
+        """
+        Return the plaintext (to, message) pair.
+        Raises RuntimeError / cryptography.fernet.InvalidToken if the row cannot be decrypted.
+        """
+        fernet = get_fernet()
+        return (fernet.decrypt(self.to.encode()).decode(),
+                fernet.decrypt(self.message.encode()).decode())
+
     def as_dict(self):
         fernet = None
         try:
@@ -123,6 +216,11 @@ class SMSMessage(db.Model):  # type: ignore
             'correlation_id': self.correlation_id,
             'attempts': self.attempts,
             'idempotency_key': self.idempotency_key,
+            'priority': self.priority,
+            'client_id': self.client_id,
+            'job_id': self.job_id,
+            'route': self.route,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
             'deleted_at': self.deleted_at.isoformat() if self.deleted_at else None,
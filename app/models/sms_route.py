@@ -0,0 +1,45 @@
+from datetime import datetime, timezone
+from app.extensions import db
+
+
+class SMSRoute(db.Model):  # type: ignore
+    """
+    DB-managed prefix route (see app/utils/sms_routing.py). Rows override
+    SMS_ROUTES entries with the same prefix.
+    """
+    __tablename__ = 'sms_routes'
+    __table_args__ = {'extend_existing': True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), nullable=False)
+    prefix = db.Column(db.String(16), unique=True, index=True, nullable=False)
+    # Comma-separated gateway pool member names; empty = any member
+    gateways = db.Column(db.String(255))
+    senderid = db.Column(db.String(32))
+    active = db.Column(db.Boolean, default=True, nullable=False)
+    created_at = db.Column(
+        db.DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc)
+    )
+    updated_at = db.Column(
+        db.DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc)
+    )
+
+    def to_route(self):
+        from app.utils.sms_routing import Route  # lazy import
+        gateways = [g.strip() for g in (self.gateways or '').split(',') if g.strip()]
+        return Route(self.name, self.prefix, gateways, self.senderid)
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'prefix': self.prefix,
+            'gateways': self.gateways,
+            'senderid': self.senderid,
+            'active': self.active,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
@@ -1,6 +1,8 @@
 from flask import Blueprint, request, current_app
 from app.extensions import db
 from app.models.email_message import EmailMessage
+from app.models.dead_letter import DeadLetter
+from app.utils.dead_letters import dead_letter_query, parse_filters, replay_dead_letters
 from app.utils.response import success, error
 from app.utils.decorators import require_admin_bearer_and_log
 from sqlalchemy import desc, asc
@@ -70,4 +72,44 @@ def cancel_email_task(task_id):
     if not celery:
         return error('Celery not configured', 'NO_CELERY', 400)
     async_res = celery.control.revoke(task_id, terminate=True)
-    return success('Cancel requested', {'task_id': task_id, 'revoked': True})
\ No newline at end of file
+    return success('Cancel requested', {'task_id': task_id, 'revoked': True})
+
+@email_admin_bp.route('/dead-letters', methods=['GET'])
+@require_admin_bearer_and_log
+def email_list_dead_letters():
+    try:
+        filters = parse_filters(request.args)
+        page = int(request.args.get('page', 1))
+        per_page = min(int(request.args.get('per_page', 20)), 100)
+        if page < 1 or per_page < 1:
+            raise ValueError('Invalid pagination parameters')
+    except ValueError as e:
+        return error(str(e), 'BAD_PARAM', 400)
+    q = dead_letter_query('email', include_replayed=request.args.get('include_replayed') == 'true', **filters)
+    pagination = db.paginate(q.order_by(desc(DeadLetter.failed_at)), page=page, per_page=per_page, error_out=False)
+    data = {
+        'items': [d.as_dict() for d in pagination.items],
+        'page': page,
+        'per_page': per_page,
+        'total': pagination.total,
+        'pages': pagination.pages
+    }
+    return success('Dead letters listed', data)
+
+@email_admin_bp.route('/dead-letters/replay', methods=['POST'])
+@require_admin_bearer_and_log
+def email_replay_dead_letters():
+    data = request.get_json(silent=True) or {}
+    try:
+        filters = parse_filters(data)
+        limit = int(data['limit']) if data.get('limit') else None
+    except (ValueError, TypeError) as e:
+        return error(str(e), 'BAD_PARAM', 400)
+    if not getattr(current_app, 'celery', None):
+        return error('Celery not configured', 'NO_CELERY', 400)
+    try:
+        result = replay_dead_letters('email', limit=limit, **filters)
+    except Exception as e:
+        current_app.logger.error(f"Dead-letter replay (email) failed: {e}")
+        return error('Failed to replay dead letters', 'DB_ERROR', 500)
+    return success('Dead letters replayed', result)
@@ -1,14 +1,21 @@
 from flask import Blueprint, request, current_app as flask_current_app, g
 from flask_restx import Api, Resource, fields
 from app.utils.response import success, error
-from app.extensions import db, email_sent_counter, email_failed_counter, email_queued_counter
+from app.extensions import db, email_sent_counter, email_failed_counter, email_queued_counter, messages_enqueued_counter
 from app.utils.decorators import require_bearer_and_log
-from app.tasks.email_queue import add_to_queue_task, send_and_record, process_health_check_task
+from app.tasks.email_queue import add_to_queue_task, send_and_record, send_batch_and_record, process_health_check_task
 from app.models.email_message import EmailMessage
+from app.tasks.queues import PRIORITIES, normalize_priority, queue_for
+from app.utils.message_ttl import resolve_expiry
+from app.utils.fair_queue import current_client_id
+from app.utils.staging import insert_and_stage
+from app.utils.bulk_jobs import new_job
+from app.tasks.outbox_relay import stage_task
 import uuid
+from datetime import datetime, timezone
 from typing import List
 import re
-from sqlalchemy import select
+from sqlalchemy import select, update
 import time
 import logging
 
@@ -19,16 +26,47 @@ single_email_model = api.model('SingleEmailRequest', {
     'to': fields.String(required=True, description='Recipient email'),
     'subject': fields.String(required=True, description='Email subject'),
     'body': fields.String(required=True, description='Email body content'),
-    'correlation_id': fields.String(required=False, description='Correlation ID for tracing')
+    'correlation_id': fields.String(required=False, description='Correlation ID for tracing'),
+    'priority': fields.String(required=False, enum=list(PRIORITIES), description='Delivery lane (default: transactional)'),
+    'expires_at': fields.String(required=False, description='ISO 8601 time after which the email is dropped, not sent'),
+    'ttl_seconds': fields.Integer(required=False, description='Alternative to expires_at: seconds from now')
 })
 
 bulk_email_model = api.model('BulkEmailRequest', {
     'to': fields.List(fields.String, required=True, description='List of recipient emails'),
     'subject': fields.String(required=True, description='Email subject'),
     'body': fields.String(required=True, description='Email body content'),
-    'correlation_id': fields.String(required=False, description='Correlation ID for tracing')
+    'correlation_id': fields.String(required=False, description='Correlation ID for tracing'),
+    'priority': fields.String(required=False, enum=list(PRIORITIES), description='Delivery lane (default: bulk)'),
+    'expires_at': fields.String(required=False, description='ISO 8601 time after which unsent emails are dropped'),
+    'ttl_seconds': fields.Integer(required=False, description='Alternative to expires_at: seconds from now')
 })
 
+batch_email_item_model = api.model('BatchEmailItem', {
+    'to': fields.String(required=True, description='Recipient email'),
+    'subject': fields.String(required=True, description='Email subject for this recipient'),
+    'body': fields.String(required=True, description='Email body content for this recipient'),
+    'idempotency_key': fields.String(required=False, description='Repeats return the existing email (max 64 chars)')
+})
+
+batch_email_model = api.model('BatchEmailRequest', {
+    'messages': fields.List(fields.Nested(batch_email_item_model), required=True,
+                            description='One item per recipient, each with its own subject and body'),
+    'correlation_id': fields.String(required=False, description='Correlation ID for tracing'),
+    'priority': fields.String(required=False, enum=list(PRIORITIES), description='Delivery lane (default: transactional)'),
+    'expires_at': fields.String(required=False, description='ISO 8601 time after which unsent emails are dropped'),
+    'ttl_seconds': fields.Integer(required=False, description='Alternative to expires_at: seconds from now')
+})
+
+email_job_params = {
+    'subject': {'in': 'query', 'required': True, 'description': 'Email subject'},
+    'body': {'in': 'query', 'required': True, 'description': 'Email body content'},
+    'format': {'in': 'query', 'enum': ['csv', 'ndjson'], 'description': 'Upload format (default: from Content-Type)'},
+    'priority': {'in': 'query', 'enum': list(PRIORITIES), 'description': 'Delivery lane (default: bulk)'},
+    'expires_at': {'in': 'query', 'description': 'ISO 8601 time after which unsent emails are dropped'},
+    'ttl_seconds': {'in': 'query', 'type': 'integer', 'description': 'Alternative to expires_at: seconds from now'},
+}
+
 """Email endpoints with database persistence and advanced functionality."""
 
 def _normalize_email(e: str) -> str:
@@ -106,6 +144,11 @@ class SingleEmail(Resource):
             return error("Body exceeds maximum length of 10000 characters", "EMAIL_SERVICE_ERROR", 400)
         if not _validate_email(to):
             return error("Invalid email address format", "EMAIL_SERVICE_ERROR", 400)
+        try:
+            priority = normalize_priority(data.get('priority'), 'transactional')
+            expires_at = resolve_expiry(data, priority)
+        except ValueError as e:
+            return error(str(e), "EMAIL_SERVICE_ERROR", 400)
         
         idempotency_key = request.headers.get('Idempotency-Key')
         if idempotency_key:
@@ -116,11 +159,16 @@ class SingleEmail(Resource):
                 logging.getLogger('app').info(f"Idempotent request: Email already processed: {idempotency_key}")
                 return success("Email already processed", existing.as_dict())
         
+        celery = getattr(flask_current_app, 'celery', None)
         try:
-            # Create record within a transaction to ensure a consistent id is available
-            record = EmailMessage(to=to, subject=subject, body=body, status='queued', idempotency_key=idempotency_key, correlation_id=correlation_id, uuid=str(uuid.uuid4()))
+            record = EmailMessage(to=to, subject=subject, body=body, status='queued', idempotency_key=idempotency_key, correlation_id=correlation_id, uuid=str(uuid.uuid4()), priority=priority, expires_at=expires_at, client_id=current_client_id())
             db.session.add(record)
-            db.session.commit()  # create the row so we have an id
+            if celery:
+                # Outbox row commits with the message; the relay publishes it
+                db.session.flush()  # id for the task arguments
+                record.task_id = stage_task(send_and_record, (record.id, correlation_id),
+                                            queue=queue_for('email', priority, record.shard_key))
+            db.session.commit()
         except ValueError as e:
             # Handle validation errors from EmailMessage constructor
             db.session.rollback()
@@ -132,45 +180,11 @@ class SingleEmail(Resource):
             logging.getLogger('error').error(f"Database error when creating email record: {str(e)}")
             return error("Internal server error", "EMAIL_SERVICE_ERROR", 500)
 
-        # Add to queue for processing
-        celery = getattr(flask_current_app, 'celery', None)
         if celery:
-            try:
-                # Add to queue with the send_and_record task (which handles database tracking)
-                task = send_and_record.delay(record.id, correlation_id)
-                
-                # Update the record to store the task ID
-                with db.session.begin():
-                    row = db.session.execute(
-                        select(EmailMessage).where(EmailMessage.id == record.id).with_for_update()
-                    ).scalar_one()
-                    # We don't have a direct task ID from send_and_record, but it's tracked internally
-                    row.task_id = task.id if hasattr(task, 'id') else str(uuid.uuid4())[:16]
-                
-                email_queued_counter.inc()
-                logging.getLogger('email').info(f"Single email queued for {to}")
-                return success("Email queued for processing", record.as_dict())
-            except Exception as e:
-                logging.getLogger('error').error(f"Error queuing email task: {str(e)}")
-                # Fallback to direct sending if queueing fails
-                from app.utils.email_util import send_single_email_util
-                status, message_id = send_single_email_util(to, subject, body)
-                
-                # Update status in DB
-                with db.session.begin():
-                    row = db.session.execute(
-                        select(EmailMessage).where(EmailMessage.id == record.id).with_for_update()
-                    ).scalar_one()
-                    if status == 200:
-                        row.status = 'sent'
-                        email_sent_counter.inc()
-                        logging.getLogger('email').info(f"Single email sent directly to {to}")
-                        return success("Email sent successfully", row.as_dict())
-                    else:
-                        row.status = 'failed'
-                        email_failed_counter.inc()
-                        logging.getLogger('email').error(f"Single email failed to {to}, status: {status}")
-                        return error("Failed to send email", "EMAIL_SERVICE_ERROR", 400)
+            email_queued_counter.inc()
+            messages_enqueued_counter.labels(channel='email', priority=priority).inc()
+            logging.getLogger('email').info(f"Single email queued for {to} on {priority} lane")
+            return success("Email queued for processing", record.as_dict())
         else:
             # Direct send if no Celery
             from app.utils.email_util import send_single_email_util
@@ -231,6 +245,11 @@ class BulkEmail(Resource):
             return error("Body exceeds maximum length of 10000 characters", "EMAIL_SERVICE_ERROR", 400)
         if len(recipients) > 200:  # Max 200 in bulk request
             return error("Bulk email request exceeds maximum of 200 messages", "EMAIL_SERVICE_ERROR", 400)
+        try:
+            priority = normalize_priority(data.get('priority'), 'bulk')
+            expires_at = resolve_expiry(data, priority)
+        except ValueError as e:
+            return error(str(e), "EMAIL_SERVICE_ERROR", 400)
         
         cleaned = []
         for e in recipients:
@@ -243,74 +262,75 @@ class BulkEmail(Resource):
         
         successes = []
         failures = []
-        
-        for e in cleaned:
+
+        # Validate and encrypt every recipient up front (subject and body once); a bad
+        # address becomes a per-recipient failure instead of rolling back the others
+        try:
+            rows, rejected = EmailMessage.bulk_values(
+                cleaned, subject, body, status='queued', correlation_id=correlation_id,
+                priority=priority, expires_at=expires_at, client_id=current_client_id())
+        except ValueError as ve:
+            return error(str(ve), "EMAIL_SERVICE_ERROR", 400)
+        failures.extend({'email': e, 'error': reason} for e, reason in rejected)
+
+        # One INSERT ... RETURNING for all rows, plus their batch tasks in the outbox and
+        # the request's bulk job, in one transaction
+        batch_size = max(int(flask_current_app.config.get('EMAIL_BATCH_SIZE', 50)), 1)
+        celery = getattr(flask_current_app, 'celery', None)
+        staged, chunks = [], []
+        job = new_job('email', 'json', priority, current_client_id(), correlation_id)
+        if rows:
             try:
-                record = EmailMessage(to=e, subject=subject, body=body, status='queued', correlation_id=correlation_id, uuid=str(uuid.uuid4()))
-                db.session.add(record)
-                db.session.flush()  # Use flush to get ID without committing
-            except ValueError as ve:
-                # Handle validation error from EmailMessage constructor
-                db.session.rollback()
-                failures.append({'email': e, 'error': str(ve)})
-                continue
+                db.session.add(job)
+                db.session.flush()  # id for the rows
+                job.total, job.accepted, job.rejected = len(cleaned), len(rows), len(rejected)
+                job.status, job.finished_at = 'queued', datetime.now(timezone.utc)
+                for _, values in rows:
+                    values['job_id'] = job.id
+                staged, chunks = insert_and_stage(EmailMessage, 'email', send_batch_and_record, rows, priority,
+                                                  correlation_id, batch_size, publish=bool(celery))
+                db.session.commit()
             except Exception as e:
-                # Handle any other database error
                 db.session.rollback()
-                failures.append({'email': e, 'error': 'Database error'})
-                continue
-            
-            # Add to queue for processing
-            celery = getattr(flask_current_app, 'celery', None)
-            if celery:
-                try:
-                    # Add to queue with the send_and_record task for each record
-                    task = send_and_record.delay(record.id, correlation_id)
-                    
-                    # Update the record to store the task ID
-                    record.task_id = task.id if hasattr(task, 'id') else str(uuid.uuid4())[:16]
-                    email_queued_counter.inc()
-                    successes.append({'email': e, 'record_id': record.id, 'task_queued': True})
-                    logging.getLogger('email').info(f"Bulk email queued for {e}")
-                except Exception as e:
-                    logging.getLogger('error').error(f"Error queuing email task for {e}: {str(e)}")
-                    # Fallback to direct sending if queueing fails
-                    from app.utils.email_util import send_single_email_util
-                    code, message_id = send_single_email_util(e, subject, body)
-                    if code == 200:
-                        record.status = 'sent'
-                        email_sent_counter.inc()
-                        successes.append({'email': e, 'record_id': record.id, 'direct_send': True})
-                        logging.getLogger('email').info(f"Bulk email sent directly to {e}")
-                    else:
-                        record.status = 'failed'
-                        email_failed_counter.inc()
-                        failures.append({'email': e, 'record_id': record.id, 'status_code': code})
-                        logging.getLogger('email').error(f"Bulk email failed to {e}, status: {code}")
-            else:
-                # Direct send if no Celery
-                from app.utils.email_util import send_single_email_util
-                code, message_id = send_single_email_util(e, subject, body)
+                logging.getLogger('error').error(f"Database error when creating bulk email records: {str(e)}")
+                return error("Internal server error during bulk email processing", "EMAIL_SERVICE_ERROR", 500)
+
+        if celery and staged:
+            # The outbox relay publishes the batches
+            email_queued_counter.inc(len(staged))
+            messages_enqueued_counter.labels(channel='email', priority=priority).inc(len(staged))
+            successes.extend({'email': e, 'record_id': record_id, 'task_queued': True} for e, record_id in staged)
+            logging.getLogger('email').info(f"Bulk email queued for {len(staged)} recipients in {len(chunks)} batches")
+
+        # Direct send without Celery, over reused SMTP sessions
+        pending = [] if celery else staged
+        if pending:
+            from app.utils.email_util import send_email_batch_util
+            results = send_email_batch_util([(e, subject, body) for e, _ in pending],
+                                            concurrency=int(flask_current_app.config.get('EMAIL_BATCH_CONCURRENCY', 4)))
+            updates = []
+            for (e, record_id), (code, _) in zip(pending, results):
                 if code == 200:
-                    record.status = 'sent'
+                    updates.append({'id': record_id, 'status': 'sent', 'attempts': 1})
                     email_sent_counter.inc()
-                    successes.append({'email': e, 'record_id': record.id, 'direct_send': True})
-                    logging.getLogger('email').info(f"Bulk email sent directly to {e}")
+                    successes.append({'email': e, 'record_id': record_id, 'direct_send': True})
                 else:
-                    record.status = 'failed'
+                    updates.append({'id': record_id, 'status': 'failed', 'attempts': 1})
                     email_failed_counter.inc()
-                    failures.append({'email': e, 'record_id': record.id, 'status_code': code})
-                    logging.getLogger('email').error(f"Bulk email failed to {e}, status: {code}")
-        
-        try:
-            db.session.commit()
-        except Exception as e:
-            db.session.rollback()
-            logging.getLogger('error').error(f"Database error when committing bulk email records: {str(e)}")
-            return error("Internal server error during bulk email processing", "EMAIL_SERVICE_ERROR", 500)
+                    failures.append({'email': e, 'record_id': record_id, 'status_code': code})
+            try:
+                db.session.execute(update(EmailMessage), updates)
+                job.sent = sum(1 for u in updates if u['status'] == 'sent')
+                job.failed, job.status = len(updates) - job.sent, 'completed'
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logging.getLogger('error').error(f"Database error when committing bulk email records: {str(e)}")
+                return error("Internal server error during bulk email processing", "EMAIL_SERVICE_ERROR", 500)
         
         overall = 200 if successes and not failures else (207 if successes and failures else 400)
-        payload = {"successes": successes, "failures": failures, "requested": len(cleaned)}
+        payload = {"successes": successes, "failures": failures, "requested": len(cleaned),
+                   "job_id": job.uuid if job.id else None}
         
         if overall == 200:
             logging.getLogger('email').info(f"Bulk email: {len(successes)} sent successfully")
@@ -324,6 +344,185 @@ class BulkEmail(Resource):
         logging.getLogger('email').error(f"Bulk email: all {len(failures)} failed")
         return error("Failed to send Bulk email", "EMAIL_SERVICE_ERROR", 400)
 
+@api.route('/batch')
+class BatchEmail(Resource):
+    method_decorators = [require_bearer_and_log]
+
+    @api.expect(batch_email_model)
+    def post(self):
+        # Check IP range
+        if not _check_ip_allowed():
+            logging.getLogger('access').error(f"Access denied from IP: {_get_ip_range()}")
+            return error("Access denied from this IP", "ACCESS_DENIED", 403)
+
+        data = request.get_json(silent=True) or {}
+        messages = data.get('messages')
+        correlation_id = data.get('correlation_id', str(uuid.uuid4()))
+
+        if not isinstance(messages, list) or not messages:
+            return error("Missing required field: messages", "EMAIL_SERVICE_ERROR", 400)
+        max_items = flask_current_app.config.get('BATCH_REQUEST_MAX_ITEMS', 500)
+        if len(messages) > max_items:
+            return error(f"Batch email request exceeds maximum of {max_items} messages", "EMAIL_SERVICE_ERROR", 400)
+        try:
+            priority = normalize_priority(data.get('priority'), 'transactional')
+            expires_at = resolve_expiry(data, priority)
+        except ValueError as e:
+            return error(str(e), "EMAIL_SERVICE_ERROR", 400)
+
+        # Sanitization and Validation, per item: a bad item is rejected, not the request
+        from app.utils.sanitization import sanitize_text, validate_safe_input
+        items, rejected = [], []
+        for index, item in enumerate(messages):
+            item = item if isinstance(item, dict) else {}
+            to, subject, body = item.get('to'), item.get('subject'), item.get('body')
+            idempotency_key = item.get('idempotency_key')
+            reason = None
+            if not all(isinstance(v, str) and v.strip() for v in (to, subject, body)):
+                reason = "Missing required fields: to, subject, and body are required"
+            elif idempotency_key is not None and (not isinstance(idempotency_key, str) or len(idempotency_key) > 64):
+                reason = "idempotency_key must be a string of at most 64 characters"
+            else:
+                to, subject, body = _normalize_email(to), subject.strip(), body.strip()
+                for value, context, label in ((subject, "batch_email_subject", "subject"),
+                                              (body, "batch_email_body", "body")):
+                    is_safe, unsafe = validate_safe_input(value, context=context)
+                    if not is_safe:
+                        reason = f"Invalid {label} content: {unsafe}"
+                        break
+                if reason is None:
+                    subject, body = sanitize_text(subject), sanitize_text(body)
+                    if len(subject) > 500:
+                        reason = "Subject exceeds maximum length of 500 characters"
+                    elif len(body) > 10000:
+                        reason = "Body exceeds maximum length of 10000 characters"
+                    elif not _validate_email(to):
+                        reason = f"Invalid email address format: {to}"
+                    else:
+                        items.append((index, to, (subject, body), idempotency_key or None))
+                        continue
+            rejected.append({'index': index, 'email': to if isinstance(to, str) else None,
+                             'status': 'rejected', 'error': reason})
+
+        from app.utils.batch_workflow import process_batch
+        from app.utils.bulk_jobs import BulkJobError
+
+        job = None
+        results = []
+        if items:
+            try:
+                results, job = process_batch('email', items, priority=priority, expires_at=expires_at,
+                                             client_id=current_client_id(), correlation_id=correlation_id)
+            except BulkJobError as e:
+                return error(str(e), e.error_code, e.http_code)
+            except Exception as e:
+                logging.getLogger('error').error(f"Unexpected error in BatchEmail: {str(e)}")
+                return error("Internal server error", "EMAIL_SERVICE_ERROR", 500)
+        results = sorted(results + rejected, key=lambda r: r['index'])
+
+        failed = sum(1 for r in results if r['status'] in ('rejected', 'failed'))
+        payload = {"results": results, "requested": len(messages), "job_id": job.uuid if job else None}
+        if not failed:
+            logging.getLogger('email').info(f"Batch email: {len(results)} processed")
+            return success("Batch email processed successfully", payload, 200)
+        if failed < len(results):
+            logging.getLogger('email').info(f"Batch email: {len(results) - failed} succeeded, {failed} failed")
+            response, _ = success("Batch email partially successful", payload, 207)
+            response["status"] = "partial"
+            return response, 207
+
+        logging.getLogger('email').error(f"Batch email: all {failed} failed")
+        return error("Failed to send batch email", "EMAIL_SERVICE_ERROR", 400, data=payload)
+
+
+@api.route('/jobs')
+class EmailJobs(Resource):
+    method_decorators = [require_bearer_and_log]
+
+    @api.doc(params=email_job_params,
+             description='Streamed recipient list (CSV or NDJSON request body) of any size; returns the job')
+    def post(self):
+        # Check IP range
+        if not _check_ip_allowed():
+            logging.getLogger('access').error(f"Access denied from IP: {_get_ip_range()}")
+            return error("Access denied from this IP", "ACCESS_DENIED", 403)
+
+        # Raise the body limit for this request before the stream is opened
+        request.max_content_length = flask_current_app.config.get('BULK_JOB_MAX_UPLOAD_BYTES')
+        args = request.args
+        subject = (args.get('subject') or '').strip()
+        body = (args.get('body') or '').strip()
+        if not subject or not body:
+            return error("Missing required parameters: subject and body are required", "EMAIL_SERVICE_ERROR", 400)
+
+        from app.utils.sanitization import sanitize_text, validate_safe_input
+
+        is_safe_subj, reason_subj = validate_safe_input(subject, context="email_job_subject")
+        if not is_safe_subj:
+            return error(f"Invalid subject content: {reason_subj}", "SECURITY_VIOLATION", 400)
+
+        is_safe_body, reason_body = validate_safe_input(body, context="email_job_body")
+        if not is_safe_body:
+            return error(f"Invalid body content: {reason_body}", "SECURITY_VIOLATION", 400)
+
+        subject = sanitize_text(subject)
+        body = sanitize_text(body)
+
+        if len(subject) > 500:
+            return error("Subject exceeds maximum length of 500 characters", "EMAIL_SERVICE_ERROR", 400)
+        if len(body) > 10000:
+            return error("Body exceeds maximum length of 10000 characters", "EMAIL_SERVICE_ERROR", 400)
+        try:
+            priority = normalize_priority(args.get('priority'), 'bulk')
+            expires_at = resolve_expiry(args, priority)
+        except ValueError as e:
+            return error(str(e), "EMAIL_SERVICE_ERROR", 400)
+
+        from app.utils.bulk_jobs import BulkJobError, submit_upload, upload_format
+
+        try:
+            fmt = upload_format(request.content_type, args.get('format'))
+            job = submit_upload('email', request.stream, fmt, (subject, body), priority=priority,
+                                expires_at=expires_at, client_id=current_client_id(),
+                                correlation_id=getattr(g, 'request_id', None))
+        except BulkJobError as e:
+            return error(str(e), e.error_code, e.http_code)
+
+        if job.status == 'receiving':
+            # Spooled: a worker queues the rows; poll GET .../jobs/<job_id> for progress
+            return success("Bulk email job accepted", job.as_dict(), 202)
+        if not job.accepted:
+            return error(job.error or "Bulk email job failed", "EMAIL_SERVICE_ERROR", 400, data={'job': job.as_dict()})
+        if job.status == 'failed':
+            # Cut off mid-upload: the rows committed before the failure are still sent
+            payload, _ = success("Bulk email job partially queued", job.as_dict(), 207)
+            payload["status"] = "partial"
+            return payload, 207
+        return success("Bulk email job queued", job.as_dict(), 202)
+
+
+@api.route('/jobs/<string:job_id>')
+class EmailJob(Resource):
+    method_decorators = [require_bearer_and_log]
+
+    @api.doc(description='Progress of a bulk email job: total, queued, sent, failed and expired')
+    def get(self, job_id):
+        # Check IP range
+        if not _check_ip_allowed():
+            logging.getLogger('access').error(f"Access denied from IP: {_get_ip_range()}")
+            return error("Access denied from this IP", "ACCESS_DENIED", 403)
+
+        from app.models.bulk_job import BulkJob
+        from app.tasks.job_counters import job_progress
+
+        job = BulkJob.query.filter_by(uuid=job_id, channel='email').first()
+        # Jobs are only visible to the client that submitted them; only per-client API keys
+        # make that an access control (X-Client-Id on the shared key is taken on trust)
+        if job is None or job.client_id != current_client_id():
+            return error("Job not found", "NOT_FOUND", 404)
+        return success("Bulk email job", job_progress(job))
+
+
 @api.route('/health')
 class EmailHealth(Resource):
     def get(self):
@@ -1,6 +1,10 @@
 from flask import Blueprint, request, current_app
 from app.extensions import db
 from app.models.sms_message import SMSMessage
+from app.models.sms_route import SMSRoute
+from app.models.dead_letter import DeadLetter
+from app.utils.dead_letters import dead_letter_query, parse_filters, replay_dead_letters
+from app.utils.sms_routing import get_routing_table, reload_routing_table
 from app.utils.response import success, error
 from app.utils.decorators import require_admin_bearer_and_log
 from sqlalchemy import desc, asc
@@ -88,3 +92,83 @@ def cancel_task(task_id):
         return error('Celery not configured', 'NO_CELERY', 400)
     async_res = celery.control.revoke(task_id, terminate=True)
     return success('Cancel requested', {'task_id': task_id, 'revoked': True})
+
+@sms_admin_bp.route('/routes', methods=['GET'])
+@require_admin_bearer_and_log
+def list_routes():
+    table = get_routing_table()
+    return success('SMS routes', {
+        'active': [r.to_dict() for r in sorted(table.routes, key=lambda r: r.prefix)],
+        'db': [r.as_dict() for r in SMSRoute.query.order_by(asc(SMSRoute.prefix)).all()],
+    })
+
+@sms_admin_bp.route('/routes', methods=['POST'])
+@require_admin_bearer_and_log
+def upsert_route():
+    data = request.get_json(silent=True) or {}
+    prefix = str(data.get('prefix', '')).strip()
+    if not prefix.isdigit() or len(prefix) > 16:
+        return error('prefix must be 1-16 digits', 'BAD_PARAM', 400)
+    gateways = data.get('gateways') or []
+    if isinstance(gateways, str):
+        gateways = [g.strip() for g in gateways.split(',') if g.strip()]
+    row = SMSRoute.query.filter_by(prefix=prefix).first() or SMSRoute(prefix=prefix)
+    row.name = data.get('name') or row.name or f"prefix-{prefix}"
+    row.gateways = ','.join(gateways)
+    row.senderid = data.get('senderid')
+    row.active = bool(data.get('active', True))
+    try:
+        db.session.add(row)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Failed to save SMS route {prefix}: {e}")
+        return error('Failed to save route', 'DB_ERROR', 500)
+    reload_routing_table()
+    return success('Route saved', row.as_dict())
+
+@sms_admin_bp.route('/routes/reload', methods=['POST'])
+@require_admin_bearer_and_log
+def reload_routes():
+    table = reload_routing_table()
+    return success('Routing table reloaded', {'prefixes': len(table)})
+
+@sms_admin_bp.route('/dead-letters', methods=['GET'])
+@require_admin_bearer_and_log
+def list_dead_letters():
+    try:
+        filters = parse_filters(request.args)
+        page = int(request.args.get('page', 1))
+        per_page = min(int(request.args.get('per_page', 20)), 100)
+        if page < 1 or per_page < 1:
+            raise ValueError('Invalid pagination parameters')
+    except ValueError as e:
+        return error(str(e), 'BAD_PARAM', 400)
+    q = dead_letter_query('sms', include_replayed=request.args.get('include_replayed') == 'true', **filters)
+    pagination = db.paginate(q.order_by(desc(DeadLetter.failed_at)), page=page, per_page=per_page, error_out=False)
+    data = {
+        'items': [d.as_dict() for d in pagination.items],
+        'page': page,
+        'per_page': per_page,
+        'total': pagination.total,
+        'pages': pagination.pages
+    }
+    return success('Dead letters listed', data)
+
+@sms_admin_bp.route('/dead-letters/replay', methods=['POST'])
+@require_admin_bearer_and_log
+def replay_sms_dead_letters():
+    data = request.get_json(silent=True) or {}
+    try:
+        filters = parse_filters(data)
+        limit = int(data['limit']) if data.get('limit') else None
+    except (ValueError, TypeError) as e:
+        return error(str(e), 'BAD_PARAM', 400)
+    if not getattr(current_app, 'celery', None) and current_app.config.get('SMS_DISPATCH_BACKEND') != 'asyncio':
+        return error('Celery not configured', 'NO_CELERY', 400)
+    try:
+        result = replay_dead_letters('sms', limit=limit, **filters)
+    except Exception as e:
+        current_app.logger.error(f"Dead-letter replay (sms) failed: {e}")
+        return error('Failed to replay dead letters', 'DB_ERROR', 500)
+    return success('Dead letters replayed', result)
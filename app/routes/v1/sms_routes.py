@@ -6,6 +6,9 @@ from app.extensions import db, sms_sent_counter, sms_failed_counter, sms_queued_
 from app.utils.decorators import require_bearer_and_log
 from app.tasks.sms_queue import add_to_queue_task, process_health_check_task
 from app.models.sms_message import SMSMessage
+from app.tasks.queues import PRIORITIES, normalize_priority
+from app.utils.message_ttl import resolve_expiry
+from app.utils.fair_queue import current_client_id
 import uuid
 from typing import List
 import re
@@ -21,15 +24,43 @@ api = Api(sms_bp, doc='/docs', title='SMS API', description='API for sending SMS
 single_sms_model = api.model('SingleSMSRequest', {
     'mobile': fields.String(required=False, description='Recipient phone (preferred)'),
     'to': fields.String(required=False, description='Recipient phone (legacy key)'),
-    'message': fields.String(required=True, description='Message content')
+    'message': fields.String(required=True, description='Message content'),
+    'priority': fields.String(required=False, enum=list(PRIORITIES), description='Delivery lane (default: transactional)'),
+    'expires_at': fields.String(required=False, description='ISO 8601 time after which the SMS is dropped, not sent'),
+    'ttl_seconds': fields.Integer(required=False, description='Alternative to expires_at: seconds from now')
 })
 
 bulk_sms_model = api.model('BulkSMSRequest', {
     'mobiles': fields.List(fields.String, required=False, description='List of recipient phones (preferred)'),
     'to': fields.List(fields.String, required=False, description='Legacy key for list of phones'),
-    'message': fields.String(required=True, description='Message content')
+    'message': fields.String(required=True, description='Message content'),
+    'priority': fields.String(required=False, enum=list(PRIORITIES), description='Delivery lane (default: bulk)'),
+    'expires_at': fields.String(required=False, description='ISO 8601 time after which unsent SMS are dropped'),
+    'ttl_seconds': fields.Integer(required=False, description='Alternative to expires_at: seconds from now')
 })
 
+batch_sms_item_model = api.model('BatchSMSItem', {
+    'mobile': fields.String(required=True, description='Recipient phone'),
+    'message': fields.String(required=True, description='Message content for this recipient'),
+    'idempotency_key': fields.String(required=False, description='Repeats return the existing message (max 64 chars)')
+})
+
+batch_sms_model = api.model('BatchSMSRequest', {
+    'messages': fields.List(fields.Nested(batch_sms_item_model), required=True,
+                            description='One item per recipient, each with its own message'),
+    'priority': fields.String(required=False, enum=list(PRIORITIES), description='Delivery lane (default: transactional)'),
+    'expires_at': fields.String(required=False, description='ISO 8601 time after which unsent SMS are dropped'),
+    'ttl_seconds': fields.Integer(required=False, description='Alternative to expires_at: seconds from now')
+})
+
+sms_job_params = {
+    'message': {'in': 'query', 'required': True, 'description': 'Message content'},
+    'format': {'in': 'query', 'enum': ['csv', 'ndjson'], 'description': 'Upload format (default: from Content-Type)'},
+    'priority': {'in': 'query', 'enum': list(PRIORITIES), 'description': 'Delivery lane (default: bulk)'},
+    'expires_at': {'in': 'query', 'description': 'ISO 8601 time after which unsent SMS are dropped'},
+    'ttl_seconds': {'in': 'query', 'type': 'integer', 'description': 'Alternative to expires_at: seconds from now'},
+}
+
 sms_schema = SMSSchema()
 
 """SMS endpoints with specific rate limits and functionality."""
@@ -85,13 +116,19 @@ class SingleSMS(Resource):
             return error("Message exceeds maximum length of 500 characters", "SMS_SERVICE_ERROR", 400)
         if not _validate_number(mobile):
             return error("Invalid phone number format", "SMS_SERVICE_ERROR", 400)
+        try:
+            priority = normalize_priority(data.get('priority'), 'transactional')
+            expires_at = resolve_expiry(data, priority)
+        except ValueError as e:
+            return error(str(e), "SMS_SERVICE_ERROR", 400)
         
         idempotency_key = request.headers.get('Idempotency-Key')
         
         from app.utils.sms_workflow import process_single_sms, SMSWorkflowError
         
         try:
-            result = process_single_sms(mobile, message, idempotency_key)
+            result = process_single_sms(mobile, message, idempotency_key, priority=priority, expires_at=expires_at,
+                                        client_id=current_client_id())
             # Check if this was an existing idempotent return or a new success
             msg = "SMS already processed" if idempotency_key and result.get('status') == 'sent' and 'created_at' in result else "SMS processed"
             return success(msg, result)
@@ -128,6 +165,11 @@ class BulkSMS(Resource):
             return error("Message exceeds maximum length of 500 characters", "SMS_SERVICE_ERROR", 400)
         if len(mobiles) > 200:  # Max 200 in bulk request
             return error("Bulk SMS request exceeds maximum of 200 messages", "SMS_SERVICE_ERROR", 400)
+        try:
+            priority = normalize_priority(data.get('priority'), 'bulk')
+            expires_at = resolve_expiry(data, priority)
+        except ValueError as e:
+            return error(str(e), "SMS_SERVICE_ERROR", 400)
         
         cleaned = []
         for m in mobiles:
@@ -138,24 +180,25 @@ class BulkSMS(Resource):
                 return error(f"Invalid phone number format: {n}", "SMS_SERVICE_ERROR", 400)
             cleaned.append(n)
         
-        successes = []
-        failures = []
-        
-        from app.utils.sms_workflow import process_single_sms, SMSWorkflowError
-        
-        for n in cleaned:
-            try:
-                # We process each one individually using the workflow
-                # This explicitly trades batch performance for code reuse and safety
-                record = process_single_sms(n, message, idempotency_key=None)
-                successes.append({'mobile': n, 'record_id': record.get('id'), 'status': 'queued'})
-            except SMSWorkflowError as e:
-                failures.append({'mobile': n, 'error': str(e)})
-            except Exception as e:
-                failures.append({'mobile': n, 'error': "Internal processing error"})
+        from app.utils.sms_workflow import process_bulk_sms, SMSWorkflowError
+        from app.utils.bulk_jobs import new_job
+
+        correlation_id = getattr(g, 'request_id', None)
+        job = new_job('sms', 'json', priority, current_client_id(), correlation_id)
+        try:
+            # Recipients are persisted together and sent in multi-recipient gateway batches
+            successes, failures = process_bulk_sms(cleaned, message, correlation_id=correlation_id,
+                                                   priority=priority, expires_at=expires_at,
+                                                   client_id=current_client_id(), job=job)
+        except SMSWorkflowError as e:
+            return error(str(e), e.error_code, e.http_code)
+        except Exception as e:
+            logging.getLogger('error').error(f"Unexpected error in BulkSMS: {str(e)}")
+            return error("Internal server error", "SMS_SERVICE_ERROR", 500)
         
         overall = 200 if successes and not failures else (207 if successes and failures else 400)
-        payload = {"successes": successes, "failures": failures, "requested": len(cleaned)}
+        payload = {"successes": successes, "failures": failures, "requested": len(cleaned),
+                   "job_id": job.uuid if job.id else None}
         
         if overall == 200:
             logging.getLogger('sms').info(f"Bulk SMS: {len(successes)} sent successfully")
@@ -169,6 +212,154 @@ class BulkSMS(Resource):
         logging.getLogger('sms').error(f"Bulk SMS: all {len(failures)} failed")
         return error("Failed to send Bulk SMS", "SMS_SERVICE_ERROR", 400)
 
+@api.route('/batch')
+class BatchSMS(Resource):
+    method_decorators = [require_bearer_and_log]
+
+    @api.expect(batch_sms_model)
+    def post(self):
+
+        data = request.get_json(silent=True) or {}
+        messages = data.get('messages')
+
+        if not isinstance(messages, list) or not messages:
+            return error("Missing required field: messages", "SMS_SERVICE_ERROR", 400)
+        max_items = current_app.config.get('BATCH_REQUEST_MAX_ITEMS', 500)
+        if len(messages) > max_items:
+            return error(f"Batch SMS request exceeds maximum of {max_items} messages", "SMS_SERVICE_ERROR", 400)
+        try:
+            priority = normalize_priority(data.get('priority'), 'transactional')
+            expires_at = resolve_expiry(data, priority)
+        except ValueError as e:
+            return error(str(e), "SMS_SERVICE_ERROR", 400)
+
+        # Sanitization and Validation, per item: a bad item is rejected, not the request
+        from app.utils.sanitization import sanitize_text, validate_safe_input
+        items, rejected = [], []
+        for index, item in enumerate(messages):
+            item = item if isinstance(item, dict) else {}
+            mobile, message = item.get('mobile') or item.get('to'), item.get('message')
+            idempotency_key = item.get('idempotency_key')
+            if not isinstance(mobile, str) or not isinstance(message, str) or not mobile.strip() or not message.strip():
+                reason = "Missing required fields: mobile and message are required"
+            elif idempotency_key is not None and (not isinstance(idempotency_key, str) or len(idempotency_key) > 64):
+                reason = "idempotency_key must be a string of at most 64 characters"
+            else:
+                mobile, message = _normalize_number(mobile), message.strip()
+                is_safe, unsafe = validate_safe_input(message, context="batch_sms_message")
+                message = sanitize_text(message) if is_safe else message
+                if not is_safe:
+                    reason = f"Invalid message content: {unsafe}"
+                elif len(message) > 500:
+                    reason = "Message exceeds maximum length of 500 characters"
+                elif not _validate_number(mobile):
+                    reason = f"Invalid phone number format: {mobile}"
+                else:
+                    items.append((index, mobile, (message,), idempotency_key or None))
+                    continue
+            rejected.append({'index': index, 'mobile': mobile if isinstance(mobile, str) else None,
+                             'status': 'rejected', 'error': reason})
+
+        from app.utils.batch_workflow import process_batch
+        from app.utils.bulk_jobs import BulkJobError
+
+        job = None
+        results = []
+        if items:
+            try:
+                results, job = process_batch('sms', items, priority=priority, expires_at=expires_at,
+                                             client_id=current_client_id(),
+                                             correlation_id=getattr(g, 'request_id', None))
+            except BulkJobError as e:
+                return error(str(e), e.error_code, e.http_code)
+            except Exception as e:
+                logging.getLogger('error').error(f"Unexpected error in BatchSMS: {str(e)}")
+                return error("Internal server error", "SMS_SERVICE_ERROR", 500)
+        results = sorted(results + rejected, key=lambda r: r['index'])
+
+        failed = sum(1 for r in results if r['status'] in ('rejected', 'failed'))
+        payload = {"results": results, "requested": len(messages), "job_id": job.uuid if job else None}
+        if not failed:
+            logging.getLogger('sms').info(f"Batch SMS: {len(results)} processed")
+            return success("Batch SMS processed successfully", payload, 200)
+        if failed < len(results):
+            logging.getLogger('sms').info(f"Batch SMS: {len(results) - failed} succeeded, {failed} failed")
+            body, _ = success("Batch SMS partially successful", payload, 207)
+            body["status"] = "partial"
+            return body, 207
+
+        logging.getLogger('sms').error(f"Batch SMS: all {failed} failed")
+        return error("Failed to send Batch SMS", "SMS_SERVICE_ERROR", 400, data=payload)
+
+
+@api.route('/jobs')
+class SMSJobs(Resource):
+    method_decorators = [require_bearer_and_log]
+
+    @api.doc(params=sms_job_params,
+             description='Streamed recipient list (CSV or NDJSON request body) of any size; returns the job')
+    def post(self):
+        # Raise the body limit for this request before the stream is opened
+        request.max_content_length = current_app.config.get('BULK_JOB_MAX_UPLOAD_BYTES')
+        args = request.args
+        message = (args.get('message') or '').strip()
+        if not message:
+            return error("Missing required parameter: message", "SMS_SERVICE_ERROR", 400)
+
+        from app.utils.sanitization import sanitize_text, validate_safe_input
+        is_safe, reason = validate_safe_input(message, context="sms_job_message")
+        if not is_safe:
+            return error(f"Invalid message content: {reason}", "SECURITY_VIOLATION", 400)
+
+        message = sanitize_text(message)
+
+        if len(message) > 500:
+            return error("Message exceeds maximum length of 500 characters", "SMS_SERVICE_ERROR", 400)
+        try:
+            priority = normalize_priority(args.get('priority'), 'bulk')
+            expires_at = resolve_expiry(args, priority)
+        except ValueError as e:
+            return error(str(e), "SMS_SERVICE_ERROR", 400)
+
+        from app.utils.bulk_jobs import BulkJobError, submit_upload, upload_format
+
+        try:
+            fmt = upload_format(request.content_type, args.get('format'))
+            job = submit_upload('sms', request.stream, fmt, (message,), priority=priority, expires_at=expires_at,
+                                client_id=current_client_id(), correlation_id=getattr(g, 'request_id', None))
+        except BulkJobError as e:
+            return error(str(e), e.error_code, e.http_code)
+
+        if job.status == 'receiving':
+            # Spooled: a worker queues the rows; poll GET .../jobs/<job_id> for progress
+            return success("Bulk SMS job accepted", job.as_dict(), 202)
+        if not job.accepted:
+            return error(job.error or "Bulk SMS job failed", "SMS_SERVICE_ERROR", 400, data={'job': job.as_dict()})
+        if job.status == 'failed':
+            # Cut off mid-upload: the rows committed before the failure are still sent
+            body, _ = success("Bulk SMS job partially queued", job.as_dict(), 207)
+            body["status"] = "partial"
+            return body, 207
+        return success("Bulk SMS job queued", job.as_dict(), 202)
+
+
+@api.route('/jobs/<string:job_id>')
+class SMSJob(Resource):
+    method_decorators = [require_bearer_and_log]
+
+    @api.doc(description='Progress of a bulk SMS job: total, queued, sent, failed and expired')
+    def get(self, job_id):
+        from app.models.bulk_job import BulkJob
+        from app.tasks.job_counters import job_progress
+
+        job = BulkJob.query.filter_by(uuid=job_id, channel='sms').first()
+        # Jobs are only visible to the client that submitted them; only per-client API keys
+        # make that an access control (X-Client-Id on the shared key is taken on trust)
+        if job is None or job.client_id != current_client_id():
+            return error("Job not found", "NOT_FOUND", 404)
+        return success("Bulk SMS job", job_progress(job))
+
+
 @api.route('/health')
 class SMSHealth(Resource):
     def get(self):
@@ -187,7 +378,7 @@ class SMSHealth(Resource):
         else:
             # Direct health check if no Celery
             if current_app.config.get('OTP_FLAG', True):
-                if current_app.config.get('OTP_SERVER') and current_app.config.get('OTP_USERNAME'):
+                if current_app.config.get('SMS_GATEWAYS') or (current_app.config.get('OTP_SERVER') and current_app.config.get('OTP_USERNAME')):
                     logging.getLogger('app').info("Direct health check: configuration OK")
                     # Use configured test number or skip actual sending
                     test_number = current_app.config.get('HEALTH_CHECK_TEST_NUMBER')
@@ -0,0 +1,19 @@
+"""
+Ingest of spooled bulk uploads.
+
+POST .../jobs spools the request body to BULK_JOB_SPOOL_DIR and stages this
+task with the job row (app/utils/bulk_jobs.py: submit_upload), so the client
+gets the job id as soon as the upload is on disk. The worker reads the file
+chunk by chunk into message rows and outbox batches, as the request used to.
+"""
+from celery import shared_task
+
+INGEST_TASK = 'jobs.ingest_upload'
+
+
+@shared_task(name=INGEST_TASK)
+def ingest_job(job_id):
+    from app.utils.bulk_jobs import ingest_spooled  # lazy import
+
+    job = ingest_spooled(job_id)
+    return job.as_dict() if job else None
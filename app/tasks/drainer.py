@@ -0,0 +1,183 @@
+"""
+Drainer for sends parked by the outbound rate governor.
+
+A task that can't get a permit within RATE_GOVERNOR_MAX_WAIT parks itself on
+a Redis list per channel and priority lane instead of sleeping in a worker.
+The beat-scheduled drain task runs every RATE_GOVERNOR_DRAIN_INTERVAL seconds
+and, for up to that long, takes permits as the governor refills and
+re-publishes parked tasks on their lane with `permitted=True` (otp first,
+bulk last). A Redis lock keeps it to one drainer per channel at a time, so
+draining is continuous and independent of new traffic arriving.
+
+Without Redis nothing is parked: the task is re-published with a countdown
+equal to the governor's wait.
+"""
+import json
+import logging
+import time
+import uuid
+
+from celery import shared_task, current_app as celery_app
+from flask import current_app, has_app_context
+
+from app.extensions import governor_parked_counter, governor_drained_counter
+from app.tasks.held import PARKED, hold, release
+from app.tasks.queues import CHANNELS, PRIORITIES, queue_for
+from app.utils.rate_governor import channel_governor
+from app.utils.redis_client import get_redis, mark_redis_down
+
+logger = logging.getLogger('app')
+
+DRAIN_TASK = 'governor.drain_pending'
+
+# KEYS[1] = lock; ARGV[1] = owner token
+_UNLOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+def _pending_key(channel: str, priority: str) -> str:
+    return f"governor:pending:{channel}:{priority}"
+
+
+def _drain_interval() -> float:
+    if has_app_context():
+        return float(current_app.config.get('RATE_GOVERNOR_DRAIN_INTERVAL', 1.0))
+    return 1.0
+
+
+def park(channel: str, priority: str, task_name: str, args, kwargs=None, cost: int = 1, queue: str = None) -> bool:
+    """
+    Append a task (needing `cost` permits, e.g. a batch) to its lane's pending list.
+    `queue` keeps a shard queue for the re-publish. False if Redis is unavailable.
+    """
+    r = get_redis()
+    if r is None:
+        return False
+    try:
+        pipe = r.pipeline()
+        pipe.rpush(_pending_key(channel, priority),
+                   json.dumps({'task': task_name, 'args': list(args), 'kwargs': kwargs or {}, 'cost': cost,
+                               'queue': queue}))
+        hold(pipe, task_name, args, PARKED)  # so the reconciler leaves the rows alone
+        pipe.execute()
+        return True
+    except Exception as e:
+        mark_redis_down(e)
+        return False
+
+
+def defer(task, channel: str, priority: str, args, kwargs=None, cost: int = 1, queue: str = None) -> str:
+    """
+    Hand a task that has no permit to the drainer, or (without Redis) re-publish it
+    for when the governor expects budget, on `queue` (default: the lane's queue).
+    Returns 'parked' or 'deferred'.
+    """
+    queue = queue or queue_for(channel, priority)
+    if park(channel, priority, task.name, args, kwargs, cost, queue):
+        outcome = 'parked'
+    else:
+        wait = channel_governor(channel).wait_time(cost)
+        task.apply_async(args, kwargs or {}, countdown=max(1.0, wait), queue=queue)
+        outcome = 'deferred'
+    governor_parked_counter.labels(channel=channel, outcome=outcome).inc()
+    return outcome
+
+
+def pending_depth(channel: str) -> dict:
+    """
+    Parked tasks per priority lane for `channel` (empty when Redis is unavailable).
+    """
+    r = get_redis()
+    if r is None:
+        return {}
+    try:
+        return {p: r.llen(_pending_key(channel, p)) for p in PRIORITIES}
+    except Exception as e:
+        mark_redis_down(e)
+        return {}
+
+
+def _pop_next(r, channel):
+    for priority in PRIORITIES:
+        raw = r.lpop(_pending_key(channel, priority))
+        if raw is not None:
+            return priority, raw
+    return None, None
+
+
+def drain_channel(channel: str, budget: float) -> int:
+    """
+    Re-publish parked tasks for `channel` as permits allow, for at most `budget` seconds.
+    Returns the number of tasks released.
+    """
+    r = get_redis()
+    if r is None:
+        return 0
+    lock_key = f"governor:drain:{channel}"
+    token = uuid.uuid4().hex
+    try:
+        # Lock outlives the budget slightly so a slow publish can't let a second drainer in
+        if not r.set(lock_key, token, nx=True, px=int((budget + 5) * 1000)):
+            return 0
+    except Exception as e:
+        mark_redis_down(e)
+        return 0
+
+    governor = channel_governor(channel)
+    deadline = time.monotonic() + budget
+    released = 0
+    try:
+        while time.monotonic() < deadline:
+            priority, raw = _pop_next(r, channel)
+            if raw is None:
+                break
+            item = json.loads(raw)
+            if not governor.acquire(cost=item.get('cost', 1), max_wait=max(0.0, deadline - time.monotonic())):
+                # No budget before this run ends: put it back at the head of its lane
+                r.lpush(_pending_key(channel, priority), raw)
+                break
+            try:
+                celery_app.send_task(item['task'], args=item['args'],
+                                     kwargs={**item['kwargs'], 'permitted': True},
+                                     queue=item.get('queue') or queue_for(channel, priority))
+            except Exception:
+                # Broker trouble: keep the send parked (its permit is spent) and stop this run
+                r.lpush(_pending_key(channel, priority), raw)
+                raise
+            release(r, item['task'], item['args'], time.time())
+            governor_drained_counter.labels(channel=channel, priority=priority).inc()
+            released += 1
+    except Exception as e:
+        logging.getLogger('error').error(f"Governor drain for {channel} stopped: {e}")
+    finally:
+        try:
+            r.eval(_UNLOCK_LUA, 1, lock_key, token)
+        except Exception as e:
+            mark_redis_down(e)
+    if released:
+        logger.info(f"Governor drained {released} parked {channel} sends")
+    return released
+
+
+@shared_task(name=DRAIN_TASK)
+def drain_pending(channel=None):
+    """
+    Beat entry point: drain every channel (or just `channel`) for one interval.
+    """
+    budget = _drain_interval()
+    channels = [channel] if channel else list(CHANNELS)
+    return {ch: drain_channel(ch, budget) for ch in channels}
+
+
+def schedule_drainer(celery):
+    """
+    Register the drainer with celery beat (run `make beat` alongside the workers).
+    """
+    interval = _drain_interval()
+    celery.conf.beat_schedule = {
+        **(celery.conf.beat_schedule or {}),
+        'governor-drain': {'task': DRAIN_TASK, 'schedule': interval,
+                           'options': {'expires': interval * 2}},
+    }
@@ -2,125 +2,104 @@ import logging
 from celery import shared_task
 from flask import current_app
 import time
-from app.extensions import db, email_sent_counter, email_failed_counter
-from app.utils.email_util import send_single_email_util
-from queue import Queue, Empty
-import threading
+from datetime import datetime, timezone
+from app.extensions import db, email_sent_counter, email_failed_counter, email_expired_counter
+from app.utils.email_util import send_single_email_util, send_email_batch_util
 import uuid
-from typing import Dict, List, Any
-from sqlalchemy import select
+from sqlalchemy import select, update
 from app.models.email_message import EmailMessage
+from app.utils.rate_governor import channel_governor, governor_max_wait
+from app.tasks.drainer import defer, pending_depth
+from app.tasks.queues import priority_from_queue, queue_for
+from app.utils.status_writer import get_status_writer
+from app.tasks.retry_scheduler import backlog_stats, classify_error, schedule_retry
+from app.utils.dead_letters import dead_letter_entry, record_dead_letter, record_dead_letters
+from app.utils.message_ttl import is_expired
+from app.tasks.job_counters import add_job_counts, job_counts
 
+# Attempts (including the first) before a message is marked 'failed'
+MAX_ATTEMPTS = 5
 
-# Queue for handling email requests with rate limiting
-class EmailQueue:
-    def __init__(self):
-        self.high_priority_queue = Queue()  # For health check tasks
-        self.normal_queue = Queue()         # For regular email tasks
-        self.processed_count = 0
-        self.last_reset_time = time.time()
-        self.rate_limit = 100  # 100 requests per minute
-        self.window_size = 60  # 60 seconds
-        self.lock = threading.Lock()  # Thread lock for rate limiting
-        
-    def add_to_queue(self, task_func, is_high_priority=False, *args, **kwargs):
-        """Add a task to the appropriate queue"""
-        task_id = str(uuid.uuid4())
-        task_data = {
-            'task_id': task_id,
-            'task_func': task_func,
-            'args': args,
-            'kwargs': kwargs
-        }
-        
-        if is_high_priority:
-            self.high_priority_queue.put(task_data)
-        else:
-            self.normal_queue.put(task_data)
-        
-        return task_id
-    
-    def can_process_request(self):
-        """Check if we can process another request based on rate limit"""
-        with self.lock:
-            now = time.time()
-            # Reset counter if window has passed
-            if now - self.last_reset_time >= self.window_size:
-                self.processed_count = 0
-                self.last_reset_time = now
-            
-            # Check if we're under the rate limit
-            return self.processed_count < self.rate_limit
-    
-    def get_next_task(self):
-        """Get next task from queues (high priority first)"""
-        try:
-            # Check high priority queue first
-            if not self.high_priority_queue.empty():
-                return self.high_priority_queue.get_nowait()
-            # Then normal queue
-            elif not self.normal_queue.empty():
-                return self.normal_queue.get_nowait()
-            else:
-                return None
-        except Empty:
-            return None
-    
-    def process_queue(self):
-        """Process queued items within rate limits"""
-        if not self.can_process_request():
-            return False  # Rate limit exceeded
-        
-        # Get next task
-        task_data = self.get_next_task()
-        if task_data:
-            with self.lock:
-                # Increment processed count only if we're under rate limit
-                now = time.time()
-                if now - self.last_reset_time >= self.window_size:
-                    self.processed_count = 0
-                    self.last_reset_time = now
-                
-                if self.processed_count < self.rate_limit:
-                    task_func, args, kwargs = task_data['task_func'], task_data['args'], task_data['kwargs']
-                    result = task_func(*args, **kwargs)
-                    self.processed_count += 1
-                    return result
-                else:
-                    # Put the task back if rate limit is exceeded
-                    if task_data.get('is_high_priority', False):
-                        self.high_priority_queue.put(task_data)
-                    else:
-                        self.normal_queue.put(task_data)
-                    return False
-        
-        return None
 
-# Global email queue instance
-email_queue = EmailQueue()
+def _invalid_reason(to, subject, body):
+    """
+    Why a decrypted email can never be sent (None when it is valid).
+    """
+    from app.utils.email_util import validate_email, validate_subject, validate_body
+    if not validate_email(to):
+        return "Invalid email address"
+    if not validate_subject(subject):
+        return "Invalid subject"
+    if not validate_body(body):
+        return "Invalid body content"
+    return None
 
 
-@shared_task(bind=True, name='email.send_and_record', autoretry_for=(Exception,), retry_backoff=True, retry_backoff_max=60, retry_jitter=True, max_retries=5)
-def send_and_record(self, record_id, correlation_id=None):
+def _fail_record(record_id, attempt, correlation_id, status_code=None, exc=None):
+    """
+    Finalise an EmailMessage row as 'failed' and dead-letter it.
+    """
+    get_status_writer().record(EmailMessage, record_id, 'failed', attempts=attempt)
+    record_dead_letter('email', record_id, status_code, attempt, correlation_id, exc=exc)
+
+
+@shared_task(bind=True, name='email.send_and_record')
+def send_and_record(self, record_id, correlation_id=None, permitted=False, attempt=None):
     """
     Send email with database record tracking and retry logic.
+
+    Rows that can never be sent (undecryptable, failing validation) are failed to
+    the dead-letter store at once, like a 400 on the batch path. Any other
+    exception is retried through the retry scheduler until MAX_ATTEMPTS.
     
     Args:
         record_id: ID of the EmailMessage record in the database
         correlation_id: Correlation ID for tracing
+        permitted: A rate permit was already taken for this run (set by the drainer)
+        attempt: Attempt number, set on retries published by the retry scheduler
     """
-    # Short transaction: lock row and increment attempts to avoid lost updates
-    with db.session.begin():
-        row = db.session.execute(
-            select(EmailMessage).where(EmailMessage.id == record_id).with_for_update()
-        ).scalar_one_or_none()
-        if not row:
-            return {'error': 'record_not_found', 'record_id': record_id}
-        attempt = self.request.retries + 1
-        row.attempts = attempt
-
-    # Input validation outside the locked transaction (keeps lock short)
-    from app.utils.email_util import validate_email, validate_subject, validate_body
+    attempt = attempt or 1
+    queue = (self.request.delivery_info or {}).get('routing_key')
+    try:
+        return _send_and_record(record_id, correlation_id, permitted, attempt, queue)
+    except Exception as exc:
+        db.session.rollback()
+        logging.getLogger('error').error(f"Email send error: record={record_id}, attempt={attempt}, error={exc}")
+        if attempt >= MAX_ATTEMPTS:
+            _fail_record(record_id, attempt, correlation_id, exc=exc)
+            email_failed_counter.inc()
+            return {'record_id': record_id, 'status': 'failed', 'attempts': attempt, 'correlation_id': correlation_id}
+        get_status_writer().record(EmailMessage, record_id, 'retry', attempts=attempt)
+        delay = schedule_retry(send_and_record, [record_id, correlation_id], {'attempt': attempt + 1}, attempt,
+                               classify_error(exc=exc), queue=queue)
+        return {'record_id': record_id, 'status': 'retry', 'attempts': attempt, 'retry_in': round(delay, 1), 'correlation_id': correlation_id}
+
+
+def _send_and_record(record_id, correlation_id, permitted, attempt, queue):
+    row = db.session.get(EmailMessage, record_id)
+    if not row:
+        return {'error': 'record_not_found', 'record_id': record_id}
+    if row.status in ('sent', 'failed', 'expired'):
+        # Already finalised by an earlier delivery (outbox re-publish, reconciler re-enqueue)
+        return {'record_id': row.id, 'status': row.status, 'uuid': row.uuid, 'correlation_id': correlation_id}
+    if is_expired(row.expires_at):
+        # Checked before taking a rate permit: an expired email is never sent
+        get_status_writer().record(EmailMessage, record_id, 'expired')
+        email_expired_counter.inc()
+        return {'record_id': record_id, 'status': 'expired', 'correlation_id': correlation_id}
+
+    # Cluster-wide email rate: park the send for the drainer instead of holding the worker
+    if not permitted and not channel_governor('email').acquire(max_wait=governor_max_wait()):
+        priority = priority_from_queue(queue, 'transactional')
+        outcome = defer(send_and_record, 'email', priority, [record_id, correlation_id], {'attempt': attempt},
+                        queue=queue)
+        get_status_writer().touch(EmailMessage, record_id)
+        return {'record_id': record_id, 'status': outcome, 'reason': 'rate_limited', 'correlation_id': correlation_id}
+
+    if not row.uuid:
+        row.uuid = str(uuid.uuid4())
+        db.session.commit()
+
     from cryptography.fernet import Fernet
     import os
     
@@ -133,16 +112,17 @@ def send_and_record(self, record_id, correlation_id=None):
         body = f.decrypt(row.body.encode()).decode()
     except Exception as e:
         logging.getLogger('error').error(f"Failed to decrypt email data for record {record_id}: {str(e)}")
-        return {'error': 'decryption_error', 'record_id': record_id}
+        _fail_record(record_id, attempt, row.correlation_id or correlation_id, exc=e)
+        email_failed_counter.inc()
+        return {'record_id': record_id, 'status': 'failed', 'error': 'decryption_error', 'correlation_id': correlation_id}
 
-    # Validate inputs
-    if not validate_email(to):
-        # persist invalid state and retry (if desired) - here we raise to trigger retry/backoff
-        raise ValueError("Invalid email address")
-    if not validate_subject(subject):
-        raise ValueError("Invalid subject")
-    if not validate_body(body):
-        raise ValueError("Invalid body content")
+    # Validate inputs: retrying cannot fix the content, so fail it like a 400
+    reason = _invalid_reason(to, subject, body)
+    if reason:
+        logging.getLogger('error').error(f"Invalid email record {record_id}: {reason}")
+        _fail_record(record_id, attempt, row.correlation_id or correlation_id, 400)
+        email_failed_counter.inc()
+        return {'record_id': record_id, 'status': 'failed', 'error': reason, 'correlation_id': correlation_id}
 
     # Audit logging
     app_logger = logging.getLogger('app')
@@ -151,85 +131,154 @@ def send_and_record(self, record_id, correlation_id=None):
     # Get result of actual email sending
     status_code, message_id = send_single_email_util(to, subject, body)
 
-    # Persist status with a short transaction and row-level lock to avoid races
+    # Status goes through the write-behind writer: no row lock or transaction per send
+    writer = get_status_writer()
     if status_code == 200:
-        with db.session.begin():
-            r = db.session.execute(
-                select(EmailMessage).where(EmailMessage.id == record_id).with_for_update()
-            ).scalar_one()
-            r.status = 'sent'
-            email_sent_counter.inc()
-            if not r.uuid:
-                r.uuid = str(uuid.uuid4())
-        return {'record_id': r.id, 'status': r.status, 'attempts': r.attempts, 'uuid': r.uuid, 'correlation_id': correlation_id, 'message_id': message_id}
+        writer.record(EmailMessage, record_id, 'sent', attempts=attempt)
+        email_sent_counter.inc()
+        return {'record_id': record_id, 'status': 'sent', 'attempts': attempt, 'uuid': row.uuid, 'correlation_id': correlation_id, 'message_id': message_id}
     else:
-        # If we're going to retry, persist the 'retry' state before raising to ensure visibility
-        attempt = self.request.retries + 1
-        if attempt >= 5:
-            with db.session.begin():
-                r = db.session.execute(
-                    select(EmailMessage).where(EmailMessage.id == record_id).with_for_update()
-                ).scalar_one()
-                r.status = 'failed'
-                email_failed_counter.inc()
-            app_logger.error(f"Failed email delivery: to={to}, status={status_code}")
-            return {'record_id': r.id, 'status': r.status, 'attempts': r.attempts, 'uuid': r.uuid, 'correlation_id': correlation_id}
+        app_logger.error(f"Failed email delivery: to={to}, status={status_code}")
+        if attempt >= MAX_ATTEMPTS:
+            writer.record(EmailMessage, record_id, 'failed', attempts=attempt)
+            record_dead_letter('email', record_id, status_code, attempt, row.correlation_id or correlation_id)
+            email_failed_counter.inc()
+            return {'record_id': record_id, 'status': 'failed', 'attempts': attempt, 'uuid': row.uuid, 'correlation_id': correlation_id}
+        writer.record(EmailMessage, record_id, 'retry', attempts=attempt)
+        # The retry is published without `permitted`, so it takes a fresh rate permit
+        delay = schedule_retry(send_and_record, [record_id, correlation_id], {'attempt': attempt + 1}, attempt,
+                               classify_error(status_code), queue=queue)
+        return {'record_id': record_id, 'status': 'retry', 'attempts': attempt, 'retry_in': round(delay, 1), 'correlation_id': correlation_id}
+
+
+@shared_task(bind=True, name='email.send_batch_and_record')
+def send_batch_and_record(self, record_ids, correlation_id=None, priority='bulk', permitted=False):
+    """
+    Send a batch of EmailMessage rows over a few reused SMTP sessions
+    (see send_email_batch_util).
+
+    Rows are loaded with one query and outcomes persisted with one set-based
+    UPDATE. Members the email rate governor has no permit for are parked as a
+    smaller batch; retryable failures are re-published as a batch holding only
+    those rows, so one failing recipient never re-sends the whole batch.
+    """
+    # Re-publish on the (shard) queue this batch came from
+    queue = (self.request.delivery_info or {}).get('routing_key') or queue_for('email', priority)
+    rows = db.session.execute(
+        select(EmailMessage).where(EmailMessage.id.in_(record_ids))
+    ).scalars().all()
+    job_of = {row.id: row.job_id for row in rows}
+    # Skip rows already finalised by an earlier delivery of this batch
+    rows = [row for row in rows if row.status not in ('sent', 'failed', 'expired')]
+    # Expired rows are finalised without a rate permit or a decrypt
+    now = datetime.now(timezone.utc)
+    expired = [row.id for row in rows if is_expired(row.expires_at, now)]
+    rows = [row for row in rows if not is_expired(row.expires_at, now)]
+    parked = []
+
+    if not permitted:
+        governor = channel_governor('email')
+        deadline = time.monotonic() + governor_max_wait()
+        granted = 0
+        while granted < len(rows) and governor.acquire(max_wait=max(0.0, deadline - time.monotonic())):
+            granted += 1
+        if granted < len(rows):
+            parked = [row.id for row in rows[granted:]]
+            defer(send_batch_and_record, 'email', priority, [parked, correlation_id],
+                  {'priority': priority}, cost=len(parked), queue=queue)
+            rows = rows[:granted]
+
+    updates = [{'id': record_id, 'status': 'expired'} for record_id in expired]
+    # Parked and retried rows get a fresh updated_at so the reconciler leaves them alone
+    updates.extend({'id': record_id, 'updated_at': now} for record_id in parked)
+    messages = []
+    dead = []
+    for row in rows:
+        try:
+            messages.append((row, *row.decrypt_fields()))
+        except Exception:
+            logging.getLogger('error').error(f"Failed to decrypt email data for record {row.id}")
+            updates.append({'id': row.id, 'status': 'failed', 'attempts': (row.attempts or 0) + 1})
+            dead.append(dead_letter_entry('email', row.id, None, (row.attempts or 0) + 1,
+                                          row.correlation_id or correlation_id))
+
+    concurrency = int(current_app.config.get('EMAIL_BATCH_CONCURRENCY', 4))
+    results = send_email_batch_util([m[1:] for m in messages], concurrency=concurrency)
+
+    retry_ids = []
+    retry_attempt, retry_code = 1, None
+    summary = {'sent': 0, 'failed': 0, 'retry': 0, 'expired': len(expired)}
+    for (row, *_), (status_code, _) in zip(messages, results):
+        attempts = (row.attempts or 0) + 1
+        if status_code == 200:
+            status = 'sent'
+        elif status_code == 400 or attempts >= MAX_ATTEMPTS:
+            status = 'failed'
+            dead.append(dead_letter_entry('email', row.id, status_code, attempts, row.correlation_id or correlation_id))
         else:
-            with db.session.begin():
-                r = db.session.execute(
-                    select(EmailMessage).where(EmailMessage.id == record_id).with_for_update()
-                ).scalar_one()
-                r.status = 'retry'
-            app_logger.error(f"Failed email delivery: to={to}, status={status_code}")
-            # Ask Celery to retry using its machinery
-            self.retry(exc=Exception(f"Failed email delivery: {status_code}"), countdown=10, max_retries=5)
+            status = 'retry'
+            retry_ids.append(row.id)
+            retry_attempt, retry_code = max(retry_attempt, attempts), status_code
+        updates.append({'id': row.id, 'status': status, 'attempts': attempts, 'updated_at': now})
+        summary[status] += 1
+    summary['failed'] += len(rows) - len(messages)
+
+    try:
+        if updates:
+            db.session.execute(update(EmailMessage), updates)
+        record_dead_letters(dead, commit=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    email_sent_counter.inc(summary['sent'])
+    email_failed_counter.inc(summary['failed'])
+    email_expired_counter.inc(summary['expired'])
+    add_job_counts(job_counts((job_of[u['id']], u.get('status')) for u in updates))
+
+    if retry_ids:
+        logging.getLogger('app').error(f"Failed email delivery for {len(retry_ids)} batch members, re-queuing them")
+        schedule_retry(send_batch_and_record, [retry_ids, correlation_id], {'priority': priority}, retry_attempt,
+                       classify_error(retry_code), queue=queue)
+    return {**summary, 'record_ids': record_ids, 'correlation_id': correlation_id}
 
 
 @shared_task(bind=True, name='email.add_to_queue', autoretry_for=(Exception,), retry_backoff=True, retry_backoff_max=60, retry_jitter=True, max_retries=3)
-def add_to_queue_task(self, task_name, is_high_priority=False, *args, **kwargs):
+def add_to_queue_task(self, task_name, *args, permitted=False, **kwargs):
     """
-    Add a task to the email queue for processing.
-    
+    Run an email task under the cluster-wide email rate governor.
+
+    Health checks run immediately; other tasks run as soon as a permit is
+    available (waiting at most RATE_GOVERNOR_MAX_WAIT), otherwise they are
+    parked for the drainer, which re-publishes them with permitted=True.
+
     Args:
         task_name: Name of the task function to execute
-        is_high_priority: Whether this is a high priority task (e.g., health check)
+        permitted: A permit was already taken for this run (set by the drainer)
         *args, **kwargs: Arguments to pass to the task function
     """
     app_logger = logging.getLogger('app')
-    app_logger.info(f"Adding task {task_name} to email queue, priority: {is_high_priority}")
-    
+
     # Get the actual function by name
     if task_name == 'process_single_email':
         task_func = process_single_email
     elif task_name == 'process_health_check':
-        task_func = process_health_check
-        is_high_priority = True  # Health check is always high priority
+        return process_health_check_task()
     else:
         error_msg = f"Unknown task name: {task_name}"
         app_logger.error(error_msg)
         raise ValueError(error_msg)
-    
-    # Add to queue
-    task_id = email_queue.add_to_queue(task_func, is_high_priority, *args, **kwargs)
-    
-    app_logger.info(f"Task added to queue. Task ID: {task_id}, Priority: {is_high_priority}")
-    
-    # Try to process immediately if within rate limits
-    if email_queue.can_process_request():
-        result = email_queue.process_queue()
-        if result:
-            app_logger.info(f"Task processed immediately. Result: {result}")
-            return result
-        else:
-            # Task remains in queue due to rate limits
-            queue_length = email_queue.high_priority_queue.qsize() + email_queue.normal_queue.qsize()
-            app_logger.info(f"Task remains in queue due to rate limits. Queue length: {queue_length}")
-            return {'status': 'queued', 'task_id': task_id, 'queue_length': queue_length}
-    else:
-        # Task remains in queue due to rate limits
-        queue_length = email_queue.high_priority_queue.qsize() + email_queue.normal_queue.qsize()
-        app_logger.info(f"Task remains in queue due to rate limits. Queue length: {queue_length}")
-        return {'status': 'queued', 'task_id': task_id, 'queue_length': queue_length}
+
+    if not permitted and not channel_governor('email').acquire(max_wait=governor_max_wait()):
+        queue = (self.request.delivery_info or {}).get('routing_key')
+        priority = priority_from_queue(queue, 'transactional')
+        outcome = defer(add_to_queue_task, 'email', priority, [task_name, *args], kwargs, queue=queue)
+        if args:
+            get_status_writer().touch(EmailMessage, args[0])
+        app_logger.info(f"Email rate limit reached, task {task_name} {outcome} on {priority} lane")
+        return {'status': 'queued', 'outcome': outcome}
+
+    return task_func(*args, **kwargs)
 
 
 def process_single_email(record_id: int, correlation_id: str = None):
@@ -300,31 +349,28 @@ def process_single_email(record_id: int, correlation_id: str = None):
         }
 
 
-@shared_task(bind=True, name='email.send_email', autoretry_for=(Exception,), retry_backoff=True, retry_backoff_max=60, retry_jitter=True, max_retries=5)
-def send_email_task(self, to, subject, body, correlation_id=None, record_id=None):
+@shared_task(bind=True, name='email.send_email')
+def send_email_task(self, to, subject, body, correlation_id=None, record_id=None, attempt=None):
     """
     Send email with proper error handling and retry logic.
 
     correlation_id: propagated from incoming request for traceability.
     """
     from app.utils.email_util import send_single_email_util
-    from app.extensions import db, email_sent_counter, email_failed_counter
-    from app.models.email_message import EmailMessage
-    from sqlalchemy import select
-    from cryptography.fernet import Fernet
-    import os
+    from app.extensions import email_sent_counter, email_failed_counter
     
-    attempt = self.request.retries + 1
+    attempt = attempt or 1
+    queue = (self.request.delivery_info or {}).get('routing_key')
     current_app.logger.info(f'email_task_start: task_id={self.request.id}, attempt={attempt}, to={to}, correlation_id={correlation_id}')
     
-    # Validation
-    from app.utils.email_util import validate_email, validate_subject, validate_body
-    if not validate_email(to):
-        raise ValueError("Invalid email address")
-    if not validate_subject(subject):
-        raise ValueError("Invalid subject")
-    if not validate_body(body):
-        raise ValueError("Invalid body content")
+    # Validation: invalid input is never retried
+    reason = _invalid_reason(to, subject, body)
+    if reason:
+        current_app.logger.error(f'email_task_invalid: task_id={self.request.id}, error={reason}, correlation_id={correlation_id}')
+        if record_id:
+            _fail_record(record_id, attempt, correlation_id, 400)
+        email_failed_counter.inc()
+        return {"status": "failed", "to": to, "attempt": attempt, "error": reason, "correlation_id": correlation_id}
     
     try:
         # Try to send the email
@@ -334,13 +380,7 @@ def send_email_task(self, to, subject, body, correlation_id=None, record_id=None
         if status_code == 200:
             # Persist success
             if record_id:
-                with db.session.begin():
-                    msg = db.session.execute(
-                        select(EmailMessage).where(EmailMessage.id == record_id).with_for_update()
-                    ).scalar_one_or_none()
-                    if msg:
-                        msg.status = 'sent'
-                        msg.attempts = attempt
+                get_status_writer().record(EmailMessage, record_id, 'sent', attempts=attempt)
             email_sent_counter.inc()
             result = {"status": "success", "to": to, "subject": subject, "attempt": attempt, "correlation_id": correlation_id, "message_id": message_id}
             current_app.logger.info(f'email_task_success: task_id={self.request.id}, result={result}, correlation_id={correlation_id}')
@@ -348,44 +388,34 @@ def send_email_task(self, to, subject, body, correlation_id=None, record_id=None
         else:
             # Log failure
             current_app.logger.error(f"Failed email delivery: to={to}, status={status_code}")
-            # Update message status for tracking
-            if record_id:
-                with db.session.begin():
-                    msg = db.session.execute(
-                        select(EmailMessage).where(EmailMessage.id == record_id).with_for_update()
-                    ).scalar_one_or_none()
-                    if msg:
-                        msg.status = 'retry' if attempt < 5 else 'failed'
-                        msg.attempts = attempt
-            if attempt >= 5:
-                email_failed_counter.inc()
             # Retry if not at max attempts
-            if attempt < 5:
-                self.retry(exc=Exception(f"Failed email delivery: {status_code}"), countdown=10)
-            else:
-                # Final failure
-                return {"status": "failed", "to": to, "attempt": attempt, "correlation_id": correlation_id}
+            if attempt < MAX_ATTEMPTS:
+                if record_id:
+                    get_status_writer().record(EmailMessage, record_id, 'retry', attempts=attempt)
+                delay = schedule_retry(send_email_task, [to, subject, body, correlation_id, record_id], {'attempt': attempt + 1},
+                                       attempt, classify_error(status_code), queue=queue)
+                return {"status": "retry", "to": to, "attempt": attempt, "retry_in": round(delay, 1), "correlation_id": correlation_id}
+            # Final failure
+            if record_id:
+                _fail_record(record_id, attempt, correlation_id, status_code)
+            email_failed_counter.inc()
+            return {"status": "failed", "to": to, "attempt": attempt, "correlation_id": correlation_id}
                 
     except Exception as exc:
         # Log the exception
         current_app.logger.error(f'email_task_error: task_id={self.request.id}, attempt={attempt}, error={str(exc)}, correlation_id={correlation_id}')
-        # Update message status for tracking
-        if record_id:
-            with db.session.begin():
-                msg = db.session.execute(
-                    select(EmailMessage).where(EmailMessage.id == record_id).with_for_update()
-                ).scalar_one_or_none()
-                if msg:
-                    msg.status = 'retry' if attempt < 5 else 'failed'
-                    msg.attempts = attempt
-        if attempt >= 5:
-            email_failed_counter.inc()
         # Retry if not at max attempts
-        if attempt < 5:
-            self.retry(exc=exc, countdown=10)
-        else:
-            # Final failure
-            raise exc
+        if attempt < MAX_ATTEMPTS:
+            if record_id:
+                get_status_writer().record(EmailMessage, record_id, 'retry', attempts=attempt)
+            delay = schedule_retry(send_email_task, [to, subject, body, correlation_id, record_id], {'attempt': attempt + 1},
+                                   attempt, classify_error(exc=exc), queue=queue)
+            return {"status": "retry", "to": to, "attempt": attempt, "retry_in": round(delay, 1), "correlation_id": correlation_id}
+        # Final failure
+        if record_id:
+            _fail_record(record_id, attempt, correlation_id, exc=exc)
+        email_failed_counter.inc()
+        return {"status": "failed", "to": to, "attempt": attempt, "error": str(exc), "correlation_id": correlation_id}
 
 
 @shared_task(bind=True, name='email.process_health_check', autoretry_for=(Exception,), retry_backoff=True, retry_backoff_max=60, retry_jitter=True, max_retries=1)
@@ -429,13 +459,13 @@ def process_health_check_task(self):
 
 
 def get_queue_status():
-    """Return current queue status for monitoring"""
+    """Return current email rate governor status for monitoring"""
+    governor = channel_governor('email')
+    pending = pending_depth('email')
     return {
-        'high_priority_queue_size': email_queue.high_priority_queue.qsize(),
-        'normal_queue_size': email_queue.normal_queue.qsize(),
-        'total_queue_size': email_queue.high_priority_queue.qsize() + email_queue.normal_queue.qsize(),
-        'processed_count': email_queue.processed_count,
-        'rate_limit': email_queue.rate_limit,
-        'can_process_request': email_queue.can_process_request(),
-        'last_reset_time': email_queue.last_reset_time
-    }
\ No newline at end of file
+        'pending': pending,
+        'total_pending': sum(pending.values()),
+        'rate_per_second': governor.rate,
+        'wait_seconds': governor.wait_time(),
+        'retry_backlog': backlog_stats(),
+    }
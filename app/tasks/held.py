@@ -0,0 +1,95 @@
+"""
+Index of messages whose send is held in Redis instead of the broker.
+
+A send parked by the rate governor (drainer lanes) or scheduled for later
+(`retry:due`) has no Celery task a worker could report, and under a real
+backlog it can wait longer than RECONCILER_STALE_SECONDS. park() and
+schedule_at() therefore add its message ids to `held:<channel>`, a sorted set
+scored by when the send is published: +inf while parked (the drainer rescores
+it when it re-publishes), the due time when scheduled.
+
+The reconciler treats a row as live while its score is within the stale
+window, which also covers the time the published task then waits in the
+broker queue, and prunes older entries.
+"""
+import logging
+
+from app.tasks.queues import CHANNELS
+from app.utils.redis_client import get_redis, mark_redis_down
+
+PARKED = float('inf')
+
+
+def _key(channel: str) -> str:
+    return f"held:{channel}"
+
+
+def message_ids(task_name: str, args) -> tuple:
+    """
+    (channel, message ids) a send task works on, from its name and args; (None, []) if unknown.
+    """
+    channel, _, name = (task_name or '').partition('.')
+    if channel not in CHANNELS or not args:
+        return None, []
+    if name == 'send_batch_and_record':
+        ids = args[0] or []
+    elif name == 'send_and_record':
+        ids = args[:1]
+    elif name == 'add_to_queue':
+        ids = args[1:2]  # [task_name, record_id, correlation_id]
+    else:
+        return None, []
+    return channel, [i for i in ids if isinstance(i, int)]
+
+
+def hold(redis, task_name: str, args, until: float):
+    """
+    Mark the task's messages held until `until` (epoch seconds, or PARKED). `redis` may
+    be a pipeline, so the index is written with the parked or scheduled entry itself.
+    """
+    channel, ids = message_ids(task_name, args)
+    if ids:
+        redis.zadd(_key(channel), {record_id: until for record_id in ids})
+
+
+def release(redis, task_name: str, args, at: float):
+    """
+    Rescore held messages to their publish time `at` (only those still in the index).
+    """
+    channel, ids = message_ids(task_name, args)
+    if ids:
+        redis.zadd(_key(channel), {record_id: at for record_id in ids}, xx=True)
+
+
+def held_ids(channel: str, record_ids, since: float):
+    """
+    The ids among `record_ids` held at or after `since`. Empty without Redis; None if
+    the lookup failed, so the caller can't tell (and must not re-enqueue them).
+    """
+    r = get_redis()
+    if r is None or not record_ids:
+        return set()
+    record_ids = list(record_ids)
+    try:
+        pipe = r.pipeline(transaction=False)
+        for record_id in record_ids:
+            pipe.zscore(_key(channel), record_id)
+        scores = pipe.execute()
+    except Exception as e:
+        mark_redis_down(e)
+        return None
+    return {record_id for record_id, score in zip(record_ids, scores) if score is not None and score >= since}
+
+
+def prune(channel: str, before: float):
+    """
+    Drop index entries published before `before`.
+    """
+    r = get_redis()
+    if r is None:
+        return
+    try:
+        r.zremrangebyscore(_key(channel), '-inf', f"({before}")
+    except Exception as e:
+        mark_redis_down(e)
+        logging.getLogger('error').error(f"Could not prune held {channel} messages: {e}")
@@ -0,0 +1,257 @@
+"""
+Bulk job progress counters.
+
+Every bulk submission (/bulk, /jobs) has a BulkJob row, and its messages carry
+job_id. Send paths report the final status of job messages with
+add_job_counts(), after their own commit: one MULTI of HINCRBY on the job's
+Redis hash (`job:counts:<id>`) plus SADD of the id to `job:dirty`. They never
+touch the job row, so the batch tasks of a 100k-message job don't queue up on
+one row lock.
+
+The beat-scheduled fold (every JOB_COUNTER_FOLD_INTERVAL seconds) moves each
+dirty hash into its row with UPDATE ... SET sent = sent + n. A hash being
+folded is first renamed to `job:folding:<id>` and tagged with a fold token;
+the UPDATE stores the token and skips rows that already carry it, so a fold
+retried after a crash never adds the same counts twice. A job becomes
+'completed' once every accepted message is sent, failed or expired.
+
+GET .../jobs/<id> (job_progress) reads the row plus the two hashes: constant
+work however many messages the job has. Without Redis the counts go straight
+to the row.
+"""
+import logging
+import time
+import uuid
+
+from celery import shared_task
+from flask import current_app, has_app_context
+from sqlalchemy import bindparam, case, update
+
+from app.extensions import db, bulk_job_counts_folded_counter
+from app.models.bulk_job import BulkJob
+from app.utils.redis_client import get_redis, mark_redis_down
+
+logger = logging.getLogger('app')
+
+FOLD_TASK = 'jobs.fold_counters'
+OUTCOMES = ('sent', 'failed', 'expired')
+DIRTY_KEY = 'job:dirty'
+
+# KEYS[1] = counts hash, KEYS[2] = folding hash; ARGV[1] = fold token
+# Re-uses a folding hash left by a crashed fold, else claims the pending counts.
+_CLAIM_LUA = """
+if redis.call('EXISTS', KEYS[2]) == 0 and redis.call('EXISTS', KEYS[1]) == 1 then
+  redis.call('RENAME', KEYS[1], KEYS[2])
+  redis.call('HSET', KEYS[2], '_token', ARGV[1])
+end
+return redis.call('HGETALL', KEYS[2])
+"""
+
+# KEYS[1] = counts hash, KEYS[2] = folding hash, KEYS[3] = dirty set; ARGV[1] = job id
+# The job stays dirty if new counts arrived during the fold.
+_RELEASE_LUA = """
+redis.call('DEL', KEYS[2])
+if redis.call('EXISTS', KEYS[1]) == 0 then redis.call('SREM', KEYS[3], ARGV[1]) end
+return 0
+"""
+
+_jobs = BulkJob.__table__
+_add_counts = (
+    update(_jobs)
+    .where(_jobs.c.id == bindparam('job_id'))
+    .values(sent=_jobs.c.sent + bindparam('d_sent'), failed=_jobs.c.failed + bindparam('d_failed'),
+            expired=_jobs.c.expired + bindparam('d_expired'))
+)
+
+
+def _counts_key(job_id) -> str:
+    return f"job:counts:{job_id}"
+
+
+def _folding_key(job_id) -> str:
+    return f"job:folding:{job_id}"
+
+
+def job_counts(pairs) -> dict:
+    """
+    {job_id: {outcome: n}} from (job_id, status) pairs; rows without a job and
+    non-final statuses are skipped.
+    """
+    counts = {}
+    for job_id, status in pairs:
+        if job_id is not None and status in OUTCOMES:
+            per_job = counts.setdefault(job_id, {})
+            per_job[status] = per_job.get(status, 0) + 1
+    return counts
+
+
+def _params(job_id, per_job: dict, token: str = None) -> dict:
+    params = {'job_id': job_id, **{f'd_{outcome}': int(per_job.get(outcome, 0)) for outcome in OUTCOMES}}
+    if token is not None:
+        params['token'] = token
+    return params
+
+
+def settle_jobs(job_ids):
+    """
+    Mark queued jobs 'completed' once every accepted message is finalised (and back to
+    'queued' if a replay re-opened them). Runs in the caller's transaction.
+    """
+    if not job_ids:
+        return
+    done = _jobs.c.sent + _jobs.c.failed + _jobs.c.expired >= _jobs.c.accepted
+    db.session.execute(
+        update(_jobs)
+        .where(_jobs.c.id.in_(list(job_ids)), _jobs.c.status.in_(('queued', 'completed')))
+        .values(status=case((done, 'completed'), else_='queued'))
+    )
+
+
+def add_job_counts(counts: dict):
+    """
+    Add {job_id: {outcome: n}} to the jobs' counters; n may be negative (a replayed
+    failure). Call after the status change is committed. Never raises.
+    """
+    counts = {job_id: per_job for job_id, per_job in counts.items() if any(per_job.values())}
+    if not counts:
+        return
+    r = get_redis()
+    if r is not None:
+        try:
+            pipe = r.pipeline(transaction=True)
+            for job_id, per_job in counts.items():
+                for outcome, n in per_job.items():
+                    if n:
+                        pipe.hincrby(_counts_key(job_id), outcome, n)
+                pipe.sadd(DIRTY_KEY, job_id)
+            pipe.execute()
+            return
+        except Exception as e:
+            mark_redis_down(e)
+    try:
+        db.session.execute(_add_counts, [_params(job_id, per_job) for job_id, per_job in counts.items()])
+        settle_jobs(counts)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.getLogger('error').error(f"Failed to update counters of jobs {sorted(counts)}: {e}")
+
+
+def _decode(raw) -> dict:
+    # HGETALL: a dict from redis-py, a flat [key, value, ...] list from EVAL
+    pairs = raw.items() if isinstance(raw, dict) else zip(raw[::2], raw[1::2])
+    fields = {}
+    for key, value in pairs:
+        key = key.decode() if isinstance(key, bytes) else key
+        fields[key] = value.decode() if isinstance(value, bytes) else value
+    return fields
+
+
+def fold_job_counters(max_jobs: int = 1000) -> int:
+    """
+    Fold up to `max_jobs` dirty Redis counter hashes into their job rows in one
+    transaction. Returns the number of jobs folded.
+    """
+    r = get_redis()
+    if r is None:
+        return 0
+    try:
+        job_ids = sorted(int(job_id) for job_id in r.srandmember(DIRTY_KEY, max_jobs) or ())
+    except Exception as e:
+        mark_redis_down(e)
+        return 0
+    if not job_ids:
+        return 0
+
+    params = []
+    try:
+        for job_id in job_ids:
+            fields = _decode(r.eval(_CLAIM_LUA, 2, _counts_key(job_id), _folding_key(job_id), uuid.uuid4().hex))
+            if fields.get('_token'):
+                params.append(_params(job_id, {k: v for k, v in fields.items() if k in OUTCOMES}, fields['_token']))
+    except Exception as e:
+        # Whatever was claimed stays in its folding hash for the next run
+        mark_redis_down(e)
+        return 0
+
+    if params:
+        try:
+            # Skips a job whose fold was already applied before a crash
+            db.session.execute(
+                _add_counts.where(_jobs.c.fold_token.is_distinct_from(bindparam('token')))
+                .values(fold_token=bindparam('token')),
+                params,
+            )
+            settle_jobs(job_ids)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logging.getLogger('error').error(f"Failed to fold counters of {len(params)} jobs: {e}")
+            return 0
+
+    try:
+        for job_id in job_ids:
+            r.eval(_RELEASE_LUA, 3, _counts_key(job_id), _folding_key(job_id), DIRTY_KEY, job_id)
+    except Exception as e:
+        mark_redis_down(e)
+    bulk_job_counts_folded_counter.inc(len(params))
+    return len(params)
+
+
+def job_progress(job: BulkJob) -> dict:
+    """
+    The job with live counters: its row plus the counts not yet folded.
+    """
+    data = job.as_dict()
+    r = get_redis()
+    if r is not None:
+        try:
+            pipe = r.pipeline(transaction=False)
+            pipe.hgetall(_counts_key(job.id))
+            pipe.hgetall(_folding_key(job.id))
+            pending, folding = (_decode(h) for h in pipe.execute())
+            if folding.get('_token') == job.fold_token:
+                folding = {}  # already in the row
+            for outcome in OUTCOMES:
+                data[outcome] += int(pending.get(outcome, 0)) + int(folding.get(outcome, 0))
+        except Exception as e:
+            mark_redis_down(e)
+    data['queued'] = max(data['accepted'] - sum(data[outcome] for outcome in OUTCOMES), 0)
+    if data['status'] in ('queued', 'completed'):
+        data['status'] = 'queued' if data['queued'] else 'completed'
+    return data
+
+
+def _interval() -> float:
+    if has_app_context():
+        return float(current_app.config.get('JOB_COUNTER_FOLD_INTERVAL', 10))
+    return 10.0
+
+
+@shared_task(name=FOLD_TASK)
+def fold():
+    """
+    Beat entry point: fold dirty job counters until none are left (bounded by the interval).
+    """
+    started = time.monotonic()
+    batch = int(current_app.config.get('JOB_COUNTER_FOLD_BATCH', 1000))
+    folded = 0
+    while time.monotonic() - started < _interval():
+        n = fold_job_counters(batch)
+        folded += n
+        if n < batch:
+            break
+    if folded:
+        logger.info(f"Folded counters of {folded} bulk jobs in {time.monotonic() - started:.2f}s")
+    return folded
+
+
+def schedule_job_counter_fold(celery):
+    """
+    Register the job counter fold with celery beat.
+    """
+    interval = _interval()
+    celery.conf.beat_schedule = {
+        **(celery.conf.beat_schedule or {}),
+        'job-counters': {'task': FOLD_TASK, 'schedule': interval, 'options': {'expires': interval}},
+    }
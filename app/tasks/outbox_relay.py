@@ -0,0 +1,159 @@
+"""
+Transactional outbox relay.
+
+Request handlers don't publish to the broker. They stage the send task as an
+OutboxMessage row (stage_task) in the same transaction as the message row,
+with the Celery task id generated up front and stored on the message, so a
+message is never committed without its publication or vice versa, and the
+HTTP request neither waits on the broker nor opens a second transaction.
+
+The relay claims staged rows in id order, publishes a batch over one broker
+connection and deletes what it published. While the broker is down rows
+simply accumulate and the relay backs off; nothing is sent inline. Delivery is
+at-least-once: a relay that dies between publishing and deleting re-publishes
+with the same task id, and the send tasks skip rows that are already final.
+SKIP LOCKED lets several relays share the table.
+
+Run with:
+    python -m app.tasks.outbox_relay
+"""
+import logging
+import signal
+import time
+import uuid
+
+from sqlalchemy import delete, insert, select
+
+from app.extensions import db, outbox_published_counter, outbox_publish_failures_counter
+from app.models.outbox_message import OutboxMessage
+
+logger = logging.getLogger('app')
+
+
+def stage_task(task, args, kwargs=None, queue=None) -> str:
+    """
+    Add a publish of `task` to the current session; it commits with the caller's rows.
+    Returns the pre-generated Celery task id.
+    """
+    task_id = str(uuid.uuid4())
+    db.session.add(OutboxMessage(task_id=task_id, task_name=task.name, queue=queue,
+                                 args=list(args), kwargs=kwargs or {}))
+    return task_id
+
+
+def stage_tasks(task, calls) -> list:
+    """
+    Stage many publishes of `task` with one executemany INSERT in the current transaction.
+    `calls` holds (args, kwargs, queue) triples; returns their task ids in order.
+    """
+    rows = [{'task_id': str(uuid.uuid4()), 'task_name': task.name, 'queue': queue,
+             'args': list(args), 'kwargs': kwargs or {}, 'attempts': 0}
+            for args, kwargs, queue in calls]
+    if rows:
+        db.session.execute(insert(OutboxMessage), rows)
+    return [row['task_id'] for row in rows]
+
+
+class OutboxRelay:
+    """
+    Publishes staged outbox rows to the broker in batches.
+
+    Args:
+        app: Flask app with a configured Celery instance (app.celery)
+        batch_size: Rows claimed and published per round
+        poll_interval: Idle sleep when the outbox is empty
+        max_backoff: Longest sleep between rounds while the broker is failing
+    """
+
+    def __init__(self, app, batch_size=500, poll_interval=0.2, max_backoff=30.0):
+        self.app = app
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+        self._stopping = False
+
+    @classmethod
+    def from_config(cls, app):
+        cfg = app.config
+        return cls(
+            app,
+            batch_size=int(cfg.get('OUTBOX_RELAY_BATCH_SIZE', 500)),
+            poll_interval=float(cfg.get('OUTBOX_RELAY_POLL_INTERVAL', 0.2)),
+            max_backoff=float(cfg.get('OUTBOX_RELAY_MAX_BACKOFF', 30.0)),
+        )
+
+    def relay_once(self) -> int:
+        """
+        Publish one batch. Returns the number of rows published; raises if the
+        broker failed part-way (rows published before the failure are still removed).
+        """
+        celery = getattr(self.app, 'celery', None)
+        if celery is None:
+            raise RuntimeError("Outbox relay needs CELERY_BROKER_URL to be configured")
+        failure = None
+        with self.app.app_context():
+            try:
+                rows = db.session.execute(
+                    select(OutboxMessage)
+                    .order_by(OutboxMessage.id)
+                    .limit(self.batch_size)
+                    .with_for_update(skip_locked=True)
+                ).scalars().all()
+                published = []
+                try:
+                    with celery.producer_or_acquire() as producer:
+                        for row in rows:
+                            celery.send_task(row.task_name, args=row.args, kwargs=row.kwargs,
+                                             task_id=row.task_id, queue=row.queue, producer=producer)
+                            published.append(row)
+                except Exception as e:
+                    failure = e
+                    failed = rows[len(published)]
+                    failed.attempts = (failed.attempts or 0) + 1
+                    failed.last_error = str(e)[:255]
+                if published:
+                    db.session.execute(delete(OutboxMessage).where(
+                        OutboxMessage.id.in_([row.id for row in published])))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        for row in published:
+            outbox_published_counter.labels(task=row.task_name).inc()
+        if failure is not None:
+            outbox_publish_failures_counter.inc()
+            raise failure
+        return len(published)
+
+    def run(self):
+        logger.info("Outbox relay started")
+        backoff = 0.0
+        while not self._stopping:
+            try:
+                published = self.relay_once()
+                backoff = 0.0
+            except Exception as e:
+                backoff = min(self.max_backoff, max(self.poll_interval, backoff * 2))
+                logging.getLogger('error').error(f"Outbox relay publish failed, retrying in {backoff:.1f}s: {e}")
+                time.sleep(backoff)
+                continue
+            if published < self.batch_size:
+                time.sleep(self.poll_interval)
+        logger.info("Outbox relay stopped")
+
+    def stop(self, *_):
+        self._stopping = True
+
+
+def main():
+    from app import create_app
+
+    app = create_app()
+    relay = OutboxRelay.from_config(app)
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, relay.stop)
+    relay.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Priority lanes for Celery traffic.
+
+Each channel (sms, email) gets one broker queue per priority, so OTPs never
+wait behind a bulk campaign: workers consume lanes independently (see the
+celery-* Makefile targets and docker-compose workers). Anything published
+without a lane (health checks, maintenance) stays on the default queue.
+
+With DISPATCH_SHARDS > 1 each lane is further split into shard queues
+('sms.otp.3') by a consistent hash of the recipient. Every message to a
+recipient lands on the same shard, so a shard consumed by a single
+`-c 1` worker (make celery-shard) keeps that recipient's sends in order,
+and the per-process throttles in sms_util/email_util see all of them,
+without any cross-process coordination. Rows store only a 10-bit shard
+key, never a hash of the recipient itself; batches are grouped per shard.
+"""
+import hashlib
+from typing import List
+
+from flask import current_app, has_app_context
+
+# Highest first; also the order the asyncio dispatcher claims rows in
+PRIORITIES = ('otp', 'transactional', 'bulk')
+CHANNELS = ('sms', 'email')
+DEFAULT_QUEUE = 'celery'
+# Recipient buckets stored on message rows; shards are assigned per bucket
+SHARD_KEYS = 1024
+
+
+def normalize_priority(value, default: str) -> str:
+    """
+    Validate an API-supplied priority; None/empty means `default`.
+    Raises ValueError for unknown priorities.
+    """
+    if value is None or value == '':
+        return default
+    priority = str(value).strip().lower()
+    if priority not in PRIORITIES:
+        raise ValueError(f"priority must be one of: {', '.join(PRIORITIES)}")
+    return priority
+
+
+def recipient_shard_key(recipient: str) -> int:
+    """
+    Stable bucket (0..SHARD_KEYS-1) of a phone number or email address.
+    """
+    normalized = recipient.strip().lower()
+    if '@' not in normalized:
+        normalized = normalized.lstrip('+')
+    digest = hashlib.blake2b(normalized.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % SHARD_KEYS
+
+
+def shard_for(shard_key: int, shards: int) -> int:
+    """
+    Jump consistent hash (Lamping & Veach): going from N to N+1 shards moves only
+    1/(N+1) of the keys, so recipients keep their worker across resizes where possible.
+    """
+    key = shard_key & 0xFFFFFFFFFFFFFFFF
+    bucket, j = -1, 0
+    while j < shards:
+        bucket = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def dispatch_shards() -> int:
+    if has_app_context():
+        return max(int(current_app.config.get('DISPATCH_SHARDS', 1) or 1), 1)
+    return 1
+
+
+def queue_for(channel: str, priority: str, shard_key: int = None) -> str:
+    """
+    Broker queue for a channel's priority lane, e.g. 'sms.otp', or the recipient's
+    shard of it ('sms.otp.3') when sharding is on and `shard_key` is known.
+    """
+    shards = dispatch_shards()
+    if shard_key is None or shards <= 1:
+        return f"{channel}.{priority}"
+    return f"{channel}.{priority}.{shard_for(shard_key, shards)}"
+
+
+def shard_batches(channel: str, priority: str, items, batch_size: int, shard_key=lambda item: None):
+    """
+    Split `items` into batches of at most `batch_size` whose members share one (shard) queue.
+    `shard_key(item)` gives an item's key. Returns [(queue, batch)] in first-seen order.
+    """
+    by_queue = {}
+    for item in items:
+        by_queue.setdefault(queue_for(channel, priority, shard_key(item)), []).append(item)
+    return [(queue, members[i:i + batch_size])
+            for queue, members in by_queue.items() for i in range(0, len(members), batch_size)]
+
+
+def priority_from_queue(queue: str, default: str) -> str:
+    """
+    Priority of the lane a task was delivered on (its routing key), or `default`.
+    """
+    parts = (queue or '').split('.')
+    priority = parts[1] if len(parts) > 1 else ''
+    return priority if priority in PRIORITIES else default
+
+
+def all_queues(shards: int = 1) -> List[str]:
+    lanes = [queue_for(c, p) for c in CHANNELS for p in PRIORITIES]
+    if shards > 1:
+        lanes += [f"{lane}.{n}" for lane in lanes for n in range(shards)]
+    return [DEFAULT_QUEUE] + lanes
+
+
+def declare_queues(celery, shards: int = 1):
+    """
+    Declare every lane (and shard) on the Celery app so workers started with -Q can consume them.
+    """
+    from kombu import Queue
+
+    celery.conf.update(
+        task_default_queue=DEFAULT_QUEUE,
+        task_queues=[Queue(name) for name in all_queues(shards)],
+    )
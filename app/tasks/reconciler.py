@@ -0,0 +1,218 @@
+"""
+Stuck-message reconciler.
+
+A row can be left 'queued' or 'retry' with nothing that will ever send it:
+a worker died mid-task, Redis lost a parked or scheduled retry, a publish
+failed after the commit. The asyncio dispatcher can also die holding rows
+in 'dispatching'. The beat-scheduled reconciler scans for such rows older than
+RECONCILER_STALE_SECONDS (using the (status, updated_at) index) and checks
+whether their task is still live: staged in the outbox, active, reserved or
+scheduled on a worker, or held in Redis (parked for the rate governor's
+drainer or waiting in `retry:due`, see app/tasks/held.py). Orphans are
+re-enqueued as batch tasks on their priority lane through the outbox, in the
+same transaction that gives them their new task id.
+
+Tasks waiting in the broker queue itself can't be seen, so the stale window
+must be longer than the worst-case broker queue latency, or a backlog is
+re-enqueued and sent twice. Parking and deferring a row bump its updated_at.
+
+Every scanned row has its updated_at bumped, so it is not looked at again
+for another stale window. Rows are claimed with SKIP LOCKED under a Redis
+lock per channel, so several nodes can run the reconciler at the same time.
+"""
+import logging
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from celery import shared_task
+from flask import current_app, has_app_context
+from sqlalchemy import select, update
+
+from app.extensions import db, reconciler_requeued_counter
+from app.tasks.held import held_ids, prune
+from app.models.outbox_message import OutboxMessage
+from app.utils.redis_client import get_redis, mark_redis_down
+
+logger = logging.getLogger('app')
+
+RECONCILE_TASK = 'reconciler.run'
+STALE_STATUSES = ('queued', 'retry', 'dispatching')
+
+# KEYS[1] = lock; ARGV[1] = owner token
+_UNLOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+def _interval() -> float:
+    if has_app_context():
+        return float(current_app.config.get('RECONCILER_INTERVAL', 60))
+    return 60.0
+
+
+def _channel(channel):
+    # Lazy imports: the task modules are heavy and import each other's helpers
+    if channel == 'sms':
+        from app.models.sms_message import SMSMessage
+        from app.tasks.sms_tasks import send_batch_and_record
+        return SMSMessage, send_batch_and_record, int(current_app.config.get('SMS_GATEWAY_BATCH_SIZE', 50))
+    from app.models.email_message import EmailMessage
+    from app.tasks.email_queue import send_batch_and_record
+    return EmailMessage, send_batch_and_record, int(current_app.config.get('EMAIL_BATCH_SIZE', 50))
+
+
+def _worker_task_ids(celery) -> set:
+    """
+    Ids of tasks active, reserved (prefetched) or scheduled (ETA) on any worker.
+    """
+    ids = set()
+    try:
+        inspect = celery.control.inspect(timeout=float(current_app.config.get('RECONCILER_INSPECT_TIMEOUT', 1.0)))
+        for reply in (inspect.active(), inspect.reserved()):
+            for tasks in (reply or {}).values():
+                ids.update(t.get('id') for t in tasks)
+        for tasks in (inspect.scheduled() or {}).values():
+            ids.update(t.get('request', {}).get('id') for t in tasks)
+    except Exception as e:
+        logging.getLogger('error').error(f"Reconciler could not inspect workers: {e}")
+    return ids
+
+
+def _base_task_id(task_id: str) -> str:
+    # Batch members store "<task_id>:<record_id>" (staging.batch_member_task_id)
+    return task_id.rsplit(':', 1)[0] if ':' in task_id else task_id
+
+
+def reconcile_channel(channel: str, stale_seconds: float, batch_size: int = 500, max_rows: int = 10000,
+                      worker_task_ids: set = None) -> dict:
+    """
+    Re-enqueue orphaned stale rows of one channel. Returns what was scanned and repaired.
+    """
+    from app.tasks.outbox_relay import stage_task
+    from app.tasks.queues import shard_batches
+    from app.utils.staging import batch_member_task_id
+
+    model, task, send_batch = _channel(channel)
+    send_batch = max(send_batch, 1)
+    dispatcher = channel == 'sms' and current_app.config.get('SMS_DISPATCH_BACKEND') == 'asyncio'
+    celery = getattr(current_app, 'celery', None)
+    report = {'scanned': 0, 'live': 0, 'held': 0, 'requeued': 0, 'batches': 0}
+    if celery is None and not dispatcher:
+        return {**report, 'skipped': 'no_celery'}
+    if worker_task_ids is None:
+        worker_task_ids = set() if dispatcher else _worker_task_ids(celery)
+
+    r = get_redis()
+    lock_key, token = f"reconciler:{channel}", uuid.uuid4().hex
+    if r is not None:
+        try:
+            if not r.set(lock_key, token, nx=True, px=int((_interval() + 60) * 1000)):
+                return {**report, 'skipped': 'locked'}
+        except Exception as e:
+            mark_redis_down(e)
+
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=stale_seconds)
+    if not dispatcher:
+        prune(channel, cutoff.timestamp())
+    try:
+        while report['scanned'] < max_rows:
+            try:
+                rows = db.session.execute(
+                    select(model)
+                    .where(model.status.in_(STALE_STATUSES), model.updated_at < cutoff,
+                           model.deleted_at.is_(None))
+                    .order_by(model.updated_at)
+                    .limit(min(batch_size, max_rows - report['scanned']))
+                    .with_for_update(skip_locked=True)
+                ).scalars().all()
+                if not rows:
+                    db.session.rollback()
+                    break
+                now = datetime.now(timezone.utc)
+                bases = {_base_task_id(row.task_id) for row in rows if row.task_id}
+                staged = set(db.session.execute(
+                    select(OutboxMessage.task_id).where(OutboxMessage.task_id.in_(bases))
+                ).scalars()) if bases else set()
+                live = staged | worker_task_ids
+                has_task = {row.id for row in rows
+                            if row.task_id and row.status != 'dispatching' and _base_task_id(row.task_id) in live}
+                held = set() if dispatcher else held_ids(
+                    channel, [row.id for row in rows if row.id not in has_task], cutoff.timestamp())
+
+                updates = []
+                orphans = defaultdict(list)
+                for row in rows:
+                    if row.id in has_task:
+                        updates.append({'id': row.id, 'updated_at': now})
+                        report['live'] += 1
+                    elif held is None or row.id in held:
+                        # Parked or scheduled in Redis (or Redis can't tell us): not an orphan
+                        updates.append({'id': row.id, 'updated_at': now})
+                        report['held'] += 1
+                    elif dispatcher:
+                        # The dispatcher claims 'queued' rows without a task id itself
+                        updates.append({'id': row.id, 'status': 'queued', 'task_id': None, 'updated_at': now})
+                        report['requeued'] += 1
+                    else:
+                        orphans[row.priority or 'transactional'].append((row.id, row.shard_key))
+                for priority, members in orphans.items():
+                    for queue, batch in shard_batches(channel, priority, members, send_batch, lambda m: m[1]):
+                        ids = [record_id for record_id, _ in batch]
+                        task_id = stage_task(task, [ids, None], {'priority': priority}, queue=queue)
+                        updates.extend({'id': record_id, 'status': 'queued', 'updated_at': now,
+                                        'task_id': batch_member_task_id(task_id, record_id)} for record_id in ids)
+                        report['batches'] += 1
+                        report['requeued'] += len(ids)
+                db.session.execute(update(model), updates)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            report['scanned'] += len(rows)
+    finally:
+        if r is not None:
+            try:
+                r.eval(_UNLOCK_LUA, 1, lock_key, token)
+            except Exception as e:
+                mark_redis_down(e)
+
+    if report['requeued']:
+        reconciler_requeued_counter.labels(channel=channel).inc(report['requeued'])
+        logger.warning(f"Reconciler re-enqueued {report['requeued']} orphaned {channel} messages: {report}")
+    return report
+
+
+@shared_task(name=RECONCILE_TASK)
+def reconcile(channel=None):
+    """
+    Beat entry point: reconcile every channel (or just `channel`).
+    """
+    cfg = current_app.config
+    started = time.monotonic()
+    channels = [channel] if channel else ['sms', 'email']
+    celery = getattr(current_app, 'celery', None)
+    # One worker inspection shared by both channels
+    worker_ids = _worker_task_ids(celery) if celery is not None else set()
+    reports = {
+        ch: reconcile_channel(ch, float(cfg.get('RECONCILER_STALE_SECONDS', 1800)),
+                              int(cfg.get('RECONCILER_BATCH_SIZE', 500)),
+                              int(cfg.get('RECONCILER_MAX_ROWS', 10000)), worker_ids)
+        for ch in channels
+    }
+    logger.info(f"Reconciler run finished in {time.monotonic() - started:.1f}s: {reports}")
+    return reports
+
+
+def schedule_reconciler(celery):
+    """
+    Register the reconciler with celery beat.
+    """
+    interval = _interval()
+    celery.conf.beat_schedule = {
+        **(celery.conf.beat_schedule or {}),
+        'reconciler': {'task': RECONCILE_TASK, 'schedule': interval,
+                       'options': {'expires': interval}},
+    }
@@ -0,0 +1,225 @@
+"""
+Redis sorted-set retry scheduler.
+
+Failed sends are not retried with Celery countdowns: those become ETA tasks
+held in worker memory, and a gateway outage leaves thousands of them in every
+worker. schedule_retry() instead stores the task in the `retry:due` sorted set
+scored by its due time. The beat-scheduled poller claims due entries in
+batches (atomically, so pollers can overlap) and re-publishes them on their
+original lane.
+
+The delay comes from a backoff policy per error class (timeout, server_error,
+rate_limited, default): base * 2^(attempt-1), capped, with +/-20% jitter.
+Policies can be overridden with RETRY_POLICIES. Sends deferred for a known
+time (circuit breaker open) go through schedule_at() the same way. Without
+Redis the task falls back to a Celery countdown.
+"""
+import json
+import logging
+import random
+import time
+import uuid
+
+import requests
+from celery import shared_task, current_app as celery_app
+from flask import current_app, has_app_context
+from redis.exceptions import RedisError
+
+from app.extensions import (retry_scheduled_counter, retry_released_counter,
+                            retry_backlog_gauge, retry_backlog_age_gauge)
+from app.tasks.held import hold
+from app.utils.redis_client import get_redis, mark_redis_down
+
+logger = logging.getLogger('app')
+
+POLL_TASK = 'retry.poll_due'
+DUE_KEY = 'retry:due'
+# Same members scored by when they were scheduled (backlog age)
+ENQUEUED_KEY = 'retry:enqueued'
+
+# error class -> (base seconds, cap seconds)
+DEFAULT_POLICIES = {
+    'timeout': (15, 300),
+    'server_error': (30, 600),
+    'rate_limited': (60, 900),
+    'default': (10, 300),
+}
+
+# KEYS[1] = due set, KEYS[2] = enqueued set; ARGV = now, limit
+# Returns [member, due score, enqueued score, ...] so a failed publish can put items back as they were
+_CLAIM_LUA = """
+local items = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, tonumber(ARGV[2]))
+local claimed = {}
+for i = 1, #items, 2 do
+  local member = items[i]
+  claimed[#claimed + 1] = member
+  claimed[#claimed + 1] = items[i + 1]
+  claimed[#claimed + 1] = redis.call('ZSCORE', KEYS[2], member) or items[i + 1]
+  redis.call('ZREM', KEYS[1], member)
+  redis.call('ZREM', KEYS[2], member)
+end
+return claimed
+"""
+
+
+def _config(name: str, default=None):
+    if has_app_context():
+        return current_app.config.get(name, default)
+    return default
+
+
+def classify_error(status_code: int = None, exc: BaseException = None) -> str:
+    """
+    Map a gateway status code or exception to a backoff policy name.
+    """
+    if isinstance(exc, (requests.Timeout, TimeoutError)) or status_code in (408, 504):
+        return 'timeout'
+    if status_code == 429:
+        return 'rate_limited'
+    if isinstance(exc, requests.ConnectionError) or (status_code is not None and status_code >= 500):
+        return 'server_error'
+    if status_code is not None and 400 <= status_code < 500:
+        return 'rejected'  # no policy of its own: retried on the default one
+    return 'default'
+
+
+def _policies() -> dict:
+    policies = dict(DEFAULT_POLICIES)
+    raw = _config('RETRY_POLICIES')
+    if raw:
+        try:
+            overrides = json.loads(raw) if isinstance(raw, str) else raw
+            for name, policy in overrides.items():
+                policies[name] = (float(policy['base']), float(policy['cap']))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logging.getLogger('error').error(f"Ignoring invalid RETRY_POLICIES: {e}")
+    return policies
+
+
+def backoff_delay(error_class: str, attempt: int) -> float:
+    """
+    Seconds before retry number `attempt` (1-based) for `error_class`.
+    """
+    policies = _policies()
+    base, cap = policies.get(error_class, policies['default'])
+    delay = min(cap, base * 2 ** max(attempt - 1, 0))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def schedule_at(task, args, kwargs=None, delay: float = 0.0, queue: str = None):
+    """
+    Publish `task` on `queue` in `delay` seconds via the sorted set
+    (a Celery countdown without Redis).
+    """
+    r = get_redis()
+    if r is not None:
+        now = time.time()
+        member = json.dumps({'id': uuid.uuid4().hex, 'task': task.name, 'args': list(args),
+                             'kwargs': kwargs or {}, 'queue': queue})
+        try:
+            pipe = r.pipeline()
+            pipe.zadd(DUE_KEY, {member: now + delay})
+            pipe.zadd(ENQUEUED_KEY, {member: now})
+            hold(pipe, task.name, args, now + delay)  # for the reconciler
+            pipe.execute()
+            return
+        except Exception as e:
+            mark_redis_down(e)
+    task.apply_async(args, kwargs or {}, countdown=delay, queue=queue)
+
+
+def schedule_retry(task, args, kwargs=None, attempt: int = 1, error_class: str = 'default',
+                   queue: str = None, min_delay: float = 0.0) -> float:
+    """
+    Schedule `task` to run again after the policy delay (at least `min_delay`).
+    Returns the delay in seconds.
+    """
+    delay = max(backoff_delay(error_class, attempt), min_delay)
+    retry_scheduled_counter.labels(error_class=error_class).inc()
+    schedule_at(task, args, kwargs, delay, queue)
+    return delay
+
+
+def backlog_stats() -> dict:
+    """
+    Scheduled retries and how long the oldest has been waiting (also exported as gauges).
+    """
+    r = get_redis()
+    if r is None:
+        return {}
+    try:
+        size = r.zcard(DUE_KEY)
+        oldest = r.zrange(ENQUEUED_KEY, 0, 0, withscores=True)
+    except Exception as e:
+        mark_redis_down(e)
+        return {}
+    age = max(0.0, time.time() - oldest[0][1]) if oldest else 0.0
+    retry_backlog_gauge.set(size)
+    retry_backlog_age_gauge.set(age)
+    return {'size': size, 'oldest_age_seconds': round(age, 1)}
+
+
+def release_due(batch_size: int = 500, budget: float = 1.0) -> int:
+    """
+    Re-publish due retries in batches for at most `budget` seconds.
+    Returns the number released.
+    """
+    r = get_redis()
+    if r is None:
+        return 0
+    deadline = time.monotonic() + budget
+    released = 0
+    try:
+        claim = r.register_script(_CLAIM_LUA)
+        while time.monotonic() < deadline:
+            claimed = claim(keys=[DUE_KEY, ENQUEUED_KEY], args=[time.time(), batch_size])
+            if not claimed:
+                break
+            items = [claimed[i:i + 3] for i in range(0, len(claimed), 3)]
+            with celery_app.producer_or_acquire() as producer:
+                for i, (raw, _, _) in enumerate(items):
+                    item = json.loads(raw)
+                    try:
+                        celery_app.send_task(item['task'], args=item['args'], kwargs=item['kwargs'],
+                                             queue=item['queue'], producer=producer)
+                    except Exception as e:
+                        # Broker trouble: put the rest back with their original scores (due time
+                        # and backlog age) and try again next poll
+                        pipe = r.pipeline()
+                        for rest, due, enqueued in items[i:]:
+                            pipe.zadd(DUE_KEY, {rest: float(due)})
+                            pipe.zadd(ENQUEUED_KEY, {rest: float(enqueued)})
+                        pipe.execute()
+                        logging.getLogger('error').error(f"Retry poller publish failed: {e}")
+                        return released
+                    retry_released_counter.inc()
+                    released += 1
+            if len(items) < batch_size:
+                break
+    except RedisError as e:
+        mark_redis_down(e)
+    if released:
+        logger.info(f"Retry poller released {released} due retries")
+    return released
+
+
+@shared_task(name=POLL_TASK)
+def poll_due():
+    """
+    Beat entry point: release due retries for one interval, then refresh the backlog gauges.
+    """
+    released = release_due(int(_config('RETRY_POLL_BATCH_SIZE', 500)),
+                           float(_config('RETRY_POLL_INTERVAL', 1.0)))
+    return {'released': released, **backlog_stats()}
+
+
+def schedule_retry_poller(celery):
+    """
+    Register the retry poller with celery beat.
+    """
+    interval = float(_config('RETRY_POLL_INTERVAL', 1.0))
+    celery.conf.beat_schedule = {
+        **(celery.conf.beat_schedule or {}),
+        'retry-poll': {'task': POLL_TASK, 'schedule': interval,
+                       'options': {'expires': interval * 2}},
+    }
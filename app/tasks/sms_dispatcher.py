@@ -0,0 +1,457 @@
+"""
+Asyncio SMS gateway dispatcher.
+
+An optional alternative to the Celery send path (SMS_DISPATCH_BACKEND=asyncio).
+Gateway calls are pure network I/O, so instead of one blocking requests call
+per worker thread, a single event loop claims queued SMSMessage rows straight
+from the table and keeps hundreds of SOAP requests in flight, capped per
+gateway, and within the cluster-wide SMS_RATE_PER_SECOND governor. Outcomes
+are buffered and written back with set-based updates.
+Breaker and pool state live in Redis; those calls run on a small thread pool,
+so a slow Redis round trip never stalls the loop and every request on it.
+
+Run with:
+    python -m app.tasks.sms_dispatcher
+"""
+import asyncio
+import logging
+import signal
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, update, or_, and_, func
+
+from app.extensions import (db, sms_sent_counter, sms_failed_counter, sms_expired_counter,
+                            sms_client_queue_depth_gauge, sms_client_share_gauge, sms_client_dispatched_counter)
+from app.models.sms_message import SMSMessage
+from app.tasks.queues import PRIORITIES
+from app.utils.circuit_breaker import get_breaker, breaker_enabled
+from app.utils.fair_queue import DeficitRoundRobin, client_weights
+from app.utils.message_ttl import is_expired
+from app.utils.rate_governor import channel_governor
+from app.utils.sms_gateway import build_limiter
+from app.utils.sms_gateway_pool import get_gateway_pool
+from app.utils.sms_routing import get_routing_table
+from app.utils.sms_util import PHONE_RE, check_and_mark_throttle, sending_disabled
+from app.utils.dead_letters import dead_letter_entry, record_dead_letters
+from app.tasks.job_counters import add_job_counts, job_counts
+
+logger = logging.getLogger('sms')
+
+MAX_ATTEMPTS = 5
+
+# Threads for blocking Redis calls (breakers, pool TPS buckets): each takes at most
+# the Redis socket timeout, so a few threads serve hundreds of requests in flight
+_REDIS_THREADS = 16
+
+
+def _lane_rank(priority):
+    # Claim OTPs before transactional before bulk (app/tasks/queues.py lanes); unknown = transactional
+    return PRIORITIES.index(priority) if priority in PRIORITIES else 1
+
+
+class AsyncSMSDispatcher:
+    """
+    Claims queued SMS rows in batches and sends them concurrently on one event loop.
+
+    Args:
+        app: Flask app (config + DB access; DB work runs in worker threads)
+        concurrency: Total SOAP requests in flight
+        per_gateway_concurrency: Upper bound of the adaptive in-flight limit per gateway URL
+        claim_batch: Rows claimed per DB round trip
+        flush_size / flush_interval: Write back outcomes every N results or T seconds
+        poll_interval: Idle sleep when there is nothing to claim
+        fair_quantum: Rows a weight-1 client may claim per round-robin turn (app/utils/fair_queue.py)
+    """
+
+    def __init__(self, app, concurrency=200, per_gateway_concurrency=100, claim_batch=500,
+                 flush_size=200, flush_interval=0.5, poll_interval=1.0, retry_delay=10, fair_quantum=10):
+        self.app = app
+        self.concurrency = concurrency
+        self.per_gateway_concurrency = per_gateway_concurrency
+        self.claim_batch = claim_batch
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.fair_quantum = fair_quantum
+        self.dispatcher_id = f"dispatcher-{uuid.uuid4().hex[:12]}"
+        self._results = []
+        self._dead = []
+        self._jobs = {}  # record id -> bulk job id, for claimed rows that belong to a job
+        self._in_flight = set()
+        self._gateway_slots = {}
+        self._db_lock = None
+        self._pool = None
+        self._routing = None
+        self._breakers_on = False
+        self._governor = None
+        self._limiter_factory = None
+        self._redis_executor = None
+        self._stopping = False
+        # Deficit round-robin state per lane, and clients with exported gauges
+        self._fair = {}
+        self._clients = set()
+
+    @classmethod
+    def from_config(cls, app):
+        cfg = app.config
+        return cls(
+            app,
+            concurrency=int(cfg.get('SMS_DISPATCHER_CONCURRENCY', 200)),
+            per_gateway_concurrency=int(cfg.get('SMS_DISPATCHER_PER_GATEWAY_CONCURRENCY', 100)),
+            claim_batch=int(cfg.get('SMS_DISPATCHER_CLAIM_BATCH', 500)),
+            flush_size=int(cfg.get('SMS_DISPATCHER_FLUSH_SIZE', 200)),
+            flush_interval=float(cfg.get('SMS_DISPATCHER_FLUSH_INTERVAL', 0.5)),
+            poll_interval=float(cfg.get('SMS_DISPATCHER_POLL_INTERVAL', 1.0)),
+            retry_delay=float(cfg.get('SMS_DISPATCHER_RETRY_DELAY', 10)),
+            fair_quantum=int(cfg.get('FAIR_QUEUE_QUANTUM', 10)),
+        )
+
+    # ----- DB side (runs in a worker thread) -----
+
+    def _grants(self, claimable, limit):
+        """
+        Split `limit` across the backlog: lanes strictly by priority, clients within
+        a lane by deficit round-robin. Returns ([(priority, client_id, rows)], depth per client).
+        """
+        backlog = db.session.execute(
+            select(SMSMessage.priority, SMSMessage.client_id, func.count())
+            .where(*claimable)
+            .group_by(SMSMessage.priority, SMSMessage.client_id)
+        ).all()
+        lanes = defaultdict(dict)
+        depths = defaultdict(int)
+        for priority, client, depth in backlog:
+            lanes[priority][client] = depth
+            depths[client] += depth
+        weights = client_weights()
+        grants = []
+        for priority in sorted(lanes, key=_lane_rank):
+            if limit <= 0:
+                break
+            fair = self._fair.setdefault(priority, DeficitRoundRobin(self.fair_quantum))
+            fair.weights = weights
+            for client, n in fair.allocate(lanes[priority], limit).items():
+                grants.append((priority, client, n))
+                limit -= n
+        return grants, depths
+
+    def _export_client_metrics(self, depths, claimed):
+        total = sum(claimed.values())
+        self._clients |= set(depths) | set(claimed)
+        for client in self._clients:
+            sms_client_queue_depth_gauge.labels(client=client).set(depths.get(client, 0))
+            if total:
+                sms_client_share_gauge.labels(client=client).set(claimed.get(client, 0) / total)
+        for client, n in claimed.items():
+            sms_client_dispatched_counter.labels(client=client).inc(n)
+
+    def _claim(self, limit):
+        """
+        Lock and mark up to `limit` due rows as 'dispatching', returning decrypted work items.
+        Rows are split fairly between clients (_grants); SKIP LOCKED lets several
+        dispatchers share the table safely.
+        """
+        with self.app.app_context():
+            # Picks up route changes (TTL / reload) between claims
+            self._routing = get_routing_table()
+            retry_before = datetime.now(timezone.utc) - timedelta(seconds=self.retry_delay)
+            claimable = (
+                SMSMessage.task_id.is_(None), SMSMessage.deleted_at.is_(None),
+                or_(SMSMessage.status == 'queued',
+                    and_(SMSMessage.status == 'retry', SMSMessage.updated_at <= retry_before)),
+            )
+            try:
+                grants, depths = self._grants(claimable, limit)
+                rows = []
+                for priority, client, n in grants:
+                    lane = SMSMessage.priority.is_(None) if priority is None else SMSMessage.priority == priority
+                    rows.extend(db.session.execute(
+                        select(SMSMessage)
+                        .where(*claimable, lane, SMSMessage.client_id == client)
+                        .order_by(SMSMessage.id)
+                        .limit(n)
+                        .with_for_update(skip_locked=True)
+                    ).scalars())
+                work = []
+                now = datetime.now(timezone.utc)
+                expired = []
+                for row in rows:
+                    if is_expired(row.expires_at, now):
+                        # Finalised in the claim transaction: never decrypted or dispatched
+                        row.status = 'expired'
+                        expired.append(row.job_id)
+                        continue
+                    if row.job_id is not None:
+                        self._jobs[row.id] = row.job_id
+                    row.status = 'dispatching'
+                    row.task_id = f"{self.dispatcher_id}:{row.id}"
+                    try:
+                        to, message = row.decrypt_fields()
+                    except Exception:
+                        logger.error(f"Failed to decrypt SMS record {row.id}")
+                        to, message = None, None
+                    work.append((row.id, to, message, row.attempts or 0))
+                clients = Counter(row.client_id for row in rows)
+                db.session.commit()
+                sms_expired_counter.inc(len(expired))
+                add_job_counts(job_counts((job_id, 'expired') for job_id in expired))
+                self._export_client_metrics(depths, clients)
+                return work
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def _write_back(self, results, dead=()):
+        """
+        Persist outcomes with one bulk UPDATE by primary key, plus their dead letters.
+        """
+        with self.app.app_context():
+            try:
+                db.session.execute(update(SMSMessage), results)
+                record_dead_letters(list(dead), commit=False)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            add_job_counts(job_counts((self._jobs.pop(result['id'], None), result['status']) for result in results))
+
+    # ----- network side -----
+
+    def _gateway(self, url):
+        """
+        Per-gateway (AdaptiveLimiter, asyncio.Condition) pair; the limit starts at half
+        of per_gateway_concurrency and follows gateway latency from there.
+        """
+        entry = self._gateway_slots.get(url)
+        if entry is None:
+            limiter = self._limiter_factory()
+            entry = self._gateway_slots[url] = (limiter, asyncio.Condition())
+        return entry
+
+    async def _off_loop(self, fn, *args, **kwargs):
+        """
+        Run a blocking Redis-backed call (breaker, pool budget) on the Redis thread pool.
+        """
+        if self._redis_executor is None:
+            self._redis_executor = ThreadPoolExecutor(max_workers=_REDIS_THREADS,
+                                                      thread_name_prefix='sms-dispatcher-redis')
+        return await asyncio.get_running_loop().run_in_executor(self._redis_executor,
+                                                                partial(fn, *args, **kwargs))
+
+    async def _pick(self, tried, only):
+        """
+        Next pool member with TPS budget, awaiting (not blocking) when all are throttled.
+        """
+        while True:
+            member = await self._off_loop(self._pool.select, exclude=tried, max_wait=0, only=only)
+            if member is not None:
+                return member
+            wait = await self._off_loop(self._pool.budget_wait, exclude=tried, only=only)
+            if wait is None:
+                return None
+            await asyncio.sleep(max(wait, 0.001))
+
+    async def _rate_permit(self):
+        """
+        Take one SMS channel permit, awaiting (not blocking) while the governor is out of budget.
+        """
+        while not await self._off_loop(self._governor.try_take):
+            wait = await self._off_loop(self._governor.wait_time)
+            await asyncio.sleep(max(wait, 0.001))
+
+    async def _post(self, http, member, route, to, message, connect_timeout):
+        """
+        One gateway attempt. Returns (status_code, failover): failover is True when the
+        member never took the request (breaker open or connection refused).
+        """
+        import aiohttp
+
+        builder = member.builder('sendSingleSMS', route.senderid if route else None)
+        body = builder.build(to, message)
+        breaker = get_breaker(member.name) if self._breakers_on else None
+        limiter, cond = self._gateway(member.url)
+        async with cond:
+            await cond.wait_for(limiter.try_acquire)
+        latency, failed, failover = None, False, False
+        try:
+            if breaker is not None and not await self._off_loop(breaker.allow_request):
+                return None, True
+            timeout = aiohttp.ClientTimeout(total=limiter.timeout(), connect=connect_timeout)
+            started = time.monotonic()
+            try:
+                async with http.post(member.url, data=body, headers=builder.headers(body), timeout=timeout) as resp:
+                    await resp.read()
+                    status_code = resp.status
+            except asyncio.TimeoutError:
+                status_code = 408
+            except aiohttp.ClientConnectorError as e:
+                logger.error(f"Async SMS connect error on gateway {member.name}: {e}")
+                status_code, failover = 502, True
+            except Exception as e:
+                logger.error(f"Async SMS send error on gateway {member.name}: {e}")
+                status_code = 502
+            latency = time.monotonic() - started
+            failed = status_code >= 500 or status_code == 408
+            if breaker is not None:
+                await self._off_loop(breaker.record, failed=failed, elapsed=latency)
+            if not failed:
+                member.observe(latency)
+            return status_code, failover
+        finally:
+            limiter.release(latency, failed)
+            async with cond:
+                cond.notify_all()
+
+    async def _send(self, http, item, connect_timeout):
+        record_id, to, message, attempts = item
+        if to is None or not PHONE_RE.match(str(to)):
+            status_code = 400
+        elif not check_and_mark_throttle(to):
+            status_code = 429
+        elif self._pool is None:
+            status_code = 200  # testing / disabled / no gateway, same as the sync senders
+        else:
+            if self._governor is not None:
+                await self._rate_permit()
+            route = self._routing.lookup(to)
+            tried = []
+            status_code, failover = None, True
+            while failover:
+                member = await self._pick(tried, route.gateways if route else ())
+                if member is None:
+                    break
+                tried.append(member.name)
+                status_code, failover = await self._post(http, member, route, to, message, connect_timeout)
+            if status_code is None:
+                # No member took it (all circuits open): release the row without spending an attempt
+                self._results.append({'id': record_id, 'status': 'retry', 'attempts': attempts, 'task_id': None})
+                return
+        self._record(record_id, attempts + 1, status_code)
+
+    def _record(self, record_id, attempt, status_code):
+        if status_code == 200:
+            status = 'sent'
+            sms_sent_counter.inc()
+        elif status_code == 400 or attempt >= MAX_ATTEMPTS:
+            status = 'failed'
+            sms_failed_counter.inc()
+            self._dead.append(dead_letter_entry('sms', record_id, status_code, attempt))
+        else:
+            status = 'retry'
+        # Release task_id so retries can be claimed again
+        self._results.append({'id': record_id, 'status': status, 'attempts': attempt,
+                              'task_id': None if status == 'retry' else f"{self.dispatcher_id}:{record_id}"})
+
+    async def _db(self, fn, *args):
+        """
+        Run DB work in a worker thread, one call at a time: claims and write-backs
+        never interleave on the dispatcher's connection.
+        """
+        if self._db_lock is None:
+            self._db_lock = asyncio.Lock()
+        async with self._db_lock:
+            return await asyncio.to_thread(fn, *args)
+
+    async def _flush(self):
+        if not self._results:
+            return
+        batch, self._results = self._results, []
+        dead, self._dead = self._dead, []
+        try:
+            await self._db(self._write_back, batch, dead)
+        except Exception as e:
+            logger.error(f"Async SMS dispatcher write-back failed, will retry: {e}")
+            self._results = batch + self._results
+            self._dead = dead + self._dead
+
+    async def _flusher(self):
+        while not self._stopping:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush()
+
+    async def run(self, until_idle=False):
+        """
+        Main loop. With until_idle=True, returns once nothing is left to claim (used by tests/one-shot runs).
+        """
+        import aiohttp
+
+        with self.app.app_context():
+            cfg = self.app.config
+            self._pool = None if sending_disabled() else get_gateway_pool()
+            self._routing = get_routing_table()
+            connect_timeout = float(cfg.get('SMS_GATEWAY_CONNECT_TIMEOUT', 5))
+            limit = self.per_gateway_concurrency
+            self._limiter_factory = partial(build_limiter, initial=max(1, limit // 2), max_limit=limit)
+            self._breakers_on = breaker_enabled() and self._pool is not None
+            # Same cluster-wide budget as the Celery send tasks
+            governor = channel_governor('sms')
+            self._governor = None if governor.unlimited or self._pool is None else governor
+            if self._breakers_on:
+                # Build breakers with app config; sends run outside the app context
+                for member in self._pool.members:
+                    get_breaker(member.name)
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_gateway_concurrency)
+        logger.info(f"Async SMS dispatcher {self.dispatcher_id} started (concurrency={self.concurrency})")
+        flusher = asyncio.create_task(self._flusher())
+        try:
+            async with aiohttp.ClientSession(connector=connector) as http:
+                while not self._stopping:
+                    wait = await self._off_loop(self._pool.retry_after) if self._breakers_on else 0
+                    if wait > 0:
+                        # Every gateway circuit open: leave rows queued instead of claiming and bouncing them
+                        await self._flush()
+                        if until_idle and not self._in_flight:
+                            break
+                        await asyncio.sleep(min(wait, self.poll_interval))
+                        continue
+                    free = self.concurrency - len(self._in_flight)
+                    work = await self._db(self._claim, min(free, self.claim_batch)) if free > 0 else []
+                    for item in work:
+                        t = asyncio.create_task(self._send(http, item, connect_timeout))
+                        self._in_flight.add(t)
+                        t.add_done_callback(self._in_flight.discard)
+                    if len(self._results) >= self.flush_size:
+                        await self._flush()
+                    if not work:
+                        if until_idle and not self._in_flight:
+                            break
+                        await asyncio.sleep(self.poll_interval if free > 0 else 0.01)
+                if self._in_flight:
+                    await asyncio.gather(*self._in_flight, return_exceptions=True)
+        finally:
+            self._stopping = True
+            await flusher
+            await self._flush()
+            if self._redis_executor is not None:
+                self._redis_executor.shutdown(wait=False)
+                self._redis_executor = None
+            logger.info(f"Async SMS dispatcher {self.dispatcher_id} stopped")
+
+    def stop(self):
+        self._stopping = True
+
+
+def main():
+    from app import create_app
+
+    app = create_app()
+    dispatcher = AsyncSMSDispatcher.from_config(app)
+
+    async def _run():
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, dispatcher.stop)
+        await dispatcher.run()
+
+    asyncio.run(_run())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,135 +1,124 @@
 import logging
+import re
 from celery import shared_task
 from flask import current_app
-import time
-from app.extensions import db, sms_sent_counter, sms_failed_counter
+from app.extensions import db, sms_sent_counter, sms_failed_counter, sms_expired_counter
 from app.utils.sms_util import send_single_sms_util
-from sqlalchemy import select
+from app.utils.rate_governor import channel_governor, governor_max_wait
+from app.tasks.drainer import defer
+from app.tasks.queues import priority_from_queue
+from app.tasks.retry_scheduler import classify_error, schedule_at, schedule_retry
+from app.tasks.sms_tasks import MAX_ATTEMPTS, _circuit_wait
+from app.utils.status_writer import get_status_writer
+from app.utils.dead_letters import record_dead_letter
+from app.utils.message_ttl import is_expired
 from app.models.sms_message import SMSMessage
 
-# Queue for handling SMS requests with rate limiting
-class SMSQueue:
-    def __init__(self):
-        self.queue = []
-        self.processed_count = 0
-        self.last_reset_time = time.time()
-        self.rate_limit = 100  # 100 requests per minute
-        self.window_size = 60  # 60 seconds
-    
-    def add_to_queue(self, task_func, *args, **kwargs):
-        """Add a task to the queue"""
-        self.queue.append((task_func, args, kwargs))
-        return len(self.queue)  # Return current queue length
-    
-    def can_process_request(self):
-        """Check if we can process another request based on rate limit"""
-        now = time.time()
-        # Reset counter if window has passed
-        if now - self.last_reset_time >= self.window_size:
-            self.processed_count = 0
-            self.last_reset_time = now
-        
-        # Check if we're under the rate limit
-        return self.processed_count < self.rate_limit
-    
-    def process_queue(self):
-        """Process queued items within rate limits"""
-        if not self.can_process_request():
-            return False  # Rate limit exceeded
-        
-        # Process one item if available
-        if self.queue:
-            task_func, args, kwargs = self.queue.pop(0)
-            result = task_func(*args, **kwargs)
-            self.processed_count += 1
-            return result
-        
-        return None
-
-# Global SMS queue instance
-sms_queue = SMSQueue()
+# Outcomes where no gateway took the message (breaker open, dispatch slots or every
+# account's budget exhausted, per-mobile throttle): deferred without spending an attempt
+_NOT_SENT = ('circuit_open', 'gateway_busy', 'no_gateway_available', 'rate_limit_exceeded')
+
 
 @shared_task(bind=True, name='sms.add_to_queue', autoretry_for=(Exception,), retry_backoff=True, retry_backoff_max=60, retry_jitter=True, max_retries=3)
-def add_to_queue_task(self, task_name, *args, **kwargs):
+def add_to_queue_task(self, task_name, *args, permitted=False, **kwargs):
     """
-    Add a task to the SMS queue for processing.
-    
+    Run an SMS task under the cluster-wide SMS rate governor.
+
+    The task runs as soon as a send permit is available (waiting at most
+    RATE_GOVERNOR_MAX_WAIT); otherwise it is parked for the drainer, which
+    re-publishes it with permitted=True once the governor has budget.
+
     Args:
         task_name: Name of the task function to execute
+        permitted: A permit was already taken for this run (set by the drainer)
         *args, **kwargs: Arguments to pass to the task function
     """
-    import logging
-    logging.getLogger('app').info(f"Adding task {task_name} to queue")
-    
-    # Get the actual function by name
     if task_name == 'process_single_sms':
-        from app.tasks.sms_queue import process_single_sms
         task_func = process_single_sms
     else:
         raise ValueError(f"Unknown task name: {task_name}")
-    
-    # Add to queue
-    queue_length = sms_queue.add_to_queue(task_func, *args, **kwargs)
-    
-    logging.getLogger('app').info(f"Task added to queue. Current queue length: {queue_length}")
-    
-    # Try to process immediately if within rate limits
-    if sms_queue.can_process_request():
-        return sms_queue.process_queue()
-    else:
-        logging.getLogger('app').info("Rate limit reached, task remains in queue")
-        return {'status': 'queued', 'queue_length': queue_length}
 
-def process_single_sms(record_id, correlation_id=None):
+    queue = (self.request.delivery_info or {}).get('routing_key')
+    row = db.session.get(SMSMessage, args[0]) if args else None
+    if row is not None and (row.status in ('sent', 'failed', 'expired') or is_expired(row.expires_at)):
+        # Finalised or expired: settle it now, without a rate permit or parking for the drainer
+        return task_func(*args, queue=queue, **kwargs)
+
+    if not permitted and not channel_governor('sms').acquire(max_wait=governor_max_wait()):
+        priority = priority_from_queue(queue, 'transactional')
+        outcome = defer(add_to_queue_task, 'sms', priority, [task_name, *args], kwargs, queue=queue)
+        if args:
+            get_status_writer().touch(SMSMessage, args[0])
+        logging.getLogger('app').info(f"SMS rate limit reached, task {task_name} {outcome} on {priority} lane")
+        return {'status': 'queued', 'outcome': outcome}
+
+    return task_func(*args, queue=queue, **kwargs)
+
+def process_single_sms(record_id, correlation_id=None, queue=None):
     """
-    Process a single SMS record by calling the thread-safe utility function.
+    Send one SMSMessage row and persist the outcome.
+
+    Sends the gateway never took are re-run later without spending an attempt;
+    other failures are retried with backoff until MAX_ATTEMPTS, and only a 400
+    or the last attempt marks the row 'failed' with a dead letter. Re-runs go
+    through add_to_queue_task on `queue`, taking a fresh rate permit.
     """
-    # Short transaction: lock row and increment attempts to avoid lost updates
-    with db.session.begin():
-        row = db.session.execute(
-            select(SMSMessage).where(SMSMessage.id == record_id).with_for_update()
-        ).scalar_one_or_none()
-        if not row:
-            return {'error': 'record_not_found', 'record_id': record_id}
-        # Increment attempts (this will be handled by the caller in real implementation)
-    
-    # Input validation outside the locked transaction (keeps lock short)
-    import re
-    phone_pattern = re.compile(r"^\d{6,16}$")
-    if not phone_pattern.match(str(row.to)):
-        # persist invalid state and retry (if desired) - here we raise to trigger retry/backoff
+    row = db.session.get(SMSMessage, record_id)
+    if not row:
+        return {'error': 'record_not_found', 'record_id': record_id}
+    if row.status in ('sent', 'failed', 'expired'):
+        # Already finalised by an earlier delivery of this task
+        return {'record_id': row.id, 'status': row.status, 'uuid': row.uuid, 'correlation_id': correlation_id}
+    if is_expired(row.expires_at):
+        get_status_writer().record(SMSMessage, record_id, 'expired')
+        sms_expired_counter.inc()
+        return {'record_id': row.id, 'status': 'expired', 'uuid': row.uuid, 'correlation_id': correlation_id}
+
+    try:
+        to, message = row.decrypt_fields()
+    except Exception:
+        logging.getLogger('error').error(f"Failed to decrypt SMS record {record_id}")
+        return {'error': 'decryption_error', 'record_id': record_id}
+
+    phone_pattern = re.compile(r"^\+?\d{6,16}$")
+    if not phone_pattern.match(to):
         raise ValueError("Invalid phone number")
-    if not isinstance(row.message, str) or not (1 <= len(row.message) <= 500):
+    if not (1 <= len(message) <= 500):
         raise ValueError("Invalid message length")
     forbidden = ["<script", "SELECT ", "INSERT ", "DELETE ", "UPDATE ", "DROP "]
-    if any(f in row.message.upper() for f in forbidden):
+    if any(f in message.upper() for f in forbidden):
         raise ValueError("Forbidden content in SMS message")
 
-    # Audit logging
-    logging.getLogger('app').info(f"Audit: Sending SMS to {row.to}")
+    # Audit logging (record id only: no plaintext number in logs)
+    logging.getLogger('app').info(f"Audit: Sending SMS record {record_id}")
+
+    status_code, status_msg = send_single_sms_util(to, message)
+    rerun = ['process_single_sms', record_id, correlation_id]
 
-    status_code = send_single_sms_util(str(row.to), row.message)
+    if status_msg in _NOT_SENT:
+        # Nothing reached the gateway: keep the attempt budget
+        get_status_writer().record(SMSMessage, row.id, 'retry')
+        delay = 10.0 if status_msg == 'rate_limit_exceeded' else max(1.0, _circuit_wait())
+        schedule_at(add_to_queue_task, rerun, {}, delay, queue)
+        logging.getLogger('app').warning(f"SMS record {record_id} not sent ({status_msg}), deferred {delay:.0f}s")
+        return {'record_id': row.id, 'status': 'deferred', 'reason': status_msg, 'correlation_id': correlation_id}
 
-    # Persist status with a short transaction and row-level lock to avoid races
+    attempts = (row.attempts or 0) + 1
     if status_code == 200:
-        with db.session.begin():
-            r = db.session.execute(
-                select(SMSMessage).where(SMSMessage.id == record_id).with_for_update()
-            ).scalar_one()
-            r.status = 'sent'
-            sms_sent_counter.inc()
-            if not r.uuid:
-                r.uuid = str(r.uuid)  # Use existing UUID or generate new one
-        return {'record_id': r.id, 'status': r.status, 'uuid': r.uuid, 'correlation_id': correlation_id}
+        status = 'sent'
+        sms_sent_counter.inc()
+    elif status_code == 400 or attempts >= MAX_ATTEMPTS:
+        status = 'failed'
+        record_dead_letter('sms', row.id, status_code, attempts, row.correlation_id or correlation_id)
+        sms_failed_counter.inc()
+        logging.getLogger('app').error(f"Failed SMS delivery: record={record_id}, status={status_code}, reason={status_msg}")
     else:
-        with db.session.begin():
-            r = db.session.execute(
-                select(SMSMessage).where(SMSMessage.id == record_id).with_for_update()
-            ).scalar_one()
-            r.status = 'failed'
-            sms_failed_counter.inc()
-        logging.getLogger('app').error(f"Failed SMS delivery: to={row.to}, status={status_code}")
-        return {'record_id': r.id, 'status': r.status, 'uuid': r.uuid, 'correlation_id': correlation_id}
+        status = 'retry'
+        schedule_retry(add_to_queue_task, rerun, {}, attempts, classify_error(status_code), queue=queue,
+                       min_delay=_circuit_wait())
+        logging.getLogger('app').warning(f"SMS delivery failed: record={record_id}, status={status_code}, retrying")
+    get_status_writer().record(SMSMessage, row.id, status, attempts=attempts)
+    return {'record_id': row.id, 'status': status, 'uuid': row.uuid, 'correlation_id': correlation_id}
 
 @shared_task(bind=True, name='sms.process_health_check', autorety_for=(Exception,), retry_backoff=True, retry_backoff_max=60, retry_jitter=True, max_retries=1)
 def process_health_check_task(self):
@@ -141,7 +130,7 @@ def process_health_check_task(self):
     
     # Simple connectivity check - just verify configuration exists
     if current_app.config.get('OTP_FLAG', True):
-        if current_app.config.get('OTP_SERVER') and current_app.config.get('OTP_USERNAME'):
+        if current_app.config.get('SMS_GATEWAYS') or (current_app.config.get('OTP_SERVER') and current_app.config.get('OTP_USERNAME')):
             logging.getLogger('app').info("SMS service health check: configuration OK")
             return {"status": "healthy", "configured": True}
         else:
@@ -1,99 +1,309 @@
 from celery import shared_task
 from flask import current_app
+import time
 import uuid
-from app.extensions import db, sms_sent_counter, sms_failed_counter
+from datetime import datetime, timezone
+from app.extensions import db, sms_sent_counter, sms_failed_counter, sms_expired_counter
 from app.utils.sms_service import send_sms
-from sqlalchemy import select
+from app.utils.sms_util import send_bulk_sms_util
+from app.utils.sms_gateway_pool import get_gateway_pool
+from app.tasks.queues import priority_from_queue, queue_for
+from app.tasks.drainer import defer
+from app.utils.rate_governor import channel_governor, governor_max_wait
+from app.utils.status_writer import get_status_writer
+from app.tasks.retry_scheduler import classify_error, schedule_at, schedule_retry
+from app.utils.dead_letters import dead_letter_entry, record_dead_letter, record_dead_letters
+from app.utils.message_ttl import is_expired
+from app.tasks.job_counters import add_job_counts, job_counts
+from sqlalchemy import select, update
 
+# Attempts (including the first) before a message is marked 'failed'
+MAX_ATTEMPTS = 5
 
-@shared_task(bind=True, name='sms.send_and_record', autoretry_for=(Exception,), retry_backoff=True, retry_backoff_max=60, retry_jitter=True, max_retries=5)
-def send_and_record(self, record_id, correlation_id=None):
-    from app.models.sms_message import SMSMessage  # lazy import
+# Batch outcomes where no gateway was called (breaker open, or every account out of
+# rate budget): members are deferred without spending an attempt
+_NOT_SENT = ('circuit_open', 'no_gateway_available')
 
-    # Short transaction: lock row and increment attempts to avoid lost updates
-    with db.session.begin():
-        row = db.session.execute(
-            select(SMSMessage).where(SMSMessage.id == record_id).with_for_update()
-        ).scalar_one_or_none()
-        if not row:
-            return {'error': 'record_not_found', 'record_id': record_id}
-        attempt = self.request.retries + 1
-        row.attempts = attempt
 
-    # Input validation outside the locked transaction (keeps lock short)
+def _circuit_wait():
+    """
+    Seconds until some gateway account's breaker allows trial requests again (0 while any
+    member is closed, or breakers are disabled).
+    """
+    return get_gateway_pool().retry_after()
+
+
+def _invalid_reason(to, message, phone_pattern=r"^\+?\d{6,16}$"):
+    """
+    Why a decrypted SMS can never be sent (None when it is valid).
+    """
     import re
-    phone_pattern = re.compile(r"^\d{6,16}$")
-    if not phone_pattern.match(str(row.to)):
-        # persist invalid state and retry (if desired) - here we raise to trigger retry/backoff
-        raise ValueError("Invalid phone number")
-    if not isinstance(row.message, str) or not (1 <= len(row.message) <= 500):
-        raise ValueError("Invalid message length")
+    if not re.match(phone_pattern, str(to)):
+        return "Invalid phone number"
+    if not isinstance(message, str) or not (1 <= len(message) <= 500):
+        return "Invalid message length"
     forbidden = ["<script", "SELECT ", "INSERT ", "DELETE ", "UPDATE ", "DROP "]
-    if any(f in row.message.upper() for f in forbidden):
-        raise ValueError("Forbidden content in SMS message")
+    if any(f in message.upper() for f in forbidden):
+        return "Forbidden content in SMS message"
+    return None
+
+
+def _fail_record(record_id, attempt, correlation_id, status_code=None, exc=None):
+    """
+    Finalise an SMSMessage row as 'failed' and dead-letter it.
+    """
+    from app.models.sms_message import SMSMessage  # lazy import
+    get_status_writer().record(SMSMessage, record_id, 'failed', attempts=attempt)
+    record_dead_letter('sms', record_id, status_code, attempt, correlation_id, exc=exc)
+
+
+@shared_task(bind=True, name='sms.send_and_record')
+def send_and_record(self, record_id, correlation_id=None, attempt=None, permitted=False):
+    """
+    Send one SMSMessage row and record the outcome.
 
-    # Audit logging
-    current_app.logger.info(f"Audit: Sending SMS to {row.to}")
+    Rows that can never be sent (undecryptable, failing validation) are failed to
+    the dead-letter store at once, like a gateway 400 on the batch path. Any other
+    exception is retried through the retry scheduler until MAX_ATTEMPTS.
+    """
+    from app.models.sms_message import SMSMessage  # lazy import
+
+    # Retries come back as new tasks from the retry scheduler, carrying their attempt number
+    attempt = attempt or 1
+    queue = (self.request.delivery_info or {}).get('routing_key')
+    try:
+        return _send_and_record(record_id, correlation_id, attempt, permitted, queue)
+    except Exception as exc:
+        db.session.rollback()
+        current_app.logger.error(f"SMS send error: record={record_id}, attempt={attempt}, error={exc}")
+        if attempt >= MAX_ATTEMPTS:
+            _fail_record(record_id, attempt, correlation_id, exc=exc)
+            sms_failed_counter.inc()
+            return {'record_id': record_id, 'status': 'failed', 'attempts': attempt, 'correlation_id': correlation_id}
+        get_status_writer().record(SMSMessage, record_id, 'retry', attempts=attempt)
+        delay = schedule_retry(send_and_record, [record_id, correlation_id], {'attempt': attempt + 1}, attempt,
+                               classify_error(exc=exc), queue=queue)
+        return {'record_id': record_id, 'status': 'retry', 'attempts': attempt, 'retry_in': round(delay, 1), 'correlation_id': correlation_id}
+
+
+def _send_and_record(record_id, correlation_id, attempt, permitted, queue):
+    from app.models.sms_message import SMSMessage  # lazy import
+
+    row = db.session.get(SMSMessage, record_id)
+    if not row:
+        return {'error': 'record_not_found', 'record_id': record_id}
+    if row.status in ('sent', 'failed', 'expired'):
+        # Already finalised by an earlier delivery (outbox re-publish, reconciler re-enqueue)
+        return {'record_id': row.id, 'status': row.status, 'uuid': row.uuid, 'correlation_id': correlation_id}
+    if is_expired(row.expires_at):
+        # Too late to be useful: drop it before deferring, decrypting or touching the gateway
+        get_status_writer().record(SMSMessage, record_id, 'expired')
+        sms_expired_counter.inc()
+        return {'record_id': record_id, 'status': 'expired', 'correlation_id': correlation_id}
+
+    # Gateway circuit open: defer without occupying the worker or spending an attempt
+    wait = _circuit_wait()
+    if wait > 0:
+        # Same lane it was delivered on
+        schedule_at(send_and_record, [record_id, correlation_id], {'attempt': attempt}, wait, queue)
+        get_status_writer().touch(SMSMessage, record_id)
+        return {'record_id': record_id, 'status': 'deferred', 'reason': 'circuit_open', 'correlation_id': correlation_id}
+
+    # Cluster-wide SMS rate: park the send for the drainer instead of holding the worker
+    if not permitted and not channel_governor('sms').acquire(max_wait=governor_max_wait()):
+        priority = priority_from_queue(queue, 'transactional')
+        outcome = defer(send_and_record, 'sms', priority, [record_id, correlation_id], {'attempt': attempt},
+                        queue=queue)
+        get_status_writer().touch(SMSMessage, record_id)
+        return {'record_id': record_id, 'status': outcome, 'reason': 'rate_limited', 'correlation_id': correlation_id}
+
+    if not row.uuid:
+        row.uuid = str(uuid.uuid4())
+        db.session.commit()
+
+    try:
+        to, message = row.decrypt_fields()
+    except Exception as exc:
+        current_app.logger.error(f"Failed to decrypt SMS record {record_id}")
+        _fail_record(record_id, attempt, row.correlation_id or correlation_id, exc=exc)
+        sms_failed_counter.inc()
+        return {'record_id': record_id, 'status': 'failed', 'error': 'decryption_error', 'correlation_id': correlation_id}
+
+    # Input validation outside the locked transaction (keeps lock short)
+    reason = _invalid_reason(to, message)
+    if reason:
+        # Retrying cannot fix the content: fail it like a gateway 400
+        current_app.logger.error(f"Invalid SMS record {record_id}: {reason}")
+        _fail_record(record_id, attempt, row.correlation_id or correlation_id, 400)
+        sms_failed_counter.inc()
+        return {'record_id': record_id, 'status': 'failed', 'error': reason, 'correlation_id': correlation_id}
 
-    status_code = send_sms(row.to, row.message)
+    # Audit logging (record id only: no plaintext number in logs)
+    current_app.logger.info(f"Audit: Sending SMS record {record_id}")
 
-    # Persist status with a short transaction and row-level lock to avoid races
+    status_code = send_sms(to, message)
+
+    # Status goes through the write-behind writer: no row lock or transaction per send
+    writer = get_status_writer()
     if status_code == 200:
-        with db.session.begin():
-            r = db.session.execute(
-                select(SMSMessage).where(SMSMessage.id == record_id).with_for_update()
-            ).scalar_one()
-            r.status = 'sent'
-            sms_sent_counter.inc()
-            if not r.uuid:
-                r.uuid = str(uuid.uuid4())
-        return {'record_id': r.id, 'status': r.status, 'attempts': r.attempts, 'uuid': r.uuid, 'correlation_id': correlation_id}
+        writer.record(SMSMessage, record_id, 'sent', attempts=attempt)
+        sms_sent_counter.inc()
+        return {'record_id': record_id, 'status': 'sent', 'attempts': attempt, 'uuid': row.uuid, 'correlation_id': correlation_id}
     else:
-        # If we're going to retry, persist the 'retry' state before raising to ensure visibility
-        attempt = self.request.retries + 1
-        if attempt >= 5:
-            with db.session.begin():
-                r = db.session.execute(
-                    select(SMSMessage).where(SMSMessage.id == record_id).with_for_update()
-                ).scalar_one()
-                r.status = 'failed'
-                sms_failed_counter.inc()
-            current_app.logger.error(f"Failed SMS delivery: to={row.to}, status={status_code}")
-            return {'record_id': r.id, 'status': r.status, 'attempts': r.attempts, 'uuid': r.uuid, 'correlation_id': correlation_id}
+        current_app.logger.error(f"Failed SMS delivery: record={record_id}, status={status_code}")
+        if attempt >= MAX_ATTEMPTS:
+            writer.record(SMSMessage, record_id, 'failed', attempts=attempt)
+            record_dead_letter('sms', record_id, status_code, attempt, row.correlation_id or correlation_id)
+            sms_failed_counter.inc()
+            return {'record_id': record_id, 'status': 'failed', 'attempts': attempt, 'uuid': row.uuid, 'correlation_id': correlation_id}
+        writer.record(SMSMessage, record_id, 'retry', attempts=attempt)
+        delay = schedule_retry(send_and_record, [record_id, correlation_id], {'attempt': attempt + 1}, attempt,
+                               classify_error(status_code), queue=queue, min_delay=_circuit_wait())
+        return {'record_id': record_id, 'status': 'retry', 'attempts': attempt, 'retry_in': round(delay, 1), 'correlation_id': correlation_id}
+
+
+@shared_task(bind=True, name='sms.send_batch_and_record')
+def send_batch_and_record(self, record_ids, correlation_id=None, priority='bulk', permitted=False):
+    """
+    Send a batch of SMSMessage rows, packing recipients that share a message into
+    multi-recipient gateway envelopes (see send_bulk_sms_util).
+
+    Rows are loaded with one query, envelopes are sent concurrently and outcomes
+    are persisted with one set-based UPDATE. Members the SMS rate governor has no
+    permit for are parked as a smaller batch; retryable failures are re-published
+    as a smaller batch holding only those rows, so one failing recipient never
+    re-sends the whole batch.
+    """
+    from app.models.sms_message import SMSMessage  # lazy import
+
+    # Re-publish on the (shard) queue this batch came from
+    queue = (self.request.delivery_info or {}).get('routing_key') or queue_for('sms', priority)
+    rows = db.session.execute(
+        select(SMSMessage).where(SMSMessage.id.in_(record_ids))
+    ).scalars().all()
+    job_of = {row.id: row.job_id for row in rows}
+
+    outcomes = {}
+    now = datetime.now(timezone.utc)
+    sendable = []
+    parked = []
+    for row in rows:
+        if row.status in ('sent', 'failed', 'expired'):
+            continue  # already finalised by an earlier delivery of this batch
+        if is_expired(row.expires_at, now):
+            # Finalised without a rate permit or a decrypt
+            outcomes[row.id] = 'expired'
+            continue
+        sendable.append(row)
+
+    if not permitted:
+        governor = channel_governor('sms')
+        deadline = time.monotonic() + governor_max_wait()
+        granted = 0
+        while granted < len(sendable) and governor.acquire(max_wait=max(0.0, deadline - time.monotonic())):
+            granted += 1
+        if granted < len(sendable):
+            parked = [row.id for row in sendable[granted:]]
+            defer(send_batch_and_record, 'sms', priority, [parked, correlation_id],
+                  {'priority': priority}, cost=len(parked), queue=queue)
+            sendable = sendable[:granted]
+
+    # Group by plaintext message so identical texts share envelopes
+    groups = {}
+    for row in sendable:
+        try:
+            to, message = row.decrypt_fields()
+        except Exception:
+            current_app.logger.error(f"Failed to decrypt SMS record {row.id}")
+            outcomes[row.id] = 400
+            continue
+        groups.setdefault(message, []).append((row.id, to))
+
+    for message, members in groups.items():
+        results = send_bulk_sms_util([to for _, to in members], message)
+        for (record_id, _), (_, status_code, msg) in zip(members, results):
+            outcomes[record_id] = 'deferred' if msg in _NOT_SENT else status_code
+
+    retry_ids = []
+    retry_attempt, retry_code = 1, None
+    deferred_ids = []
+    dead = []
+    summary = {'sent': 0, 'failed': 0, 'retry': 0, 'expired': 0}
+    # Parked, deferred and retried rows get a fresh updated_at so the reconciler leaves them alone
+    updates = [{'id': record_id, 'updated_at': now} for record_id in parked]
+    for row in rows:
+        if row.id not in outcomes:
+            continue
+        status_code = outcomes[row.id]
+        if status_code == 'expired':
+            updates.append({'id': row.id, 'status': 'expired'})
+            summary['expired'] += 1
+            continue
+        if status_code == 'deferred':
+            # Never reached the gateway: keep the attempt budget
+            updates.append({'id': row.id, 'status': 'retry', 'updated_at': now})
+            deferred_ids.append(row.id)
+            summary['retry'] += 1
+            continue
+        attempts = (row.attempts or 0) + 1
+        if status_code == 200:
+            status = 'sent'
+        elif status_code == 400 or attempts >= MAX_ATTEMPTS:
+            status = 'failed'
+            dead.append(dead_letter_entry('sms', row.id, status_code, attempts, row.correlation_id or correlation_id))
         else:
-            with db.session.begin():
-                r = db.session.execute(
-                    select(SMSMessage).where(SMSMessage.id == record_id).with_for_update()
-                ).scalar_one()
-                r.status = 'retry'
-            current_app.logger.error(f"Failed SMS delivery: to={row.to}, status={status_code}")
-            # Ask Celery to retry using its machinery
-            self.retry(exc=Exception("Failed SMS delivery"), countdown=10, max_retries=5)
-
-@shared_task(bind=True, name='sms.send_sms', autoretry_for=(Exception,), retry_backoff=True, retry_backoff_max=60, retry_jitter=True, max_retries=5)
-def send_sms_task(self, to, message, correlation_id=None, record_id=None):
+            status = 'retry'
+            retry_ids.append(row.id)
+            retry_attempt, retry_code = max(retry_attempt, attempts), status_code
+        updates.append({'id': row.id, 'status': status, 'attempts': attempts, 'updated_at': now})
+        summary[status] += 1
+
+    # One executemany UPDATE for the whole batch instead of a flush per row
+    try:
+        if updates:
+            db.session.execute(update(SMSMessage), updates)
+        record_dead_letters(dead, commit=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    sms_sent_counter.inc(summary['sent'])
+    sms_failed_counter.inc(summary['failed'])
+    sms_expired_counter.inc(summary['expired'])
+    add_job_counts(job_counts((job_of[u['id']], u.get('status')) for u in updates))
+
+    if retry_ids:
+        current_app.logger.error(f"Failed SMS delivery for {len(retry_ids)} batch members, re-queuing them")
+        schedule_retry(send_batch_and_record, [retry_ids, correlation_id], {'priority': priority}, retry_attempt,
+                       classify_error(retry_code), queue=queue, min_delay=_circuit_wait())
+    if deferred_ids:
+        current_app.logger.warning(f"SMS gateway unavailable or out of rate budget, deferring {len(deferred_ids)} batch members")
+        schedule_at(send_batch_and_record, [deferred_ids, correlation_id], {'priority': priority},
+                    max(1, _circuit_wait()), queue)
+    return {**summary, 'record_ids': record_ids, 'correlation_id': correlation_id}
+
+@shared_task(bind=True, name='sms.send_sms')
+def send_sms_task(self, to, message, correlation_id=None, record_id=None, attempt=None):
     """Send SMS with proper error handling and retry logic.
 
     correlation_id: propagated from incoming request for traceability.
     """
-    import re
     from app.utils.sms_service import send_sms
-    from app.extensions import db, sms_sent_counter, sms_failed_counter
+    from app.extensions import sms_sent_counter, sms_failed_counter
     from app.models.sms_message import SMSMessage
-    from sqlalchemy import select
     
-    attempt = self.request.retries + 1
+    attempt = attempt or 1
+    queue = (self.request.delivery_info or {}).get('routing_key')
     current_app.logger.info(f'sms_task_start: task_id={self.request.id}, attempt={attempt}, to={to}, correlation_id={correlation_id}')
     
-    # Validation
-    phone_pattern = re.compile(r"^\d{6,16}$")
-    if not phone_pattern.match(str(to)):
-        raise ValueError("Invalid phone number")
-    if not isinstance(message, str) or not (1 <= len(message) <= 500):
-        raise ValueError("Invalid message length")
-    forbidden = ["<script", "SELECT ", "INSERT ", "DELETE ", "UPDATE ", "DROP "]
-    if any(f in message.upper() for f in forbidden):
-        raise ValueError("Forbidden content in SMS message")
+    # Validation: invalid input is never retried
+    reason = _invalid_reason(to, message, phone_pattern=r"^\d{6,16}$")
+    if reason:
+        current_app.logger.error(f'sms_task_invalid: task_id={self.request.id}, error={reason}, correlation_id={correlation_id}')
+        if record_id:
+            _fail_record(record_id, attempt, correlation_id, 400)
+        sms_failed_counter.inc()
+        return {"status": "failed", "to": to, "attempt": attempt, "error": reason, "correlation_id": correlation_id}
     
     try:
         # Try to send the SMS
@@ -103,13 +313,7 @@ def send_sms_task(self, to, message, correlation_id=None, record_id=None):
         if status_code == 200:
             # Persist success
             if record_id:
-                with db.session.begin():
-                    msg = db.session.execute(
-                        select(SMSMessage).where(SMSMessage.id == record_id).with_for_update()
-                    ).scalar_one_or_none()
-                    if msg:
-                        msg.status = 'sent'
-                        msg.attempts = attempt
+                get_status_writer().record(SMSMessage, record_id, 'sent', attempts=attempt)
             sms_sent_counter.inc()
             result = {"status": "success", "to": to, "message": message, "attempt": attempt, "correlation_id": correlation_id}
             current_app.logger.info(f'sms_task_success: task_id={self.request.id}, result={result}, correlation_id={correlation_id}')
@@ -117,45 +321,34 @@ def send_sms_task(self, to, message, correlation_id=None, record_id=None):
         else:
             # Log failure
             current_app.logger.error(f"Failed SMS delivery: to={to}, status={status_code}")
-            # Update message status for tracking
-            if record_id:
-                with db.session.begin():
-                    msg = db.session.execute(
-                        select(SMSMessage).where(SMSMessage.id == record_id).with_for_update()
-                    ).scalar_one_or_none()
-                    if msg:
-                        msg.status = 'retry' if attempt < 5 else 'failed'
-                        msg.attempts = attempt
-            if attempt >= 5:
-                sms_failed_counter.inc()
             # Retry if not at max attempts
-            if attempt < 5:
-                self.retry(exc=Exception("Failed SMS delivery"), countdown=10)
-            else:
-                # Final failure
-                return {"status": "failed", "to": to, "attempt": attempt, "correlation_id": correlation_id}
+            if attempt < MAX_ATTEMPTS:
+                if record_id:
+                    get_status_writer().record(SMSMessage, record_id, 'retry', attempts=attempt)
+                delay = schedule_retry(send_sms_task, [to, message, correlation_id, record_id], {'attempt': attempt + 1},
+                                       attempt, classify_error(status_code), queue=queue)
+                return {"status": "retry", "to": to, "attempt": attempt, "retry_in": round(delay, 1), "correlation_id": correlation_id}
+            # Final failure
+            if record_id:
+                _fail_record(record_id, attempt, correlation_id, status_code)
+            sms_failed_counter.inc()
+            return {"status": "failed", "to": to, "attempt": attempt, "correlation_id": correlation_id}
                 
     except Exception as exc:
         # Log the exception
         current_app.logger.error(f'sms_task_error: task_id={self.request.id}, attempt={attempt}, error={str(exc)}, correlation_id={correlation_id}')
-        # Update message status for tracking
-        if record_id:
-            with db.session.begin():
-                msg = db.session.execute(
-                    select(SMSMessage).where(SMSMessage.id == record_id).with_for_update()
-                ).scalar_one_or_none()
-                if msg:
-                    msg.status = 'retry' if attempt < 5 else 'failed'
-                    msg.attempts = attempt
-        if attempt >= 5:
-            from app.extensions import sms_failed_counter
-            sms_failed_counter.inc()
         # Retry if not at max attempts
-        if attempt < 5:
-            self.retry(exc=exc, countdown=10)
-        else:
-            # Final failure
-            raise exc
+        if attempt < MAX_ATTEMPTS:
+            if record_id:
+                get_status_writer().record(SMSMessage, record_id, 'retry', attempts=attempt)
+            delay = schedule_retry(send_sms_task, [to, message, correlation_id, record_id], {'attempt': attempt + 1},
+                                   attempt, classify_error(exc=exc), queue=queue)
+            return {"status": "retry", "to": to, "attempt": attempt, "retry_in": round(delay, 1), "correlation_id": correlation_id}
+        # Final failure
+        if record_id:
+            _fail_record(record_id, attempt, correlation_id, exc=exc)
+        sms_failed_counter.inc()
+        return {"status": "failed", "to": to, "attempt": attempt, "error": str(exc), "correlation_id": correlation_id}
 
 @shared_task(bind=True, name='sms.cancel_sms')
 def cancel_sms_task(self, task_id, correlation_id=None):
@@ -0,0 +1,139 @@
+"""
+AIMD concurrency limiter and latency-derived timeouts for the SMS gateway.
+
+Instead of a fixed number of in-flight gateway requests and a constant 30s
+timeout, the limiter watches the latency and 5xx/timeout rate of completed
+requests. Every `window` completions it either grows the limit by one (healthy
+and the limit was actually reached) or multiplies it by `backoff` (p95 over
+target or too many errors), so throughput follows what the gateway can absorb.
+Request timeouts are a multiple of the observed p99, clamped to a range.
+"""
+import math
+import threading
+from collections import deque
+
+
+def percentile(samples, pct: float) -> float:
+    """
+    Nearest-rank percentile of an unsorted sequence (0.0 when empty).
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class AdaptiveLimiter:
+    """
+    Thread-safe AIMD limiter.
+
+    Args:
+        initial: Starting in-flight limit
+        min_limit / max_limit: Bounds for the limit (equal bounds = fixed limit)
+        target_p95: p95 latency (seconds) above which the limit is cut
+        max_error_rate: Failure share above which the limit is cut
+        backoff: Multiplicative decrease factor
+        window: Completions per adjustment
+        min_timeout / max_timeout: Bounds for the derived request timeout
+        timeout_multiplier: Timeout = p99 latency x multiplier
+        history: Latency samples kept for percentiles
+    """
+
+    def __init__(self, initial: int = 8, min_limit: int = 1, max_limit: int = 64,
+                 target_p95: float = 2.0, max_error_rate: float = 0.05, backoff: float = 0.7,
+                 window: int = 20, min_timeout: float = 2.0, max_timeout: float = 30.0,
+                 timeout_multiplier: float = 3.0, history: int = 200):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self._limit = min(max(initial, self.min_limit), self.max_limit)
+        self.target_p95 = target_p95
+        self.max_error_rate = max_error_rate
+        self.backoff = backoff
+        self.window = window
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self._latencies = deque(maxlen=history)
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._peak = 0
+        self._count = 0
+        self._errors = 0
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def try_acquire(self) -> bool:
+        """
+        Take a slot if one is free under the current limit.
+        """
+        with self._cond:
+            if self._in_flight >= self._limit:
+                return False
+            self._in_flight += 1
+            self._peak = max(self._peak, self._in_flight)
+            return True
+
+    def acquire(self, timeout: float = None) -> bool:
+        """
+        Block until a slot is free (or `timeout` seconds pass). Returns False on timeout.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._in_flight < self._limit, timeout=timeout):
+                return False
+            self._in_flight += 1
+            self._peak = max(self._peak, self._in_flight)
+            return True
+
+    def release(self, latency: float = None, failed: bool = False):
+        """
+        Free a slot. Pass the request latency (and whether it failed) to feed the controller;
+        without a latency the slot is freed without recording a sample.
+        """
+        with self._cond:
+            self._in_flight = max(0, self._in_flight - 1)
+            if latency is not None:
+                self._latencies.append(latency)
+                self._count += 1
+                self._errors += int(failed)
+                if self._count >= self.window:
+                    self._adjust()
+            self._cond.notify_all()
+
+    def _adjust(self):
+        p95 = percentile(list(self._latencies)[-self._count:], 95)
+        error_rate = self._errors / self._count
+        if error_rate > self.max_error_rate or p95 > self.target_p95:
+            self._limit = max(self.min_limit, int(self._limit * self.backoff))
+        elif self._peak >= self._limit:
+            # Only probe upwards when the current limit was actually the bottleneck
+            self._limit = min(self.max_limit, self._limit + 1)
+        self._count = 0
+        self._errors = 0
+        self._peak = self._in_flight
+
+    def timeout(self) -> float:
+        """
+        Read timeout derived from observed latency; max_timeout until enough samples exist.
+        """
+        samples = list(self._latencies)
+        if len(samples) < self.window:
+            return self.max_timeout
+        derived = percentile(samples, 99) * self.timeout_multiplier
+        return min(self.max_timeout, max(self.min_timeout, derived))
+
+    def stats(self) -> dict:
+        samples = list(self._latencies)
+        return {
+            'limit': self._limit,
+            'in_flight': self._in_flight,
+            'latency_p50': percentile(samples, 50),
+            'latency_p95': percentile(samples, 95),
+            'timeout': self.timeout(),
+        }
@@ -0,0 +1,179 @@
+"""
+Heterogeneous batch sends: different content per recipient in one request.
+
+/bulk sends one message to many recipients; personalised traffic (one
+reminder text per patient) used to fall back to one /single call per
+message, each paying auth, rate limiting, sanitization and its own
+transactions. POST /sms/batch and /mail/batch take a list of
+{recipient, content, idempotency_key} items and run them through the same
+set-based pipeline as /bulk:
+
+1. Idempotency keys are looked up with one query; an item whose key already
+   exists returns the existing record instead of sending again
+2. Every item is validated and encrypted up front (each distinct content once);
+   invalid items get a per-item error instead of failing the request
+3. One INSERT ... RETURNING for the valid items, their outbox batches and the
+   request's bulk job, in one transaction
+4. A synchronous batched send when neither Celery nor the dispatcher is configured
+
+The batch tasks already group rows by content (SMS envelopes share a text,
+email batches send per row), so mixed content costs nothing extra downstream.
+"""
+import logging
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.extensions import (db, email_failed_counter, email_queued_counter, email_sent_counter,
+                            messages_enqueued_counter, sms_failed_counter, sms_queued_counter, sms_sent_counter)
+from app.utils.bulk_jobs import BulkJobError, _channel_tasks, new_job
+
+logger = logging.getLogger('app')
+
+RECIPIENT_KEYS = {'sms': 'mobile', 'email': 'email'}
+
+
+def _send_direct(channel, staged):
+    """
+    Send (index, recipient, content, record_id) items now; returns {record_id: status code}.
+    """
+    if channel == 'sms':
+        from app.utils.sms_util import send_bulk_sms_util
+        by_message = {}
+        for _, to, (message,), record_id in staged:
+            by_message.setdefault(message, []).append((to, record_id))
+        codes = {}
+        for message, members in by_message.items():
+            results = send_bulk_sms_util([to for to, _ in members], message)
+            codes.update((record_id, status_code) for (_, record_id), (_, status_code, _) in zip(members, results))
+        return codes
+    from app.utils.email_util import send_email_batch_util
+    results = send_email_batch_util([(to, *content) for _, to, content, _ in staged],
+                                    concurrency=int(current_app.config.get('EMAIL_BATCH_CONCURRENCY', 4)))
+    return {record_id: code for (*_, record_id), (code, _) in zip(staged, results)}
+
+
+def process_batch(channel: str, items: list, priority: str = 'transactional', expires_at=None,
+                  client_id: str = 'default', correlation_id: str = None):
+    """
+    Queue (or, without Celery, send) one message per item.
+
+    Args:
+        channel: 'sms' or 'email'
+        items: (index, recipient, content, idempotency_key) tuples, content being
+            (message,) for SMS or (subject, body) for email, already sanitized
+
+    Returns:
+        (results, job): one result dict per item in input order, and the request's
+        BulkJob (None if no item was accepted).
+
+    Raises:
+        BulkJobError: On a database failure or an idempotency key race (409).
+    """
+    from app.tasks.job_counters import settle_jobs
+    from app.utils.sms_routing import get_routing_table
+    from app.utils.staging import insert_and_stage
+
+    model, task, batch_size = _channel_tasks(channel)
+    key = RECIPIENT_KEYS[channel]
+    dispatcher = channel == 'sms' and current_app.config.get('SMS_DISPATCH_BACKEND') == 'asyncio'
+    celery = getattr(current_app, 'celery', None)
+    results = {}
+
+    # 1. Idempotency: one lookup for every key in the request
+    keys = [k for *_, k in items if k]
+    existing = {}
+    if keys:
+        existing = {row.idempotency_key: row for row in db.session.execute(
+            select(model.id, model.idempotency_key, model.status).where(model.idempotency_key.in_(keys))
+        )}
+    seen = set()
+    fresh = []
+    for index, recipient, content, idempotency_key in items:
+        if idempotency_key in existing:
+            row = existing[idempotency_key]
+            results[index] = {'index': index, key: recipient, 'record_id': row.id, 'status': row.status,
+                              'duplicate': True}
+        elif idempotency_key and idempotency_key in seen:
+            results[index] = {'index': index, key: recipient, 'status': 'rejected',
+                              'error': 'Duplicate idempotency_key in request'}
+        else:
+            seen.add(idempotency_key)
+            fresh.append((index, recipient, content, idempotency_key))
+
+    # 2. Validate and encrypt up front
+    routing = get_routing_table() if channel == 'sms' else None
+    job = new_job(channel, 'json', priority, client_id, correlation_id)
+    fields = dict(status='queued', correlation_id=correlation_id, priority=priority, expires_at=expires_at,
+                  client_id=client_id)
+    rows, accepted = [], []
+    for (index, recipient, content, idempotency_key), (to, values, reason) in zip(
+            fresh, model.batch_values([(recipient, *content) for _, recipient, content, _ in fresh], **fields)):
+        if reason:
+            results[index] = {'index': index, key: recipient, 'status': 'rejected', 'error': reason}
+            continue
+        values['idempotency_key'] = idempotency_key
+        if routing is not None:
+            values['route'] = routing.route_name(to)
+        rows.append((to, values))
+        accepted.append((index, to, content))
+    if not rows:
+        return [results[index] for index, *_ in items], None
+
+    # 3. One INSERT ... RETURNING, plus the outbox batches and the job, in one transaction
+    try:
+        db.session.add(job)
+        db.session.flush()  # id for the rows
+        job.total, job.accepted, job.rejected = len(items), len(rows), len(fresh) - len(rows)
+        job.status, job.finished_at = 'queued', datetime.now(timezone.utc)
+        for _, values in rows:
+            values['job_id'] = job.id
+        staged, _ = insert_and_stage(model, channel, task, rows, priority, correlation_id,
+                                     max(batch_size, 1), publish=bool(celery and not dispatcher))
+        db.session.commit()
+    except IntegrityError as e:
+        # A concurrent request took one of the idempotency keys between the lookup and the insert
+        db.session.rollback()
+        logging.getLogger('error').error(f"Idempotency conflict in {channel} batch: {e}")
+        raise BulkJobError("Conflicting idempotency keys, retry the request", "IDEMPOTENCY_CONFLICT", 409)
+    except Exception as e:
+        db.session.rollback()
+        logging.getLogger('error').error(f"Database error when creating {channel} batch records: {e}")
+        raise BulkJobError("Internal server error", "SERVICE_ERROR", 500)
+    # staged follows rows, which follow accepted
+    staged = [(index, to, content, record_id) for (index, to, content), (_, record_id) in zip(accepted, staged)]
+
+    if dispatcher or celery:
+        (sms_queued_counter if channel == 'sms' else email_queued_counter).inc(len(staged))
+        if not dispatcher:
+            messages_enqueued_counter.labels(channel=channel, priority=priority).inc(len(staged))
+        for index, to, _, record_id in staged:
+            results[index] = {'index': index, key: to, 'record_id': record_id, 'status': 'queued'}
+        logger.info(f"Batch {channel} queued for {len(staged)} recipients")
+        return [results[index] for index, *_ in items], job
+
+    # 4. No Celery: direct, batched send
+    codes = _send_direct(channel, staged)
+    sent_counter, failed_counter = ((sms_sent_counter, sms_failed_counter) if channel == 'sms'
+                                    else (email_sent_counter, email_failed_counter))
+    updates = []
+    for index, to, _, record_id in staged:
+        status = 'sent' if codes.get(record_id) == 200 else 'failed'
+        updates.append({'id': record_id, 'status': status, 'attempts': 1})
+        (sent_counter if status == 'sent' else failed_counter).inc()
+        results[index] = {'index': index, key: to, 'record_id': record_id, 'status': status}
+        if status == 'failed':
+            results[index]['error'] = f"Failed to send {'SMS' if channel == 'sms' else 'email'}"
+    try:
+        db.session.execute(update(model), updates)
+        job.sent = sum(1 for u in updates if u['status'] == 'sent')
+        job.failed = len(updates) - job.sent
+        settle_jobs([job.id])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.getLogger('error').error(f"Database error when updating {channel} batch records: {e}")
+    logger.info(f"Batch {channel} sent directly: {job.sent} sent, {job.failed} failed")
+    return [results[index] for index, *_ in items], job
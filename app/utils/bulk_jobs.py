@@ -0,0 +1,396 @@
+"""
+Streamed bulk upload jobs.
+
+/bulk takes at most 200 recipients in one JSON body. A job takes a recipient
+list of any size as the raw request body (POST /sms/jobs, /mail/jobs). The
+request only copies the body to BULK_JOB_SPOOL_DIR and commits the job row
+with its ingest task staged in the outbox, then returns the job id (202,
+status 'receiving'). A worker (app/tasks/bulk_ingest.py) reads the spooled
+file one line at a time: every BULK_JOB_CHUNK_SIZE recipients are inserted
+with one INSERT ... RETURNING, with their batch tasks staged in the outbox, in
+one transaction, and then dropped. Memory stays flat however large the upload
+is; the BulkJob row keeps the counters and a sample of the rejected rows, and
+GET .../jobs/<id> shows the progress.
+
+Jobs need an asynchronous backend: there is no synchronous fallback for a
+100k-row upload. With only the asyncio SMS dispatcher there is no worker to
+ingest the spool, so the request ingests request.stream itself, bounded by
+BULK_JOB_INLINE_INGEST_SECONDS (rows read by then stay queued, the job fails).
+
+Formats:
+    CSV: one recipient per line, either a bare list or under a header naming
+    the recipient column (mobile/phone/to for SMS, email/to for email). Other
+    columns are ignored; quoted fields may not span lines.
+    NDJSON: one JSON string, or an object with one of those keys, per line.
+"""
+import csv
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+
+from flask import current_app
+
+from app.extensions import (db, bulk_job_rows_counter, email_queued_counter, messages_enqueued_counter,
+                            sms_queued_counter)
+from app.models.bulk_job import BulkJob
+
+logger = logging.getLogger('app')
+
+FORMATS = ('csv', 'ndjson')
+_CONTENT_TYPES = {
+    'text/csv': 'csv',
+    'application/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+RECIPIENT_COLUMNS = {'sms': ('mobile', 'phone', 'to'), 'email': ('email', 'to')}
+
+
+class BulkJobError(Exception):
+    def __init__(self, message, error_code, http_code=400):
+        super().__init__(message)
+        self.error_code = error_code
+        self.http_code = http_code
+
+
+def upload_format(content_type: str, requested: str = None) -> str:
+    """
+    'csv' or 'ndjson' from ?format= or the Content-Type; raises BulkJobError (415) otherwise.
+    """
+    fmt = (requested or '').strip().lower() or _CONTENT_TYPES.get((content_type or '').split(';')[0].strip().lower())
+    if fmt not in FORMATS:
+        raise BulkJobError("Upload must be CSV (text/csv) or NDJSON (application/x-ndjson)",
+                           "UNSUPPORTED_FORMAT", 415)
+    return fmt
+
+
+def new_job(channel: str, fmt: str, priority: str = 'bulk', client_id: str = 'default',
+            correlation_id: str = None) -> BulkJob:
+    """
+    An unsaved job for one bulk submission; the caller adds it in its own transaction.
+    """
+    return BulkJob(uuid=str(uuid.uuid4()), channel=channel, format=fmt, priority=priority, client_id=client_id,
+                   correlation_id=correlation_id, status='receiving', total=0, accepted=0, rejected=0,
+                   sent=0, failed=0, expired=0, errors=[])
+
+
+def _channel_tasks(channel):
+    # Lazy imports: the workflows import the task modules
+    if channel == 'sms':
+        from app.models.sms_message import SMSMessage
+        from app.tasks.sms_tasks import send_batch_and_record
+        return SMSMessage, send_batch_and_record, int(current_app.config.get('SMS_GATEWAY_BATCH_SIZE', 50))
+    from app.models.email_message import EmailMessage
+    from app.tasks.email_queue import send_batch_and_record
+    return EmailMessage, send_batch_and_record, int(current_app.config.get('EMAIL_BATCH_SIZE', 50))
+
+
+def _lines(stream, max_line: int):
+    """
+    (line number, text, problem) per line of a byte stream. Only one line is held in
+    memory; a line over max_line bytes is skipped to its end and reported.
+    """
+    number = 0
+    while True:
+        raw = stream.readline(max_line + 1)
+        if not raw:
+            return
+        number += 1
+        if len(raw) > max_line and not raw.endswith(b'\n'):
+            while raw and not raw.endswith(b'\n'):
+                raw = stream.readline(max_line + 1)
+            yield number, None, 'Line too long'
+            continue
+        try:
+            yield number, raw.decode('utf-8-sig' if number == 1 else 'utf-8').strip(), None
+        except UnicodeDecodeError:
+            yield number, None, 'Line is not valid UTF-8'
+
+
+def _records(lines, fmt: str, columns: tuple):
+    """
+    (line number, recipient, problem) per data row; blank lines and the CSV header are skipped.
+    """
+    column = None  # CSV recipient column, fixed by the first row
+    for number, text, problem in lines:
+        if problem:
+            yield number, None, problem
+            continue
+        if not text:
+            continue
+        if fmt == 'ndjson':
+            try:
+                item = json.loads(text)
+            except ValueError:
+                yield number, None, 'Invalid JSON'
+                continue
+            if isinstance(item, dict):
+                item = next((item[key] for key in columns if item.get(key)), None)
+            if isinstance(item, int) and not isinstance(item, bool):
+                item = str(item)
+            if not isinstance(item, str) or not item.strip():
+                yield number, None, 'No recipient'
+                continue
+            yield number, item, None
+            continue
+        try:
+            cells = next(csv.reader([text]))
+        except csv.Error:
+            yield number, None, 'Invalid CSV'
+            continue
+        if column is None:
+            header = [cell.strip().lower() for cell in cells]
+            column = next((header.index(key) for key in columns if key in header), None)
+            if column is not None:
+                continue
+            column = 0  # no header: a bare recipient list
+        if column >= len(cells) or not cells[column].strip():
+            yield number, None, 'No recipient'
+            continue
+        yield number, cells[column], None
+
+
+def _check_submission(channel: str, content: tuple):
+    """
+    (celery, dispatcher) for the channel; raises BulkJobError if nothing would send the
+    rows or the content is invalid (content errors fail the request, not every row).
+    """
+    model, _, _ = _channel_tasks(channel)
+    dispatcher = channel == 'sms' and current_app.config.get('SMS_DISPATCH_BACKEND') == 'asyncio'
+    celery = getattr(current_app, 'celery', None)
+    if celery is None and not dispatcher:
+        raise BulkJobError("Bulk jobs need Celery or the asyncio dispatcher", "JOBS_UNAVAILABLE", 503)
+    try:
+        model.bulk_values([], *content)
+    except ValueError as e:
+        raise BulkJobError(str(e), "INVALID_CONTENT", 400)
+    return celery, dispatcher
+
+
+def _spool_paths(job_uuid: str) -> tuple:
+    spool_dir = current_app.config.get('BULK_JOB_SPOOL_DIR') or tempfile.gettempdir()
+    base = os.path.join(spool_dir, f"bulk-job-{job_uuid}")
+    return f"{base}.upload", f"{base}.json"
+
+
+def _discard(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def submit_upload(channel: str, stream, fmt: str, content: tuple, priority: str = 'bulk', expires_at=None,
+                  client_id: str = 'default', correlation_id: str = None) -> BulkJob:
+    """
+    Accept an upload as a job.
+
+    With Celery the body is only copied to BULK_JOB_SPOOL_DIR; the job row and its
+    ingest task (staged in the outbox) commit together and the job comes back still
+    'receiving', so the request never waits on the inserts. A worker ingests the
+    spooled file (ingest_spooled). Without Celery (asyncio dispatcher only) there
+    is no worker to hand it to, so the upload is ingested in the request, for at
+    most BULK_JOB_INLINE_INGEST_SECONDS.
+
+    Raises:
+        BulkJobError: No asynchronous send backend, invalid content, the upload was
+            cut off or too large, or the job could not be created.
+    """
+    celery, _ = _check_submission(channel, content)
+    if celery is None:
+        return ingest_upload(channel, stream, fmt, content, priority, expires_at, client_id, correlation_id,
+                             time_limit=float(current_app.config.get('BULK_JOB_INLINE_INGEST_SECONDS', 30)))
+
+    from app.tasks.bulk_ingest import ingest_job
+    from app.tasks.outbox_relay import stage_task
+
+    job = new_job(channel, fmt, priority, client_id, correlation_id)
+    upload_path, meta_path = _spool_paths(job.uuid)
+    try:
+        with open(upload_path, 'wb') as spool:
+            shutil.copyfileobj(stream, spool, 64 * 1024)
+        with open(meta_path, 'w') as meta:
+            json.dump({'content': list(content), 'expires_at': expires_at.isoformat() if expires_at else None},
+                      meta)
+    except Exception as e:
+        # Cut off, or over BULK_JOB_MAX_UPLOAD_BYTES (413)
+        _discard(upload_path, meta_path)
+        logging.getLogger('error').error(f"Bulk {channel} upload aborted while spooling: {e}")
+        raise BulkJobError(f"Upload aborted: {getattr(e, 'description', None) or e}", "UPLOAD_ABORTED",
+                           getattr(e, 'code', None) or 400)
+
+    try:
+        db.session.add(job)
+        db.session.flush()  # id for the task
+        stage_task(ingest_job, [job.id])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        _discard(upload_path, meta_path)
+        logging.getLogger('error').error(f"Database error when creating bulk {channel} job: {e}")
+        raise BulkJobError("Internal server error", "SERVICE_ERROR", 500)
+    logger.info(f"Bulk {channel} job {job.uuid} spooled for ingest")
+    return job
+
+
+def ingest_spooled(job_id: int) -> BulkJob:
+    """
+    Worker side of submit_upload: ingest a job's spooled upload, then delete it.
+
+    A redelivered task resumes after the rows the job already counts (each chunk's
+    counts commit with its rows), so no recipient is queued twice. The spool must
+    be readable by the workers; if it isn't, the job fails.
+    """
+    job = db.session.get(BulkJob, job_id)
+    if job is None:
+        return None
+    upload_path, meta_path = _spool_paths(job.uuid)
+    if job.status != 'receiving':
+        _discard(upload_path, meta_path)
+        return job
+    try:
+        with open(meta_path) as meta:
+            spooled = json.load(meta)
+        expires_at = datetime.fromisoformat(spooled['expires_at']) if spooled['expires_at'] else None
+        with open(upload_path, 'rb') as stream:
+            _ingest(job, stream, tuple(spooled['content']), expires_at, skip=job.total)
+    except FileNotFoundError:
+        logging.getLogger('error').error(f"Bulk job {job.uuid}: spooled upload not found at {upload_path}")
+        job.status = 'failed'
+        job.error = 'Spooled upload not found (BULK_JOB_SPOOL_DIR must be shared with the workers)'
+        job.finished_at = datetime.now(timezone.utc)
+        db.session.commit()
+        return job
+    _discard(upload_path, meta_path)
+    return job
+
+
+def ingest_upload(channel: str, stream, fmt: str, content: tuple, priority: str = 'bulk', expires_at=None,
+                  client_id: str = 'default', correlation_id: str = None, time_limit: float = None) -> BulkJob:
+    """
+    Create a job and queue the recipients read from `stream`, chunk by chunk.
+
+    Args:
+        channel: 'sms' or 'email'
+        stream: Binary file-like object (request.stream)
+        fmt: 'csv' or 'ndjson'
+        content: (message,) for SMS, (subject, body) for email; already sanitized
+        time_limit: Seconds after which reading stops and the job fails
+
+    Returns:
+        The finished job: 'queued', or 'failed' with its error. Chunks committed
+        before a failure stay queued and are counted on the job.
+
+    Raises:
+        BulkJobError: No asynchronous send backend, or invalid content.
+    """
+    _check_submission(channel, content)
+    job = new_job(channel, fmt, priority, client_id, correlation_id)
+    db.session.add(job)
+    db.session.commit()
+    return _ingest(job, stream, content, expires_at, time_limit=time_limit)
+
+
+def _ingest(job: BulkJob, stream, content: tuple, expires_at=None, skip: int = 0,
+            time_limit: float = None) -> BulkJob:
+    """
+    Queue the recipients read from `stream` for a committed 'receiving' job, skipping
+    the first `skip` data rows (already counted on the job), and finish the job.
+    """
+    from app.tasks.job_counters import settle_jobs
+    from app.utils.sms_routing import get_routing_table
+    from app.utils.staging import insert_and_stage
+
+    channel, priority, client_id, correlation_id = job.channel, job.priority, job.client_id, job.correlation_id
+    model, task, batch_size = _channel_tasks(channel)
+    dispatcher = channel == 'sms' and current_app.config.get('SMS_DISPATCH_BACKEND') == 'asyncio'
+    celery = getattr(current_app, 'celery', None)
+    cfg = current_app.config
+    chunk_size = max(int(cfg.get('BULK_JOB_CHUNK_SIZE', 1000)), 1)
+    max_line = max(int(cfg.get('BULK_JOB_MAX_LINE_BYTES', 4096)), 64)
+    sample = max(int(cfg.get('BULK_JOB_ERROR_SAMPLE', 50)), 0)
+    routing = get_routing_table() if channel == 'sms' else None
+    queued_counter = sms_queued_counter if channel == 'sms' else email_queued_counter
+    deadline = time.monotonic() + time_limit if time_limit else None
+    job_id = job.id
+
+    errors = list(job.errors or [])
+    pending = {'read': 0, 'rejected': 0}  # parse counts not yet written to the job
+
+    def reject(number, reason):
+        pending['rejected'] += 1
+        if len(errors) < sample:
+            errors.append({'line': number, 'error': reason})
+
+    def flush(chunk):
+        rows = []
+        if chunk:
+            recipients = [recipient.strip().lower() if channel == 'email' else recipient.strip()
+                          for _, recipient in chunk]
+            rows, rejected = model.bulk_values(
+                recipients, *content, status='queued', correlation_id=correlation_id, priority=priority,
+                expires_at=expires_at, client_id=client_id, job_id=job_id)
+            if rejected:
+                line_of = {}
+                for (number, _), recipient in zip(chunk, recipients):
+                    line_of.setdefault(recipient, number)
+                for recipient, reason in rejected:
+                    reject(line_of.get(recipient), reason)
+            if routing is not None:
+                for mobile, values in rows:
+                    values['route'] = routing.route_name(mobile)
+            if rows:
+                insert_and_stage(model, channel, task, rows, priority, correlation_id, batch_size,
+                                 publish=bool(celery and not dispatcher))
+        job.total += pending['read']
+        job.accepted += len(rows)
+        job.rejected += pending['rejected']
+        job.errors = list(errors)
+        db.session.commit()
+        bulk_job_rows_counter.labels(channel=channel, outcome='accepted').inc(len(rows))
+        bulk_job_rows_counter.labels(channel=channel, outcome='rejected').inc(pending['rejected'])
+        if rows:
+            queued_counter.inc(len(rows))
+            if not dispatcher:
+                messages_enqueued_counter.labels(channel=channel, priority=priority).inc(len(rows))
+        pending.update(read=0, rejected=0)
+
+    chunk = []
+    try:
+        records = _records(_lines(stream, max_line), job.format, RECIPIENT_COLUMNS[channel])
+        for _ in zip(range(skip), records):
+            pass
+        for number, recipient, problem in records:
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"ingest time limit of {time_limit:g}s reached")
+            pending['read'] += 1
+            if problem:
+                reject(number, problem)
+            else:
+                chunk.append((number, recipient))
+            if len(chunk) >= chunk_size:
+                flush(chunk)
+                chunk = []
+        flush(chunk)
+    except Exception as e:
+        # Upload cut off, over BULK_JOB_MAX_UPLOAD_BYTES, or a DB error: keep what was committed
+        db.session.rollback()
+        logging.getLogger('error').error(f"Bulk job {job.uuid} aborted after {job.total} rows: {e}")
+        job.status = 'failed'
+        job.error = f"Upload aborted after {job.total} rows: {getattr(e, 'description', None) or e}"[:255]
+    else:
+        job.status = 'queued' if job.accepted else 'failed'
+        job.error = None if job.accepted else 'No valid recipients'
+    job.finished_at = datetime.now(timezone.utc)
+    settle_jobs([job_id])  # small jobs may be fully sent before the upload ends
+    db.session.commit()
+    logger.info(f"Bulk {channel} job {job.uuid} {job.status}: {job.total} rows, "
+                f"{job.accepted} queued, {job.rejected} rejected")
+    return job
@@ -0,0 +1,312 @@
+"""
+Circuit breaker for the SOAP SMS gateway.
+
+State is kept in a Redis hash so every gunicorn/Celery worker sees the same
+breaker: once the gateway starts failing (or answering too slowly), callers
+fail fast instead of each blocking on a dead endpoint. After a cool-down a
+limited number of trial requests are let through (half-open); enough
+successes close the breaker again, a single failure re-opens it.
+
+Without Redis the same state machine runs per process.
+"""
+import logging
+import threading
+import time
+
+from flask import current_app, has_app_context
+
+from app.extensions import sms_gateway_breaker_state_gauge, sms_gateway_breaker_rejections_counter
+from app.utils.redis_client import get_redis, mark_redis_down
+
+logger = logging.getLogger('sms')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Gauge encoding
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# KEYS[1] = state hash; ARGV = now, open_seconds, half_open_max_calls
+_ALLOW_LUA = """
+local k = KEYS[1]
+local now = tonumber(ARGV[1])
+local open_seconds = tonumber(ARGV[2])
+local state = redis.call('HGET', k, 'state') or 'closed'
+if state == 'closed' then return {1, state} end
+if state == 'open' then
+  local opened = tonumber(redis.call('HGET', k, 'opened_at') or '0')
+  if now - opened < open_seconds then return {0, state} end
+  state = 'half_open'
+  redis.call('HSET', k, 'state', state, 'half_open_at', now, 'trials', 0, 'trial_ok', 0)
+else
+  -- trial requests that never reported back (worker died) must not wedge the breaker
+  local since = tonumber(redis.call('HGET', k, 'half_open_at') or '0')
+  if now - since >= open_seconds then
+    redis.call('HSET', k, 'half_open_at', now, 'trials', 0, 'trial_ok', 0)
+  end
+end
+local trials = redis.call('HINCRBY', k, 'trials', 1)
+if trials <= tonumber(ARGV[3]) then return {1, state} end
+return {0, state}
+"""
+
+# KEYS[1] = state hash; ARGV = now, failed, slow, window, min_calls,
+#           error_rate, slow_rate, half_open_successes
+_RECORD_LUA = """
+local k = KEYS[1]
+local now = tonumber(ARGV[1])
+local failed = ARGV[2] == '1'
+local slow = ARGV[3] == '1'
+local state = redis.call('HGET', k, 'state') or 'closed'
+if state == 'open' then return state end
+if state == 'half_open' then
+  if failed or slow then
+    redis.call('HSET', k, 'state', 'open', 'opened_at', now)
+    return 'open'
+  end
+  if redis.call('HINCRBY', k, 'trial_ok', 1) >= tonumber(ARGV[8]) then
+    redis.call('DEL', k)
+    return 'closed'
+  end
+  return state
+end
+local started = tonumber(redis.call('HGET', k, 'window_start') or '0')
+if now - started > tonumber(ARGV[4]) then
+  redis.call('HSET', k, 'window_start', now, 'calls', 0, 'errors', 0, 'slow', 0)
+end
+local calls = redis.call('HINCRBY', k, 'calls', 1)
+local errors = redis.call('HINCRBY', k, 'errors', failed and 1 or 0)
+local slows = redis.call('HINCRBY', k, 'slow', slow and 1 or 0)
+if calls >= tonumber(ARGV[5]) and (errors / calls >= tonumber(ARGV[6]) or slows / calls >= tonumber(ARGV[7])) then
+  redis.call('HSET', k, 'state', 'open', 'opened_at', now)
+  return 'open'
+end
+return 'closed'
+"""
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the gateway while its breaker is open."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"SMS gateway circuit '{name}' is open, retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Shared error-rate / latency circuit breaker.
+
+    Args:
+        name: Breaker name (one per gateway); also the Redis key suffix and metric label
+        window: Seconds per counting window
+        min_calls: Calls needed in a window before rates are evaluated
+        error_rate: Failure share (5xx, timeouts, connection errors) that opens the breaker
+        slow_call_seconds: Calls slower than this count as slow
+        slow_rate: Slow-call share that opens the breaker
+        open_seconds: Cool-down before half-open trials are allowed
+        half_open_max_calls: Trial requests allowed while half-open
+        half_open_successes: Successful trials needed to close again
+    """
+
+    def __init__(self, name: str, window: float = 30, min_calls: int = 10, error_rate: float = 0.5,
+                 slow_call_seconds: float = 5, slow_rate: float = 0.8, open_seconds: float = 30,
+                 half_open_max_calls: int = 3, half_open_successes: int = 3):
+        self.name = name
+        self.key = f"sms:breaker:{name}"
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self.half_open_successes = half_open_successes
+        self._lock = threading.Lock()
+        self._local = {}
+        self._allow_script = None
+        self._record_script = None
+        self._set_state(CLOSED)
+
+    # ----- public API -----
+
+    def allow_request(self) -> bool:
+        """
+        True if a call may go to the gateway now. While half-open this hands out
+        one of the limited trial permits.
+        """
+        now = time.time()
+        r = get_redis()
+        if r is not None:
+            try:
+                if self._allow_script is None:
+                    self._allow_script = r.register_script(_ALLOW_LUA)
+                allowed, state = self._allow_script(keys=[self.key],
+                                                    args=[now, self.open_seconds, self.half_open_max_calls])
+                state = state.decode() if isinstance(state, bytes) else state
+                return self._allowed(bool(int(allowed)), state)
+            except Exception as e:
+                mark_redis_down(e)
+        with self._lock:
+            return self._allowed(*self._local_allow(now))
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError unless a call is allowed.
+        """
+        if not self.allow_request():
+            raise CircuitOpenError(self.name, self.retry_after())
+
+    def record(self, failed: bool, elapsed: float):
+        """
+        Report the outcome of an allowed call.
+        """
+        now = time.time()
+        slow = elapsed >= self.slow_call_seconds
+        r = get_redis()
+        if r is not None:
+            try:
+                if self._record_script is None:
+                    self._record_script = r.register_script(_RECORD_LUA)
+                state = self._record_script(keys=[self.key], args=[
+                    now, int(failed), int(slow), self.window, self.min_calls,
+                    self.error_rate, self.slow_rate, self.half_open_successes])
+                self._set_state(state.decode() if isinstance(state, bytes) else state)
+                return
+            except Exception as e:
+                mark_redis_down(e)
+        with self._lock:
+            self._set_state(self._local_record(now, failed, slow))
+
+    def retry_after(self) -> float:
+        """
+        Seconds until the breaker will allow trial requests again (0 if not open).
+        """
+        opened_at = None
+        r = get_redis()
+        if r is not None:
+            try:
+                state, opened_at = r.hmget(self.key, 'state', 'opened_at')
+                if state != b'open':
+                    return 0.0
+            except Exception as e:
+                mark_redis_down(e)
+                opened_at = None
+        if opened_at is None:
+            if self._local.get('state') != OPEN:
+                return 0.0
+            opened_at = self._local.get('opened_at', 0)
+        return max(0.0, float(opened_at) + self.open_seconds - time.time())
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def reset(self):
+        """
+        Force the breaker closed (admin / tests).
+        """
+        r = get_redis()
+        if r is not None:
+            try:
+                r.delete(self.key)
+            except Exception as e:
+                mark_redis_down(e)
+        with self._lock:
+            self._local = {}
+        self._set_state(CLOSED)
+
+    # ----- internals -----
+
+    def _allowed(self, allowed: bool, state: str) -> bool:
+        self._set_state(state)
+        if not allowed:
+            sms_gateway_breaker_rejections_counter.labels(gateway=self.name).inc()
+        return allowed
+
+    def _set_state(self, state: str):
+        previous = getattr(self, '_state', None)
+        self._state = state
+        if previous is not None and previous != state:
+            logger.warning(f"SMS gateway circuit '{self.name}' {previous} -> {state}")
+        sms_gateway_breaker_state_gauge.labels(gateway=self.name).set(_STATE_VALUE.get(state, 0))
+
+    def _local_allow(self, now):
+        s = self._local
+        state = s.get('state', CLOSED)
+        if state == CLOSED:
+            return True, state
+        if state == OPEN:
+            if now - s.get('opened_at', 0) < self.open_seconds:
+                return False, state
+            state = HALF_OPEN
+            s.update(state=state, half_open_at=now, trials=0, trial_ok=0)
+        elif now - s.get('half_open_at', 0) >= self.open_seconds:
+            s.update(half_open_at=now, trials=0, trial_ok=0)
+        s['trials'] = s.get('trials', 0) + 1
+        return s['trials'] <= self.half_open_max_calls, state
+
+    def _local_record(self, now, failed, slow):
+        s = self._local
+        state = s.get('state', CLOSED)
+        if state == OPEN:
+            return state
+        if state == HALF_OPEN:
+            if failed or slow:
+                s.update(state=OPEN, opened_at=now)
+                return OPEN
+            s['trial_ok'] = s.get('trial_ok', 0) + 1
+            if s['trial_ok'] >= self.half_open_successes:
+                s.clear()
+                return CLOSED
+            return state
+        if now - s.get('window_start', 0) > self.window:
+            s.update(window_start=now, calls=0, errors=0, slow=0)
+        s['calls'] += 1
+        s['errors'] += int(failed)
+        s['slow'] += int(slow)
+        if s['calls'] >= self.min_calls and (s['errors'] / s['calls'] >= self.error_rate
+                                             or s['slow'] / s['calls'] >= self.slow_rate):
+            s.update(state=OPEN, opened_at=now)
+            return OPEN
+        return CLOSED
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def _config(name: str, default):
+    if has_app_context():
+        return current_app.config.get(name, default)
+    return default
+
+
+def get_breaker(name: str = 'default') -> CircuitBreaker:
+    """
+    Return the process-wide breaker for gateway `name`, configured from SMS_BREAKER_*.
+    """
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    name,
+                    window=float(_config('SMS_BREAKER_WINDOW', 30)),
+                    min_calls=int(_config('SMS_BREAKER_MIN_CALLS', 10)),
+                    error_rate=float(_config('SMS_BREAKER_ERROR_RATE', 0.5)),
+                    slow_call_seconds=float(_config('SMS_BREAKER_SLOW_CALL_SECONDS', 5)),
+                    slow_rate=float(_config('SMS_BREAKER_SLOW_RATE', 0.8)),
+                    open_seconds=float(_config('SMS_BREAKER_OPEN_SECONDS', 30)),
+                    half_open_max_calls=int(_config('SMS_BREAKER_HALF_OPEN_MAX_CALLS', 3)),
+                    half_open_successes=int(_config('SMS_BREAKER_HALF_OPEN_SUCCESSES', 3)),
+                )
+                _breakers[name] = breaker
+    return breaker
+
+
+def breaker_enabled() -> bool:
+    return bool(_config('SMS_BREAKER_ENABLED', True))
@@ -0,0 +1,192 @@
+"""
+Dead-letter store for permanently failed messages.
+
+Send paths call record_dead_letter(s) when a message is finalised as
+'failed' (attempts exhausted or rejected by the gateway), recording the error
+class and the last gateway status code. The admin API lists them and
+replays them by filter (failed_at range, error class, correlation_id).
+
+Replay works in chunks of DEAD_LETTER_REPLAY_CHUNK: each chunk resets its
+still-failed messages to 'queued' and stages bulk-lane batch tasks in the
+outbox in one transaction. The batch tasks go through the rate governor and
+gateway budgets like any other bulk send, so a large replay drains at the
+configured rate instead of flooding the gateway.
+"""
+import datetime
+import logging
+
+from flask import current_app
+from sqlalchemy import insert, select, update
+
+from app.extensions import db, dead_letters_counter, dead_letters_replayed_counter
+from app.models.dead_letter import DeadLetter
+
+logger = logging.getLogger('app')
+
+CHANNELS = ('sms', 'email')
+
+
+def dead_letter_entry(channel: str, record_id: int, status_code: int = None, attempts: int = None,
+                      correlation_id: str = None, exc: BaseException = None) -> dict:
+    """
+    Row values for one dead letter (for record_dead_letters).
+    """
+    from app.tasks.retry_scheduler import classify_error  # lazy import
+    return {
+        'channel': channel,
+        'message_id': record_id,
+        'correlation_id': correlation_id,
+        'error_class': classify_error(status_code, exc),
+        'last_status_code': status_code,
+        'attempts': attempts,
+        'failed_at': datetime.datetime.now(datetime.timezone.utc),
+    }
+
+
+def record_dead_letters(entries: list, commit: bool = True):
+    """
+    Insert dead letters with one executemany INSERT. With commit=False they join the
+    caller's transaction (e.g. a batch task's status update).
+    """
+    if not entries:
+        return
+    try:
+        db.session.execute(insert(DeadLetter), entries)
+        if commit:
+            db.session.commit()
+    except Exception as e:
+        if not commit:
+            raise
+        db.session.rollback()
+        logging.getLogger('error').error(f"Failed to record {len(entries)} dead letters: {e}")
+        return
+    for entry in entries:
+        dead_letters_counter.labels(channel=entry['channel'], error_class=entry['error_class']).inc()
+
+
+def record_dead_letter(channel: str, record_id: int, status_code: int = None, attempts: int = None,
+                       correlation_id: str = None, exc: BaseException = None):
+    """
+    Record one permanently failed message.
+    """
+    record_dead_letters([dead_letter_entry(channel, record_id, status_code, attempts, correlation_id, exc)])
+
+
+def _parse_time(value, name):
+    if not value:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"Invalid {name}")
+
+
+def parse_filters(params) -> dict:
+    """
+    Dead-letter filters from query args or a JSON body; raises ValueError on bad input.
+    """
+    return {
+        'since': _parse_time(params.get('since'), 'since'),
+        'until': _parse_time(params.get('until'), 'until'),
+        'error_class': params.get('error_class') or None,
+        'correlation_id': params.get('correlation_id') or None,
+    }
+
+
+def dead_letter_query(channel: str, since=None, until=None, error_class=None, correlation_id=None,
+                      include_replayed=False):
+    q = select(DeadLetter).where(DeadLetter.channel == channel)
+    if not include_replayed:
+        q = q.where(DeadLetter.replayed_at.is_(None))
+    if since:
+        q = q.where(DeadLetter.failed_at >= since)
+    if until:
+        q = q.where(DeadLetter.failed_at <= until)
+    if error_class:
+        q = q.where(DeadLetter.error_class == error_class)
+    if correlation_id:
+        q = q.where(DeadLetter.correlation_id == correlation_id)
+    return q
+
+
+def _channel_tasks(channel):
+    # Lazy imports: the send tasks import this module to record dead letters
+    if channel == 'sms':
+        from app.models.sms_message import SMSMessage
+        from app.tasks.sms_tasks import send_batch_and_record
+        return SMSMessage, send_batch_and_record, int(current_app.config.get('SMS_GATEWAY_BATCH_SIZE', 50))
+    from app.models.email_message import EmailMessage
+    from app.tasks.email_queue import send_batch_and_record
+    return EmailMessage, send_batch_and_record, int(current_app.config.get('EMAIL_BATCH_SIZE', 50))
+
+
+def replay_dead_letters(channel: str, limit: int = None, **filters) -> dict:
+    """
+    Re-enqueue the not-yet-replayed dead letters matching `filters` on the bulk lane.
+    Returns counts of dead letters replayed, messages re-queued and batches staged.
+    """
+    from app.tasks.job_counters import add_job_counts
+    from app.tasks.outbox_relay import stage_task
+    from app.tasks.queues import shard_batches
+    from app.utils.staging import batch_member_task_id
+
+    model, task, batch_size = _channel_tasks(channel)
+    batch_size = max(batch_size, 1)
+    chunk = max(int(current_app.config.get('DEAD_LETTER_REPLAY_CHUNK', 500)), 1)
+    limit = min(int(limit or current_app.config.get('DEAD_LETTER_REPLAY_MAX', 50000)),
+                int(current_app.config.get('DEAD_LETTER_REPLAY_MAX', 50000)))
+    # The asyncio dispatcher claims 'queued' rows itself; nothing to publish
+    dispatcher = channel == 'sms' and current_app.config.get('SMS_DISPATCH_BACKEND') == 'asyncio'
+    totals = {'replayed': 0, 'requeued': 0, 'batches': 0}
+
+    while totals['replayed'] < limit:
+        try:
+            letters = db.session.execute(
+                dead_letter_query(channel, **filters)
+                .order_by(DeadLetter.id)
+                .limit(min(chunk, limit - totals['replayed']))
+                .with_for_update(skip_locked=True)
+            ).scalars().all()
+            if not letters:
+                db.session.rollback()
+                break
+            # Only messages still failed: a message dead-lettered twice is re-sent once
+            messages = db.session.execute(
+                select(model.id, model.shard_key, model.job_id)
+                .where(model.id.in_({letter.message_id for letter in letters}))
+                .where(model.status == 'failed', model.deleted_at.is_(None))
+                .order_by(model.id)
+            ).all()
+            ids = [message.id for message in messages]
+            values = {'status': 'queued', 'attempts': 0, 'task_id': None}
+            if ids:
+                db.session.execute(update(model).where(model.id.in_(ids)).values(**values))
+            if not dispatcher:
+                task_ids = []
+                for queue, members in shard_batches(channel, 'bulk', messages, batch_size, lambda m: m.shard_key):
+                    batch = [message.id for message in members]
+                    task_id = stage_task(task, [batch, None], {'priority': 'bulk'}, queue=queue)
+                    task_ids.extend({'id': record_id, 'task_id': batch_member_task_id(task_id, record_id)}
+                                    for record_id in batch)
+                    totals['batches'] += 1
+                if task_ids:
+                    db.session.execute(update(model), task_ids)
+            now = datetime.datetime.now(datetime.timezone.utc)
+            for letter in letters:
+                letter.replayed_at = now
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        totals['replayed'] += len(letters)
+        totals['requeued'] += len(ids)
+        dead_letters_replayed_counter.labels(channel=channel).inc(len(ids))
+        # Re-queued job messages are no longer counted as failed on their job
+        reopened = {}
+        for message in messages:
+            if message.job_id is not None:
+                reopened.setdefault(message.job_id, {'failed': 0})['failed'] -= 1
+        add_job_counts(reopened)
+
+    logger.info(f"Dead-letter replay ({channel}): {totals}")
+    return totals
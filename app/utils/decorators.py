@@ -1,7 +1,8 @@
-from flask import request, current_app
+from flask import request, current_app, g
 from functools import wraps
 import logging
 from app.utils.response import error
+from app.utils.fair_queue import CLIENT_ID_RE, DEFAULT_CLIENT, client_api_keys
 
 def require_bearer_and_log(route_func):
     @wraps(route_func)
@@ -17,6 +18,8 @@ def require_bearer_and_log(route_func):
         is_single_email = request.path.endswith('/send') and 'mail' in request.path and request.method == 'POST'
         is_bulk_email = request.path.endswith('/bulk_send') and 'mail' in request.path and request.method == 'POST'
         is_health_email = request.path.endswith('/health') and 'mail' in request.path and request.method == 'GET'
+        is_job_status = '/jobs/' in request.path and request.method == 'GET'
+        is_batch = request.path.endswith('/batch') and request.method == 'POST'
         
         # Rate limiting based on endpoint type
         if is_single_sms:
@@ -37,6 +40,12 @@ def require_bearer_and_log(route_func):
         elif is_health_email:
             # Email Health check: 5 per minute
             limit = 5
+        elif is_job_status:
+            # Bulk job progress polling: 120 per minute
+            limit = 120
+        elif is_batch:
+            # Per-recipient batches (SMS or email): 60 per minute
+            limit = 60
         else:
             # Default rate limit for other endpoints
             limit = 10
@@ -62,12 +71,14 @@ def require_bearer_and_log(route_func):
             token = auth_header.split(' ', 1)[1]
         # Require config value, no fallback
         expected_token = current_app.config.get('SMS_API_KEY')  # Using SMS_API_KEY as default, but could be extended
-        if not expected_token:
+        # Per-client keys: the key itself names the calling integration
+        keyed_client = client_api_keys().get(token) if token else None
+        if not expected_token and not current_app.config.get('CLIENT_API_KEYS'):
             logger.error("Missing API key in config")
             return error("Server misconfiguration", "SERVER_ERROR", 500)
         # Token format validation (simple: length, chars, not default)
         import re
-        if not token or token != expected_token:
+        if not token or (token != expected_token and keyed_client is None):
             logger.warning(f"Invalid token for {ip} on {request.path}")
             audit_logger.warning(
                 f"Authentication failed: ip={ip}, path={request.path}, reason=invalid_token")
@@ -88,13 +99,27 @@ def require_bearer_and_log(route_func):
             audit_logger.warning(f"RBAC denied: ip={ip}, role={role}, path={request.path}")
             return error("Forbidden", "FORBIDDEN", 403)
         # API key check
-        if token != expected_token:
+        if token != expected_token and keyed_client is None:
             logger.warning(f"Unauthorized access attempt to {request.path} from {ip}")
             audit_logger.warning(f"Unauthorized: ip={ip}, path={request.path}, reason=token_mismatch")
             return error("Unauthorized", "UNAUTHORIZED", 401)
+        # Calling integration, recorded on its messages for per-client fair queuing and job visibility
+        claimed_client = request.headers.get('X-Client-Id')
+        if keyed_client is not None:
+            # Authenticated by its own key: the header may only repeat that client
+            if claimed_client and claimed_client != keyed_client:
+                audit_logger.warning(f"Client mismatch: ip={ip}, path={request.path}, claimed={claimed_client}")
+                return error("X-Client-Id does not match the API key", "FORBIDDEN", 403)
+            client_id = keyed_client
+        else:
+            # Shared SMS_API_KEY: the header is trusted as sent, so it is not a security boundary
+            client_id = claimed_client or DEFAULT_CLIENT
+        if not CLIENT_ID_RE.match(client_id):
+            return error("Invalid X-Client-Id", "INVALID_CLIENT_ID", 400)
+        g.client_id = client_id
         # Log request metadata (NO TOKENS)
-        logger.info(f"Authorized access to {request.path} from {ip} user_agent={request.headers.get('User-Agent')} role={role}")
-        audit_logger.info(f"Access granted: ip={ip}, path={request.path}, user_agent={request.headers.get('User-Agent')}, role={role}, has_nonce={bool(nonce)}")
+        logger.info(f"Authorized access to {request.path} from {ip} user_agent={request.headers.get('User-Agent')} role={role} client={client_id}")
+        audit_logger.info(f"Access granted: ip={ip}, path={request.path}, user_agent={request.headers.get('User-Agent')}, role={role}, client={client_id}, has_nonce={bool(nonce)}")
         return route_func(*args, **kwargs)
     return wrapper
 
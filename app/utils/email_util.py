@@ -4,8 +4,9 @@ from email.mime.multipart import MIMEMultipart
 from flask import current_app
 import logging
 import re
+from concurrent.futures import ThreadPoolExecutor
 from threading import Lock
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 import os
 from cryptography.fernet import Fernet
 import time
@@ -13,6 +14,9 @@ import time
 
 # Thread lock for email sending (per-process)
 email_send_lock = Lock()
+# Guards the per-address throttle map (batch sends don't take email_send_lock)
+_throttle_lock = Lock()
+_PROCESS_EMAIL_RATE_LIMIT = {}
 
 # Email regex: basic validation
 EMAIL_RE = re.compile(r'^[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}$')
@@ -92,6 +96,50 @@ def _is_forbidden(content: str) -> bool:
     return False
 
 
+def _smtp_config() -> dict:
+    """
+    SMTP settings from the Flask app config, or the environment outside an app context.
+    """
+    try:
+        from flask import current_app
+        config = current_app.config
+        username = config.get('SMTP_USERNAME')
+        return {
+            'server': config.get('SMTP_SERVER', 'localhost'),
+            'port': int(config.get('SMTP_PORT', 587)),
+            'username': username,
+            'password': config.get('SMTP_PASSWORD'),
+            'from_email': config.get('SMTP_FROM_EMAIL', username),
+            'use_tls': config.get('SMTP_USE_TLS', True),
+            'use_ssl': config.get('SMTP_USE_SSL', False),
+        }
+    except RuntimeError:
+        # Not in Flask app context (e.g., in Celery worker)
+        username = os.getenv('SMTP_USERNAME')
+        return {
+            'server': os.getenv('SMTP_SERVER', 'localhost'),
+            'port': int(os.getenv('SMTP_PORT', 587)),
+            'username': username,
+            'password': os.getenv('SMTP_PASSWORD'),
+            'from_email': os.getenv('SMTP_FROM_EMAIL', username or 'noreply@example.com'),
+            'use_tls': os.getenv('SMTP_USE_TLS', 'True').lower() == 'true',
+            'use_ssl': os.getenv('SMTP_USE_SSL', 'False').lower() == 'true',
+        }
+
+
+def _check_email_throttle(to_email: str, window: float = 1) -> bool:
+    """
+    Per-process throttle: one email per address every `window` seconds.
+    Returns True (and records the send) if allowed.
+    """
+    with _throttle_lock:
+        now = time.time()
+        if now - _PROCESS_EMAIL_RATE_LIMIT.get(to_email, 0) < window:
+            return False
+        _PROCESS_EMAIL_RATE_LIMIT[to_email] = now
+        return True
+
+
 def send_single_email_util(to_email: str, subject: str, body: str,
                           from_email: Optional[str] = None,
                           smtp_server: Optional[str] = None,
@@ -139,24 +187,14 @@ def send_single_email_util(to_email: str, subject: str, body: str,
             return 400, error_msg
 
         # Get configuration from Flask app context or environment
-        try:
-            from flask import current_app
-            smtp_server = smtp_server or current_app.config.get('SMTP_SERVER', 'localhost')
-            smtp_port = smtp_port or int(current_app.config.get('SMTP_PORT', 587))
-            smtp_username = smtp_username or current_app.config.get('SMTP_USERNAME')
-            smtp_password = smtp_password or current_app.config.get('SMTP_PASSWORD')
-            from_email = from_email or current_app.config.get('SMTP_FROM_EMAIL', smtp_username)
-            use_tls = current_app.config.get('SMTP_USE_TLS', True)
-            use_ssl = current_app.config.get('SMTP_USE_SSL', False)
-        except RuntimeError:
-            # Not in Flask app context (e.g., in Celery worker)
-            smtp_server = smtp_server or os.getenv('SMTP_SERVER', 'localhost')
-            smtp_port = smtp_port or int(os.getenv('SMTP_PORT', 587))
-            smtp_username = smtp_username or os.getenv('SMTP_USERNAME')
-            smtp_password = smtp_password or os.getenv('SMTP_PASSWORD')
-            from_email = from_email or os.getenv('SMTP_FROM_EMAIL', smtp_username or 'noreply@example.com')
-            use_tls = os.getenv('SMTP_USE_TLS', 'True').lower() == 'true'
-            use_ssl = os.getenv('SMTP_USE_SSL', 'False').lower() == 'true'
+        cfg = _smtp_config()
+        smtp_server = smtp_server or cfg['server']
+        smtp_port = smtp_port or cfg['port']
+        smtp_username = smtp_username or cfg['username']
+        smtp_password = smtp_password or cfg['password']
+        from_email = from_email or cfg['from_email']
+        use_tls = cfg['use_tls']
+        use_ssl = cfg['use_ssl']
 
         # Check required configuration
         if not all([smtp_server, smtp_username, smtp_password, from_email]):
@@ -166,23 +204,10 @@ def send_single_email_util(to_email: str, subject: str, body: str,
             return 500, error_msg
 
         # Rate limiting - per process fallback. Replace with Redis for multi-process deployments.
-        now = time.time()
-        try:
-            # Process-global rate limiting
-            global _PROCESS_EMAIL_RATE_LIMIT
-            if '_PROCESS_EMAIL_RATE_LIMIT' not in globals():
-                _PROCESS_EMAIL_RATE_LIMIT = {}
-            rate_store = _PROCESS_EMAIL_RATE_LIMIT
-        except NameError:
-            _PROCESS_EMAIL_RATE_LIMIT = {}
-            rate_store = _PROCESS_EMAIL_RATE_LIMIT
-
-        last_sent = rate_store.get(to_email, 0)
-        if now - last_sent < 1:  # 1 second minimum between emails to same address
+        if not _check_email_throttle(to_email):
             error_msg = f"Rate limit exceeded for {to_email}"
             email_logger.warning(error_msg)
             return 429, error_msg
-        rate_store[to_email] = now
 
         try:
             # Create message
@@ -237,4 +262,94 @@ def send_single_email_util(to_email: str, subject: str, body: str,
             error_msg = f"Failed to send email to {to_email}: {str(e)}"
             email_logger.error(error_msg)
             logging.getLogger('error').exception(error_msg)
-            return 500, error_msg
\ No newline at end of file
+            return 500, error_msg
+
+
+def _open_smtp(cfg: dict):
+    port = int(cfg['port'])
+    use_ssl = port == 465 or cfg['use_ssl']
+    server = (smtplib.SMTP_SSL if use_ssl else smtplib.SMTP)(cfg['server'], port)
+    if not use_ssl and cfg['use_tls']:
+        server.starttls()
+    server.login(cfg['username'], cfg['password'])
+    return server
+
+
+def _send_over_session(cfg: dict, messages: List[Tuple[int, str, str, str]]) -> List[Tuple[int, int, str]]:
+    """
+    Send (index, to, subject, body) messages over one SMTP session, reconnecting once if the
+    server drops it. Returns (index, status_code, message_id or error) per message.
+    """
+    email_logger = logging.getLogger('email')
+    results = []
+    server = None
+    try:
+        for index, to_email, subject, body in messages:
+            if not validate_email(to_email) or not validate_subject(subject) or not validate_body(body):
+                results.append((index, 400, f"Invalid email content for {to_email}"))
+                continue
+            if not _check_email_throttle(to_email):
+                results.append((index, 429, f"Rate limit exceeded for {to_email}"))
+                continue
+            msg = MIMEMultipart()
+            msg['From'] = cfg['from_email']
+            msg['To'] = to_email
+            msg['Subject'] = subject
+            msg.attach(MIMEText(body, 'plain'))
+            for reconnect in (False, True):
+                try:
+                    if server is None:
+                        server = _open_smtp(cfg)
+                    server.send_message(msg)
+                    results.append((index, 200, f"email_{int(time.time())}_{hash(to_email) % 10000}"))
+                    break
+                except smtplib.SMTPServerDisconnected:
+                    server = None
+                    if reconnect:
+                        results.append((index, 503, f"SMTP server disconnected when sending to {to_email}"))
+                except smtplib.SMTPRecipientsRefused:
+                    results.append((index, 400, f"Recipient email address refused: {to_email}"))
+                    break
+        email_logger.info(f"SMTP session sent {sum(1 for r in results if r[1] == 200)}/{len(messages)} emails")
+    except smtplib.SMTPAuthenticationError:
+        email_logger.error("SMTP authentication failed for batch")
+        done = {r[0] for r in results}
+        results.extend((index, 401, "SMTP authentication failed") for index, *_ in messages if index not in done)
+    except Exception as e:
+        logging.getLogger('error').exception(f"Failed to send email batch: {e}")
+        done = {r[0] for r in results}
+        results.extend((index, 500, f"Failed to send email: {e}") for index, *_ in messages if index not in done)
+    finally:
+        if server is not None:
+            try:
+                server.quit()
+            except Exception:
+                pass
+    return results
+
+
+def send_email_batch_util(messages: List[Tuple[str, str, str]], concurrency: int = 4) -> List[Tuple[int, str]]:
+    """
+    Send many (to, subject, body) emails, spread over up to `concurrency` SMTP sessions
+    that each stay open for their share of the batch (instead of one connect, TLS
+    handshake and login per email).
+
+    Returns:
+        List of (status_code, message_id or error_message) in input order.
+    """
+    if not messages:
+        return []
+    cfg = _smtp_config()
+    if not all([cfg['server'], cfg['username'], cfg['password'], cfg['from_email']]):
+        logging.getLogger('error').error("Missing SMTP configuration")
+        return [(500, "Missing SMTP configuration")] * len(messages)
+
+    indexed = [(i, *m) for i, m in enumerate(messages)]
+    sessions = max(1, min(int(concurrency), len(indexed)))
+    slices = [indexed[k::sessions] for k in range(sessions)]
+    results = [None] * len(messages)
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        for outcome in pool.map(lambda part: _send_over_session(cfg, part), slices):
+            for index, status_code, detail in outcome:
+                results[index] = (status_code, detail)
+    return results
@@ -0,0 +1,123 @@
+"""
+Per-client weighted fair queuing.
+
+Each integration's client id comes from its API key in CLIENT_API_KEYS (see
+require_bearer_and_log); callers on the shared SMS_API_KEY name themselves with
+the X-Client-Id header, which is trusted as given. Every message row records
+its client_id. Without
+this, all integrations share one FIFO per lane and one client firing a
+handful of /bulk calls starves everybody else until its backlog drains.
+
+The asyncio dispatcher claims each lane's rows across clients with deficit
+round-robin: on every visit a backlogged client's deficit grows by
+FAIR_QUEUE_QUANTUM x its weight (CLIENT_WEIGHTS, default 1) and it may take
+that many rows. A client whose backlog empties loses its leftover deficit,
+so idle time cannot be banked.
+"""
+import json
+import logging
+import re
+
+from flask import current_app, g, has_app_context, has_request_context
+
+DEFAULT_CLIENT = 'default'
+CLIENT_ID_RE = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+
+def current_client_id() -> str:
+    """
+    Client of the current request (set by require_bearer_and_log), else 'default'.
+
+    Only a client resolved from a CLIENT_API_KEYS key is authenticated; with the
+    shared SMS_API_KEY it is whatever X-Client-Id the caller sent.
+    """
+    if has_request_context():
+        return g.get('client_id') or DEFAULT_CLIENT
+    return DEFAULT_CLIENT
+
+
+def client_api_keys() -> dict:
+    """
+    CLIENT_API_KEYS (JSON {client_id: api_key}) inverted to {api_key: client_id};
+    entries with an invalid client id or an empty key are ignored.
+    """
+    raw = current_app.config.get('CLIENT_API_KEYS') if has_app_context() else None
+    if not raw:
+        return {}
+    try:
+        parsed = json.loads(raw) if isinstance(raw, str) else raw
+        return {str(key): str(client) for client, key in parsed.items()
+                if key and CLIENT_ID_RE.match(str(client))}
+    except (ValueError, TypeError, AttributeError) as e:
+        logging.getLogger('error').error(f"Ignoring invalid CLIENT_API_KEYS: {e}")
+        return {}
+
+
+def client_weights() -> dict:
+    """
+    CLIENT_WEIGHTS parsed to {client_id: weight}; invalid or non-positive entries are ignored.
+    """
+    raw = current_app.config.get('CLIENT_WEIGHTS') if has_app_context() else None
+    if not raw:
+        return {}
+    try:
+        parsed = json.loads(raw) if isinstance(raw, str) else raw
+        return {str(client): float(weight) for client, weight in parsed.items() if float(weight) > 0}
+    except (ValueError, TypeError, AttributeError) as e:
+        logging.getLogger('error').error(f"Ignoring invalid CLIENT_WEIGHTS: {e}")
+        return {}
+
+
+class DeficitRoundRobin:
+    """
+    Deficit round-robin over per-client backlogs (every message costs 1).
+
+    Not thread-safe: each dispatcher keeps one instance per lane and only
+    claims from one thread at a time.
+
+    Args:
+        quantum: Rows a weight-1 client may take per round
+        weights: {client_id: weight}; unlisted clients weigh 1
+    """
+
+    def __init__(self, quantum: float = 10, weights: dict = None):
+        self.quantum = max(float(quantum), 1.0)
+        self.weights = weights or {}
+        self._deficits = {}
+        # Round-robin order; a claim resumes after the last client it visited
+        self._order = []
+
+    def weight(self, client: str) -> float:
+        return self.weights.get(client, 1.0)
+
+    def allocate(self, backlog: dict, limit: int) -> dict:
+        """
+        Split `limit` rows across clients with `backlog` ({client_id: depth}).
+        Returns {client_id: rows to claim}.
+        """
+        active = {client for client, depth in backlog.items() if depth > 0}
+        for client in [c for c in self._order if c not in active]:
+            self._order.remove(client)
+            self._deficits.pop(client, None)  # idle clients don't keep credit
+        self._order.extend(sorted(active - set(self._order)))
+
+        remaining = {client: backlog[client] for client in self._order}
+        grants = {}
+        visited = 0
+        while limit > 0 and any(remaining.values()):
+            for i, client in enumerate(self._order):
+                if limit <= 0:
+                    break
+                visited = i + 1
+                if not remaining[client]:
+                    continue
+                deficit = self._deficits.get(client, 0.0) + self.quantum * self.weight(client)
+                take = min(int(deficit), remaining[client], limit)
+                grants[client] = grants.get(client, 0) + take
+                remaining[client] -= take
+                limit -= take
+                # An emptied backlog forfeits the rest of its deficit
+                self._deficits[client] = deficit - take if remaining[client] else 0.0
+        # Next claim starts with the client after the last one visited
+        self._order = self._order[visited:] + self._order[:visited]
+        return {client: n for client, n in grants.items() if n}
@@ -0,0 +1,55 @@
+"""
+Message time-to-live.
+
+A message may carry `expires_at` (from the API's `expires_at` or
+`ttl_seconds`, or the lane default MESSAGE_TTL_<PRIORITY>_SECONDS). Send
+paths check it before decrypting or calling a gateway and finalise late
+messages as 'expired' instead: an OTP delivered minutes late is useless
+and takes gateway capacity from fresh traffic.
+"""
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+
+
+def _aware(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes; everything is stored in UTC
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def resolve_expiry(data: dict, priority: str, now: datetime = None):
+    """
+    expires_at for an API payload: explicit `expires_at` (ISO 8601), else `ttl_seconds`,
+    else the lane default (None = never expires). Raises ValueError on bad input.
+    """
+    now = now or datetime.now(timezone.utc)
+    raw_expires, raw_ttl = data.get('expires_at'), data.get('ttl_seconds')
+    if raw_expires:
+        try:
+            expires_at = _aware(datetime.fromisoformat(str(raw_expires).replace('Z', '+00:00')))
+        except ValueError:
+            raise ValueError("expires_at must be an ISO 8601 timestamp")
+        if expires_at <= now:
+            raise ValueError("expires_at must be in the future")
+        return expires_at
+    if raw_ttl is not None:
+        try:
+            ttl = int(raw_ttl)
+        except (TypeError, ValueError):
+            raise ValueError("ttl_seconds must be an integer")
+        if ttl <= 0:
+            raise ValueError("ttl_seconds must be positive")
+    else:
+        ttl = int(current_app.config.get(f'MESSAGE_TTL_{priority.upper()}_SECONDS', 0) or 0)
+        if ttl <= 0:
+            return None
+    return now + timedelta(seconds=ttl)
+
+
+def is_expired(expires_at, now: datetime = None) -> bool:
+    """
+    True if `expires_at` is set and has passed.
+    """
+    if expires_at is None:
+        return False
+    return _aware(expires_at) <= (now or datetime.now(timezone.utc))
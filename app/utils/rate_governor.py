@@ -0,0 +1,178 @@
+"""
+Cluster-wide outbound rate governor.
+
+Each governor is a token bucket kept in a Redis hash and updated by one Lua
+script, so every gunicorn/Celery process draws from the same budget: N
+workers together send at the configured rate, not N times it. Permits are
+taken with a bounded wait; a caller that can't get one in time parks the
+work for the drainer (app/tasks/drainer.py) instead of blocking a worker.
+
+There is one governor per channel (SMS_RATE_PER_SECOND, EMAIL_RATE_PER_SECOND)
+and one per SMS gateway account (its `tps`, see sms_gateway_pool). Without
+Redis each process falls back to its share of the rate (rate / processes).
+"""
+import os
+import threading
+import time
+
+from flask import current_app, has_app_context
+
+from app.utils.redis_client import get_redis, mark_redis_down
+
+# KEYS[1] = bucket hash; ARGV = rate, capacity, cost, take (1 = consume on success)
+# Returns the wait in seconds as a string (0 = permit granted / available now).
+# Uses the Redis clock so hosts with skewed clocks still share one bucket.
+_TAKE_LUA = """
+local k = KEYS[1]
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local tokens = tonumber(redis.call('HGET', k, 'tokens') or capacity)
+local ts = tonumber(redis.call('HGET', k, 'ts') or now)
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= cost then
+  if ARGV[4] == '1' then tokens = tokens - cost end
+else
+  wait = (cost - tokens) / rate
+end
+redis.call('HSET', k, 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', k, math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+
+
+class _LocalBucket:
+    """Per-process token bucket used when Redis is unavailable."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, cost: float, take: bool) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= cost:
+                if take:
+                    self._tokens -= cost
+                return 0.0
+            return (cost - self._tokens) / self.rate
+
+
+class RateGovernor:
+    """
+    Shared token bucket.
+
+    Args:
+        name: Bucket name; also the Redis key suffix
+        rate: Permits per second across the cluster (<= 0 = unlimited)
+        burst: Bucket capacity (default: one second of rate, at least 1)
+        processes: Processes sharing the rate when falling back to per-process buckets
+    """
+
+    def __init__(self, name: str, rate: float, burst: float = None, processes: int = 1):
+        self.name = name
+        self.key = f"rate:{name}"
+        self.rate = float(rate or 0)
+        self.capacity = float(burst) if burst else max(self.rate, 1.0)
+        share = self.rate / max(int(processes), 1)
+        self._local = _LocalBucket(share, max(share, 1.0)) if share > 0 else None
+        self._script = None
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate <= 0
+
+    def _take(self, cost: float, take: bool) -> float:
+        # Requests larger than the bucket would never fit; charge a full bucket instead
+        cost = min(cost, self.capacity)
+        r = get_redis()
+        if r is not None:
+            try:
+                if self._script is None:
+                    self._script = r.register_script(_TAKE_LUA)
+                return float(self._script(keys=[self.key],
+                                          args=[self.rate, self.capacity, cost, int(take)]))
+            except Exception as e:
+                mark_redis_down(e)
+        return self._local.take(min(cost, self._local.capacity), take)
+
+    def try_take(self, cost: float = 1.0) -> bool:
+        """
+        Take `cost` permits if available right now.
+        """
+        if self.unlimited:
+            return True
+        return self._take(cost, True) == 0
+
+    def wait_time(self, cost: float = 1.0) -> float:
+        """
+        Seconds until `cost` permits are available (without taking them).
+        """
+        if self.unlimited:
+            return 0.0
+        return self._take(cost, False)
+
+    def acquire(self, cost: float = 1.0, max_wait: float = 0.0) -> bool:
+        """
+        Take `cost` permits, sleeping up to `max_wait` seconds for them.
+        Returns False (nothing taken) if they won't be available in time.
+        """
+        if self.unlimited:
+            return True
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self._take(cost, True)
+            if wait == 0:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+_governors = {}
+_governors_lock = threading.Lock()
+
+
+def _config(name: str, default=None):
+    if has_app_context():
+        return current_app.config.get(name, default)
+    return os.getenv(name, default)
+
+
+def get_governor(name: str, rate: float, burst: float = None, processes: int = 1) -> RateGovernor:
+    """
+    Process-wide governor for `name`; rebuilt if its configured rate changes.
+    """
+    governor = _governors.get(name)
+    if governor is None or governor.rate != float(rate or 0):
+        with _governors_lock:
+            governor = _governors.get(name)
+            if governor is None or governor.rate != float(rate or 0):
+                governor = _governors[name] = RateGovernor(name, rate, burst, processes=processes)
+    return governor
+
+
+def channel_governor(channel: str) -> RateGovernor:
+    """
+    Governor for a whole channel ('sms' or 'email'), from <CHANNEL>_RATE_PER_SECOND.
+    """
+    prefix = channel.upper()
+    rate = float(_config(f'{prefix}_RATE_PER_SECOND', 0) or 0)
+    burst = _config(f'{prefix}_RATE_BURST')
+    processes = int(_config('RATE_GOVERNOR_PROCESSES', 1))
+    return get_governor(channel, rate, float(burst) if burst else None, processes=processes)
+
+
+def governor_max_wait() -> float:
+    """
+    Longest a task waits in-process for a permit before parking its work.
+    """
+    return float(_config('RATE_GOVERNOR_MAX_WAIT', 2.0))
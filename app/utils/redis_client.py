@@ -0,0 +1,60 @@
+"""
+Shared Redis connection for cross-process coordination state
+(circuit breaker, rate governor, retry schedule, job counters).
+
+Callers get None when Redis is not configured or currently unreachable and
+are expected to fall back to per-process behaviour, like NonceStore does.
+"""
+import logging
+import os
+import threading
+import time
+
+import redis
+from flask import current_app, has_app_context
+
+_client = None
+_client_url = None
+_retry_at = 0.0
+_lock = threading.Lock()
+
+# After a connection failure, don't try Redis again for this many seconds
+RECONNECT_BACKOFF = 5.0
+
+
+def _redis_url():
+    if has_app_context():
+        url = current_app.config.get('REDIS_URL') or current_app.config.get('RATELIMIT_STORAGE_URI')
+    else:
+        url = os.getenv('REDIS_URL') or os.getenv('RATELIMIT_STORAGE_URI', 'redis://localhost:6379/2')
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        return url
+    return None
+
+
+def get_redis():
+    """
+    Return a shared redis.Redis client, or None if Redis is unavailable.
+    """
+    global _client, _client_url
+    if time.time() < _retry_at:
+        return None
+    url = _redis_url()
+    if not url:
+        return None
+    if _client is None or _client_url != url:
+        with _lock:
+            if _client is None or _client_url != url:
+                _client = redis.from_url(url, socket_connect_timeout=0.5, socket_timeout=1.0)
+                _client_url = url
+    return _client
+
+
+def mark_redis_down(exc: Exception):
+    """
+    Record a Redis failure so callers fall back locally for RECONNECT_BACKOFF seconds.
+    """
+    global _retry_at
+    if time.time() >= _retry_at:
+        logging.getLogger('app').warning(f"Redis unavailable, using per-process fallback: {exc}")
+    _retry_at = time.time() + RECONNECT_BACKOFF
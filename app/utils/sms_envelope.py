@@ -0,0 +1,64 @@
+"""
+Precompiled SOAP 1.2 envelope serializer shared by every SMS sender.
+
+Credentials, sender id and template id never change between messages, so the
+static prefix/suffix of each envelope is rendered, escaped and encoded once.
+Per message only the recipient list and text are escaped, and the body is
+produced with a single bytes join.
+"""
+from typing import Iterable, Union
+from xml.sax.saxutils import escape as xml_escape
+
+
+def _escape(value) -> bytes:
+    if value is None:
+        return b''
+    return xml_escape(str(value)).encode('utf-8')
+
+
+class SOAPEnvelopeBuilder:
+    """
+    Byte-level builder for one gateway operation (sendSingleSMS, sendBulkSMS, ...).
+
+    Args:
+        operation: SOAP operation element name
+        username, password, senderid, templateid: Static gateway fields
+    """
+
+    CONTENT_TYPE = "application/soap+xml; charset=utf-8"
+
+    def __init__(self, operation: str, username=None, password=None, senderid=None, templateid=None):
+        self.operation = operation
+        op = operation.encode('utf-8')
+        self._prefix = b''.join((
+            b'<?xml version="1.0" encoding="utf-8"?>\n'
+            b'<soap12:Envelope xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"\n'
+            b'                 xmlns:xsd="http://www.w3.org/2001/XMLSchema"\n'
+            b'                 xmlns:soap12="http://www.w3.org/2003/05/soap-envelope">\n'
+            b'  <soap12:Body>\n'
+            b'    <', op, b' xmlns="http://tempuri.org/">\n'
+            b'      <username>', _escape(username), b'</username>\n'
+            b'      <password>', _escape(password), b'</password>\n'
+            b'      <senderid>', _escape(senderid), b'</senderid>\n'
+            b'      <mobileNos>',
+        ))
+        self._middle = b'</mobileNos>\n      <message>'
+        self._suffix = b''.join((
+            b'</message>\n'
+            b'      <templateid1>', _escape(templateid), b'</templateid1>\n'
+            b'    </', op, b'>\n'
+            b'  </soap12:Body>\n'
+            b'</soap12:Envelope>',
+        ))
+
+    def build(self, mobiles: Union[str, Iterable[str]], message: str) -> bytes:
+        """
+        Serialize one envelope. `mobiles` is a single number or an iterable of numbers
+        (sent comma-separated in mobileNos).
+        """
+        if not isinstance(mobiles, str):
+            mobiles = ",".join(mobiles)
+        return b''.join((self._prefix, _escape(mobiles), self._middle, _escape(message), self._suffix))
+
+    def headers(self, body: bytes) -> dict:
+        return {"Content-Type": self.CONTENT_TYPE, "Content-Length": str(len(body))}
@@ -0,0 +1,268 @@
+"""
+Process-wide pooled HTTP client for the SOAP SMS gateway.
+
+Every SMS used to open a fresh requests.Session, paying a new TCP + TLS
+handshake to OTP_SERVER per message. This module keeps a single keep-alive
+pool per process instead. The pool is rebuilt transparently after fork()
+(gunicorn / Celery prefork) so sockets are never shared between processes.
+"""
+import os
+import threading
+import logging
+import time
+
+import requests
+from flask import current_app, has_app_context
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from app.extensions import (
+    sms_gateway_requests_counter,
+    sms_gateway_pool_connections_gauge,
+    sms_gateway_pool_requests_gauge,
+    sms_gateway_pool_reuse_ratio_gauge,
+    sms_gateway_pool_idle_gauge,
+    sms_gateway_concurrency_limit_gauge,
+    sms_gateway_in_flight_gauge,
+    sms_gateway_latency_p95_gauge,
+    sms_gateway_timeout_gauge,
+)
+from app.utils.circuit_breaker import CircuitOpenError, get_breaker, breaker_enabled
+from app.utils.adaptive_concurrency import AdaptiveLimiter
+
+logger = logging.getLogger('sms')
+
+
+class GatewayBusyError(requests.RequestException):
+    """Raised when no dispatch slot frees up within the acquire timeout."""
+
+
+def _config(name: str, default=None):
+    """
+    Read gateway config from the Flask app if available, otherwise from the environment.
+    """
+    if has_app_context():
+        return current_app.config.get(name, default)
+    return os.getenv(name, default)
+
+
+class SMSGatewayClient:
+    """
+    Thread-safe, fork-safe wrapper around a pooled requests.Session.
+
+    Args:
+        pool_connections: Number of per-host connection pools to cache
+        pool_maxsize: Maximum keep-alive connections kept per host
+        retries: urllib3 retry budget for connect errors (and read/5xx errors on GET)
+        backoff_factor: urllib3 retry backoff factor
+        max_in_flight: Initial concurrent gateway requests in this process (1 = serial)
+        acquire_timeout: Seconds to wait for a free dispatch slot before GatewayBusyError
+        limiter: AdaptiveLimiter that moves the in-flight limit with gateway latency;
+            defaults to a fixed limit of max_in_flight
+    """
+
+    def __init__(self, pool_connections: int = 4, pool_maxsize: int = 16, retries: int = 2,
+                 backoff_factor: float = 0.3, status_forcelist=(500, 502, 503, 504),
+                 max_in_flight: int = 8, acquire_timeout: float = 30, limiter: AdaptiveLimiter = None):
+        self.pool_connections = pool_connections
+        self._slots = limiter or AdaptiveLimiter(initial=max_in_flight, min_limit=max_in_flight,
+                                                 max_limit=max_in_flight)
+        # Never let in-flight requests outnumber pooled connections, or the
+        # overflow would open (and discard) throwaway connections.
+        self.pool_maxsize = max(pool_maxsize, self._slots.max_limit)
+        self.acquire_timeout = acquire_timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.status_forcelist = status_forcelist
+        self._lock = threading.Lock()
+        self._pid = None
+        self._session = None
+        self._adapter = None
+
+    @property
+    def limiter(self) -> AdaptiveLimiter:
+        return self._slots
+
+    def _build_session(self):
+        s = requests.Session()
+        # Sends are POSTs, retried only when the connection could not be made: after a read
+        # error or a 5xx the gateway may already have accepted the SMS, and a retry would
+        # deliver it twice (urllib3 retries connect errors for any method)
+        retry = Retry(
+            total=self.retries,
+            read=self.retries,
+            connect=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=self.status_forcelist,
+            allowed_methods=frozenset(["GET"])
+        )
+        adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                              pool_maxsize=self.pool_maxsize,
+                              max_retries=retry,
+                              pool_block=False)
+        s.mount("http://", adapter)
+        s.mount("https://", adapter)
+        return s, adapter
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        Return the session for the current process, rebuilding it after fork().
+        """
+        pid = os.getpid()
+        if self._session is None or self._pid != pid:
+            with self._lock:
+                if self._session is None or self._pid != pid:
+                    if self._pid is not None and self._pid != pid:
+                        # Inherited from the parent: drop references without closing
+                        # the parent's sockets.
+                        logger.info("SMS gateway pool re-created after fork (pid %s)", pid)
+                    self._session, self._adapter = self._build_session()
+                    self._pid = pid
+        return self._session
+
+    def post(self, url: str, data: bytes, headers: dict, timeout, gateway: str = 'default') -> requests.Response:
+        """
+        POST a request through the shared pool, holding one dispatch slot for its duration.
+        Raises requests exceptions unchanged, GatewayBusyError if no slot frees up, or
+        CircuitOpenError if the breaker for `gateway` is open.
+        """
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            sms_gateway_requests_counter.labels(outcome='busy').inc()
+            raise GatewayBusyError(f"No SMS dispatch slot free after {self.acquire_timeout}s")
+        breaker = get_breaker(gateway) if breaker_enabled() else None
+        started = time.monotonic()
+        latency, failed = None, True
+        try:
+            if breaker is not None:
+                breaker.before_call()
+            resp = self.session.post(url, data=data, headers=headers, timeout=timeout)
+            latency, failed = time.monotonic() - started, resp.status_code >= 500
+        except CircuitOpenError:
+            sms_gateway_requests_counter.labels(outcome='circuit_open').inc()
+            raise
+        except requests.RequestException:
+            latency = time.monotonic() - started
+            sms_gateway_requests_counter.labels(outcome='error').inc()
+            if breaker is not None:
+                breaker.record(failed=True, elapsed=latency)
+            raise
+        finally:
+            self._slots.release(latency, failed)
+        if breaker is not None:
+            breaker.record(failed=failed, elapsed=latency)
+        sms_gateway_requests_counter.labels(outcome='ok' if resp.status_code == 200 else 'http_error').inc()
+        return resp
+
+    def pool_stats(self) -> dict:
+        """
+        Connection pool statistics for this process.
+
+        connections_opened counts TCP (+TLS) connections actually established;
+        requests counts requests served. Their ratio is the reuse rate.
+        """
+        opened = 0
+        served = 0
+        idle = 0
+        adapter = self._adapter if self._pid == os.getpid() else None
+        if adapter is not None:
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                opened += pool.num_connections
+                served += pool.num_requests
+                idle += sum(1 for c in list(pool.pool.queue) if c is not None) if pool.pool else 0
+        reuse = (1 - opened / served) if served else 0.0
+        return {
+            'connections_opened': opened,
+            'requests': served,
+            'idle_connections': idle,
+            'reuse_ratio': max(reuse, 0.0),
+            'pool_maxsize': self.pool_maxsize,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._session is not None and self._pid == os.getpid():
+                self._session.close()
+            self._session = None
+            self._adapter = None
+            self._pid = None
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_gateway_client() -> SMSGatewayClient:
+    """
+    Return the process-wide gateway client, creating it from config on first use.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SMSGatewayClient(
+                    pool_connections=int(_config('SMS_GATEWAY_POOL_CONNECTIONS', 4)),
+                    pool_maxsize=int(_config('SMS_GATEWAY_POOL_MAXSIZE', 16)),
+                    retries=int(_config('SMS_GATEWAY_RETRIES', 2)),
+                    acquire_timeout=float(_config('SMS_DISPATCH_ACQUIRE_TIMEOUT', 30)),
+                    limiter=build_limiter(),
+                )
+    return _client
+
+
+def build_limiter(initial: int = None, max_limit: int = None) -> AdaptiveLimiter:
+    """
+    AdaptiveLimiter configured from SMS_DISPATCH_* / SMS_ADAPTIVE_*. With
+    SMS_ADAPTIVE_CONCURRENCY off the limit stays at `initial` (SMS_DISPATCH_CONCURRENCY).
+    """
+    if initial is None:
+        initial = int(_config('SMS_DISPATCH_CONCURRENCY', 8))
+    if max_limit is None:
+        max_limit = int(_config('SMS_DISPATCH_MAX_CONCURRENCY', 64))
+    adaptive = _config('SMS_ADAPTIVE_CONCURRENCY', 'True')
+    if isinstance(adaptive, str):
+        adaptive = adaptive == 'True'
+    return AdaptiveLimiter(
+        initial=initial,
+        min_limit=int(_config('SMS_DISPATCH_MIN_CONCURRENCY', 1)) if adaptive else initial,
+        max_limit=max_limit if adaptive else initial,
+        target_p95=float(_config('SMS_ADAPTIVE_TARGET_P95', 2.0)),
+        max_error_rate=float(_config('SMS_ADAPTIVE_MAX_ERROR_RATE', 0.05)),
+        backoff=float(_config('SMS_ADAPTIVE_BACKOFF', 0.7)),
+        window=int(_config('SMS_ADAPTIVE_WINDOW', 20)),
+        min_timeout=float(_config('SMS_GATEWAY_MIN_TIMEOUT', 2)),
+        max_timeout=float(_config('SMS_GATEWAY_TIMEOUT', 30)),
+        timeout_multiplier=float(_config('SMS_ADAPTIVE_TIMEOUT_MULTIPLIER', 3)),
+    )
+
+
+def get_gateway_timeout():
+    """
+    (connect, read) timeout tuple for gateway requests. The read timeout follows observed
+    gateway latency (see AdaptiveLimiter.timeout), capped at SMS_GATEWAY_TIMEOUT.
+    """
+    return (float(_config('SMS_GATEWAY_CONNECT_TIMEOUT', 5)), get_gateway_client().limiter.timeout())
+
+
+def _stat(name):
+    return lambda: get_gateway_client().pool_stats()[name] if _client is not None else 0
+
+
+sms_gateway_pool_connections_gauge.set_function(_stat('connections_opened'))
+sms_gateway_pool_requests_gauge.set_function(_stat('requests'))
+sms_gateway_pool_reuse_ratio_gauge.set_function(_stat('reuse_ratio'))
+sms_gateway_pool_idle_gauge.set_function(_stat('idle_connections'))
+
+
+def _limiter_stat(name):
+    return lambda: get_gateway_client().limiter.stats()[name] if _client is not None else 0
+
+
+sms_gateway_concurrency_limit_gauge.set_function(_limiter_stat('limit'))
+sms_gateway_in_flight_gauge.set_function(_limiter_stat('in_flight'))
+sms_gateway_latency_p95_gauge.set_function(_limiter_stat('latency_p95'))
+sms_gateway_timeout_gauge.set_function(_limiter_stat('timeout'))
@@ -0,0 +1,226 @@
+"""
+Pool of SOAP gateway accounts/endpoints.
+
+SMS_GATEWAYS (JSON list) defines the members; each has its own URL,
+credentials, TPS cap and circuit breaker. Every message picks a member by
+weighted random choice over the healthy ones that have TPS budget left, with
+weight = configured weight x capacity / smoothed latency, so faster and
+larger accounts take a proportionally bigger share. TPS budgets are
+cluster-wide token buckets (app/utils/rate_governor.py). If a member's breaker is
+open, or the request never reaches it, the send fails over to the next one.
+
+Without SMS_GATEWAYS the pool has a single 'default' member built from OTP_*.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Iterable, List, Optional
+
+from flask import current_app, has_app_context
+
+from app.utils.circuit_breaker import get_breaker, breaker_enabled
+from app.utils.rate_governor import RateGovernor
+from app.utils.sms_envelope import SOAPEnvelopeBuilder
+
+logger = logging.getLogger('sms')
+
+_EXTENSION_KEY = 'sms_gateway_pool'
+
+# Capacity assumed for members without a TPS cap when weighting
+_UNCAPPED_CAPACITY = 100.0
+# Latency floor so a member with tiny latency doesn't take all traffic
+_MIN_LATENCY = 0.05
+
+
+def _config(name: str, default=None):
+    if has_app_context():
+        return current_app.config.get(name, default)
+    return os.getenv(name, default)
+
+
+class GatewayMember:
+    """
+    One gateway account/endpoint.
+
+    Args:
+        name: Unique member name (breaker key and metric label)
+        url: SOAP endpoint
+        username, password, senderid, templateid: Account credentials
+        tps: Account TPS cap (0 = uncapped), shared cluster-wide through Redis
+        (split across `processes` sending processes when Redis is down)
+        weight: Static preference multiplier
+        processes: Number of processes sharing this account's TPS budget
+    """
+
+    def __init__(self, name: str, url: str, username=None, password=None, senderid=None,
+                 templateid=None, tps: float = 0, weight: float = 1.0, processes: int = 1):
+        self.name = name
+        self.url = url
+        self.username = username
+        self.password = password
+        self.senderid = senderid
+        self.templateid = templateid
+        self.tps = float(tps or 0)
+        self.weight = float(weight)
+        self._bucket = RateGovernor(f"sms:{name}", self.tps, processes=processes)
+        self._builders = {}
+        self._latency = None
+        self._lock = threading.Lock()
+
+    def builder(self, operation: str, senderid: str = None) -> SOAPEnvelopeBuilder:
+        """
+        Precompiled envelope builder for this member's credentials, optionally with a
+        routed sender id instead of the member's own.
+        """
+        key = (operation, senderid)
+        builder = self._builders.get(key)
+        if builder is None:
+            builder = self._builders[key] = SOAPEnvelopeBuilder(
+                operation, username=self.username, password=self.password,
+                senderid=senderid or self.senderid, templateid=self.templateid)
+        return builder
+
+    @property
+    def latency(self) -> float:
+        return self._latency if self._latency is not None else 1.0
+
+    def observe(self, latency: float, alpha: float = 0.2):
+        """
+        Fold a request latency into the member's EWMA.
+        """
+        with self._lock:
+            self._latency = latency if self._latency is None else (1 - alpha) * self._latency + alpha * latency
+
+    def available(self) -> bool:
+        return not breaker_enabled() or get_breaker(self.name).retry_after() == 0
+
+    def score(self) -> float:
+        capacity = self.tps or _UNCAPPED_CAPACITY
+        return self.weight * capacity / max(self.latency, _MIN_LATENCY)
+
+    def to_dict(self) -> dict:
+        return {'name': self.name, 'url': self.url, 'tps': self.tps, 'weight': self.weight,
+                'latency_ewma': self._latency, 'available': self.available()}
+
+
+class GatewayPool:
+    """
+    Weighted, TPS-aware selection over GatewayMembers.
+
+    Args:
+        members: Pool members
+        max_wait: Longest time select() sleeps for TPS budget before giving up
+    """
+
+    def __init__(self, members: List[GatewayMember], max_wait: float = 1.0):
+        self.members = members
+        self.max_wait = max_wait
+
+    def _candidates(self, exclude, only):
+        return [m for m in self.members
+                if m.name not in exclude and (not only or m.name in only) and m.available()]
+
+    def select(self, exclude: Iterable[str] = (), cost: float = 1.0, max_wait: float = None,
+               only: Iterable[str] = ()) -> Optional[GatewayMember]:
+        """
+        Pick a member for a request costing `cost` TPS tokens (recipients in the envelope),
+        restricted to the names in `only` when given (routing).
+        Returns None if every healthy member is out of budget for longer than `max_wait`
+        (default: the pool's max_wait), or no healthy member remains.
+        """
+        deadline = time.monotonic() + (self.max_wait if max_wait is None else max_wait)
+        while True:
+            candidates = self._candidates(exclude, only)
+            if not candidates:
+                return None
+            # Weighted random order; first member with budget wins
+            remaining = list(candidates)
+            while remaining:
+                weights = [m.score() for m in remaining]
+                member = random.choices(remaining, weights=weights)[0]
+                if member._bucket.try_take(cost):
+                    return member
+                remaining.remove(member)
+            wait = min(m._bucket.wait_time(cost) for m in candidates)
+            if time.monotonic() + wait > deadline:
+                return None
+            time.sleep(wait)
+
+    def budget_wait(self, exclude: Iterable[str] = (), cost: float = 1.0,
+                    only: Iterable[str] = ()) -> Optional[float]:
+        """
+        Seconds until some healthy member has TPS budget for `cost`, or None if no healthy
+        member remains (for callers that cannot block in select()).
+        """
+        waits = [m._bucket.wait_time(cost) for m in self._candidates(exclude, only)]
+        return min(waits) if waits else None
+
+    def retry_after(self) -> float:
+        """
+        Seconds until some member's breaker allows traffic again (0 if any is available).
+        """
+        if not breaker_enabled():
+            return 0.0
+        return min((get_breaker(m.name).retry_after() for m in self.members), default=0.0)
+
+    def stats(self) -> List[dict]:
+        return [m.to_dict() for m in self.members]
+
+
+def _load_members() -> List[GatewayMember]:
+    processes = int(_config('SMS_GATEWAY_PROCESSES', 1))
+    defaults = {
+        'url': _config('OTP_SERVER'),
+        'username': _config('OTP_USERNAME'),
+        'password': _config('OTP_PASSWORD'),
+        'senderid': _config('OTP_SENDERID'),
+        'templateid': _config('OTP_ID'),
+    }
+    raw = _config('SMS_GATEWAYS')
+    if not raw:
+        if not defaults['url']:
+            return []
+        return [GatewayMember('default', processes=processes, tps=float(_config('OTP_TPS', 0) or 0), **defaults)]
+
+    entries = json.loads(raw) if isinstance(raw, str) else raw
+    members = []
+    for i, entry in enumerate(entries):
+        fields = {**defaults, **{k: v for k, v in entry.items() if k in defaults}}
+        if not fields['url']:
+            raise ValueError(f"SMS_GATEWAYS entry {i} has no url")
+        members.append(GatewayMember(
+            entry.get('name') or f"gateway{i}",
+            tps=entry.get('tps', 0),
+            weight=entry.get('weight', 1.0),
+            processes=processes,
+            **fields,
+        ))
+    return members
+
+
+_process_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_gateway_pool() -> GatewayPool:
+    """
+    Return the gateway pool, built from config on first use and cached per Flask app
+    (or per process outside an app context).
+    """
+    global _process_pool
+    if has_app_context():
+        pool = current_app.extensions.get(_EXTENSION_KEY)
+    else:
+        pool = _process_pool
+    if pool is None:
+        with _pool_lock:
+            pool = GatewayPool(_load_members(), max_wait=float(_config('SMS_GATEWAY_MAX_WAIT', 1.0)))
+            if has_app_context():
+                current_app.extensions[_EXTENSION_KEY] = pool
+            else:
+                _process_pool = pool
+            logger.info(f"SMS gateway pool: {[m.name for m in pool.members]}")
+    return pool
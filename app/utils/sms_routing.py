@@ -0,0 +1,189 @@
+"""
+Prefix-based SMS routing.
+
+Routes map a number prefix (country or operator code) to the gateway pool
+members allowed to carry it and, optionally, a sender id override. They come
+from SMS_ROUTES (JSON) and the sms_routes table (DB rows win on the same
+prefix), and are compiled into a digit trie so every send does an
+O(number length) longest-prefix match. The compiled table is cached per
+process and rebuilt every SMS_ROUTES_RELOAD_SECONDS or on reload_routing_table().
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from flask import current_app, has_app_context
+
+logger = logging.getLogger('sms')
+
+
+def _config(name: str, default=None):
+    if has_app_context():
+        return current_app.config.get(name, default)
+    return os.getenv(name, default)
+
+
+def normalize_number(mobile: str) -> str:
+    """
+    Digits used for prefix matching: strips whitespace, a leading '+' or international '00'.
+    """
+    digits = str(mobile).strip()
+    if digits.startswith('+'):
+        return digits[1:]
+    if digits.startswith('00'):
+        return digits[2:]
+    return digits
+
+
+class Route:
+    """
+    One routing rule.
+
+    Args:
+        name: Route name recorded on SMSMessage.route
+        prefix: Digit prefix matched against the normalized number
+        gateways: Pool member names allowed for this route (empty = any member)
+        senderid: Sender id override (None = the member's own)
+    """
+
+    __slots__ = ('name', 'prefix', 'gateways', 'senderid')
+
+    def __init__(self, name: str, prefix: str, gateways: Iterable[str] = (), senderid: str = None):
+        if not prefix or not str(prefix).isdigit():
+            raise ValueError(f"Route prefix must be digits, got {prefix!r}")
+        self.name = name or f"prefix-{prefix}"
+        self.prefix = str(prefix)
+        self.gateways = tuple(gateways or ())
+        self.senderid = senderid or None
+
+    def to_dict(self) -> dict:
+        return {'name': self.name, 'prefix': self.prefix, 'gateways': list(self.gateways), 'senderid': self.senderid}
+
+
+class PrefixTrie:
+    """Digit trie returning the longest matching prefix's value."""
+
+    _VALUE = '$'
+
+    def __init__(self):
+        self._root = {}
+        self._size = 0
+
+    def insert(self, prefix: str, value):
+        node = self._root
+        for ch in prefix:
+            node = node.setdefault(ch, {})
+        if self._VALUE not in node:
+            self._size += 1
+        node[self._VALUE] = value
+
+    def longest_match(self, key: str):
+        node = self._root
+        best = node.get(self._VALUE)
+        for ch in key:
+            node = node.get(ch)
+            if node is None:
+                break
+            best = node.get(self._VALUE, best)
+        return best
+
+    def __len__(self):
+        return self._size
+
+
+class RoutingTable:
+    """
+    Compiled routes plus lookup.
+    """
+
+    def __init__(self, routes: List[Route]):
+        self.routes = routes
+        self._trie = PrefixTrie()
+        for route in routes:
+            self._trie.insert(route.prefix, route)
+        self.loaded_at = time.monotonic()
+
+    def lookup(self, mobile: str) -> Optional[Route]:
+        return self._trie.longest_match(normalize_number(mobile))
+
+    def route_name(self, mobile: str) -> Optional[str]:
+        route = self.lookup(mobile)
+        return route.name if route else None
+
+    def __len__(self):
+        return len(self._trie)
+
+
+def _config_routes() -> List[Route]:
+    raw = _config('SMS_ROUTES')
+    if not raw:
+        return []
+    entries = json.loads(raw) if isinstance(raw, str) else raw
+    return [Route(e.get('name'), e.get('prefix'), e.get('gateways') or (), e.get('senderid')) for e in entries]
+
+
+def _db_routes() -> List[Route]:
+    if not has_app_context():
+        return []
+    from app.models.sms_route import SMSRoute  # lazy import
+
+    try:
+        rows = SMSRoute.query.filter(SMSRoute.active.is_(True)).all()
+    except Exception as e:
+        # Table missing (not migrated yet) or DB unavailable: run on config routes only
+        logger.warning(f"SMS routes not loaded from DB: {e}")
+        from app.extensions import db
+        db.session.rollback()
+        return []
+    return [row.to_route() for row in rows]
+
+
+def load_routing_table() -> RoutingTable:
+    """
+    Build a fresh table from SMS_ROUTES and the sms_routes table; DB rows win on the same prefix.
+    """
+    by_prefix: Dict[str, Route] = {}
+    for route in _config_routes() + _db_routes():
+        by_prefix[route.prefix] = route
+    table = RoutingTable(list(by_prefix.values()))
+    logger.info(f"SMS routing table loaded: {len(table)} prefixes")
+    return table
+
+
+_table = None
+_table_lock = threading.Lock()
+
+
+def get_routing_table() -> RoutingTable:
+    """
+    Process-wide routing table, rebuilt after SMS_ROUTES_RELOAD_SECONDS (0 = never).
+    """
+    global _table
+    ttl = float(_config('SMS_ROUTES_RELOAD_SECONDS', 60))
+    table = _table
+    if table is None or (ttl > 0 and time.monotonic() - table.loaded_at > ttl):
+        with _table_lock:
+            if _table is table:
+                try:
+                    _table = load_routing_table()
+                except Exception as e:
+                    if table is None:
+                        raise
+                    # Keep serving the previous table if a reload fails
+                    logger.error(f"SMS routing table reload failed, keeping previous table: {e}")
+                    table.loaded_at = time.monotonic()
+            table = _table
+    return table
+
+
+def reload_routing_table() -> RoutingTable:
+    """
+    Rebuild the table now (after editing routes).
+    """
+    global _table
+    with _table_lock:
+        _table = load_routing_table()
+    return _table
@@ -1,7 +1,7 @@
 from flask import current_app as app
-import requests
 import re
-from time import time
+from app.utils.sms_util import check_and_mark_throttle, send_envelope, sending_disabled
+from app.utils.sms_routing import get_routing_table
 
 def send_sms(mobile, message):
     """
@@ -34,85 +34,24 @@ def send_sms(mobile, message):
         app.logger.error(f"Failed SMS delivery: mobile={mobile}, reason=forbidden_content")
         return 400
 
-    # Improved rate limiting (per mobile number, 1 SMS per 10 seconds)
-    if not hasattr(app, "sms_rate_limit"): app.sms_rate_limit = {}
-    now = time()
-    last_sent = app.sms_rate_limit.get(mobile, 0)
-    if now - last_sent < 10:
+    # Improved rate limiting (per mobile number, 1 SMS per 10 seconds), shared with sms_util
+    if not check_and_mark_throttle(mobile):
         app.logger.warning(f"Rate limit exceeded for mobile {mobile}")
         app.logger.error(f"Failed SMS delivery: mobile={mobile}, reason=rate_limit_exceeded")
         return 429
-    app.sms_rate_limit[mobile] = now
-
-    # SMS service config
-    username = app.config.get('OTP_USERNAME')
-    password = app.config.get('OTP_PASSWORD')
-    senderid = app.config.get('OTP_SENDERID')
-    templateid = app.config.get('OTP_ID')
-    url = app.config.get('OTP_SERVER')
-
-    # SOAP Envelope (SOAP 1.2)
-    soap_body = f"""<?xml version="1.0" encoding="utf-8"?>
-    <soap12:Envelope xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" 
-                     xmlns:xsd="http://www.w3.org/2001/XMLSchema" 
-                     xmlns:soap12="http://www.w3.org/2003/05/soap-envelope">
-        <soap12:Body>
-            <sendSingleSMS xmlns="http://tempuri.org/">
-                <username>{username}</username>
-                    <password>{password}</password>
-                    <senderid>{senderid}</senderid>
-                    <mobileNos>{mobile}</mobileNos>
-                    <message>{message}</message>
-                    <templateid1>{templateid}</templateid1>
-                </sendSingleSMS>
-            </soap12:Body>
-        </soap12:Envelope>"""
-
-    headers = {
-        "Content-Type": "application/soap+xml; charset=utf-8",
-        "Content-Length": str(len(soap_body))
-    }
 
     # Skip real sending if:
     # - In testing mode
     # - OTP_FLAG is False
-    # - Required gateway URL not configured
-    if app.config.get('TESTING') or not app.config.get('OTP_FLAG') or not url:
+    # - No gateway configured (OTP_SERVER / SMS_GATEWAYS)
+    if sending_disabled():
         app.logger.info("SMS skipped (testing/disabled/missing URL). Returning 200 for mobile %s", mobile)
         return 200
 
-    try:
-        app.logger.info(
-            f"Sending SOAP SMS request to {url} for mobile {mobile}")
-
-        # Added timeout to prevent indefinite hanging
-        response = requests.post(
-            url, data=soap_body.encode('utf-8'), headers=headers, timeout=30)
-
-        app.logger.info(f"SOAP SMS sent. Status: {response.status_code}")
-        if response.status_code != 200:
-            app.logger.warning(
-                f"Failed to send SOAP SMS. Status: {response.status_code}, Response: {response.text}"
-            )
-            # Log failed SMS delivery attempt
-            app.logger.error(f"Failed SMS delivery: mobile={mobile}, status={response.status_code}, response={response.text}")
-        return response.status_code
-
-    except requests.Timeout:
-        app.logger.error(
-            f"Timeout sending SOAP SMS to {mobile}: request timed out after 30 seconds")
-        # Log failed SMS delivery attempt
-        app.logger.error(f"Failed SMS delivery: mobile={mobile}, reason=timeout")
-        return 408  # Request Timeout
-    except requests.ConnectionError:
-        app.logger.error(
-            f"Connection error sending SOAP SMS to {mobile}: could not connect to server")
-        # Log failed SMS delivery attempt
-        app.logger.error(f"Failed SMS delivery: mobile={mobile}, reason=connection_error")
-        return 502  # Bad Gateway
-    except requests.RequestException as e:
-        app.logger.error(
-            f"Error sending SOAP SMS to {mobile}: {e}")
+    # Pool member selection, failover and error mapping are shared with sms_util
+    status_code, reason = send_envelope('sendSingleSMS', str(mobile), message, mobile,
+                                        route=get_routing_table().lookup(mobile))
+    if status_code != 200:
         # Log failed SMS delivery attempt
-        app.logger.error(f"Failed SMS delivery: mobile={mobile}, error={e}")
-        return 500
+        app.logger.error(f"Failed SMS delivery: mobile={mobile}, status={status_code}, reason={reason}")
+    return status_code
@@ -3,17 +3,24 @@ import time
 import logging
 import re
 import os
-from typing import Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 
 from cryptography.fernet import Fernet, InvalidToken
 from flask import current_app, has_app_context
-from xml.sax.saxutils import escape as xml_escape
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
 
-# Thread lock for SMS sending (per-process)
-sms_send_lock = threading.Lock()
+from app.utils.sms_gateway import get_gateway_client, get_gateway_timeout, GatewayBusyError
+from app.utils.circuit_breaker import CircuitOpenError
+from app.utils.sms_envelope import SOAPEnvelopeBuilder
+from app.utils.sms_gateway_pool import get_gateway_pool
+from app.utils.sms_routing import Route, get_routing_table
+
+# Guards the per-mobile throttle map. The gateway call itself is bounded by the
+# gateway client's dispatch slots (SMS_DISPATCH_CONCURRENCY), not by this lock.
+_throttle_lock = threading.Lock()
+_PROCESS_SMS_RATE_LIMIT = {}
 
 # Phone regex: allow 6-16 digits (you used this; adjust as needed)
 PHONE_RE = re.compile(r"^\d{6,16}$")
@@ -56,34 +63,41 @@ def _get_config_value(name: str, default=None):
     return os.getenv(name, default)
 
 
-def _create_requests_session(retries: int = 2, backoff_factor: float = 0.3, status_forcelist=(500, 502, 503, 504)):
-    s = requests.Session()
-    retry = Retry(
-        total=retries,
-        read=retries,
-        connect=retries,
-        backoff_factor=backoff_factor,
-        status_forcelist=status_forcelist,
-        allowed_methods=frozenset(["GET", "POST"])
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    s.mount("http://", adapter)
-    s.mount("https://", adapter)
-    return s
+def check_and_mark_throttle(mobile: str, window: float = 10) -> bool:
+    """
+    Per-process throttle: allow one SMS per mobile every `window` seconds.
+    Returns True (and records the send) if allowed, False if throttled.
+    """
+    if has_app_context():
+        rate_store = getattr(current_app, "sms_rate_limit", None)
+        if rate_store is None:
+            rate_store = current_app.sms_rate_limit = {}
+    else:
+        rate_store = _PROCESS_SMS_RATE_LIMIT
+    with _throttle_lock:
+        now = time.time()
+        if now - rate_store.get(mobile, 0) < window:
+            return False
+        rate_store[mobile] = now
+        return True
 
 
-def _xml_escape_params(**kwargs) -> dict:
+def _map_concurrently(fn, items, workers: int):
     """
-    XML-escape all string params to avoid breaking SOAP body or allowing XML injection.
-    Non-strings are converted to str() then escaped.
+    map(fn, items) on up to `workers` threads, each running inside the caller's app context.
     """
-    escaped = {}
-    for k, v in kwargs.items():
-        if v is None:
-            escaped[k] = ""
-        else:
-            escaped[k] = xml_escape(str(v))
-    return escaped
+    if workers <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    app = current_app._get_current_object() if has_app_context() else None
+
+    def call(item):
+        if app is None:
+            return fn(item)
+        with app.app_context():
+            return fn(item)
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as pool:
+        return list(pool.map(call, items))
 
 
 def _is_forbidden(message: str) -> bool:
@@ -99,114 +113,208 @@ def send_single_sms_util(mobile: str, message: str) -> Tuple[int, str]:
     Send a single SMS; returns (status_code, message).
     Keeps previous behavior but:
       - safer Fernet lazy init if you need encryption
-      - XML-escapes payload
-      - uses a retrying requests session
+      - XML-escapes payload via the shared precompiled envelope builder
+      - uses the process-wide pooled gateway client (keep-alive, retries)
+      - picks a gateway account from the pool (SMS_GATEWAYS) and fails over between them
+      - runs concurrently: only the throttle map is locked, and in-flight
+        gateway requests are bounded by SMS_DISPATCH_CONCURRENCY
       - checks app context and falls back to env-based config
     """
-    with sms_send_lock:
-        logger = logging.getLogger('sms')
-        logger.info("Processing single SMS to %s", mobile)
+    logger = logging.getLogger('sms')
+    logger.info("Processing single SMS to %s", mobile)
+
+    # Basic validations
+    if not PHONE_RE.match(str(mobile)):
+        logger.warning("Invalid phone number: %s", mobile)
+        return 400, "invalid_phone"
+
+    if not isinstance(message, str) or not (1 <= len(message) <= 500):
+        logger.warning("Invalid message length for mobile %s", mobile)
+        return 400, "invalid_message_length"
+
+    if _is_forbidden(message):
+        logger.warning(
+            "Forbidden content in SMS message for mobile %s", mobile)
+        return 400, "forbidden_content"
+
+    # Per-mobile throttle - the only shared state on this path, so the only thing locked.
+    if not check_and_mark_throttle(mobile):
+        logger.warning("Rate limit exceeded for mobile %s", mobile)
+        return 429, "rate_limit_exceeded"
+
+    # Skip sending if configured to skip
+    if sending_disabled():
+        logger.info(
+            "SMS skipped (testing/disabled/missing URL) for mobile %s", mobile)
+        return 200, "skipped"
+
+    return send_envelope('sendSingleSMS', mobile, message, mobile, route=get_routing_table().lookup(mobile))
+
+
+def sending_disabled() -> bool:
+    """
+    True when real gateway calls are off: TESTING, OTP_FLAG false, or no gateway configured.
+    """
+    otp_flag = _get_config_value('OTP_FLAG', False)
+    testing = _get_config_value('TESTING', False)
+    return bool(testing) or not bool(otp_flag) or not get_gateway_pool().members
+
+
+# Outcomes where the request never reached the gateway, so another member can safely take it.
+# A connection dropped or timed out after the envelope was sent is not one of them: the
+# gateway may have accepted it, and failing over would deliver the SMS twice.
+_FAILOVER_OUTCOMES = {"circuit_open", "gateway_busy", "connect_error"}
+
+
+def _never_connected(exc: requests.RequestException) -> bool:
+    """
+    True if the request failed while connecting (refused, DNS, connect timeout), before
+    anything was sent.
+    """
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    reason = exc.args[0] if exc.args else None
+    reason = getattr(reason, 'reason', reason)  # MaxRetryError wraps the last urllib3 error
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
 
-        # Basic validations
-        if not PHONE_RE.match(str(mobile)):
-            logger.warning("Invalid phone number: %s", mobile)
-            return 400, "invalid_phone"
 
-        if not isinstance(message, str) or not (1 <= len(message) <= 500):
-            logger.warning("Invalid message length for mobile %s", mobile)
-            return 400, "invalid_message_length"
+def send_envelope(operation: str, mobiles, message: str, target: str,
+                  route: Optional[Route] = None) -> Tuple[int, str]:
+    """
+    Send one envelope (one or many comma-joined recipients) through the gateway pool.
+    Each attempt picks a member by weight/TPS budget (limited to the route's gateways,
+    with the route's sender id); outcomes where the request was not accepted fail over
+    to the next healthy member.
+    """
+    pool = get_gateway_pool()
+    cost = 1 if isinstance(mobiles, str) else len(mobiles)
+    only = route.gateways if route else ()
+    senderid = route.senderid if route else None
+    tried = []
+    outcome = (503, "no_gateway_available")
+    while len(tried) < len(pool.members):
+        member = pool.select(exclude=tried, cost=cost, only=only)
+        if member is None:
+            break
+        tried.append(member.name)
+        body = member.builder(operation, senderid).build(mobiles, message)
+        started = time.monotonic()
+        outcome = _post_soap(member.url, body, target, gateway=member.name)
+        if outcome[1] not in _FAILOVER_OUTCOMES:
+            member.observe(time.monotonic() - started)
+            return outcome
+        if len(tried) < len(pool.members):
+            logging.getLogger('sms').warning(
+                "Gateway %s did not take SMS for %s (%s), failing over", member.name, target, outcome[1])
+    return outcome
+
 
-        if _is_forbidden(message):
+def _post_soap(url: str, data: bytes, target: str, gateway: str = 'default') -> Tuple[int, str]:
+    """
+    POST an encoded envelope through the pooled gateway client and map the outcome to
+    (status_code, message). `target` is only used for logging (one mobile, or a batch description);
+    `gateway` names the pool member (and its circuit breaker).
+    """
+    logger = logging.getLogger('sms')
+    headers = {
+        "Content-Type": SOAPEnvelopeBuilder.CONTENT_TYPE,
+        "Content-Length": str(len(data))
+    }
+    try:
+        logger.info(
+            "Sending SOAP SMS request to %s for mobile %s", url, target)
+        resp = get_gateway_client().post(url, data=data, headers=headers, timeout=get_gateway_timeout(),
+                                         gateway=gateway)
+        logger.info("SOAP SMS sent. Status: %s", resp.status_code)
+        if resp.status_code != 200:
             logger.warning(
-                "Forbidden content in SMS message for mobile %s", mobile)
-            return 400, "forbidden_content"
+                "Failed to send SOAP SMS. Status: %s, Response: %s", resp.status_code, resp.text)
+            return resp.status_code, "gateway_error"
+        return 200, "ok"
+    except CircuitOpenError as e:
+        logger.warning("%s; not sending to %s", e, target)
+        return 503, "circuit_open"
+    except GatewayBusyError:
+        logger.warning("All SMS dispatch slots busy, not sending to %s", target)
+        return 503, "gateway_busy"
+    except requests.ConnectionError as e:  # includes ConnectTimeout
+        if _never_connected(e):
+            logger.exception("Could not connect to SMS gateway %s for %s", gateway, target)
+            return 502, "connect_error"
+        logger.exception("Connection error sending SOAP SMS to %s", target)
+        return 502, "connection_error"
+    except requests.Timeout:
+        logger.exception("Timeout sending SOAP SMS to %s", target)
+        return 408, "timeout"
+    except requests.RequestException:
+        logger.exception(
+            "Unexpected requests error when sending SMS to %s", target)
+        return 500, "request_exception"
+    except Exception:
+        logger.exception(
+            "Unexpected error sending SOAP SMS to %s", target)
+        return 500, "internal_error"
 
-        # Rate limiting - per process fallback. Replace with Redis for multi-process deployments.
-        now = time.time()
-        if has_app_context():
-            rate_store = getattr(current_app, "sms_rate_limit", None)
-            if rate_store is None:
-                current_app.sms_rate_limit = {}
-                rate_store = current_app.sms_rate_limit
+
+def send_bulk_sms_util(mobiles: List[str], message: str) -> List[Tuple[str, int, str]]:
+    """
+    Send one message to many recipients, packing up to SMS_GATEWAY_BATCH_SIZE numbers
+    into each SOAP envelope (comma-separated mobileNos on SMS_GATEWAY_BULK_OPERATION).
+
+    Per-recipient checks (phone format, throttle) are applied before batching and
+    recipients are grouped by route. The gateway's reply to an envelope carries only an
+    HTTP status, no per-number result, so every recipient of an envelope shares that
+    outcome (all sent or all failed). Envelopes go out concurrently on up to
+    SMS_BATCH_CONCURRENCY threads (still bounded by the gateway client's in-flight limit).
+
+    Returns:
+        List of (mobile, status_code, message) in input order.
+    """
+    logger = logging.getLogger('sms')
+    logger.info("Processing bulk SMS to %s recipients", len(mobiles))
+
+    if not isinstance(message, str) or not (1 <= len(message) <= 500):
+        return [(m, 400, "invalid_message_length") for m in mobiles]
+    if _is_forbidden(message):
+        logger.warning("Forbidden content in bulk SMS message")
+        return [(m, 400, "forbidden_content") for m in mobiles]
+
+    results = [None] * len(mobiles)
+    sendable = []  # indexes into mobiles
+    for i, m in enumerate(mobiles):
+        if not PHONE_RE.match(str(m)):
+            results[i] = (400, "invalid_phone")
+        elif not check_and_mark_throttle(m):
+            results[i] = (429, "rate_limit_exceeded")
         else:
-            # process-global fallback
-            global _PROCESS_SMS_RATE_LIMIT
-            try:
-                _PROCESS_SMS_RATE_LIMIT
-            except NameError:
-                _PROCESS_SMS_RATE_LIMIT = {}
-            rate_store = _PROCESS_SMS_RATE_LIMIT
-
-        last_sent = rate_store.get(mobile, 0)
-        if now - last_sent < 10:
-            logger.warning("Rate limit exceeded for mobile %s", mobile)
-            return 429, "rate_limit_exceeded"
-        rate_store[mobile] = now
+            sendable.append(i)
+
+    operation = _get_config_value('SMS_GATEWAY_BULK_OPERATION', 'sendBulkSMS')
+    batch_size = max(int(_get_config_value('SMS_GATEWAY_BATCH_SIZE', 50)), 1)
+
+    if sending_disabled():
+        logger.info("Bulk SMS skipped (testing/disabled/missing URL) for %s recipients", len(sendable))
+        for i in sendable:
+            results[i] = (200, "skipped")
+    else:
+        # Envelopes never mix routes: each carries one route's gateway and sender id
+        routing = get_routing_table()
+        by_route = {}
+        for i in sendable:
+            route = routing.lookup(mobiles[i])
+            by_route.setdefault(route.name if route else None, (route, []))[1].append(i)
+        envelopes = [(route, indexes[start:start + batch_size])
+                     for route, indexes in by_route.values()
+                     for start in range(0, len(indexes), batch_size)]
+
+        def send(envelope):
+            route, chunk = envelope
+            return send_envelope(operation, [mobiles[i] for i in chunk], message,
+                                 f"batch of {len(chunk)}", route=route)
+
+        workers = int(_get_config_value('SMS_BATCH_CONCURRENCY', 4))
+        for (_, chunk), outcome in zip(envelopes, _map_concurrently(send, envelopes, workers)):
+            for i in chunk:
+                results[i] = outcome
 
-        # Config - prefer Flask config if available
-        username = _get_config_value('OTP_USERNAME')
-        password = _get_config_value('OTP_PASSWORD')
-        senderid = _get_config_value('OTP_SENDERID')
-        templateid = _get_config_value('OTP_ID')
-        url = _get_config_value('OTP_SERVER')
-        otp_flag = _get_config_value('OTP_FLAG', False)
-        testing = _get_config_value('TESTING', False)
-
-        # Escape params for XML safety
-        params = _xml_escape_params(username=username, password=password, senderid=senderid,
-                                    mobile=mobile, message=message, templateid=templateid)
-
-        soap_body = f"""<?xml version="1.0" encoding="utf-8"?>
-<soap12:Envelope xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
-                 xmlns:xsd="http://www.w3.org/2001/XMLSchema"
-                 xmlns:soap12="http://www.w3.org/2003/05/soap-envelope">
-  <soap12:Body>
-    <sendSingleSMS xmlns="http://tempuri.org/">
-      <username>{params['username']}</username>
-      <password>{params['password']}</password>
-      <senderid>{params['senderid']}</senderid>
-      <mobileNos>{params['mobile']}</mobileNos>
-      <message>{params['message']}</message>
-      <templateid1>{params['templateid']}</templateid1>
-    </sendSingleSMS>
-  </soap12:Body>
-</soap12:Envelope>"""
-
-        headers = {
-            "Content-Type": "application/soap+xml; charset=utf-8",
-            "Content-Length": str(len(soap_body))
-        }
-
-        # Skip sending if configured to skip
-        if testing or not bool(otp_flag) or not url:
-            logger.info(
-                "SMS skipped (testing/disabled/missing URL) for mobile %s", mobile)
-            return 200, "skipped"
-
-        session = _create_requests_session()
-
-        try:
-            logger.info(
-                "Sending SOAP SMS request to %s for mobile %s", url, mobile)
-            resp = session.post(url, data=soap_body.encode(
-                'utf-8'), headers=headers, timeout=30)
-            logger.info("SOAP SMS sent. Status: %s", resp.status_code)
-            if resp.status_code != 200:
-                logger.warning(
-                    "Failed to send SOAP SMS. Status: %s, Response: %s", resp.status_code, resp.text)
-                return resp.status_code, "gateway_error"
-            return 200, "ok"
-        except requests.Timeout:
-            logger.exception("Timeout sending SOAP SMS to %s", mobile)
-            return 408, "timeout"
-        except requests.ConnectionError:
-            logger.exception("Connection error sending SOAP SMS to %s", mobile)
-            return 502, "connection_error"
-        except requests.RequestException:
-            logger.exception(
-                "Unexpected requests error when sending SMS to %s", mobile)
-            return 500, "request_exception"
-        except Exception:
-            logger.exception(
-                "Unexpected error in send_single_sms_util for %s", mobile)
-            return 500, "internal_error"
+    return [(m, *results[i]) for i, m in enumerate(mobiles)]
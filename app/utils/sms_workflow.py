@@ -1,11 +1,18 @@
 import uuid
 import logging
-from sqlalchemy import select
+from datetime import datetime, timezone
+from typing import List, Tuple
+from sqlalchemy import select, update
 from flask import current_app
-from app.extensions import db, sms_sent_counter, sms_failed_counter, sms_queued_counter
+from app.extensions import db, sms_sent_counter, sms_failed_counter, sms_queued_counter, messages_enqueued_counter
 from app.models.sms_message import SMSMessage
 from app.tasks.sms_queue import add_to_queue_task
-from app.utils.sms_util import send_single_sms_util
+from app.tasks.sms_tasks import send_batch_and_record
+from app.tasks.queues import queue_for
+from app.tasks.outbox_relay import stage_task
+from app.utils.staging import insert_and_stage
+from app.utils.sms_util import send_single_sms_util, send_bulk_sms_util
+from app.utils.sms_routing import get_routing_table
 
 logger = logging.getLogger('sms')
 
@@ -15,12 +22,13 @@ class SMSWorkflowError(Exception):
         self.error_code = error_code
         self.http_code = http_code
 
-def process_single_sms(mobile: str, message: str, idempotency_key: str = None) -> dict:
+def process_single_sms(mobile: str, message: str, idempotency_key: str = None,
+                       priority: str = 'transactional', expires_at=None, client_id: str = 'default') -> dict:
     """
-    Orchestrates the lifecycle of a single SMS:
+    Orchestrates the lifecycle of a single SMS on the `priority` lane:
     1. Validation
-    2. DB Persistence (Queued)
-    3. Async Queueing (Celery) or Synchronous Fallback
+    2. DB Persistence (Queued), with the Celery task staged in the outbox
+    3. Synchronous send when Celery is not configured
     4. DB Update
     5. Metric Emission
     
@@ -38,16 +46,27 @@ def process_single_sms(mobile: str, message: str, idempotency_key: str = None) -
             logging.getLogger('app').info(f"Idempotent request: SMS already processed: {idempotency_key}")
             return existing.as_dict()
 
-    # 2. Create DB Record (Queued)
+    dispatcher = current_app.config.get('SMS_DISPATCH_BACKEND') == 'asyncio'
+    celery = getattr(current_app, 'celery', None)
+
+    # 2. Create DB Record (Queued), plus its outbox publish when Celery is configured
     try:
         record = SMSMessage(
             to=mobile, 
             message=message, 
             status='queued', 
             idempotency_key=idempotency_key, 
-            uuid=str(uuid.uuid4())
+            uuid=str(uuid.uuid4()),
+            route=get_routing_table().route_name(mobile),
+            priority=priority,
+            expires_at=expires_at,
+            client_id=client_id
         )
         db.session.add(record)
+        if celery and not dispatcher:
+            db.session.flush()  # id for the task arguments
+            record.task_id = stage_task(add_to_queue_task, ('process_single_sms', record.id, None),
+                                        queue=queue_for('sms', priority, record.shard_key))
         db.session.commit()
     except ValueError as e:
         db.session.rollback()
@@ -58,28 +77,19 @@ def process_single_sms(mobile: str, message: str, idempotency_key: str = None) -
         logging.getLogger('error').error(f"Database error when creating SMS record: {str(e)}")
         raise SMSWorkflowError("Internal server error", "SMS_SERVICE_ERROR", 500)
 
-    # 3. Processing (Queue vs Direct)
-    celery = getattr(current_app, 'celery', None)
-    
+    # 3. Processing (Dispatcher vs Outbox vs Direct)
+    if dispatcher:
+        # The asyncio dispatcher claims 'queued' rows straight from the table
+        sms_queued_counter.inc()
+        logger.info(f"Single SMS queued for dispatcher: {mobile}")
+        return record.as_dict()
+
     if celery:
-        try:
-            task = add_to_queue_task.delay('process_single_sms', record.id, None)
-            
-            # Update record with task_id
-            with db.session.begin():
-                row = db.session.execute(
-                    select(SMSMessage).where(SMSMessage.id == record.id).with_for_update()
-                ).scalar_one()
-                row.task_id = task.id if hasattr(task, 'id') else str(uuid.uuid4())[:16]
-            
-            sms_queued_counter.inc()
-            logger.info(f"Single SMS queued for {mobile}")
-            return record.as_dict()
-            
-        except Exception as e:
-            logging.getLogger('error').error(f"Error queuing SMS task: {str(e)}")
-            # Proceed to fallback
-            pass
+        # The outbox relay publishes it; a broker outage only delays it
+        sms_queued_counter.inc()
+        messages_enqueued_counter.labels(channel='sms', priority=priority).inc()
+        logger.info(f"Single SMS queued for {mobile} on {priority} lane")
+        return record.as_dict()
 
     # 4. Fallback (Direct Send)
     status_code, status_msg = send_single_sms_util(mobile, message)
@@ -109,3 +119,95 @@ def process_single_sms(mobile: str, message: str, idempotency_key: str = None) -
         **record.as_dict(),
         'status': 'sent' # Force status to match what we just did
     }
+
+
+def process_bulk_sms(mobiles: List[str], message: str, correlation_id: str = None,
+                     priority: str = 'bulk', expires_at=None, client_id: str = 'default',
+                     job=None) -> Tuple[list, list]:
+    """
+    Orchestrates a bulk SMS broadcast of one message on the `priority` lane, set-based:
+    1. Validation and encryption of every recipient up front (the message once)
+    2. One multi-row INSERT ... RETURNING for all rows
+    3. SMS_GATEWAY_BATCH_SIZE rows per task, staged in the outbox in the same
+       transaction, or a synchronous batched send without Celery
+    4. Metric Emission
+
+    A 200-number request costs a handful of DB round trips, and each gateway round
+    trip carries a whole batch of recipients (send_bulk_sms_util). With `job` (an
+    unsaved BulkJob, see bulk_jobs.new_job) the request is recorded as a bulk job
+    in the same transaction and its rows carry the job id.
+
+    Returns:
+        (successes, failures): lists of per-recipient dicts.
+    """
+    successes = []
+    failures = []
+
+    # 1. Validate and encrypt up front
+    routing = get_routing_table()
+    try:
+        rows, rejected = SMSMessage.bulk_values(
+            mobiles, message, status='queued', correlation_id=correlation_id,
+            priority=priority, expires_at=expires_at, client_id=client_id)
+    except ValueError as e:
+        logging.getLogger('error').error(f"SMS validation error: {str(e)}")
+        raise SMSWorkflowError(f"Invalid SMS data: {str(e)}", "SMS_SERVICE_ERROR", 400)
+    for mobile, reason in rejected:
+        logging.getLogger('error').error(f"SMS validation error: {reason}")
+        failures.append({'mobile': mobile, 'error': f"Invalid SMS data: {reason}"})
+    if not rows:
+        return successes, failures
+    for mobile, values in rows:
+        values['route'] = routing.route_name(mobile)
+
+    dispatcher = current_app.config.get('SMS_DISPATCH_BACKEND') == 'asyncio'
+    celery = getattr(current_app, 'celery', None)
+    batch_size = max(int(current_app.config.get('SMS_GATEWAY_BATCH_SIZE', 50)), 1)
+
+    # 2./3. One INSERT ... RETURNING, plus the outbox batches, in one transaction
+    try:
+        if job is not None:
+            db.session.add(job)
+            db.session.flush()  # id for the rows
+            job.total, job.accepted, job.rejected = len(mobiles), len(rows), len(rejected)
+            job.status, job.finished_at = 'queued', datetime.now(timezone.utc)
+            for _, values in rows:
+                values['job_id'] = job.id
+        staged, chunks = insert_and_stage(SMSMessage, 'sms', send_batch_and_record, rows, priority, correlation_id,
+                                          batch_size, publish=bool(celery and not dispatcher))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.getLogger('error').error(f"Database error when creating bulk SMS records: {str(e)}")
+        raise SMSWorkflowError("Internal server error", "SMS_SERVICE_ERROR", 500)
+
+    if dispatcher or celery:
+        # The asyncio dispatcher claims 'queued' rows itself; otherwise the relay publishes the batches
+        sms_queued_counter.inc(len(staged))
+        if not dispatcher:
+            messages_enqueued_counter.labels(channel='sms', priority=priority).inc(len(staged))
+        logger.info(f"Bulk SMS queued for {len(staged)} recipients in {len(chunks)} batches")
+        return [{'mobile': mobile, 'record_id': record_id, 'status': 'queued'} for mobile, record_id in staged], failures
+
+    # 4. No Celery: direct, batched send
+    results = send_bulk_sms_util([mobile for mobile, _ in staged], message)
+    updates = []
+    for (mobile, record_id), (_, status_code, _) in zip(staged, results):
+        if status_code == 200:
+            updates.append({'id': record_id, 'status': 'sent', 'attempts': 1})
+            sms_sent_counter.inc()
+            successes.append({'mobile': mobile, 'record_id': record_id, 'status': 'sent'})
+        else:
+            updates.append({'id': record_id, 'status': 'failed', 'attempts': 1})
+            sms_failed_counter.inc()
+            failures.append({'mobile': mobile, 'record_id': record_id, 'error': "Failed to send SMS"})
+    try:
+        db.session.execute(update(SMSMessage), updates)
+        if job is not None:
+            job.sent, job.failed, job.status = len(successes), len(staged) - len(successes), 'completed'
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.getLogger('error').error(f"Database error when updating bulk SMS records: {str(e)}")
+    logger.info(f"Bulk SMS sent directly: {len(successes)} sent, {len(failures)} failed")
+    return successes, failures
@@ -0,0 +1,53 @@
+"""
+Set-based insert-and-stage shared by the SMS and email bulk paths (bulk and
+batch requests, streamed upload jobs).
+
+Rows are inserted with one INSERT ... RETURNING, grouped into shard batches and
+their batch tasks staged in the transactional outbox, all in the caller's
+transaction.
+"""
+from typing import Tuple
+
+from sqlalchemy import insert, update
+
+from app.extensions import db
+from app.tasks.outbox_relay import stage_tasks
+from app.tasks.queues import recipient_shard_key, shard_batches
+
+
+def batch_member_task_id(task_id: str, record_id: int) -> str:
+    """
+    task_id is unique per row, so rows sharing a batch task store "<task_id>:<record_id>".
+    """
+    return f"{task_id}:{record_id}"
+
+
+def insert_and_stage(model, channel: str, task, rows: list, priority: str, correlation_id: str = None,
+                     batch_size: int = 50, publish: bool = True) -> Tuple[list, list]:
+    """
+    One INSERT ... RETURNING for `rows` ((recipient, values) pairs from bulk_values),
+    grouped into shard batches of `batch_size`. With `publish`, each batch task is
+    staged in the outbox and its members get their task ids. Runs in the caller's
+    transaction; the caller commits.
+
+    Returns:
+        (staged, chunks): (recipient, record_id) pairs and their (queue, batch) groups.
+    """
+    # Ids are matched back by uuid: RETURNING order is not guaranteed to follow the
+    # parameters, and asking for it costs one statement per row on some backends
+    ids = dict(db.session.execute(
+        insert(model).returning(model.uuid, model.id), [values for _, values in rows]
+    ).all())
+    staged = [(recipient, ids[values['uuid']]) for recipient, values in rows]
+    # One batch never mixes shards: each recipient stays on its shard queue
+    chunks = shard_batches(channel, priority, staged, batch_size, lambda item: recipient_shard_key(item[0]))
+    if publish:
+        task_ids = stage_tasks(task, [
+            (([record_id for _, record_id in chunk], correlation_id), {'priority': priority}, queue)
+            for queue, chunk in chunks
+        ])
+        db.session.execute(update(model), [
+            {'id': record_id, 'task_id': batch_member_task_id(task_id, record_id)}
+            for task_id, (_, chunk) in zip(task_ids, chunks) for _, record_id in chunk
+        ])
+    return staged, chunks
@@ -0,0 +1,280 @@
+"""
+Write-behind writer for message status transitions.
+
+Send tasks record `sent` / `retry` / `failed` (plus attempts) here instead of
+each opening a transaction and locking its row. Transitions are coalesced per
+row (the latest wins) and written every STATUS_WRITER_FLUSH_INTERVAL seconds,
+or as soon as STATUS_WRITER_BATCH_SIZE are waiting, as one executemany UPDATE
+per table.
+
+With Redis the buffer is a hash per table, so it survives a worker crash: a
+flush first moves the hash to a 'processing' key and deletes it only after the
+database commit; a processing hash left behind by a crashed flusher is
+re-applied by the next one (the updates are idempotent). Without Redis the
+buffer is in memory and lost on a hard crash; the reconciler catches those rows.
+Buffered updates are flushed on interpreter exit and Celery worker shutdown.
+"""
+import atexit
+import json
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from celery.signals import worker_process_shutdown, worker_shutdown
+from flask import current_app
+from redis.exceptions import RedisError
+from sqlalchemy import bindparam, update
+
+from app.extensions import db, status_updates_flushed_counter
+from app.utils.redis_client import get_redis, mark_redis_down
+
+logger = logging.getLogger('app')
+
+_EXTENSION_KEY = 'status_writer'
+
+# KEYS[1] = pending hash, KEYS[2] = processing hash
+# Re-uses a processing hash left by a crashed flusher, else claims the pending one.
+_CLAIM_LUA = """
+if redis.call('EXISTS', KEYS[2]) == 0 and redis.call('EXISTS', KEYS[1]) == 1 then
+  redis.call('RENAME', KEYS[1], KEYS[2])
+end
+return redis.call('HGETALL', KEYS[2])
+"""
+
+# KEYS[1] = lock; ARGV[1] = owner token
+_UNLOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+def _models():
+    from app.models.email_message import EmailMessage
+    from app.models.sms_message import SMSMessage
+    return {m.__tablename__: m for m in (SMSMessage, EmailMessage)}
+
+
+class StatusWriter:
+    """
+    Coalescing status buffer for one Flask app.
+
+    Args:
+        app: Flask app whose context the flusher thread runs in
+        enabled: False = record() writes through immediately
+        flush_interval: Seconds between background flushes
+        batch_size: Buffered transitions that trigger an early flush
+    """
+
+    def __init__(self, app, enabled: bool = True, flush_interval: float = 0.05, batch_size: int = 500):
+        self.app = app
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._buffer = {}  # (table, id) -> fields; in-memory fallback
+        self._buffer_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._recorded = 0
+        self._wake = threading.Event()
+        self._thread = None
+        self._stopped = False
+        self._script = None
+
+    # ----- public API -----
+
+    def record(self, model, record_id: int, status: str, attempts: int = None):
+        """
+        Buffer a status transition for one row.
+        """
+        fields = {'status': status}
+        if attempts is not None:
+            fields['attempts'] = attempts
+        if not self.enabled:
+            self._apply({model.__tablename__: {record_id: fields}})
+            return
+        if not self._record_redis(model.__tablename__, record_id, fields):
+            with self._buffer_lock:
+                self._buffer[(model.__tablename__, record_id)] = fields
+        self._recorded += 1
+        self._ensure_thread()
+        if self._recorded >= self.batch_size:
+            self._wake.set()
+
+    def touch(self, model, record_id: int):
+        """
+        Buffer an updated_at bump for a parked or deferred row (keeps the reconciler
+        off it); a transition already waiting for the row is left as it is.
+        """
+        table = model.__tablename__
+        if not self.enabled:
+            self._apply({table: {record_id: {}}})
+            return
+        r = get_redis()
+        if r is not None:
+            try:
+                r.hsetnx(f"status:pending:{table}", record_id, json.dumps({}))
+                self._ensure_thread()
+                return
+            except Exception as e:
+                mark_redis_down(e)
+        with self._buffer_lock:
+            self._buffer.setdefault((table, record_id), {})
+        self._ensure_thread()
+
+    def flush(self) -> int:
+        """
+        Write everything buffered now. Returns the number of rows updated.
+        """
+        with self._flush_lock:
+            self._recorded = 0
+            with self.app.app_context():
+                return self._flush_redis() + self._flush_memory()
+
+    def close(self):
+        """
+        Stop the flusher thread and write what is left (shutdown hook).
+        """
+        self._stopped = True
+        self._wake.set()
+        try:
+            self.flush()
+        except Exception as e:
+            logging.getLogger('error').error(f"Status writer final flush failed: {e}")
+
+    # ----- internals -----
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._buffer_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='status-writer', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # Buffer is kept; the next tick retries
+                logging.getLogger('error').error(f"Status writer flush failed: {e}")
+                time.sleep(self.flush_interval)
+
+    def _record_redis(self, table, record_id, fields) -> bool:
+        r = get_redis()
+        if r is None:
+            return False
+        try:
+            r.hset(f"status:pending:{table}", record_id, json.dumps(fields))
+            return True
+        except Exception as e:
+            mark_redis_down(e)
+            return False
+
+    def _flush_redis(self) -> int:
+        r = get_redis()
+        if r is None:
+            return 0
+        flushed = 0
+        for table in _models():
+            pending, processing = f"status:pending:{table}", f"status:processing:{table}"
+            lock, token = f"status:flush:{table}", uuid.uuid4().hex
+            try:
+                if not r.set(lock, token, nx=True, px=30000):
+                    continue  # another process is flushing this table
+                if self._script is None:
+                    self._script = r.register_script(_CLAIM_LUA)
+                # Twice at most: a crashed flusher's leftovers first, then the live buffer
+                for _ in range(2):
+                    raw = self._script(keys=[pending, processing])
+                    if not raw:
+                        break
+                    entries = {int(raw[i]): json.loads(raw[i + 1]) for i in range(0, len(raw), 2)}
+                    flushed += self._apply({table: entries})
+                    r.delete(processing)
+            except RedisError as e:
+                # Nothing is lost: the hashes stay in Redis for the next flush
+                mark_redis_down(e)
+            finally:
+                try:
+                    r.eval(_UNLOCK_LUA, 1, lock, token)
+                except Exception:
+                    pass
+        return flushed
+
+    def _flush_memory(self) -> int:
+        with self._buffer_lock:
+            batch, self._buffer = self._buffer, {}
+        if not batch:
+            return 0
+        by_table = {}
+        for (table, record_id), fields in batch.items():
+            by_table.setdefault(table, {})[record_id] = fields
+        try:
+            return self._apply(by_table)
+        except Exception:
+            with self._buffer_lock:
+                # Put the batch back; transitions recorded meanwhile are newer and win
+                for key, fields in batch.items():
+                    self._buffer.setdefault(key, fields)
+            raise
+
+    def _apply(self, by_table) -> int:
+        models = _models()
+        now = datetime.now(timezone.utc)
+        count = 0
+        try:
+            for table, entries in by_table.items():
+                t = models[table].__table__
+                # executemany needs one statement per set of columns
+                groups = {}
+                for record_id, fields in entries.items():
+                    groups.setdefault(tuple(sorted(fields)), []).append(
+                        {'_id': record_id, 'updated_at': now, **fields})
+                for columns, params in groups.items():
+                    stmt = (update(t).where(t.c.id == bindparam('_id'))
+                            .values({c: bindparam(c) for c in (*columns, 'updated_at')}))
+                    db.session.execute(stmt, params)
+                count += len(entries)
+                status_updates_flushed_counter.labels(table=table).inc(len(entries))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return count
+
+
+_writers = []
+
+
+def get_status_writer() -> StatusWriter:
+    """
+    The current app's status writer, configured from STATUS_WRITER_*.
+    """
+    writer = current_app.extensions.get(_EXTENSION_KEY)
+    if writer is None:
+        writer = StatusWriter(
+            current_app._get_current_object(),
+            enabled=bool(current_app.config.get('STATUS_WRITER_ENABLED', True)),
+            flush_interval=float(current_app.config.get('STATUS_WRITER_FLUSH_INTERVAL', 0.05)),
+            batch_size=int(current_app.config.get('STATUS_WRITER_BATCH_SIZE', 500)),
+        )
+        current_app.extensions[_EXTENSION_KEY] = writer
+        _writers.append(writer)
+    return writer
+
+
+def flush_all_writers():
+    """
+    Flush every status writer in this process (shutdown hook).
+    """
+    for writer in list(_writers):
+        writer.close()
+
+
+atexit.register(flush_all_writers)
+
+worker_process_shutdown.connect(lambda **kwargs: flush_all_writers(), weak=False)
+worker_shutdown.connect(lambda **kwargs: flush_all_writers(), weak=False)
@@ -0,0 +1,39 @@
+"""sms_routes table and sms_messages.route
+
+Revision ID: 0002_sms_routes
+Revises: 0001_initial
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_sms_routes'
+down_revision = '0001_initial'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    op.create_table(
+        'sms_routes',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('name', sa.String(length=64), nullable=False),
+        sa.Column('prefix', sa.String(length=16), nullable=False),
+        sa.Column('gateways', sa.String(length=255)),
+        sa.Column('senderid', sa.String(length=32)),
+        sa.Column('active', sa.Boolean(), nullable=False, server_default=sa.true()),
+        sa.Column('created_at', sa.DateTime(timezone=True)),
+        sa.Column('updated_at', sa.DateTime(timezone=True)),
+    )
+    op.create_index('ix_sms_routes_prefix', 'sms_routes', ['prefix'], unique=True)
+    op.add_column('sms_messages', sa.Column('route', sa.String(length=64)))
+    op.create_index('ix_sms_messages_route', 'sms_messages', ['route'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_sms_messages_route', table_name='sms_messages')
+    with op.batch_alter_table('sms_messages') as batch:
+        batch.drop_column('route')
+    op.drop_table('sms_routes')
@@ -0,0 +1,72 @@
+"""bring sms_messages up to the models and add email_messages
+
+0001 predates the uuid, idempotency_key and deleted_at columns and the
+email_messages table, which the models (and db.create_all) already had.
+
+Revision ID: 0003_baseline_models
+Revises: 0002_sms_routes
+Create Date: 2026-10-18 00:00:00
+
+"""
+import uuid
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_baseline_models'
+down_revision = '0002_sms_routes'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    op.add_column('sms_messages', sa.Column('uuid', sa.String(length=36)))
+    op.add_column('sms_messages', sa.Column('idempotency_key', sa.String(length=64)))
+    op.add_column('sms_messages', sa.Column('deleted_at', sa.DateTime(timezone=True)))
+    # Existing rows need a uuid before the column can be NOT NULL
+    sms = sa.table('sms_messages', sa.column('id', sa.Integer), sa.column('uuid', sa.String))
+    conn = op.get_bind()
+    for (row_id,) in conn.execute(sa.select(sms.c.id).where(sms.c.uuid.is_(None))).all():
+        conn.execute(sms.update().where(sms.c.id == row_id).values(uuid=str(uuid.uuid4())))
+    with op.batch_alter_table('sms_messages') as batch:
+        batch.alter_column('uuid', existing_type=sa.String(length=36), nullable=False)
+    op.create_index('ix_sms_messages_uuid', 'sms_messages', ['uuid'], unique=True)
+    op.create_index('ix_sms_messages_idempotency_key', 'sms_messages', ['idempotency_key'], unique=True)
+    op.create_index('ix_sms_messages_deleted_at', 'sms_messages', ['deleted_at'])
+
+    op.create_table(
+        'email_messages',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('uuid', sa.String(length=36), nullable=False),
+        sa.Column('to', sa.String(length=255), nullable=False),
+        sa.Column('subject', sa.String(length=500), nullable=False),
+        sa.Column('body', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=32)),
+        sa.Column('task_id', sa.String(length=64)),
+        sa.Column('correlation_id', sa.String(length=64)),
+        sa.Column('attempts', sa.Integer()),
+        sa.Column('idempotency_key', sa.String(length=64)),
+        sa.Column('created_at', sa.DateTime(timezone=True)),
+        sa.Column('updated_at', sa.DateTime(timezone=True)),
+        sa.Column('deleted_at', sa.DateTime(timezone=True)),
+        sa.UniqueConstraint('task_id', name='uq_email_messages_task_id'),
+    )
+    op.create_index('ix_email_messages_uuid', 'email_messages', ['uuid'], unique=True)
+    op.create_index('ix_email_messages_to', 'email_messages', ['to'])
+    op.create_index('ix_email_messages_status', 'email_messages', ['status'])
+    op.create_index('ix_email_messages_correlation_id', 'email_messages', ['correlation_id'])
+    op.create_index('ix_email_messages_idempotency_key', 'email_messages', ['idempotency_key'], unique=True)
+    op.create_index('ix_email_messages_created_at', 'email_messages', ['created_at'])
+    op.create_index('ix_email_messages_deleted_at', 'email_messages', ['deleted_at'])
+
+
+def downgrade() -> None:
+    op.drop_table('email_messages')
+    op.drop_index('ix_sms_messages_deleted_at', table_name='sms_messages')
+    op.drop_index('ix_sms_messages_idempotency_key', table_name='sms_messages')
+    op.drop_index('ix_sms_messages_uuid', table_name='sms_messages')
+    with op.batch_alter_table('sms_messages') as batch:
+        batch.drop_column('deleted_at')
+        batch.drop_column('idempotency_key')
+        batch.drop_column('uuid')
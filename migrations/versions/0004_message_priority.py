@@ -0,0 +1,30 @@
+"""priority lane of sms and email messages
+
+Revision ID: 0004_message_priority
+Revises: 0003_baseline_models
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_message_priority'
+down_revision = '0003_baseline_models'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    for table in ('sms_messages', 'email_messages'):
+        op.add_column(table, sa.Column('priority', sa.String(length=16)))
+        # Rows queued before lanes existed were ordinary traffic
+        op.execute(sa.text(f"UPDATE {table} SET priority = 'transactional' WHERE priority IS NULL"))
+        op.create_index(f'ix_{table}_priority', table, ['priority'])
+
+
+def downgrade() -> None:
+    for table in ('email_messages', 'sms_messages'):
+        op.drop_index(f'ix_{table}_priority', table_name=table)
+        with op.batch_alter_table(table) as batch:
+            batch.drop_column('priority')
@@ -0,0 +1,36 @@
+"""outbox_messages table for the transactional outbox
+
+Revision ID: 0005_outbox_messages
+Revises: 0004_message_priority
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005_outbox_messages'
+down_revision = '0004_message_priority'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    op.create_table(
+        'outbox_messages',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('task_id', sa.String(length=64), nullable=False),
+        sa.Column('task_name', sa.String(length=128), nullable=False),
+        sa.Column('queue', sa.String(length=64)),
+        sa.Column('args', sa.JSON(), nullable=False),
+        sa.Column('kwargs', sa.JSON(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('last_error', sa.String(length=255)),
+        sa.Column('created_at', sa.DateTime(timezone=True)),
+        sa.UniqueConstraint('task_id', name='uq_outbox_messages_task_id'),
+    )
+    op.create_index('ix_outbox_messages_created_at', 'outbox_messages', ['created_at'])
+
+
+def downgrade() -> None:
+    op.drop_table('outbox_messages')
@@ -0,0 +1,36 @@
+"""dead_letters table
+
+Revision ID: 0006_dead_letters
+Revises: 0005_outbox_messages
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_dead_letters'
+down_revision = '0005_outbox_messages'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    op.create_table(
+        'dead_letters',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('channel', sa.String(length=16), nullable=False),
+        sa.Column('message_id', sa.Integer(), nullable=False),
+        sa.Column('correlation_id', sa.String(length=64)),
+        sa.Column('error_class', sa.String(length=32), nullable=False),
+        sa.Column('last_status_code', sa.Integer()),
+        sa.Column('attempts', sa.Integer()),
+        sa.Column('failed_at', sa.DateTime(timezone=True)),
+        sa.Column('replayed_at', sa.DateTime(timezone=True)),
+    )
+    for column in ('channel', 'message_id', 'correlation_id', 'error_class', 'failed_at', 'replayed_at'):
+        op.create_index(f'ix_dead_letters_{column}', 'dead_letters', [column])
+
+
+def downgrade() -> None:
+    op.drop_table('dead_letters')
@@ -0,0 +1,25 @@
+"""(status, updated_at) indexes for the reconciler
+
+Revision ID: 0007_status_updated_at
+Revises: 0006_dead_letters
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007_status_updated_at'
+down_revision = '0006_dead_letters'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    for table in ('sms_messages', 'email_messages'):
+        op.create_index(f'ix_{table}_status_updated_at', table, ['status', 'updated_at'])
+
+
+def downgrade() -> None:
+    for table in ('email_messages', 'sms_messages'):
+        op.drop_index(f'ix_{table}_status_updated_at', table_name=table)
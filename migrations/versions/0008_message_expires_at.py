@@ -0,0 +1,26 @@
+"""expires_at of sms and email messages
+
+Revision ID: 0008_message_expires_at
+Revises: 0007_status_updated_at
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008_message_expires_at'
+down_revision = '0007_status_updated_at'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    for table in ('sms_messages', 'email_messages'):
+        op.add_column(table, sa.Column('expires_at', sa.DateTime(timezone=True)))
+
+
+def downgrade() -> None:
+    for table in ('email_messages', 'sms_messages'):
+        with op.batch_alter_table(table) as batch:
+            batch.drop_column('expires_at')
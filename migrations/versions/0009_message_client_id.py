@@ -0,0 +1,29 @@
+"""client_id of sms and email messages, for fair queuing
+
+Revision ID: 0009_message_client_id
+Revises: 0008_message_expires_at
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009_message_client_id'
+down_revision = '0008_message_expires_at'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    for table in ('sms_messages', 'email_messages'):
+        op.add_column(table, sa.Column('client_id', sa.String(length=64), nullable=False,
+                                       server_default='default'))
+        op.create_index(f'ix_{table}_status_client_id', table, ['status', 'client_id'])
+
+
+def downgrade() -> None:
+    for table in ('email_messages', 'sms_messages'):
+        op.drop_index(f'ix_{table}_status_client_id', table_name=table)
+        with op.batch_alter_table(table) as batch:
+            batch.drop_column('client_id')
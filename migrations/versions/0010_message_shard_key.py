@@ -0,0 +1,27 @@
+"""recipient shard_key of sms and email messages
+
+Revision ID: 0010_message_shard_key
+Revises: 0009_message_client_id
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010_message_shard_key'
+down_revision = '0009_message_client_id'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    # Left NULL on existing rows: they are published on the unsharded lane
+    for table in ('sms_messages', 'email_messages'):
+        op.add_column(table, sa.Column('shard_key', sa.SmallInteger()))
+
+
+def downgrade() -> None:
+    for table in ('email_messages', 'sms_messages'):
+        with op.batch_alter_table(table) as batch:
+            batch.drop_column('shard_key')
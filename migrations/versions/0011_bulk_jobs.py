@@ -0,0 +1,51 @@
+"""bulk_jobs table and the job_id of sms and email messages
+
+Revision ID: 0011_bulk_jobs
+Revises: 0010_message_shard_key
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0011_bulk_jobs'
+down_revision = '0010_message_shard_key'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    op.create_table(
+        'bulk_jobs',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('uuid', sa.String(length=36), nullable=False),
+        sa.Column('channel', sa.String(length=16), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('format', sa.String(length=16), nullable=False),
+        sa.Column('priority', sa.String(length=16)),
+        sa.Column('client_id', sa.String(length=64), nullable=False, server_default='default'),
+        sa.Column('correlation_id', sa.String(length=64)),
+        sa.Column('total', sa.Integer(), nullable=False),
+        sa.Column('accepted', sa.Integer(), nullable=False),
+        sa.Column('rejected', sa.Integer(), nullable=False),
+        sa.Column('errors', sa.JSON(), nullable=False),
+        sa.Column('error', sa.String(length=255)),
+        sa.Column('created_at', sa.DateTime(timezone=True)),
+        sa.Column('updated_at', sa.DateTime(timezone=True)),
+        sa.Column('finished_at', sa.DateTime(timezone=True)),
+    )
+    op.create_index('ix_bulk_jobs_uuid', 'bulk_jobs', ['uuid'], unique=True)
+    for column in ('channel', 'status', 'correlation_id', 'created_at'):
+        op.create_index(f'ix_bulk_jobs_{column}', 'bulk_jobs', [column])
+    for table in ('sms_messages', 'email_messages'):
+        op.add_column(table, sa.Column('job_id', sa.Integer()))
+        op.create_index(f'ix_{table}_job_id', table, ['job_id'])
+
+
+def downgrade() -> None:
+    for table in ('email_messages', 'sms_messages'):
+        op.drop_index(f'ix_{table}_job_id', table_name=table)
+        with op.batch_alter_table(table) as batch:
+            batch.drop_column('job_id')
+    op.drop_table('bulk_jobs')
@@ -0,0 +1,28 @@
+"""sent/failed/expired counters and fold token of bulk jobs
+
+Revision ID: 0012_bulk_job_counters
+Revises: 0011_bulk_jobs
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0012_bulk_job_counters'
+down_revision = '0011_bulk_jobs'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    for column in ('sent', 'failed', 'expired'):
+        op.add_column('bulk_jobs', sa.Column(column, sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('bulk_jobs', sa.Column('fold_token', sa.String(length=32)))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('bulk_jobs') as batch:
+        batch.drop_column('fold_token')
+        for column in ('expired', 'failed', 'sent'):
+            batch.drop_column(column)
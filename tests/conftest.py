@@ -1,4 +1,48 @@
 import sys, os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 if BASE_DIR not in sys.path:
-    sys.path.insert(0, BASE_DIR)
\ No newline at end of file
+    sys.path.insert(0, BASE_DIR)
+
+
+class _SOAPGateway:
+    """Local keep-alive stand-in for OTP_SERVER that records every request body."""
+
+    def __init__(self):
+        self.received = []
+        self.status = 200
+        gateway = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                gateway.received.append(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                if gateway.status is None:
+                    # Took the request but dropped the connection without answering
+                    self.close_connection = True
+                    return
+                body = b'ok'
+                self.send_response(gateway.status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/sms"
+
+
+@pytest.fixture
+def soap_gateway():
+    gateway = _SOAPGateway()
+    t = threading.Thread(target=gateway.server.serve_forever, daemon=True)
+    t.start()
+    yield gateway
+    gateway.server.shutdown()
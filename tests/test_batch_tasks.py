@@ -0,0 +1,106 @@
+import smtplib
+
+from app import create_app
+from app.extensions import db
+from app.models.email_message import EmailMessage
+from app.models.sms_message import SMSMessage
+from app.tasks import email_queue, sms_tasks
+from app.utils import email_util
+
+
+class _FakeSMTP:
+    """Records sessions and messages instead of talking to a mail server."""
+
+    sessions = []
+
+    def __init__(self, host, port):
+        self.sent = []
+        _FakeSMTP.sessions.append(self)
+
+    def starttls(self):
+        pass
+
+    def login(self, username, password):
+        pass
+
+    def send_message(self, msg):
+        if msg['To'].startswith('refused'):
+            raise smtplib.SMTPRecipientsRefused({msg['To']: (550, b'no')})
+        self.sent.append(msg['To'])
+
+    def quit(self):
+        pass
+
+
+def _smtp_app(monkeypatch):
+    _FakeSMTP.sessions = []
+    monkeypatch.setattr(email_util.smtplib, 'SMTP', _FakeSMTP)
+    app = create_app()
+    app.config.update(TESTING=True, SMTP_SERVER='mail.test', SMTP_USERNAME='u', SMTP_PASSWORD='p',
+                      SMTP_FROM_EMAIL='noreply@test.org')
+    return app
+
+
+def test_email_batch_util_reuses_sessions(monkeypatch):
+    app = _smtp_app(monkeypatch)
+    messages = [(f"user{i}@batch.test", 'Report', 'Your report is ready') for i in range(6)]
+    messages.append(('refused@batch.test', 'Report', 'Your report is ready'))
+    with app.app_context():
+        results = email_util.send_email_batch_util(messages, concurrency=2)
+    assert len(_FakeSMTP.sessions) == 2
+    assert [code for code, _ in results] == [200] * 6 + [400]
+    assert sorted(to for s in _FakeSMTP.sessions for to in s.sent) == sorted(m[0] for m in messages[:6])
+
+
+def test_email_batch_task_persists_outcomes(monkeypatch):
+    app = _smtp_app(monkeypatch)
+    with app.app_context():
+        rows = [EmailMessage(to=f"{name}@task.test", subject='Camp', body='Camp on Sunday', uuid=f"batch-email-{name}")
+                for name in ('alice', 'bob', 'refused')]
+        db.session.add_all(rows)
+        db.session.commit()
+        ids = [r.id for r in rows]
+
+        result = email_queue.send_batch_and_record(ids)
+        assert (result['sent'], result['failed'], result['retry']) == (2, 1, 0)
+        db.session.expire_all()
+        statuses = {r.uuid: (r.status, r.attempts) for r in db.session.execute(
+            db.select(EmailMessage).where(EmailMessage.id.in_(ids))).scalars()}
+    assert statuses == {'batch-email-alice': ('sent', 1), 'batch-email-bob': ('sent', 1),
+                        'batch-email-refused': ('failed', 1)}
+
+
+def test_sms_batch_task_sends_one_envelope(soap_gateway):
+    app = create_app()
+    app.config.update(TESTING=False, OTP_FLAG=True, OTP_SERVER=soap_gateway.url)
+    with app.app_context():
+        rows = [SMSMessage(to=str(9811100000 + i), message='Camp on Sunday', uuid=f"batch-sms-{i}") for i in range(3)]
+        db.session.add_all(rows)
+        db.session.commit()
+        ids = [r.id for r in rows]
+
+        result = sms_tasks.send_batch_and_record(ids)
+        assert result['sent'] == 3
+        db.session.expire_all()
+        assert {(r.status, r.attempts) for r in db.session.execute(
+            db.select(SMSMessage).where(SMSMessage.id.in_(ids))).scalars()} == {('sent', 1)}
+    assert len(soap_gateway.received) == 1
+
+
+def test_sms_batch_task_parks_members_over_the_rate(monkeypatch):
+    parked = []
+    monkeypatch.setattr(sms_tasks, 'defer', lambda task, channel, priority, args, kwargs=None, cost=1, queue=None:
+                        parked.append((channel, args[0], cost)))
+    app = create_app()
+    app.config.update(TESTING=True, SMS_RATE_PER_SECOND=2, RATE_GOVERNOR_MAX_WAIT=0)
+    with app.app_context():
+        rows = [SMSMessage(to=str(9811200000 + i), message='Camp on Sunday', uuid=f"rate-sms-{i}") for i in range(5)]
+        db.session.add_all(rows)
+        db.session.commit()
+        ids = [r.id for r in rows]
+
+        result = sms_tasks.send_batch_and_record(ids)
+        assert result['sent'] == 2
+        assert parked == [('sms', ids[2:], 3)]
+        # The drainer re-publishes parked members with their permits already taken
+        assert sms_tasks.send_batch_and_record(ids[2:], permitted=True)['sent'] == 3
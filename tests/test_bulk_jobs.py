@@ -0,0 +1,217 @@
+import io
+from contextlib import contextmanager
+
+from sqlalchemy import func
+
+from app import create_app
+from app.extensions import db
+from app.models.bulk_job import BulkJob
+from app.models.email_message import EmailMessage
+from app.models.outbox_message import OutboxMessage
+from app.models.sms_message import SMSMessage
+
+AUTH = {'Authorization': 'Bearer your-sms-api-key'}
+
+
+class _FakeCelery:
+    @contextmanager
+    def producer_or_acquire(self):
+        yield object()
+
+    def send_task(self, *args, **kwargs):
+        pass
+
+
+def _jobs_app(tmp_path, **config):
+    app = create_app()
+    app.config.update(TESTING=True, SMS_API_KEY='your-sms-api-key', BULK_JOB_SPOOL_DIR=str(tmp_path), **config)
+    app.celery = _FakeCelery()
+    return app
+
+
+def _run_ingest(app):
+    """
+    Run the staged ingest tasks, as a worker would; returns the finished jobs.
+    """
+    from app.tasks.bulk_ingest import INGEST_TASK, ingest_job
+
+    with app.app_context():
+        staged = db.session.execute(
+            db.select(OutboxMessage).where(OutboxMessage.task_name == INGEST_TASK)).scalars().all()
+        return [ingest_job(*row.args) for row in staged]
+
+
+def test_sms_csv_upload_is_queued_in_chunks(tmp_path):
+    app = _jobs_app(tmp_path, BULK_JOB_CHUNK_SIZE=1000, SMS_GATEWAY_BATCH_SIZE=50)
+    lines = ['name,mobile'] + [f'Parent {i},{9100000000 + i}' for i in range(2500)]
+    lines[10] = 'Parent 9,not-a-number'
+    lines[20] = 'Parent 19,'
+    upload = io.BytesIO(('\n'.join(lines) + '\n').encode())
+    r = app.test_client().post('/services/api/v1/sms/jobs?message=School+closed+tomorrow', headers=AUTH,
+                               data=upload, content_type='text/csv')
+    assert r.status_code == 202, r.get_json()
+    # The request only spools the upload; a worker queues the rows
+    assert (r.get_json()['data']['status'], r.get_json()['data']['total']) == ('receiving', 0)
+    assert len(list(tmp_path.iterdir())) == 2
+    job, = _run_ingest(app)
+    assert (job['status'], job['total'], job['accepted'], job['rejected']) == ('queued', 2500, 2498, 2)
+    assert not list(tmp_path.iterdir())
+    assert sorted(e['line'] for e in job['errors']) == [11, 21]
+    with app.app_context():
+        job_pk = db.session.execute(db.select(BulkJob.id).where(BulkJob.uuid == job['job_id'])).scalar_one()
+        queued = db.session.execute(
+            db.select(func.count()).select_from(SMSMessage).where(SMSMessage.job_id == job_pk,
+                                                                 SMSMessage.task_id.is_not(None))
+        ).scalar()
+        assert queued == 2498
+        # Each 1000-row chunk is split into gateway batches of 50
+        assert db.session.execute(db.select(func.count()).select_from(OutboxMessage)
+                                  .where(OutboxMessage.task_name == 'sms.send_batch_and_record')).scalar() == 20 + 20 + 10
+
+
+def test_email_ndjson_upload_and_rejections(tmp_path):
+    app = _jobs_app(tmp_path)
+    upload = io.BytesIO(b'"a@school.test"\n{"email": "B@School.test"}\n\n{"name": "no address"}\n{broken\n')
+    r = app.test_client().post('/services/api/v1/mail/jobs?subject=Camp&body=Camp+on+Sunday', headers=AUTH,
+                               data=upload, content_type='application/x-ndjson',
+                               environ_base={'REMOTE_ADDR': '192.168.14.20'})
+    assert r.status_code == 202, r.get_json()
+    job, = _run_ingest(app)
+    assert (job['total'], job['accepted'], job['rejected']) == (4, 2, 2)
+    with app.app_context():
+        rows = db.session.execute(db.select(EmailMessage).order_by(EmailMessage.id)).scalars().all()
+        assert [row.decrypt_fields()[0] for row in rows] == ['a@school.test', 'b@school.test']
+
+
+def test_job_upload_rejects_unusable_requests():
+    app = create_app()
+    app.config.update(TESTING=True, SMS_API_KEY='your-sms-api-key')
+    client = app.test_client()
+    # No Celery and no dispatcher: nothing would ever send the rows
+    r = client.post('/services/api/v1/sms/jobs?message=hi', headers=AUTH, data=b'9100000000\n',
+                    content_type='text/csv')
+    assert r.status_code == 503
+    app.config['SMS_DISPATCH_BACKEND'] = 'asyncio'
+    r = client.post('/services/api/v1/sms/jobs?message=hi', headers=AUTH, data=b'9100000000\n',
+                    content_type='application/pdf')
+    assert r.status_code == 415
+    r = client.post('/services/api/v1/sms/jobs?message=hi', headers=AUTH, data=b'mobile\nnope\n',
+                    content_type='text/csv')
+    assert r.status_code == 400 and r.get_json()['data']['job']['rejected'] == 1
+    with app.app_context():
+        assert db.session.execute(db.select(func.count()).select_from(BulkJob)).scalar() == 1
+
+
+def test_redelivered_ingest_resumes_after_committed_rows(tmp_path):
+    app = _jobs_app(tmp_path, BULK_JOB_CHUNK_SIZE=2)
+    upload = io.BytesIO(''.join(f'{9100000000 + i}\n' for i in range(7)).encode())
+    r = app.test_client().post('/services/api/v1/sms/jobs?message=Camp', headers=AUTH, data=upload,
+                               content_type='text/csv')
+    assert r.status_code == 202
+    with app.app_context():
+        # A worker died after committing the first chunk (its rows and counts)
+        job = db.session.execute(db.select(BulkJob)).scalar_one()
+        job.total = job.accepted = 2
+        db.session.commit()
+    job, = _run_ingest(app)
+    assert (job['status'], job['total'], job['accepted']) == ('queued', 7, 7)
+    with app.app_context():
+        mobiles = [row.decrypt_fields()[0] for row in db.session.execute(
+            db.select(SMSMessage).order_by(SMSMessage.id)).scalars()]
+        assert mobiles == [str(9100000000 + i) for i in range(2, 7)]
+    # Redelivered again once finished: nothing more is queued
+    assert _run_ingest(app)[0]['accepted'] == 7
+
+
+def test_bulk_request_job_reports_outcomes(monkeypatch, tmp_path):
+    from app.tasks import job_counters, sms_tasks
+
+    def fake_bulk(numbers, message):
+        return [(n, 400 if n.endswith('7') else 200, 'ok') for n in numbers]
+
+    monkeypatch.setattr(sms_tasks, 'send_bulk_sms_util', fake_bulk)
+    monkeypatch.setattr(job_counters, 'get_redis', lambda: None)  # counts go straight to the row
+    app = _jobs_app(tmp_path, SMS_GATEWAY_BATCH_SIZE=10)
+    client = app.test_client()
+    r = client.post('/services/api/v1/sms/bulk', headers={**AUTH, 'X-Client-Id': 'clinic'},
+                    json={'mobiles': [str(9100000000 + i) for i in range(30)], 'message': 'Reminder'})
+    assert r.status_code == 200
+    job_id = r.get_json()['data']['job_id']
+    status = client.get(f'/services/api/v1/sms/jobs/{job_id}', headers={**AUTH, 'X-Client-Id': 'clinic'})
+    assert {k: status.get_json()['data'][k] for k in ('status', 'total', 'queued', 'sent')} == \
+        {'status': 'queued', 'total': 30, 'queued': 30, 'sent': 0}
+
+    with app.app_context():
+        for staged in db.session.execute(db.select(OutboxMessage)).scalars().all():
+            sms_tasks.send_batch_and_record(*staged.args, **staged.kwargs)
+    status = client.get(f'/services/api/v1/sms/jobs/{job_id}', headers={**AUTH, 'X-Client-Id': 'clinic'})
+    data = status.get_json()['data']
+    assert (data['status'], data['queued'], data['sent'], data['failed']) == ('completed', 0, 27, 3)
+    # Other clients can't see the job
+    assert client.get(f'/services/api/v1/sms/jobs/{job_id}', headers=AUTH).status_code == 404
+
+
+def test_per_client_keys_decide_who_sees_a_job(tmp_path):
+    app = _jobs_app(tmp_path, CLIENT_API_KEYS='{"clinic": "clinic-key", "lab": "lab-key"}')
+    client = app.test_client()
+    clinic, lab = {'Authorization': 'Bearer clinic-key'}, {'Authorization': 'Bearer lab-key'}
+    r = client.post('/services/api/v1/sms/bulk', headers=clinic, json={'mobiles': ['9100000001'], 'message': 'Hi'})
+    assert r.status_code == 200
+    job_id = r.get_json()['data']['job_id']
+    assert client.get(f'/services/api/v1/sms/jobs/{job_id}', headers=clinic).status_code == 200
+    assert client.get(f'/services/api/v1/sms/jobs/{job_id}', headers=lab).status_code == 404
+    # A keyed caller cannot claim another client's id
+    assert client.get(f'/services/api/v1/sms/jobs/{job_id}',
+                      headers={**lab, 'X-Client-Id': 'clinic'}).status_code == 403
+    with app.app_context():
+        assert db.session.execute(db.select(BulkJob.client_id)).scalar_one() == 'clinic'
+
+
+def test_sms_batch_queues_per_recipient_messages(tmp_path):
+    app = _jobs_app(tmp_path, SMS_GATEWAY_BATCH_SIZE=50)
+    client = app.test_client()
+    messages = [{'mobile': str(9100000000 + i), 'message': f'Appointment {i} at 10:00',
+                 'idempotency_key': f'appt-{i}'} for i in range(3)]
+    messages += [{'mobile': 'not-a-number', 'message': 'Hi'}, {'mobile': '9100000009'},
+                 {'mobile': '9100000010', 'message': 'Again', 'idempotency_key': 'appt-0'}]
+    r = client.post('/services/api/v1/sms/batch', headers=AUTH, json={'messages': messages})
+    assert r.status_code == 207, r.get_json()
+    results = r.get_json()['data']['results']
+    assert [res['status'] for res in results] == ['queued'] * 3 + ['rejected'] * 3
+    assert results[5]['error'] == 'Duplicate idempotency_key in request'
+    with app.app_context():
+        rows = db.session.execute(db.select(SMSMessage).order_by(SMSMessage.id)).scalars().all()
+        assert [row.decrypt_fields()[1] for row in rows] == [f'Appointment {i} at 10:00' for i in range(3)]
+        assert [row.id for row in rows] == [res['record_id'] for res in results[:3]]
+        assert db.session.execute(db.select(func.count()).select_from(OutboxMessage)).scalar() == 1
+
+    # A retried item returns the existing message instead of sending it again
+    r = client.post('/services/api/v1/sms/batch', headers=AUTH, json={'messages': messages[:1]})
+    assert r.status_code == 200
+    assert r.get_json()['data']['results'][0] == {'index': 0, 'mobile': '9100000000', 'record_id': rows[0].id,
+                                                  'status': 'queued', 'duplicate': True}
+    assert r.get_json()['data']['job_id'] is None
+
+
+def test_email_batch_sends_directly_without_celery(monkeypatch):
+    from app.utils import email_util
+
+    sent = []
+
+    def fake_batch(messages, concurrency=4):
+        sent.extend(messages)
+        return [(500 if to.startswith('c') else 200, 'id') for to, _, _ in messages]
+
+    monkeypatch.setattr(email_util, 'send_email_batch_util', fake_batch)
+    app = create_app()
+    app.config.update(TESTING=True, SMS_API_KEY='your-sms-api-key')
+    messages = [{'to': f'{name}@school.test', 'subject': f'Report for {name}', 'body': f'Dear {name}'}
+                for name in ('a', 'b', 'c')] + [{'to': 'nobody', 'subject': 'x', 'body': 'y'}]
+    r = app.test_client().post('/services/api/v1/mail/batch', headers=AUTH, json={'messages': messages},
+                               environ_base={'REMOTE_ADDR': '192.168.14.20'})
+    assert r.status_code == 207, r.get_json()
+    assert [res['status'] for res in r.get_json()['data']['results']] == ['sent', 'sent', 'failed', 'rejected']
+    assert sent == [(f'{name}@school.test', f'Report for {name}', f'Dear {name}') for name in ('a', 'b', 'c')]
+    with app.app_context():
+        job = db.session.execute(db.select(BulkJob)).scalar_one()
+        assert (job.status, job.total, job.accepted, job.sent, job.failed) == ('completed', 3, 3, 2, 1)
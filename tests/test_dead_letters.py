@@ -0,0 +1,132 @@
+import smtplib
+
+from app import create_app
+from app.extensions import db
+from app.models.dead_letter import DeadLetter
+from app.models.email_message import EmailMessage
+from app.models.outbox_message import OutboxMessage
+from app.tasks import email_queue
+from app.utils import email_util
+
+ADMIN_HEADERS = {'Authorization': 'Bearer test-admin-key', 'X-Role': 'admin'}
+
+
+class _RefusingSMTP:
+    """Accepts the session but refuses every recipient."""
+
+    def __init__(self, host, port):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, username, password):
+        pass
+
+    def send_message(self, msg):
+        raise smtplib.SMTPRecipientsRefused({msg['To']: (550, b'no')})
+
+    def quit(self):
+        pass
+
+
+def test_failed_batch_members_are_dead_lettered_and_replayed(monkeypatch):
+    monkeypatch.setattr(email_util.smtplib, 'SMTP', _RefusingSMTP)
+    app = create_app()
+    app.config.update(TESTING=True, SMTP_SERVER='mail.test', SMTP_USERNAME='u', SMTP_PASSWORD='p',
+                      SMTP_FROM_EMAIL='noreply@test.org', ADMIN_API_KEY='test-admin-key', EMAIL_BATCH_SIZE=2)
+    # Replay stages batch tasks in the outbox; any configured Celery will do
+    app.celery = object()
+    with app.app_context():
+        rows = [EmailMessage(to=f"gone{i}@dead.test", subject='Camp', body='Camp on Sunday',
+                             uuid=f"dead-email-{i}", correlation_id='dead-run') for i in range(3)]
+        db.session.add_all(rows)
+        db.session.commit()
+        ids = [r.id for r in rows]
+        assert email_queue.send_batch_and_record(ids)['failed'] == 3
+        letters = db.session.execute(
+            db.select(DeadLetter).where(DeadLetter.correlation_id == 'dead-run')).scalars().all()
+        assert {(d.message_id, d.error_class, d.last_status_code) for d in letters} == {(i, 'rejected', 400) for i in ids}
+
+    client = app.test_client()
+    listed = client.get('/services/api/v1/mail/dead-letters?correlation_id=dead-run', headers=ADMIN_HEADERS)
+    assert listed.status_code == 200
+    assert listed.get_json()['data']['total'] == 3
+
+    replayed = client.post('/services/api/v1/mail/dead-letters/replay', headers=ADMIN_HEADERS,
+                           json={'correlation_id': 'dead-run', 'error_class': 'rejected'})
+    assert replayed.status_code == 200
+    assert replayed.get_json()['data'] == {'replayed': 3, 'requeued': 3, 'batches': 2}
+
+    with app.app_context():
+        assert {r.status for r in db.session.execute(
+            db.select(EmailMessage).where(EmailMessage.id.in_(ids))).scalars()} == {'queued'}
+        staged = db.session.execute(db.select(OutboxMessage).where(
+            OutboxMessage.task_name == 'email.send_batch_and_record')).scalars().all()
+        assert sorted(i for row in staged if row.queue == 'email.bulk' for i in row.args[0]) == ids
+
+    again = client.post('/services/api/v1/mail/dead-letters/replay', headers=ADMIN_HEADERS,
+                        json={'correlation_id': 'dead-run'})
+    assert again.get_json()['data']['replayed'] == 0
+
+
+def test_invalid_single_sends_are_dead_lettered_not_retried(monkeypatch):
+    from app.models.sms_message import SMSMessage, get_fernet
+    from app.tasks import sms_tasks
+    from app.utils.status_writer import get_status_writer
+
+    sent, retried = [], []
+    monkeypatch.setattr(sms_tasks, 'send_sms', lambda to, message: sent.append(to) or 200)
+    monkeypatch.setattr(email_queue, 'send_single_email_util', lambda *a: sent.append(a[0]) or (200, 'msg-1'))
+    monkeypatch.setattr(sms_tasks, 'schedule_retry', lambda *a, **kw: retried.append(a) or 1.0)
+    app = create_app()
+    app.config.update(TESTING=True)
+    with app.app_context():
+        sms = SMSMessage(to='9876500497', message='OTP 1234', uuid='invalid-sms', correlation_id='invalid-run')
+        email = EmailMessage(to='valid@dead.test', subject='Camp', body='Camp on Sunday', uuid='invalid-email',
+                             correlation_id='invalid-run')
+        db.session.add_all([sms, email])
+        db.session.commit()
+        # Stored before the model validated recipients: the send task is the last line of defence
+        db.session.execute(db.update(SMSMessage).where(SMSMessage.id == sms.id)
+                           .values(to=get_fernet().encrypt(b'not-a-number').decode()))
+        db.session.execute(db.update(EmailMessage).where(EmailMessage.id == email.id)
+                           .values(to=get_fernet().encrypt(b'not-an-address').decode()))
+        db.session.commit()
+        assert sms_tasks.send_and_record.apply(args=[sms.id], kwargs={'permitted': True}).result['status'] == 'failed'
+        assert email_queue.send_and_record.apply(args=[email.id], kwargs={'permitted': True}).result['status'] == 'failed'
+        get_status_writer().flush()
+        db.session.expire_all()
+        assert sent == [] and retried == []
+        assert db.session.get(SMSMessage, sms.id).status == 'failed'
+        assert db.session.get(EmailMessage, email.id).status == 'failed'
+        letters = db.session.execute(
+            db.select(DeadLetter).where(DeadLetter.correlation_id == 'invalid-run')).scalars().all()
+        assert {(d.channel, d.error_class, d.last_status_code) for d in letters} == {
+            ('sms', 'rejected', 400), ('email', 'rejected', 400)}
+
+
+def test_single_send_exception_goes_through_the_retry_scheduler(monkeypatch):
+    from app.models.sms_message import SMSMessage
+    from app.tasks import sms_tasks
+
+    def refuse(to, message):
+        raise ConnectionError('gateway unreachable')
+
+    retried = []
+    monkeypatch.setattr(sms_tasks, 'send_sms', refuse)
+    monkeypatch.setattr(sms_tasks, 'schedule_retry', lambda *a, **kw: retried.append((a, kw)) or 2.0)
+    app = create_app()
+    app.config.update(TESTING=True)
+    with app.app_context():
+        sms = SMSMessage(to='9876500498', message='OTP 1234', uuid='transient-sms')
+        db.session.add(sms)
+        db.session.commit()
+        result = sms_tasks.send_and_record.apply(args=[sms.id], kwargs={'permitted': True, 'attempt': 2}).result
+        assert result['status'] == 'retry'
+        (task, args, kwargs, attempt, error_class), _ = retried[0]
+        assert (task, kwargs, attempt, error_class) == (sms_tasks.send_and_record, {'attempt': 3}, 2, 'default')
+
+        assert sms_tasks.send_and_record.apply(
+            args=[sms.id], kwargs={'permitted': True, 'attempt': sms_tasks.MAX_ATTEMPTS}).result['status'] == 'failed'
+        assert len(retried) == 1
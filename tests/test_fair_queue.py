@@ -0,0 +1,43 @@
+from collections import Counter
+
+from app import create_app
+from app.extensions import db
+from app.models.sms_message import SMSMessage
+from app.tasks.sms_dispatcher import AsyncSMSDispatcher
+from app.utils.fair_queue import DeficitRoundRobin
+
+AUTH = {'Authorization': 'Bearer your-sms-api-key'}
+
+
+def test_deficit_round_robin_follows_weights_and_forfeits_idle_credit():
+    fair = DeficitRoundRobin(quantum=4, weights={'ehospital': 2})
+    assert fair.allocate({'cdac': 1000, 'ehospital': 1000}, 12) == {'cdac': 4, 'ehospital': 8}
+    # A small backlog is served in full; the rest goes to the busy client
+    assert fair.allocate({'cdac': 1000, 'clinic': 1}, 12) == {'cdac': 11, 'clinic': 1}
+    # Fractional weights accumulate deficit over several rounds
+    slow = DeficitRoundRobin(quantum=1, weights={'batch': 0.5})
+    assert slow.allocate({'batch': 10, 'otp': 10}, 6) == {'batch': 2, 'otp': 4}
+
+
+def test_dispatcher_claims_fairly_across_clients():
+    app = create_app()
+    app.config.update(TESTING=True, SMS_API_KEY='your-sms-api-key')
+    client = app.test_client()
+    flood = client.post('/services/api/v1/sms/bulk', headers={**AUTH, 'X-Client-Id': 'flood'},
+                        json={'mobiles': [str(9200000000 + i) for i in range(40)], 'message': 'Sale'})
+    assert flood.status_code == 200
+    for i in range(3):
+        client.post('/services/api/v1/sms/bulk', headers={**AUTH, 'X-Client-Id': 'clinic'},
+                    json={'mobiles': [str(9300000000 + i)], 'message': 'Appointment'})
+    assert client.post('/services/api/v1/sms/single', headers={**AUTH, 'X-Client-Id': 'bad id!'},
+                       json={'mobile': '9300000009', 'message': 'hi'}).status_code == 400
+
+    with app.app_context():
+        # Park everything back in the queue as if the dispatcher backend had been used
+        db.session.execute(db.update(SMSMessage).values(status='queued', task_id=None))
+        db.session.commit()
+    dispatcher = AsyncSMSDispatcher(app, claim_batch=10, fair_quantum=2)
+    claimed = dispatcher._claim(10)
+    with app.app_context():
+        owners = Counter(db.session.get(SMSMessage, record_id).client_id for record_id, *_ in claimed)
+    assert owners == {'flood': 7, 'clinic': 3}
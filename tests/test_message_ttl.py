@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app import create_app
+from app.extensions import db
+from app.models.sms_message import SMSMessage
+from app.tasks import sms_tasks
+from app.utils.message_ttl import is_expired, resolve_expiry
+
+AUTH = {'Authorization': 'Bearer your-sms-api-key'}
+
+
+def test_resolve_expiry_prefers_explicit_values_over_lane_default():
+    app = create_app()
+    app.config.update(MESSAGE_TTL_OTP_SECONDS=60, MESSAGE_TTL_BULK_SECONDS=0)
+    now = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    with app.app_context():
+        assert resolve_expiry({}, 'otp', now) == now + timedelta(seconds=60)
+        assert resolve_expiry({}, 'bulk', now) is None
+        assert resolve_expiry({'ttl_seconds': 5}, 'otp', now) == now + timedelta(seconds=5)
+        assert resolve_expiry({'expires_at': '2026-01-01T00:10:00Z'}, 'otp', now) == now + timedelta(minutes=10)
+        for bad in ({'ttl_seconds': 0}, {'ttl_seconds': 'soon'}, {'expires_at': 'tomorrow'},
+                    {'expires_at': '2025-12-31T23:59:00Z'}):
+            with pytest.raises(ValueError):
+                resolve_expiry(bad, 'otp', now)
+    # Naive datetimes (SQLite) are read as UTC
+    assert is_expired(datetime(2025, 12, 31, 23, 59), now)
+    assert not is_expired(None, now)
+
+
+def test_expired_batch_members_are_dropped_without_sending(monkeypatch):
+    sent = []
+
+    def fake_bulk(numbers, message):
+        sent.extend(numbers)
+        return [(n, 200, 'ok') for n in numbers]
+
+    monkeypatch.setattr(sms_tasks, 'send_bulk_sms_util', fake_bulk)
+    app = create_app()
+    app.config.update(TESTING=True, SMS_API_KEY='your-sms-api-key')
+    past = datetime.now(timezone.utc) - timedelta(minutes=5)
+    with app.app_context():
+        stale = SMSMessage(to='254700000101', message='Your code is 1234', uuid='ttl-stale', expires_at=past)
+        fresh = SMSMessage(to='254700000102', message='Your code is 5678', uuid='ttl-fresh',
+                           expires_at=past + timedelta(hours=1))
+        db.session.add_all([stale, fresh])
+        db.session.commit()
+        result = sms_tasks.send_batch_and_record([stale.id, fresh.id])
+        assert (result['expired'], result['sent']) == (1, 1)
+        assert sent == ['254700000102']
+        db.session.expire_all()
+        assert (db.session.get(SMSMessage, stale.id).status, db.session.get(SMSMessage, fresh.id).status) == ('expired', 'sent')
+
+    response = app.test_client().post('/services/api/v1/sms/single', headers=AUTH, json={
+        'mobile': '254700000103', 'message': 'hello', 'expires_at': past.isoformat()})
+    assert response.status_code == 400
+
+
+def test_expired_single_sends_take_no_permit_and_are_never_deferred(monkeypatch):
+    from app.tasks import sms_queue
+    from app.utils.status_writer import get_status_writer
+
+    acquired, deferred = [], []
+
+    class _Governor:
+        def acquire(self, max_wait=0):
+            acquired.append(max_wait)
+            return False
+
+    for module in (sms_tasks, sms_queue):
+        monkeypatch.setattr(module, 'channel_governor', lambda channel: _Governor())
+    monkeypatch.setattr(sms_tasks, '_circuit_wait', lambda: 30.0)
+    monkeypatch.setattr(sms_tasks, 'schedule_at', lambda *a: deferred.append(a))
+    app = create_app()
+    app.config.update(TESTING=True)
+    past = datetime.now(timezone.utc) - timedelta(minutes=5)
+    with app.app_context():
+        queued = SMSMessage(to='254700000104', message='Your code is 1234', uuid='ttl-queued', expires_at=past)
+        single = SMSMessage(to='254700000105', message='Your code is 5678', uuid='ttl-single', expires_at=past)
+        db.session.add_all([queued, single])
+        db.session.commit()
+        assert sms_queue.add_to_queue_task.apply(args=['process_single_sms', queued.id]).result['status'] == 'expired'
+        assert sms_tasks.send_and_record.apply(args=[single.id]).result['status'] == 'expired'
+        assert acquired == [] and deferred == []
+        get_status_writer().flush()
+        db.session.expire_all()
+        assert {db.session.get(SMSMessage, queued.id).status, db.session.get(SMSMessage, single.id).status} == {'expired'}
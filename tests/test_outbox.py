@@ -0,0 +1,140 @@
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from app import create_app
+from app.extensions import db
+from app.models.outbox_message import OutboxMessage
+from app.models.sms_message import SMSMessage
+from app.tasks.outbox_relay import OutboxRelay
+from app.utils.sms_workflow import process_bulk_sms, process_single_sms
+
+
+class _FakeCelery:
+    """Records published tasks; `down` simulates a broker outage."""
+
+    def __init__(self):
+        self.sent = []
+        self.down = False
+
+    @contextmanager
+    def producer_or_acquire(self):
+        yield object()
+
+    def send_task(self, name, args=None, kwargs=None, task_id=None, queue=None, producer=None):
+        if self.down:
+            raise ConnectionError('broker unavailable')
+        self.sent.append((name, args, task_id, queue))
+
+
+def _outbox_app():
+    app = create_app()
+    app.config['TESTING'] = True
+    app.celery = _FakeCelery()
+    return app
+
+
+def test_single_sms_is_staged_with_its_message():
+    app = _outbox_app()
+    with app.app_context():
+        result = process_single_sms('9876500401', 'Camp on Sunday', priority='otp')
+        staged = db.session.execute(
+            db.select(OutboxMessage).where(OutboxMessage.task_id == result['task_id'])).scalar_one()
+        assert staged.task_name == 'sms.add_to_queue'
+        assert staged.queue == 'sms.otp'
+        assert staged.args == ['process_single_sms', result['id'], None]
+        assert db.session.get(SMSMessage, result['id']).status == 'queued'
+    # Nothing published inline
+    assert app.celery.sent == []
+
+
+def test_relay_publishes_in_order_and_survives_broker_outage():
+    app = _outbox_app()
+    relay = OutboxRelay(app, batch_size=10)
+    with app.app_context():
+        ids = [process_single_sms(f"98765004{i:02d}", 'Camp on Sunday')['task_id'] for i in range(3)]
+
+    app.celery.down = True
+    with pytest.raises(ConnectionError):
+        relay.relay_once()
+    with app.app_context():
+        first = db.session.execute(db.select(OutboxMessage).where(OutboxMessage.task_id == ids[0])).scalar_one()
+        assert first.attempts == 1
+
+    app.celery.down = False
+    published = relay.relay_once()
+    assert published >= 3
+    assert [task_id for _, _, task_id, _ in app.celery.sent][-3:] == ids
+    with app.app_context():
+        assert db.session.execute(db.select(db.func.count()).select_from(OutboxMessage)).scalar() == 0
+
+
+def test_bulk_sms_is_inserted_and_staged_in_a_few_statements():
+    app = _outbox_app()
+    app.config['SMS_GATEWAY_BATCH_SIZE'] = 50
+    mobiles = [str(9500000000 + i) for i in range(200)]
+    with app.app_context():
+        statements = []
+        listener = lambda *args: statements.append(args[2])  # noqa: E731
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            successes, failures = process_bulk_sms(mobiles + ['12'], 'Camp on Sunday')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        assert len(successes) == 200 and failures[0]['mobile'] == '12'
+        # INSERT ... RETURNING, outbox INSERT, task id UPDATE (plus the route lookup at most)
+        assert len(statements) <= 5
+        staged = db.session.execute(db.select(OutboxMessage)).scalars().all()
+        assert sorted(len(row.args[0]) for row in staged) == [50, 50, 50, 50]
+        rows = db.session.execute(db.select(SMSMessage)).scalars().all()
+        assert {row.status for row in rows} == {'queued'}
+        assert all(row.task_id.split(':')[0] in {s.task_id for s in staged} for row in rows)
+        assert rows[0].decrypt_fields() == (mobiles[0], 'Camp on Sunday')
+    assert app.celery.sent == []
+
+
+def test_bulk_email_rows_and_batches_commit_together():
+    from app.models.email_message import EmailMessage
+
+    app = _outbox_app()
+    app.config.update(SMS_API_KEY='your-sms-api-key', EMAIL_BATCH_SIZE=50)
+    recipients = [f"parent{i}@school.test" for i in range(120)]
+    r = app.test_client().post('/services/api/v1/mail/bulk', headers={'Authorization': 'Bearer your-sms-api-key'},
+                               json={'to': recipients, 'subject': 'Camp', 'body': 'Camp on Sunday'},
+                               environ_base={'REMOTE_ADDR': '192.168.14.20'})
+    assert r.status_code == 200, r.get_json()
+    assert len(r.get_json()['data']['successes']) == 120
+    with app.app_context():
+        staged = db.session.execute(db.select(OutboxMessage)).scalars().all()
+        assert sorted(len(row.args[0]) for row in staged) == [20, 50, 50]
+        rows = db.session.execute(db.select(EmailMessage)).scalars().all()
+        assert len(rows) == 120 and all(row.task_id for row in rows)
+        assert rows[0].decrypt_fields() == (recipients[0], 'Camp', 'Camp on Sunday')
+    assert app.celery.sent == []
+
+
+def test_republished_single_send_is_not_sent_twice(monkeypatch):
+    from app.models.email_message import EmailMessage
+    from app.tasks import email_queue, sms_tasks
+    from app.utils.status_writer import get_status_writer
+
+    sent = []
+    monkeypatch.setattr(sms_tasks, 'send_sms', lambda to, message: sent.append(to) or 200)
+    monkeypatch.setattr(email_queue, 'send_single_email_util',
+                        lambda to, subject, body: sent.append(to) or (200, 'msg-1'))
+    app = _outbox_app()
+    with app.app_context():
+        sms = SMSMessage(to='9876500499', message='OTP 1234', uuid='twice-sms')
+        email = EmailMessage(to='twice@outbox.test', subject='Camp', body='Camp on Sunday', uuid='twice-email')
+        db.session.add_all([sms, email])
+        db.session.commit()
+        # The relay re-publishes a row it published but could not delete
+        for _ in range(2):
+            sms_tasks.send_and_record.apply(args=[sms.id], kwargs={'permitted': True})
+            email_queue.send_and_record.apply(args=[email.id], kwargs={'permitted': True})
+            get_status_writer().flush()
+            db.session.expire_all()
+        assert sent == ['9876500499', 'twice@outbox.test']
+        assert db.session.get(SMSMessage, sms.id).status == 'sent'
+        assert db.session.get(EmailMessage, email.id).status == 'sent'
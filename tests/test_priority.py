@@ -0,0 +1,64 @@
+import pytest
+from app import create_app
+from app.tasks.queues import (normalize_priority, priority_from_queue, queue_for, recipient_shard_key,
+                              shard_batches)
+
+AUTH = {'Authorization': 'Bearer your-sms-api-key'}
+
+
+@pytest.fixture
+def client():
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['SMS_API_KEY'] = 'your-sms-api-key'
+    with app.test_client() as c:
+        yield c
+
+
+def test_priority_lanes():
+    assert queue_for('sms', normalize_priority('OTP', 'bulk')) == 'sms.otp'
+    assert queue_for('email', normalize_priority(None, 'bulk')) == 'email.bulk'
+    with pytest.raises(ValueError):
+        normalize_priority('urgent', 'bulk')
+
+
+def test_sms_priority_recorded_on_rows(client):
+    r = client.post('/services/api/v1/sms/single', headers=AUTH,
+                    json={'mobile': '9876500101', 'message': 'Your OTP is 1234', 'priority': 'otp'})
+    assert r.status_code == 200
+    assert r.json['data']['priority'] == 'otp'
+
+    r = client.post('/services/api/v1/sms/bulk', headers=AUTH,
+                    json={'mobiles': ['9876500102', '9876500103'], 'message': 'Camp on Sunday'})
+    assert r.status_code == 200
+    from app.models.sms_message import SMSMessage
+    with client.application.app_context():
+        ids = [s['record_id'] for s in r.json['data']['successes']]
+        assert {m.priority for m in SMSMessage.query.filter(SMSMessage.id.in_(ids))} == {'bulk'}
+
+
+def test_sms_rejects_unknown_priority(client):
+    r = client.post('/services/api/v1/sms/single', headers=AUTH,
+                    json={'mobile': '9876500104', 'message': 'hi', 'priority': 'urgent'})
+    assert r.status_code == 400
+
+
+def test_recipient_shards_are_stable_and_never_mixed_in_a_batch():
+    app = create_app()
+    app.config['DISPATCH_SHARDS'] = 4
+    with app.app_context():
+        key = recipient_shard_key('+254700000001')
+        assert key == recipient_shard_key('254700000001')
+        queue = queue_for('sms', 'otp', key)
+        assert queue.startswith('sms.otp.') and priority_from_queue(queue, 'bulk') == 'otp'
+        # Without a recipient the lane queue is used
+        assert queue_for('sms', 'otp') == 'sms.otp'
+
+        mobiles = [str(9400000000 + i) for i in range(40)]
+        batches = shard_batches('sms', 'bulk', mobiles, 5, recipient_shard_key)
+        assert sorted(m for _, batch in batches for m in batch) == sorted(mobiles)
+        for queue, batch in batches:
+            assert len(batch) <= 5
+            assert {queue_for('sms', 'bulk', recipient_shard_key(m)) for m in batch} == {queue}
+        assert len({queue for queue, _ in batches}) > 1
+    assert queue_for('sms', 'otp', key) == 'sms.otp'  # sharding off outside the app
@@ -0,0 +1,70 @@
+import time
+
+from app import create_app
+from app.extensions import db
+from app.models.sms_message import SMSMessage
+from app.tasks.queues import priority_from_queue
+from app.tasks.sms_queue import process_single_sms
+from app.utils.rate_governor import RateGovernor
+from app.utils.status_writer import get_status_writer
+
+
+def test_governor_bounds_permits():
+    # No Redis here: exercises the per-process fallback bucket
+    governor = RateGovernor('test-bounds', rate=5)
+    assert all(governor.try_take() for _ in range(5))
+    assert not governor.try_take()
+    assert 0 < governor.wait_time() <= 0.2
+
+    started = time.monotonic()
+    assert governor.acquire(max_wait=1.0)
+    assert time.monotonic() - started < 0.5
+    assert not governor.acquire(cost=5, max_wait=0.1)
+    assert RateGovernor('test-unlimited', rate=0).try_take(cost=1000)
+
+
+def test_governor_fallback_splits_rate_across_processes():
+    governor = RateGovernor('test-split', rate=10, processes=5)
+    assert governor.try_take() and governor.try_take()
+    assert not governor.try_take()
+
+
+def test_priority_from_queue():
+    assert priority_from_queue('sms.otp', 'transactional') == 'otp'
+    assert priority_from_queue(None, 'transactional') == 'transactional'
+    assert priority_from_queue('celery', 'bulk') == 'bulk'
+
+
+def test_process_single_sms_sends_decrypted_row():
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.app_context():
+        record = SMSMessage(to='9876500201', message='Report ready', uuid='governed-1')
+        db.session.add(record)
+        db.session.commit()
+        result = process_single_sms(record.id)
+        assert result['status'] == 'sent'
+        get_status_writer().flush()
+        db.session.expire_all()
+        assert db.session.get(SMSMessage, record.id).attempts == 1
+
+
+def test_process_single_sms_defers_unsent_otp(monkeypatch):
+    from app.tasks import sms_queue
+
+    scheduled = []
+    monkeypatch.setattr(sms_queue, 'send_single_sms_util', lambda to, message: (503, 'circuit_open'))
+    monkeypatch.setattr(sms_queue, 'schedule_at', lambda task, args, kwargs, delay, queue: scheduled.append(args))
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.app_context():
+        record = SMSMessage(to='9876500202', message='OTP 1234', uuid='governed-2', priority='otp')
+        db.session.add(record)
+        db.session.commit()
+        # An open breaker defers the OTP instead of failing it, and keeps its attempts
+        assert process_single_sms(record.id, queue='sms.otp')['status'] == 'deferred'
+        assert scheduled == [['process_single_sms', record.id, None]]
+        get_status_writer().flush()
+        db.session.expire_all()
+        row = db.session.get(SMSMessage, record.id)
+        assert (row.status, row.attempts) == ('retry', 0)
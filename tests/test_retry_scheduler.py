@@ -0,0 +1,100 @@
+import json
+from contextlib import contextmanager
+
+from app import create_app
+from app.tasks import retry_scheduler
+from app.tasks.retry_scheduler import backoff_delay, classify_error, schedule_retry
+
+
+class _RecordingTask:
+    """Stands in for a Celery task; records countdown publishes."""
+
+    name = 'test.recording'
+
+    def __init__(self):
+        self.published = []
+
+    def apply_async(self, args, kwargs=None, countdown=None, queue=None):
+        self.published.append((args, kwargs, countdown, queue))
+
+
+def test_classify_error():
+    assert classify_error(408) == 'timeout'
+    assert classify_error(exc=TimeoutError()) == 'timeout'
+    assert classify_error(429) == 'rate_limited'
+    assert classify_error(503) == 'server_error'
+    assert classify_error(400) == 'rejected'
+    assert classify_error(exc=ValueError()) == 'default'
+
+
+def test_backoff_grows_per_policy_and_is_capped():
+    app = create_app()
+    with app.app_context():
+        assert 12 <= backoff_delay('timeout', 1) <= 18
+        assert 24 <= backoff_delay('timeout', 2) <= 36
+        assert backoff_delay('rate_limited', 1) > backoff_delay('default', 1) * 1.2
+        assert backoff_delay('server_error', 20) <= 600 * 1.2
+
+        app.config['RETRY_POLICIES'] = '{"timeout": {"base": 1, "cap": 2}}'
+        assert backoff_delay('timeout', 10) <= 2.4
+
+
+def test_schedule_retry_falls_back_to_countdown_without_redis(monkeypatch):
+    monkeypatch.setattr(retry_scheduler, 'get_redis', lambda: None)
+    task = _RecordingTask()
+    app = create_app()
+    with app.app_context():
+        delay = schedule_retry(task, [7, 'corr'], {'attempt': 2}, attempt=1, error_class='timeout',
+                               queue='sms.otp', min_delay=40)
+    assert delay == 40
+    assert task.published == [([7, 'corr'], {'attempt': 2}, 40, 'sms.otp')]
+
+
+class _SortedSetRedis:
+    """Just enough of a Redis client for release_due: two sorted sets and the claim script."""
+
+    def __init__(self):
+        self.sets = {retry_scheduler.DUE_KEY: {}, retry_scheduler.ENQUEUED_KEY: {}}
+
+    def register_script(self, script):
+        def claim(keys, args):
+            due, enqueued = (self.sets[k] for k in keys)
+            members = sorted((m for m, s in due.items() if s <= args[0]), key=due.get)[:args[1]]
+            claimed = []
+            for m in members:
+                claimed += [m, str(due.pop(m)).encode(), str(enqueued.pop(m, 0)).encode()]
+            return claimed
+        return claim
+
+    def pipeline(self):
+        return self
+
+    def zadd(self, key, mapping, nx=False):
+        self.sets[key].update(mapping)
+
+    def execute(self):
+        pass
+
+
+class _DownBroker:
+    @contextmanager
+    def producer_or_acquire(self):
+        yield object()
+
+    def send_task(self, *args, **kwargs):
+        raise ConnectionError('broker unavailable')
+
+
+def test_release_due_puts_unpublished_items_back_with_their_scores(monkeypatch):
+    r = _SortedSetRedis()
+    member = json.dumps({'id': 'x', 'task': 'sms.send_and_record', 'args': [7], 'kwargs': {}, 'queue': 'sms.otp'})
+    r.sets[retry_scheduler.DUE_KEY][member] = 1000.25
+    r.sets[retry_scheduler.ENQUEUED_KEY][member] = 940.5
+    monkeypatch.setattr(retry_scheduler, 'get_redis', lambda: r)
+    monkeypatch.setattr(retry_scheduler, 'celery_app', _DownBroker())
+    app = create_app()
+    with app.app_context():
+        assert retry_scheduler.release_due() == 0
+    assert r.sets[retry_scheduler.DUE_KEY] == {member: 1000.25}
+    # Backlog age is still measured from when the retry was first scheduled
+    assert r.sets[retry_scheduler.ENQUEUED_KEY] == {member: 940.5}
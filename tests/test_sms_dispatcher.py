@@ -0,0 +1,30 @@
+import asyncio
+
+import pytest
+from app import create_app
+from app.extensions import db
+from app.models.sms_message import SMSMessage
+
+pytest.importorskip('aiohttp')
+
+from app.tasks.sms_dispatcher import AsyncSMSDispatcher  # noqa: E402
+from app.utils.sms_workflow import process_bulk_sms  # noqa: E402
+
+
+def test_async_dispatcher_sends_queued_rows(soap_gateway):
+    app = create_app()
+    app.config.update(OTP_FLAG=True, OTP_SERVER=soap_gateway.url, SMS_DISPATCH_BACKEND='asyncio')
+    mobiles = [str(9100000000 + i) for i in range(25)]
+    with app.app_context():
+        successes, failures = process_bulk_sms(mobiles, 'Reminder')
+        assert not failures
+        assert {s['status'] for s in successes} == {'queued'}
+
+    dispatcher = AsyncSMSDispatcher(app, concurrency=10, per_gateway_concurrency=5,
+                                    claim_batch=8, flush_interval=0.05, poll_interval=0.05)
+    asyncio.run(dispatcher.run(until_idle=True))
+
+    assert len(soap_gateway.received) == 25
+    with app.app_context():
+        statuses = db.session.execute(db.select(SMSMessage.status, SMSMessage.attempts)).all()
+        assert set(statuses) == {('sent', 1)}
@@ -0,0 +1,188 @@
+import pytest
+from app import create_app
+from app.utils.sms_gateway import SMSGatewayClient, GatewayBusyError
+from app.utils.sms_util import send_bulk_sms_util
+from app.utils.sms_envelope import SOAPEnvelopeBuilder
+
+
+def test_gateway_client_reuses_connections(soap_gateway):
+    client = SMSGatewayClient(pool_maxsize=2)
+    for _ in range(5):
+        resp = client.post(soap_gateway.url, data=b'<x/>', headers={}, timeout=5)
+        assert resp.status_code == 200
+    stats = client.pool_stats()
+    assert stats['requests'] == 5
+    assert stats['connections_opened'] == 1
+    assert stats['reuse_ratio'] == pytest.approx(0.8)
+    client.close()
+
+
+def test_gateway_pool_metrics_exposed():
+    app = create_app()
+    app.config['TESTING'] = True
+    r = app.test_client().get('/metrics')
+    assert b'sms_gateway_pool_connections_opened' in r.data
+    assert b'sms_gateway_pool_reuse_ratio' in r.data
+
+
+def test_gateway_client_bounds_in_flight_requests(soap_gateway):
+    client = SMSGatewayClient(max_in_flight=1, acquire_timeout=0.05)
+    assert client._slots.acquire(timeout=1)  # simulate a request already in flight
+    try:
+        with pytest.raises(GatewayBusyError):
+            client.post(soap_gateway.url, data=b'<x/>', headers={}, timeout=5)
+    finally:
+        client._slots.release()
+    assert client.post(soap_gateway.url, data=b'<x/>', headers={}, timeout=5).status_code == 200
+    client.close()
+
+
+def test_bulk_sms_packs_recipients_into_batches(soap_gateway):
+    app = create_app()
+    app.config.update(TESTING=False, OTP_FLAG=True, OTP_SERVER=soap_gateway.url, SMS_GATEWAY_BATCH_SIZE=50,
+                      SMS_BATCH_CONCURRENCY=1)  # envelopes arrive in order
+    mobiles = [str(9000000000 + i) for i in range(120)] + ['12ab']
+    with app.app_context():
+        results = send_bulk_sms_util(mobiles, 'Clinic closed <today> & tomorrow')
+    assert len(soap_gateway.received) == 3
+    assert b'<sendBulkSMS' in soap_gateway.received[0]
+    assert b'9000000000,9000000001' in soap_gateway.received[0]
+    assert b'&lt;today&gt; &amp; tomorrow' in soap_gateway.received[0]
+    assert [r[1] for r in results[:120]] == [200] * 120
+    assert results[-1] == ('12ab', 400, 'invalid_phone')
+
+
+def test_envelope_builder_escapes_only_variable_fields():
+    builder = SOAPEnvelopeBuilder('sendSingleSMS', username='u&1', password='p', senderid='AIIMS', templateid='42')
+    body = builder.build('9876543210', 'a < b')
+    assert isinstance(body, bytes)
+    assert b'<username>u&amp;1</username>' in body
+    assert b'<mobileNos>9876543210</mobileNos>' in body
+    assert b'<message>a &lt; b</message>' in body
+    assert body.endswith(b'</soap12:Envelope>')
+    assert builder.headers(body)['Content-Length'] == str(len(body))
+
+
+def test_circuit_breaker_fast_fails_then_probes(soap_gateway):
+    import uuid
+    from app.utils.circuit_breaker import CircuitBreaker, CircuitOpenError, get_breaker, _breakers
+
+    name = f"test-{uuid.uuid4().hex[:8]}"
+    _breakers[name] = CircuitBreaker(name, min_calls=2, error_rate=0.5, open_seconds=0.2,
+                                     half_open_max_calls=1, half_open_successes=1)
+    client = SMSGatewayClient(retries=0, status_forcelist=())
+    soap_gateway.status = 500
+    for _ in range(2):
+        assert client.post(soap_gateway.url, data=b'<x/>', headers={}, timeout=5, gateway=name).status_code == 500
+    assert get_breaker(name).state == 'open'
+    with pytest.raises(CircuitOpenError):
+        client.post(soap_gateway.url, data=b'<x/>', headers={}, timeout=5, gateway=name)
+    assert len(soap_gateway.received) == 2
+
+    import time
+    time.sleep(0.25)
+    soap_gateway.status = 200
+    assert client.post(soap_gateway.url, data=b'<x/>', headers={}, timeout=5, gateway=name).status_code == 200
+    assert get_breaker(name).state == 'closed'
+    get_breaker(name).reset()
+    client.close()
+
+
+def test_adaptive_limiter_tracks_gateway_latency():
+    from app.utils.adaptive_concurrency import AdaptiveLimiter
+
+    limiter = AdaptiveLimiter(initial=2, max_limit=10, target_p95=1.0, window=10,
+                              min_timeout=0.5, max_timeout=30, timeout_multiplier=3)
+    assert limiter.timeout() == 30  # no samples yet
+
+    def run_window(latency, failed=False):
+        for _ in range(5):
+            assert limiter.acquire(timeout=1) and limiter.acquire(timeout=1)
+            limiter.release(latency, failed)
+            limiter.release(latency, failed)
+
+    run_window(0.1)
+    assert limiter.limit == 3  # healthy and saturated: additive increase
+    assert limiter.timeout() == pytest.approx(0.5)  # 3 x p99 (0.3s) clamped to min_timeout
+    run_window(2.0)
+    assert limiter.limit == 2  # p95 over target: multiplicative decrease
+    run_window(0.1, failed=True)
+    assert limiter.limit == 1
+    assert limiter.timeout() == pytest.approx(6.0)
+
+
+def test_gateway_pool_fails_over_to_healthy_account(soap_gateway):
+    import json
+    from app.utils.sms_util import send_single_sms_util
+
+    app = create_app()
+    app.config.update(TESTING=False, OTP_FLAG=True, OTP_USERNAME='shared', SMS_GATEWAYS=json.dumps([
+        {'name': 'down-account', 'url': 'http://127.0.0.1:1/sms', 'weight': 1000},
+        {'name': 'live-account', 'url': soap_gateway.url, 'username': 'acct2'},
+    ]))
+    with app.app_context():
+        assert send_single_sms_util('9876500001', 'hello') == (200, 'ok')
+        assert send_single_sms_util('9876500002', 'hello') == (200, 'ok')
+    assert len(soap_gateway.received) == 2
+    assert b'<username>acct2</username>' in soap_gateway.received[0]
+
+
+def test_gateway_pool_never_resends_a_request_the_gateway_took(soap_gateway):
+    import json
+    from app.utils.sms_util import send_single_sms_util
+
+    app = create_app()
+    app.config.update(TESTING=False, OTP_FLAG=True, OTP_USERNAME='shared', SMS_GATEWAY_RETRIES=2,
+                      SMS_GATEWAYS=json.dumps([
+                          {'name': 'flaky-account', 'url': soap_gateway.url, 'weight': 1000},
+                          {'name': 'other-account', 'url': soap_gateway.url, 'username': 'acct2'},
+                      ]))
+    with app.app_context():
+        # A 5xx or a dropped connection may follow delivery: no urllib3 retry, no failover
+        soap_gateway.status = 503
+        assert send_single_sms_util('9876500001', 'hello') == (503, 'gateway_error')
+        soap_gateway.status = None
+        assert send_single_sms_util('9876500002', 'hello') == (502, 'connection_error')
+    assert len(soap_gateway.received) == 2
+    assert b'<username>acct2</username>' not in b''.join(soap_gateway.received)
+
+
+def test_send_task_defers_while_every_account_breaker_is_open(monkeypatch):
+    import json
+    import uuid
+    from app.extensions import db
+    from app.models.sms_message import SMSMessage
+    from app.tasks import sms_tasks
+    from app.utils.circuit_breaker import CircuitBreaker, _breakers, get_breaker
+
+    scheduled = []
+    monkeypatch.setattr(sms_tasks, 'schedule_at',
+                        lambda task, args, kwargs, delay, queue: scheduled.append((args, delay)))
+    monkeypatch.setattr(sms_tasks, 'send_sms', lambda to, message: pytest.fail('sent through an open breaker'))
+    name = f"acct-{uuid.uuid4().hex[:8]}"
+    _breakers[name] = CircuitBreaker(name, min_calls=1, open_seconds=30)
+    app = create_app()
+    app.config.update(TESTING=True, SMS_GATEWAYS=json.dumps([{'name': name, 'url': 'http://127.0.0.1:1/sms'}]))
+    try:
+        with app.app_context():
+            record = SMSMessage(to='9876500301', message='OTP 4321', uuid=f'breaker-{name}')
+            db.session.add(record)
+            db.session.commit()
+            get_breaker(name).record(failed=True, elapsed=0.1)
+            # The pool member's breaker is open; the 'default' breaker never saw a call
+            assert get_breaker('default').retry_after() == 0
+            result = sms_tasks.send_and_record.apply(args=[record.id]).result
+            assert (result['status'], result['reason']) == ('deferred', 'circuit_open')
+            assert scheduled and scheduled[0][0] == [record.id, None] and scheduled[0][1] > 0
+    finally:
+        _breakers.pop(name).reset()
+
+
+def test_gateway_pool_respects_account_tps():
+    from app.utils.sms_gateway_pool import GatewayMember, GatewayPool
+
+    pool = GatewayPool([GatewayMember('small', 'http://a', tps=2), GatewayMember('big', 'http://b', tps=4)])
+    picked = [pool.select(max_wait=0) for _ in range(7)]
+    assert sorted(m.name for m in picked if m) == ['big'] * 4 + ['small'] * 2
+    assert picked.count(None) == 1
+    assert 0 < pool.budget_wait() <= 0.5
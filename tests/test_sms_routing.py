@@ -0,0 +1,43 @@
+import json
+from app import create_app
+from app.extensions import db
+from app.models.sms_message import SMSMessage
+from app.utils.sms_routing import Route, RoutingTable, reload_routing_table
+from app.utils.sms_util import send_single_sms_util
+from app.utils.sms_workflow import process_bulk_sms
+
+
+def test_routing_table_longest_prefix_match():
+    table = RoutingTable([Route('india', '91'), Route('india-op', '9198'), Route('uk', '44')])
+    assert table.route_name('919812345678') == 'india-op'
+    assert table.route_name('+919712345678') == 'india'
+    assert table.route_name('00447911123456') == 'uk'
+    assert table.lookup('15551234567') is None
+
+
+def test_route_selects_gateway_and_sender_id(soap_gateway):
+    app = create_app()
+    app.config.update(
+        TESTING=False, OTP_FLAG=True, OTP_SENDERID='DEFAULT',
+        SMS_GATEWAYS=json.dumps([
+            {'name': 'intl', 'url': 'http://127.0.0.1:1/sms'},
+            {'name': 'domestic', 'url': soap_gateway.url},
+        ]),
+        SMS_ROUTES=json.dumps([{'name': 'india', 'prefix': '91', 'gateways': ['domestic'], 'senderid': 'AIIMSD'}]),
+    )
+    with app.app_context():
+        reload_routing_table()
+        assert send_single_sms_util('919812345001', 'hello') == (200, 'ok')
+    assert b'<senderid>AIIMSD</senderid>' in soap_gateway.received[0]
+
+
+def test_route_recorded_on_message():
+    app = create_app()
+    app.config.update(TESTING=True, SMS_ROUTES=json.dumps([{'name': 'india', 'prefix': '91'}]))
+    with app.app_context():
+        reload_routing_table()
+        successes, failures = process_bulk_sms(['919812345002', '441234567890'], 'hello')
+        assert not failures
+        routes = {s['mobile']: db.session.get(SMSMessage, s['record_id']).route for s in successes}
+        reload_routing_table()
+    assert routes == {'919812345002': 'india', '441234567890': None}
@@ -0,0 +1,47 @@
+from app import create_app
+from app.extensions import db, status_updates_flushed_counter
+from app.models.email_message import EmailMessage
+from app.models.sms_message import SMSMessage
+from app.utils.status_writer import StatusWriter
+
+
+def _rows(app):
+    with app.app_context():
+        sms = SMSMessage(to='9876500301', message='Camp on Sunday', uuid='writer-sms-1')
+        email = EmailMessage(to='writer@status.test', subject='Camp', body='Camp on Sunday', uuid='writer-email-1')
+        db.session.add_all([sms, email])
+        db.session.commit()
+        return sms.id, email.id
+
+
+def test_transitions_coalesce_to_latest():
+    app = create_app()
+    sms_id, email_id = _rows(app)
+    # Long interval: nothing is written until the explicit flush
+    writer = StatusWriter(app, flush_interval=60)
+    flushed_before = status_updates_flushed_counter.labels(table='sms_messages')._value.get()
+    writer.record(SMSMessage, sms_id, 'retry', attempts=1)
+    writer.record(SMSMessage, sms_id, 'retry', attempts=2)
+    writer.record(SMSMessage, sms_id, 'sent', attempts=3)
+    writer.record(EmailMessage, email_id, 'failed', attempts=5)
+    with app.app_context():
+        assert db.session.get(SMSMessage, sms_id).status == 'queued'
+    assert writer.flush() == 2
+    assert writer.flush() == 0
+    writer.close()
+    assert status_updates_flushed_counter.labels(table='sms_messages')._value.get() - flushed_before == 1
+    with app.app_context():
+        sms = db.session.get(SMSMessage, sms_id)
+        email = db.session.get(EmailMessage, email_id)
+        assert (sms.status, sms.attempts) == ('sent', 3)
+        assert (email.status, email.attempts) == ('failed', 5)
+
+
+def test_disabled_writer_writes_through():
+    app = create_app()
+    sms_id, _ = _rows(app)
+    writer = StatusWriter(app, enabled=False)
+    with app.app_context():
+        writer.record(SMSMessage, sms_id, 'failed', attempts=5)
+        db.session.expire_all()
+        assert db.session.get(SMSMessage, sms_id).status == 'failed'